@@ -0,0 +1,206 @@
+"""
+Running many programs on a pool of worker processes
+
+BatchExecutor distributes jobs, each a program plus its inputs, over a
+ProcessPoolExecutor whose workers stay up between batches:
+
+    with BatchExecutor(max_workers=4, limits=ExecutionLimits(max_time=1.0)) as executor:
+        for result in executor.run((entry, {'n': n}) for n in range(1000)):
+            print(result.job, result.reason.name, result.value)
+
+Programs travel as compact bytecode (bytecode.CompactProgram), not as
+pickled Instructions: a CodeObject is encoded once in the parent and
+every worker keeps the programs it has decoded in a small LRU cache keyed
+by a hash of the bytes, so a program used by many jobs is decoded once
+per worker. Programs given as `preload` are decoded by each worker when
+it starts and jobs that use them send only the key. Each worker runs all
+its jobs on one VirtualMachine, reloaded per job, whose output goes to a
+BufferSink.
+
+A job's inputs fill the entry function's parameters by name; the other
+names become globals. Its budget is an ExecutionLimits (the executor's
+default or the job's own); a program that exceeds it, fails or returns
+comes back as a JobResult with the termination reason. A program whose
+bytes do not decode comes back as an ERROR with the BytecodeFormatError
+message, and one that makes the VM raise a Python exception (say, a
+function stored without a stack size that pops an empty stack) as an
+ERROR with the exception; the rest of the batch is unaffected. run() submits jobs in chunks of
+`chunk_size`, keeps at most `max_pending` chunks in flight and yields
+results as their chunk completes, so they arrive in completion order;
+JobResult.job is the position of the job in the input. run_all() returns
+them in input order.
+"""
+
+import hashlib
+import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from main import MAX_CALL_DEPTH, BufferSink, CodeObject, TerminationReason, VirtualMachine
+from bytecode import BytecodeFormatError, CompactProgram
+from pybackend import program_functions
+
+DEFAULT_CHUNK_SIZE = 8
+# Decoded programs each worker keeps
+PROGRAM_CACHE_SIZE = 64
+
+Job = namedtuple('Job', ['program', 'inputs', 'limits'], defaults=(None, None))
+JobResult = namedtuple('JobResult', ['job', 'reason', 'message', 'value', 'memory', 'output',
+                                     'instructions_run', 'time_used'])
+
+
+def encode_program(entry):
+    """Compact bytecode of the entry CodeObject and every function it calls"""
+    functions = {code.name: code for code in program_functions(entry)}
+    return CompactProgram.from_functions(functions, entry).to_bytes()
+
+
+def program_key(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Worker process state, set up by _start_worker(); preloaded programs are
+# never evicted
+_preloaded = {}
+_programs = OrderedDict()
+_vm = None
+
+
+def _start_worker(max_call_depth, preload):
+    global _vm
+    _vm = VirtualMachine(max_call_depth, output=BufferSink())
+    for key, data in preload.items():
+        _preloaded[key] = CompactProgram.from_buffer(data).to_code_objects()[1]
+
+
+def _decode(key, data):
+    """Entry CodeObject for key, decoding data the first time"""
+    entry = _preloaded.get(key)
+    if entry is not None:
+        return entry
+    entry = _programs.get(key)
+    if entry is not None:
+        _programs.move_to_end(key)
+        return entry
+    _, entry = CompactProgram.from_buffer(data).to_code_objects()
+    _programs[key] = entry
+    if len(_programs) > PROGRAM_CACHE_SIZE:
+        _programs.popitem(last=False)
+    return entry
+
+
+def _run_job(job, key, data, inputs, limits):
+    global _vm
+    vm = _vm
+    sink = vm.output
+    sink.clear()
+    try:
+        return _execute(vm, job, _decode(key, data), inputs, limits)
+    except BytecodeFormatError as e:
+        message = str(e)
+    except Exception as e:
+        # The VM may have stopped inside a call: later jobs get a fresh one
+        _vm = VirtualMachine(vm.max_call_depth, output=sink)
+        message = f"{type(e).__name__}: {e}"
+    return JobResult(job, TerminationReason.ERROR, message, None, {}, sink.getvalue(), 0, 0.0)
+
+
+def _execute(vm, job, entry, inputs, limits):
+    sink = vm.output
+    vm.limits = limits
+    vm.globals = {}
+    vm.stack = []
+    vm.load_instructions(entry)
+    for name, value in inputs.items():
+        if name in entry.params:
+            vm.slots[entry.params.index(name)] = value
+        else:
+            vm.globals[name] = value
+    vm.run()
+    termination = vm.termination
+    value = vm.stack[-1] if termination.reason is TerminationReason.RETURNED and vm.stack else None
+    return JobResult(job, termination.reason, termination.message, value, dict(vm.memory),
+                     sink.getvalue(), vm.instructions_run, vm.time_used)
+
+
+def _run_chunk(jobs):
+    return [_run_job(*job) for job in jobs]
+
+
+class BatchExecutor:
+    """Runs jobs on a warm pool of worker processes; see the module docstring"""
+
+    def __init__(self, max_workers=None, limits=None, preload=(), chunk_size=DEFAULT_CHUNK_SIZE,
+                 max_pending=None, max_call_depth=MAX_CALL_DEPTH):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.limits = limits
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending or 2 * self.max_workers
+        # id(CodeObject) -> (CodeObject, key, bytes); the CodeObject keeps its id in use
+        self._encoded = {}
+        preloaded = {}
+        for program in preload:
+            key, data = self._encode(program)
+            if not isinstance(program, CodeObject):
+                # Bad bytes fail here rather than in every worker's initializer
+                CompactProgram.from_buffer(data).to_code_objects()
+            preloaded[key] = data
+        self._preloaded = set(preloaded)
+        initargs = (max_call_depth, preloaded)
+        self._pool = ProcessPoolExecutor(self.max_workers, initializer=_start_worker,
+                                         initargs=initargs)
+
+    def _encode(self, program):
+        """(key, bytes) of a CodeObject or of compact bytecode"""
+        if isinstance(program, CodeObject):
+            cached = self._encoded.get(id(program))
+            if cached is None:
+                data = encode_program(program)
+                cached = self._encoded[id(program)] = (program, program_key(data), data)
+            return cached[1:]
+        data = bytes(program)
+        return program_key(data), data
+
+    def _task(self, index, job):
+        if not isinstance(job, Job):
+            job = Job(*job)
+        key, data = self._encode(job.program)
+        if key in self._preloaded:
+            data = None
+        limits = job.limits if job.limits is not None else self.limits
+        return (index, key, data, dict(job.inputs or {}), limits)
+
+    def run(self, jobs):
+        """Yield a JobResult per job (a Job or a (program, inputs[, limits]) tuple) as they complete"""
+        pending = set()
+        chunk = []
+        for index, job in enumerate(jobs):
+            chunk.append(self._task(index, job))
+            if len(chunk) == self.chunk_size:
+                pending.add(self._pool.submit(_run_chunk, chunk))
+                chunk = []
+                while len(pending) >= self.max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from future.result()
+        if chunk:
+            pending.add(self._pool.submit(_run_chunk, chunk))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+    def run_all(self, jobs):
+        """JobResults of every job, in input order"""
+        return sorted(self.run(jobs), key=lambda result: result.job)
+
+    def close(self):
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
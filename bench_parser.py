@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark del Parser: tokens por segundo
+
+Genera un programa sintético, lo tokeniza una sola vez y mide cuántos tokens
+por segundo procesa Parser.parse(). Con --baseline se compara contra otra
+copia de main.py (por ejemplo la versión anterior del parser):
+
+    git show HEAD~1:main.py > /tmp/main_baseline.py
+    python bench_parser.py --baseline /tmp/main_baseline.py
+
+Con --workers N también se mide Parser.parse_parallel() sobre un pool de N
+procesos ya iniciado.
+"""
+
+import argparse
+import gc
+import importlib.util
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from main import LexicalAnalyzer, Parser
+
+
+def generate_source(functions=200):
+    """Genera un programa con declaraciones, if, while y asignaciones"""
+    parts = []
+    for f in range(functions):
+        parts.append(f'''
+int func_{f}() {{
+    int a = {f};
+    int b = a + 2;
+    float c = 1.5;
+    if (a > b) {{
+        a = a - 1;
+        b = (b + a) - 3;
+    }}
+    while (b > 0) {{
+        b = b - 1;
+        c = c + 0.5;
+    }}
+    return a + b;
+}}
+''')
+    return ''.join(parts)
+
+
+def load_parser_class(path):
+    """Carga la clase Parser de otra copia de main.py"""
+    spec = importlib.util.spec_from_file_location('baseline_main', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Parser
+
+
+def measure(parser_class, tokens):
+    """Tiempo de una llamada a parse() en segundos, sin recolector de basura"""
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        parser_class(tokens).parse()
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark del Parser')
+    arg_parser.add_argument('--functions', type=int, default=200)
+    arg_parser.add_argument('--repeat', type=int, default=30)
+    arg_parser.add_argument('--baseline', help='ruta a otra copia de main.py')
+    arg_parser.add_argument('--workers', type=int,
+                            help='mide también parse_parallel() con N procesos')
+    args = arg_parser.parse_args()
+
+    lexer = LexicalAnalyzer()
+    lexer.analyze(generate_source(args.functions))
+    tokens = lexer.tokens
+
+    print("=" * 60)
+    print("BENCHMARK DEL PARSER")
+    print("=" * 60)
+    print(f"Tokens: {len(tokens)}")
+
+    results = [('actual', Parser)]
+    if args.baseline:
+        results.insert(0, ('baseline', load_parser_class(args.baseline)))
+
+    # Las mediciones se intercalan para que el ruido afecte a todas por igual
+    timings = {name: float('inf') for name, _ in results}
+    for _ in range(args.repeat):
+        for name, parser_class in results:
+            timings[name] = min(timings[name], measure(parser_class, tokens))
+
+    for name, _ in results:
+        elapsed = timings[name]
+        print(f"{name:<10}: {elapsed * 1000:8.2f} ms  {len(tokens) / elapsed:12,.0f} tokens/s")
+
+    if 'baseline' in timings:
+        print(f"Aceleración: {timings['baseline'] / timings['actual']:.2f}x")
+
+    if args.workers:
+        # El pool se crea una vez; solo se mide el reparto y el ensamblado
+        with ProcessPoolExecutor(args.workers) as pool:
+            best = float('inf')
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                Parser(tokens).parse_parallel(args.workers, pool, min_tokens=0)
+                best = min(best, time.perf_counter() - start)
+        print(f"{'paralelo':<10}: {best * 1000:8.2f} ms  {len(tokens) / best:12,.0f} tokens/s"
+              f"  ({args.workers} procesos)")
+
+
+if __name__ == '__main__':
+    main()
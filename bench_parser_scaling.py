@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Benchmark de escalabilidad del Parser con programas generados
+
+Genera programas adversariales de tamaño creciente para cada forma:
+
+    functions    muchas funciones pequeñas
+    statements   una función con una lista de sentencias muy larga
+    nesting      if/while anidados a gran profundidad
+    expression   una expresión muy larga
+
+y mide el tiempo de Parser.parse() y el pico de memoria (tracemalloc) para
+cada forma y tamaño. Los resultados se guardan como JSON junto con el
+exponente de crecimiento estimado (pendiente log-log del tiempo frente al
+número de tokens: ~1.0 es lineal). Con --compare se contrasta contra un JSON
+anterior y el script termina con código 1 si alguna medición empeora más del
+umbral indicado:
+
+    python bench_parser_scaling.py --output base.json
+    python bench_parser_scaling.py --compare base.json
+"""
+
+import argparse
+import gc
+import json
+import math
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from main import LexicalAnalyzer, Parser
+
+DEFAULT_SIZES = {
+    'functions': [100, 200, 400, 800, 1600],
+    'statements': [500, 1000, 2000, 4000, 8000],
+    'nesting': [50, 100, 200, 400, 800],
+    'expression': [1000, 2000, 4000, 8000, 16000],
+}
+
+
+def gen_functions(size):
+    """`size` funciones con un cuerpo corto"""
+    return ''.join(f'''
+int f{i}() {{
+    int a = {i};
+    if (a > 1) {{ a = a - 1; }}
+    return a;
+}}
+''' for i in range(size))
+
+
+def gen_statements(size):
+    """Una sola función con `size` sentencias"""
+    body = ''.join(f'    x = x + {i};\n' for i in range(size))
+    return f'int main() {{\n    int x = 0;\n{body}    return x;\n}}\n'
+
+
+def gen_nesting(size):
+    """`size` niveles alternando if y while"""
+    opening = ''.join(
+        f'{"if" if level % 2 == 0 else "while"} (x > {level}) {{\n'
+        for level in range(size))
+    return f'int main() {{\nint x = 0;\n{opening}x = x - 1;\n{"}" * size}\nreturn x;\n}}\n'
+
+
+def gen_expression(size):
+    """Una asignación cuyo lado derecho tiene `size` operandos"""
+    terms = ' + '.join(f'(x - {i})' if i % 3 == 0 else str(i) for i in range(size))
+    return f'int main() {{\n    int x = 1;\n    x = {terms};\n    return x;\n}}\n'
+
+
+GENERATORS = {
+    'functions': gen_functions,
+    'statements': gen_statements,
+    'nesting': gen_nesting,
+    'expression': gen_expression,
+}
+
+
+def measure(tokens, repeat):
+    """Mejor tiempo de parse() y pico de memoria en bytes"""
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            Parser(tokens).parse()
+            best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+
+    # tracemalloc ralentiza la ejecución: la memoria se mide aparte
+    gc.collect()
+    tracemalloc.start()
+    try:
+        Parser(tokens).parse()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def growth_exponent(points):
+    """Pendiente log-log (tokens, segundos) por mínimos cuadrados"""
+    points = [(math.log(t), math.log(s)) for t, s in points if t > 0 and s > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if var_x == 0:
+        return None
+    cov = sum((x - mean_x) * (y - mean_y) for x, y in points)
+    return cov / var_x
+
+
+def run(shapes, sizes_override, repeat):
+    lexer = LexicalAnalyzer()
+    results = []
+    for shape in shapes:
+        for size in sizes_override or DEFAULT_SIZES[shape]:
+            lexer.analyze(GENERATORS[shape](size))
+            tokens = lexer.tokens
+            entry = {'shape': shape, 'size': size, 'tokens': len(tokens)}
+            try:
+                seconds, peak = measure(tokens, repeat)
+            except RecursionError:
+                entry['error'] = 'RecursionError'
+                print(f"{shape:<11} {size:>7} {len(tokens):>9}  RecursionError")
+            else:
+                entry.update({
+                    'seconds': seconds,
+                    'tokens_per_second': len(tokens) / seconds,
+                    'peak_bytes': peak,
+                    'bytes_per_token': peak / len(tokens),
+                })
+                print(f"{shape:<11} {size:>7} {len(tokens):>9} {seconds * 1000:10.2f} ms"
+                      f" {len(tokens) / seconds:12,.0f} tok/s {peak / 1024:10.1f} KiB")
+            results.append(entry)
+    return results
+
+
+def summarize(results):
+    """Exponente de crecimiento por forma"""
+    summary = {}
+    for shape in dict.fromkeys(entry['shape'] for entry in results):
+        points = [(e['tokens'], e['seconds']) for e in results
+                  if e['shape'] == shape and 'seconds' in e]
+        memory = [(e['tokens'], e['peak_bytes']) for e in results
+                  if e['shape'] == shape and 'peak_bytes' in e]
+        summary[shape] = {
+            'time_exponent': growth_exponent(points),
+            'memory_exponent': growth_exponent(memory),
+            'max_size_without_error': max(
+                (e['size'] for e in results if e['shape'] == shape and 'error' not in e),
+                default=None),
+        }
+    return summary
+
+
+def compare(results, summary, baseline_path, threshold, exponent_slack=0.25):
+    """Lista de regresiones respecto a un JSON anterior"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(e['shape'], e['size']): e for e in baseline['results']}
+    regressions = []
+    for entry in results:
+        old = previous.get((entry['shape'], entry['size']))
+        if old is None:
+            continue
+        key = f"{entry['shape']}/{entry['size']}"
+        if 'error' in entry and 'error' not in old:
+            regressions.append(f"{key}: {entry['error']} (antes sin error)")
+            continue
+        for metric in ('seconds', 'peak_bytes'):
+            if metric in entry and metric in old and old[metric] > 0:
+                ratio = entry[metric] / old[metric]
+                if ratio > threshold:
+                    regressions.append(f"{key}: {metric} x{ratio:.2f}")
+
+    # Un exponente mayor indica un cambio de complejidad aunque los
+    # tamaños medidos todavía no superen el umbral
+    for shape, info in summary.items():
+        old_exponent = baseline.get('summary', {}).get(shape, {}).get('time_exponent')
+        new_exponent = info['time_exponent']
+        if old_exponent is not None and new_exponent is not None:
+            if new_exponent > old_exponent + exponent_slack:
+                regressions.append(
+                    f"{shape}: exponente {old_exponent:.2f} -> {new_exponent:.2f}")
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Escalabilidad del Parser')
+    arg_parser.add_argument('--shapes', nargs='+', choices=sorted(GENERATORS),
+                            default=list(GENERATORS))
+    arg_parser.add_argument('--sizes', nargs='+', type=int,
+                            help='tamaños a usar en todas las formas')
+    arg_parser.add_argument('--repeat', type=int, default=3)
+    arg_parser.add_argument('--output', help='archivo JSON de resultados')
+    arg_parser.add_argument('--compare', help='JSON anterior contra el que comparar')
+    arg_parser.add_argument('--threshold', type=float, default=1.5,
+                            help='factor de empeoramiento tolerado (por defecto 1.5)')
+    args = arg_parser.parse_args()
+
+    print("=" * 78)
+    print("ESCALABILIDAD DEL PARSER")
+    print("=" * 78)
+    print(f"{'forma':<11} {'tamaño':>7} {'tokens':>9} {'tiempo':>13} {'velocidad':>18} {'memoria':>14}")
+
+    results = run(args.shapes, args.sizes, args.repeat)
+    summary = summarize(results)
+
+    print("\nExponente de crecimiento (1.0 = lineal):")
+    for shape, info in summary.items():
+        time_exp = info['time_exponent']
+        mem_exp = info['memory_exponent']
+        print(f"  {shape:<11} tiempo {time_exp if time_exp is None else round(time_exp, 2)}"
+              f"  memoria {mem_exp if mem_exp is None else round(mem_exp, 2)}")
+
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'results': results,
+        'summary': summary,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResultados guardados en {args.output}")
+
+    if args.compare:
+        regressions = compare(results, summary, args.compare, args.threshold)
+        if regressions:
+            print("\n❌ Regresiones detectadas:")
+            for line in regressions:
+                print(f"  - {line}")
+            sys.exit(1)
+        print("\n✅ Sin regresiones respecto a", args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la Máquina Virtual: bucles
+
+Compila una sola vez un programa dominado por bucles (acceso a variables,
+aritmética y comparaciones) y mide cuánto tarda VirtualMachine.run(). Con
+--baseline se compara contra otra copia de main.py, compilando y ejecutando
+el mismo programa con su propio pipeline:
+
+    git show HEAD~1:main.py > /tmp/main_baseline.py
+    python bench_vm.py --baseline /tmp/main_baseline.py
+
+Con --opt-level se compila con compiler.Compiler en ese nivel; --unfused
+añade la misma compilación sin superinstrucciones para comparar:
+
+    python bench_vm.py --opt-level 2 --unfused
+
+--no-loop-opt hace lo mismo sin las optimizaciones de bucles (loops.py):
+
+    python bench_vm.py --opt-level 2 --no-loop-opt
+
+--python-backend mide también el programa traducido a Python por
+pybackend.PythonBackend:
+
+    python bench_vm.py --opt-level 2 --python-backend
+
+--lanes N ejecuta inner(n) para N valores distintos de n a la vez con
+lanes.LaneVM (necesita NumPy) y lo compara con una VirtualMachine por valor:
+
+    python bench_vm.py --opt-level 2 --lanes 100000
+"""
+
+import argparse
+import gc
+import importlib.util
+import time
+
+import main as current
+
+
+def generate_source(iterations=2000):
+    """Programa con un bucle en main y bucles anidados en una función"""
+    return f'''
+int inner(int n) {{
+    int j = 0;
+    int acc = 0;
+    while (j < n) {{
+        acc = acc + j * 2;
+        j = j + 1;
+    }}
+    return acc;
+}}
+
+int main() {{
+    int i = 0;
+    int total = 0;
+    while (i < {iterations}) {{
+        total = total + i;
+        if (i > 10) {{
+            total = total - 1;
+        }}
+        i = i + 1;
+    }}
+    int k = 0;
+    while (k < {iterations // 100}) {{
+        total = total + inner(100);
+        k = k + 1;
+    }}
+    return total;
+}}
+'''
+
+
+def load_module(path):
+    """Carga otra copia de main.py"""
+    spec = importlib.util.spec_from_file_location('baseline_main', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def compile_with(module, source_code, opt_level=None, superinstructions=True,
+                 loop_optimization=True):
+    """Lexer -> Parser -> CodeGenerator del módulo indicado, o Compiler si hay opt_level"""
+    lexer = module.LexicalAnalyzer()
+    lexer.analyze(source_code)
+    ast = module.Parser(lexer.tokens).parse()
+    if opt_level is None:
+        return module.CodeGenerator().generate(ast)
+    from compiler import Compiler
+    return Compiler(opt_level, superinstructions, loop_optimization).compile(ast)
+
+
+def count_instructions(module, code):
+    """Instrucciones que ejecuta el programa, paso a paso con execute_instruction()"""
+    vm = module.VirtualMachine()
+    vm.load_instructions(code)
+    vm.running = True
+    count = 0
+    while vm.running and vm.instruction_pointer < len(vm.instructions):
+        vm.execute_instruction()
+        count += 1
+    return count
+
+
+def measure(module, code, backend=None):
+    """Tiempo de una ejecución completa en segundos y pila final"""
+    vm = module.VirtualMachine()
+    vm.load_instructions(code)
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        if backend is not None:
+            backend.run(vm)
+        else:
+            vm.run()
+        return time.perf_counter() - start, vm.stack
+    finally:
+        gc.enable()
+
+
+def measure_lanes(code, lanes):
+    """(segundos por valor con LaneVM, segundos por valor con VirtualMachine) para inner(n)"""
+    from lanes import LaneVM
+    inner = next(instr.operand for instr in code if instr.opcode is current.OpCode.CALL)
+    values = [50 + lane % 101 for lane in range(lanes)]
+    vm = LaneVM(lanes)
+    vm.load_instructions(inner, {'n': values})
+    start = time.perf_counter()
+    vm.run()
+    vectorized = (time.perf_counter() - start) / lanes
+
+    # Con una muestra basta para el tiempo por valor del intérprete
+    sample = values[:200]
+    start = time.perf_counter()
+    for n, expected in zip(sample, vm.stack[0]):
+        scalar = current.VirtualMachine()
+        scalar.load_instructions(inner)
+        scalar.slots[0] = n
+        scalar.run()
+        assert scalar.stack == [expected]
+    return vectorized, (time.perf_counter() - start) / len(sample)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark de la Máquina Virtual')
+    arg_parser.add_argument('--iterations', type=int, default=2000)
+    arg_parser.add_argument('--repeat', type=int, default=10)
+    arg_parser.add_argument('--baseline', help='ruta a otra copia de main.py')
+    arg_parser.add_argument('--opt-level', type=int, choices=(0, 1, 2),
+                            help='compilar la versión actual con compiler.Compiler')
+    arg_parser.add_argument('--unfused', action='store_true',
+                            help='medir también el nivel elegido sin superinstrucciones')
+    arg_parser.add_argument('--no-loop-opt', action='store_true',
+                            help='medir también el nivel elegido sin optimización de bucles')
+    arg_parser.add_argument('--python-backend', action='store_true',
+                            help='medir también la ejecución con pybackend.PythonBackend')
+    arg_parser.add_argument('--lanes', type=int,
+                            help='medir inner(n) para tantos valores de n con lanes.LaneVM')
+    args = arg_parser.parse_args()
+
+    source_code = generate_source(args.iterations)
+    # Iteraciones de bucle que ejecuta el programa
+    loops = args.iterations + (args.iterations // 100) * 101
+
+    results = [('actual', current)]
+    programs = {'actual': compile_with(current, source_code, args.opt_level)}
+    if args.baseline:
+        results.insert(0, ('baseline', load_module(args.baseline)))
+        programs['baseline'] = compile_with(results[0][1], source_code)
+    if args.unfused:
+        results.insert(0, ('sin fusión', current))
+        programs['sin fusión'] = compile_with(current, source_code, args.opt_level or 2, False)
+    if args.no_loop_opt:
+        results.insert(0, ('sin bucles', current))
+        programs['sin bucles'] = compile_with(current, source_code, args.opt_level or 2,
+                                              loop_optimization=False)
+    backends = {}
+    if args.python_backend:
+        from pybackend import PythonBackend
+        results.append(('python', current))
+        programs['python'] = programs['actual']
+        backends['python'] = PythonBackend()
+
+    print("=" * 60)
+    print("BENCHMARK DE LA MÁQUINA VIRTUAL")
+    print("=" * 60)
+    print(f"Iteraciones de bucle: {loops}")
+
+    # Las mediciones se intercalan para que el ruido afecte a todas por igual
+    executed = {name: count_instructions(module, programs[name]) for name, module in results}
+    timings = {name: float('inf') for name, _ in results}
+    stacks = {}
+    for _ in range(args.repeat):
+        for name, module in results:
+            elapsed, stacks[name] = measure(module, programs[name], backends.get(name))
+            timings[name] = min(timings[name], elapsed)
+
+    for name, _ in results:
+        elapsed = timings[name]
+        print(f"{name:<10}: {elapsed * 1000:8.2f} ms  {loops / elapsed:12,.0f} iteraciones/s"
+              f"  {executed[name] / elapsed:12,.0f} instrucciones/s  resultado {stacks[name]}")
+
+    if 'baseline' in timings:
+        print(f"Aceleración: {timings['baseline'] / timings['actual']:.2f}x")
+    if 'sin fusión' in timings:
+        print(f"Aceleración por superinstrucciones: "
+              f"{timings['sin fusión'] / timings['actual']:.2f}x")
+    if 'sin bucles' in timings:
+        print(f"Aceleración por optimización de bucles: "
+              f"{timings['sin bucles'] / timings['actual']:.2f}x")
+    if 'python' in timings:
+        print(f"Aceleración del backend Python: {timings['actual'] / timings['python']:.2f}x")
+    if args.lanes:
+        vectorized, scalar = measure_lanes(programs['actual'], args.lanes)
+        print(f"Carriles ({args.lanes}): {1 / vectorized:12,.0f} valores/s con LaneVM, "
+              f"{1 / scalar:12,.0f} valores/s con VirtualMachine ({scalar / vectorized:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,483 @@
+"""
+Compact bytecode encoding and the .cbc file format
+
+CompactProgram.from_functions() encodes the CodeObjects produced by
+CodeGenerator into flat arrays: per function, opcodes as small integers in
+an array('H') and operands in an array('I'). Operands index a constant
+pool and a name table shared by the whole program (both deduplicated),
+except for slots and jump targets, which are stored as is, and CALL,
+whose operand is the callee's function index. Source lines are kept in a
+run-length line table of (first instruction, line) pairs.
+
+A .cbc file is that encoding on disk, little-endian:
+
+    header      magic b'CBC\\0', version u16, reserved u16,
+                constant count u32, name count u32, function count u32,
+                entry function index u32
+    constants   tag u8 + payload: 0 int (i64), 1 float (f64),
+                2 int outside i64 / 3 str (u32 length + UTF-8),
+                4 tuple (u32 count + that many constants)
+    names       u32 length + UTF-8
+    functions   name u32, line u32, param count u32, params u32 * n,
+                slot count u32, slot names u32 * n, stack size u32
+                (0xFFFFFFFF if unknown), instruction count u32,
+                opcodes u16 * n, operands u32 * n,
+                line entries u32, (first instruction u32, line u32) * n
+
+load() maps the file with mmap and rebuilds the CodeObjects straight from
+it, so running a saved program skips the lexer, parser and code generator.
+Every function with a stack size is verified on load (main.verify): a file
+whose instructions would need a deeper stack than declared is rejected.
+Operands are checked on load as well (table indices, slots, jump targets
+and the shape of superinstruction tuples), so a file that decodes never
+makes the VM fail with anything but its own runtime errors.
+
+
+    save('program.cbc', codegen.functions, entry)
+    vm.load_instructions(load('program.cbc'))
+"""
+
+import mmap
+import struct
+import sys
+from array import array
+
+from main import (CodeObject, Instruction, OpCode, VerifyError, COMPARISON_OPERATORS,
+                  jump_target, verify)
+
+MAGIC = b'CBC\0'
+FORMAT_VERSION = 4
+# Stack size of a function whose instructions did not verify
+UNKNOWN_STACKSIZE = 0xFFFFFFFF
+
+# Opcode numbers used in the encoding; new opcodes are appended and bump
+# FORMAT_VERSION
+OPCODE_TABLE = (
+    OpCode.LOAD_CONST, OpCode.LOAD_VAR, OpCode.STORE_VAR,
+    OpCode.BINARY_ADD, OpCode.BINARY_SUB, OpCode.BINARY_MUL, OpCode.BINARY_DIV,
+    OpCode.BINARY_CMP, OpCode.JUMP_IF_FALSE, OpCode.JUMP,
+    OpCode.CALL, OpCode.RETURN, OpCode.PRINT, OpCode.POP, OpCode.DUP,
+    OpCode.LOAD_FAST, OpCode.STORE_FAST,
+    # version 2
+    OpCode.INC_FAST, OpCode.LOAD_FAST_LOAD_FAST,
+    OpCode.COMPARE_JUMP_IF_FALSE, OpCode.COMPARE_FAST_CONST_JUMP_IF_FALSE,
+    # version 3
+    OpCode.BINARY_ADD_INT, OpCode.BINARY_SUB_INT, OpCode.BINARY_MUL_INT,
+    OpCode.BINARY_ADD_FLOAT, OpCode.BINARY_SUB_FLOAT, OpCode.BINARY_MUL_FLOAT,
+    OpCode.BINARY_DIV_FLOAT,
+)
+OPCODE_NUMBERS = {opcode: number for number, opcode in enumerate(OPCODE_TABLE)}
+
+# How each opcode's operand is encoded; superinstruction operand tuples go
+# to the constant pool
+CONSTANT_OPERANDS = frozenset((OpCode.LOAD_CONST, OpCode.INC_FAST, OpCode.LOAD_FAST_LOAD_FAST,
+                               OpCode.COMPARE_JUMP_IF_FALSE,
+                               OpCode.COMPARE_FAST_CONST_JUMP_IF_FALSE))
+NAME_OPERANDS = frozenset((OpCode.LOAD_VAR, OpCode.STORE_VAR, OpCode.BINARY_CMP))
+FUNCTION_OPERANDS = frozenset((OpCode.CALL,))
+INTEGER_OPERANDS = frozenset((OpCode.LOAD_FAST, OpCode.STORE_FAST,
+                              OpCode.JUMP_IF_FALSE, OpCode.JUMP))
+SLOT_OPERANDS = frozenset((OpCode.LOAD_FAST, OpCode.STORE_FAST))
+# Fields of each superinstruction's operand tuple, checked on load
+FUSED_OPERANDS = {
+    OpCode.INC_FAST: ('slot', 'number'),
+    OpCode.LOAD_FAST_LOAD_FAST: ('slot', 'slot'),
+    OpCode.COMPARE_JUMP_IF_FALSE: ('comparison', 'target'),
+    OpCode.COMPARE_FAST_CONST_JUMP_IF_FALSE: ('slot', 'comparison', 'number', 'target'),
+}
+
+# array typecode with 4-byte items for the u32 operand arrays
+U32_TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+
+_HEADER = struct.Struct('<4sHHIIII')
+_U32 = struct.Struct('<I')
+_U8 = struct.Struct('<B')
+_I64 = struct.Struct('<q')
+_F64 = struct.Struct('<d')
+_PAIR = struct.Struct('<II')
+
+TAG_INT = 0
+TAG_FLOAT = 1
+TAG_BIG_INT = 2
+TAG_STR = 3
+TAG_TUPLE = 4
+
+
+class BytecodeFormatError(ValueError):
+    """A buffer is not a valid .cbc program of a supported version"""
+
+
+class CompactFunction:
+    """One function of a CompactProgram"""
+    __slots__ = ('name', 'line', 'params', 'varnames', 'stacksize', 'ops', 'args', 'lines')
+
+    def __init__(self, name, line, params, varnames, stacksize, ops, args, lines):
+        self.name = name          # name table index
+        self.line = line
+        self.params = params      # name table indices
+        self.varnames = varnames  # name table indices
+        self.stacksize = stacksize  # None if unknown
+        self.ops = ops            # array('H') of opcode numbers
+        self.args = args          # array('I') of encoded operands
+        self.lines = lines        # [(first instruction, line), ...]
+
+    def __len__(self):
+        return len(self.ops)
+
+
+class CompactProgram:
+    """Deduplicated constant pool, name table and encoded functions"""
+
+    def __init__(self, constants=None, names=None, functions=None, entry=0):
+        self.constants = constants if constants is not None else []
+        self.names = names if names is not None else []
+        self.functions = functions if functions is not None else []
+        self.entry = entry
+
+    # Encoding
+
+    @classmethod
+    def from_functions(cls, functions, entry=None):
+        """Encode a {name: CodeObject} dict; entry defaults to main or the first function"""
+        program = cls()
+        codes = list(functions.values())
+        if entry is None:
+            entry = functions.get('main') or (codes[0] if codes else None)
+        if entry is not None and all(code is not entry for code in codes):
+            codes.append(entry)
+        index_of = {id(code): index for index, code in enumerate(codes)}
+        program.entry = index_of[id(entry)] if entry is not None else 0
+
+        constant_index = {}
+        name_index = {}
+
+        def constant(value):
+            key = (type(value), repr(value))  # keeps 1 / 1.0 and 0.0 / -0.0 apart
+            if key not in constant_index:
+                constant_index[key] = len(program.constants)
+                program.constants.append(value)
+            return constant_index[key]
+
+        def name(value):
+            if value not in name_index:
+                name_index[value] = len(program.names)
+                program.names.append(value)
+            return name_index[value]
+
+        for code in codes:
+            ops = array('H')
+            args = array(U32_TYPECODE)
+            lines = []
+            for position, instr in enumerate(code.instructions):
+                opcode = instr.opcode
+                ops.append(OPCODE_NUMBERS[opcode])
+                if opcode in CONSTANT_OPERANDS:
+                    args.append(constant(instr.operand))
+                elif opcode in NAME_OPERANDS:
+                    args.append(name(instr.operand))
+                elif opcode in FUNCTION_OPERANDS:
+                    if id(instr.operand) not in index_of:
+                        raise ValueError(f"CALL to '{instr.operand.name}', which is not "
+                                         f"one of the encoded functions")
+                    args.append(index_of[id(instr.operand)])
+                elif opcode in INTEGER_OPERANDS:
+                    args.append(instr.operand)
+                else:
+                    args.append(0)
+                if not lines or lines[-1][1] != instr.line:
+                    lines.append((position, instr.line))
+
+            program.functions.append(CompactFunction(
+                name(code.name), code.line,
+                [name(param) for param in code.params],
+                [name(var) for var in code.varnames],
+                code.stacksize, ops, args, lines))
+        return program
+
+    def to_bytes(self):
+        """Serialize in the .cbc format"""
+        parts = [_HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(self.constants),
+                              len(self.names), len(self.functions), self.entry)]
+
+        for value in self.constants:
+            _encode_constant(value, parts)
+
+        for value in self.names:
+            parts.append(_string(value))
+
+        for function in self.functions:
+            parts.append(_U32.pack(function.name) + _U32.pack(function.line))
+            parts.append(_u32_array(function.params))
+            parts.append(_u32_array(function.varnames))
+            parts.append(_U32.pack(UNKNOWN_STACKSIZE if function.stacksize is None
+                                   else function.stacksize))
+            parts.append(_U32.pack(len(function.ops)))
+            parts.append(_little_endian(function.ops))
+            parts.append(_little_endian(function.args))
+            parts.append(_U32.pack(len(function.lines)))
+            parts.extend(_PAIR.pack(first, line) for first, line in function.lines)
+
+        return b''.join(parts)
+
+    # Decoding
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        """Parse a .cbc buffer (bytes, memoryview or mmap)"""
+        # The view is released on the way out, even on errors, so a mmap
+        # passed in can be closed afterwards
+        with memoryview(buffer) as view:
+            try:
+                return cls._parse(_Reader(view))
+            except (struct.error, UnicodeDecodeError) as e:
+                raise BytecodeFormatError(f"Corrupt bytecode file: {e}") from None
+
+    @classmethod
+    def _parse(cls, reader):
+        magic, version, _, constant_count, name_count, function_count, entry = (
+            reader.unpack(_HEADER))
+        if magic != MAGIC:
+            raise BytecodeFormatError("Not a compiled bytecode file (bad magic number)")
+        if version != FORMAT_VERSION:
+            raise BytecodeFormatError(f"Unsupported bytecode version {version}, "
+                                      f"expected {FORMAT_VERSION}")
+
+        program = cls(entry=entry)
+        for _ in range(constant_count):
+            program.constants.append(reader.constant())
+
+        for _ in range(name_count):
+            program.names.append(reader.string())
+
+        for _ in range(function_count):
+            name, line = reader.unpack(_PAIR)
+            params = reader.u32_array()
+            varnames = reader.u32_array()
+            stacksize, = reader.unpack(_U32)
+            if stacksize == UNKNOWN_STACKSIZE:
+                stacksize = None
+            count, = reader.unpack(_U32)
+            ops = reader.array('H', count)
+            args = reader.array(U32_TYPECODE, count)
+            line_count, = reader.unpack(_U32)
+            lines = [reader.unpack(_PAIR) for _ in range(line_count)]
+            program.functions.append(
+                CompactFunction(name, line, params, varnames, stacksize, ops, args, lines))
+
+        if function_count and entry >= function_count:
+            raise BytecodeFormatError(f"Entry function {entry} out of range")
+        return program
+
+    def to_code_objects(self):
+        """Rebuild the CodeObjects; returns ({name: CodeObject}, entry CodeObject)"""
+        names = self.names
+        constants = self.constants
+        name_at = _table_lookup(names, 'name')
+        constant_at = _table_lookup(constants, 'constant')
+        codes = [CodeObject(name_at(function.name),
+                            [name_at(index) for index in function.params],
+                            line=function.line,
+                            varnames=[name_at(index) for index in function.varnames])
+                 for function in self.functions]
+        function_at = _table_lookup(codes, 'function')
+
+        for code, function in zip(codes, self.functions):
+            line_starts = iter(function.lines[1:])
+            next_start, next_line = next(line_starts, (None, 0))
+            line = function.lines[0][1] if function.lines else 0
+            instructions = code.instructions
+            slot_count = len(code.varnames)
+            for position, (number, arg) in enumerate(zip(function.ops, function.args)):
+                if position == next_start:
+                    line = next_line
+                    next_start, next_line = next(line_starts, (None, 0))
+                try:
+                    opcode = OPCODE_TABLE[number]
+                except IndexError:
+                    raise BytecodeFormatError(f"Unknown opcode number {number}") from None
+                if opcode in CONSTANT_OPERANDS:
+                    operand = constant_at(arg)
+                    if opcode in FUSED_OPERANDS:
+                        _check_fused(opcode, operand, slot_count)
+                elif opcode in NAME_OPERANDS:
+                    operand = name_at(arg)
+                elif opcode in FUNCTION_OPERANDS:
+                    operand = function_at(arg)
+                elif opcode in INTEGER_OPERANDS:
+                    operand = arg
+                    if opcode in SLOT_OPERANDS and arg >= slot_count:
+                        raise BytecodeFormatError(f"Slot {arg} out of range "
+                                                  f"({slot_count} slots in '{code.name}')")
+                else:
+                    operand = None
+                instructions.append(Instruction(opcode, operand, line))
+
+        for code, function in zip(codes, self.functions):
+            code.stacksize = function.stacksize
+            try:
+                _check_jumps(code)
+                if code.stacksize is not None:
+                    verify(code)
+            except VerifyError as e:
+                raise BytecodeFormatError(f"Invalid function '{code.name}': {e}") from None
+
+        functions = {code.name: code for code in codes}
+        entry = codes[self.entry] if codes else CodeObject('<program>')
+        return functions, entry
+
+
+def save(path, functions, entry=None):
+    """Write a {name: CodeObject} dict to a .cbc file; returns its size in bytes"""
+    data = CompactProgram.from_functions(functions, entry).to_bytes()
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+def load_program(path):
+    """Read a .cbc file through mmap; returns ({name: CodeObject}, entry CodeObject)"""
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            raise BytecodeFormatError(f"'{path}' is empty")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return CompactProgram.from_buffer(mapped).to_code_objects()
+
+
+def load(path):
+    """Entry CodeObject of a .cbc file, ready for VirtualMachine.load_instructions()"""
+    return load_program(path)[1]
+
+
+# Helpers
+
+def _table_lookup(table, kind):
+    """table[index] as a function that raises BytecodeFormatError for a bad index"""
+    def lookup(index):
+        if index >= len(table):
+            raise BytecodeFormatError(f"{kind.capitalize()} index {index} out of range "
+                                      f"({len(table)} {kind}s)")
+        return table[index]
+    return lookup
+
+
+def _check_fused(opcode, operand, slot_count):
+    """Check the shape of a superinstruction's operand tuple against FUSED_OPERANDS"""
+    fields = FUSED_OPERANDS[opcode]
+    if type(operand) is not tuple or len(operand) != len(fields):
+        raise BytecodeFormatError(f"Malformed {opcode.name} operand {operand!r}")
+    for field, value in zip(fields, operand):
+        if field == 'slot':
+            valid = type(value) is int and 0 <= value < slot_count
+        elif field == 'number':
+            valid = type(value) in (int, float)
+        elif field == 'comparison':
+            valid = type(value) is str and value in COMPARISON_OPERATORS
+        else:
+            valid = type(value) is int
+        if not valid:
+            raise BytecodeFormatError(f"Malformed {opcode.name} operand {operand!r}: "
+                                      f"bad {field} {value!r}")
+
+
+def _check_jumps(code):
+    """Check that every jump stays within code, also for functions stored without a stack size"""
+    end = len(code.instructions)
+    for index, instr in enumerate(code.instructions):
+        try:
+            target = jump_target(instr)
+        except (TypeError, IndexError):
+            raise VerifyError(f"Instruction {index} ({instr.opcode.name}) has a malformed "
+                              f"operand {instr.operand!r}") from None
+        if target is not None and (type(target) is not int or not 0 <= target <= end):
+            raise VerifyError(f"Instruction {index} jumps to {target!r}, outside "
+                              f"the {end} instructions")
+
+
+def _encode_constant(value, parts):
+    if type(value) is int:
+        if -2**63 <= value < 2**63:
+            parts.append(_U8.pack(TAG_INT) + _I64.pack(value))
+        else:
+            parts.append(_U8.pack(TAG_BIG_INT) + _string(str(value)))
+    elif type(value) is float:
+        parts.append(_U8.pack(TAG_FLOAT) + _F64.pack(value))
+    elif type(value) is str:
+        parts.append(_U8.pack(TAG_STR) + _string(value))
+    elif type(value) is tuple:
+        parts.append(_U8.pack(TAG_TUPLE) + _U32.pack(len(value)))
+        for item in value:
+            _encode_constant(item, parts)
+    else:
+        raise ValueError(f"Constant {value!r} cannot be encoded")
+
+
+def _string(value):
+    data = value.encode('utf-8')
+    return _U32.pack(len(data)) + data
+
+
+def _u32_array(values):
+    return _U32.pack(len(values)) + _little_endian(array(U32_TYPECODE, values))
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class _Reader:
+    """Sequential reader over a .cbc buffer"""
+
+    def __init__(self, view):
+        self.buffer = view
+        self.offset = 0
+
+    def _take(self, size):
+        end = self.offset + size
+        if end > len(self.buffer):
+            raise BytecodeFormatError("Truncated bytecode file")
+        chunk = self.buffer[self.offset:end]
+        self.offset = end
+        return chunk
+
+    def unpack(self, layout):
+        return layout.unpack(self._take(layout.size))
+
+    def constant(self):
+        tag, = self.unpack(_U8)
+        if tag == TAG_INT:
+            return self.unpack(_I64)[0]
+        if tag == TAG_FLOAT:
+            return self.unpack(_F64)[0]
+        if tag == TAG_BIG_INT:
+            digits = self.string()
+            try:
+                return int(digits)
+            except ValueError:
+                raise BytecodeFormatError(f"Malformed integer constant {digits!r}") from None
+        if tag == TAG_STR:
+            return self.string()
+        if tag == TAG_TUPLE:
+            count, = self.unpack(_U32)
+            return tuple(self.constant() for _ in range(count))
+        raise BytecodeFormatError(f"Unknown constant tag {tag}")
+
+    def string(self):
+        size, = self.unpack(_U32)
+        try:
+            return str(self._take(size), 'utf-8')
+        except UnicodeDecodeError as e:
+            raise BytecodeFormatError(f"Invalid UTF-8 string: {e}") from None
+
+    def array(self, typecode, count):
+        values = array(typecode)
+        values.frombytes(self._take(count * values.itemsize))
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
+
+    def u32_array(self):
+        count, = self.unpack(_U32)
+        return list(self.array(U32_TYPECODE, count))
@@ -0,0 +1,254 @@
+"""
+Content-addressed compilation cache
+
+A compiled program is stored under the SHA-256 of the compiler
+fingerprint (the source of every module of the pipeline, so any change to
+the compiler invalidates old entries), the compilation options and the
+program source. Each disk entry is one file:
+
+    u32 length of the metadata, metadata (JSON: diagnostics, pass report),
+    then the program in the .cbc format of bytecode.py (absent if
+    compilation stopped at an error)
+
+The directory is kept under max_bytes by evicting the least recently used
+entries (a hit refreshes the file's modification time). In front of the
+disk, an in-process memo keeps the last memo_size results.
+
+The cache directory is $MINILANG_CACHE_DIR, or ~/.cache/minilang.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+from collections import OrderedDict, namedtuple
+
+from main import LexicalAnalyzer, SemanticAnalyzer, Parser
+from compiler import Compiler, DEFAULT_OPT_LEVEL
+import bytecode
+
+CACHE_DIR_ENV = 'MINILANG_CACHE_DIR'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'minilang')
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_MEMO_SIZE = 64
+ENTRY_SUFFIX = '.entry'
+
+# Modules whose source defines the generated bytecode
+FINGERPRINT_MODULES = ('main', 'cfg', 'compiler', 'optimizer', 'peephole', 'deadcode', 'loops',
+                       'superinstructions', 'typespec', 'bytecode', 'cache')
+
+_U32 = struct.Struct('<I')
+
+# entry: CodeObject to run, None if compilation stopped at an error
+# diagnostics: (stage, line, column, message) tuples
+# report: Compiler.report
+CompileResult = namedtuple('CompileResult', ['entry', 'functions', 'diagnostics', 'report'])
+
+_fingerprint = None
+
+
+def compiler_fingerprint():
+    """Hash of the source of the compiler modules, computed once per process"""
+    global _fingerprint
+    if _fingerprint is None:
+        digest = hashlib.sha256()
+        for name in FINGERPRINT_MODULES:
+            with open(sys.modules[name].__file__, 'rb') as f:
+                digest.update(f.read())
+        _fingerprint = digest.hexdigest()
+    return _fingerprint
+
+
+def collect_diagnostics(lexer_errors=(), semantic_errors=(), parser_errors=(), codegen_errors=()):
+    """Errors of every stage as (stage, line, column, message) tuples"""
+    diagnostics = []
+    for stage, errors in (('lexer', lexer_errors), ('semantic', semantic_errors),
+                          ('parser', parser_errors), ('codegen', codegen_errors)):
+        diagnostics.extend((stage, error['line'], error['column'], error['message'])
+                           for error in errors)
+    return diagnostics
+
+
+def compile_source(source_code, opt_level=DEFAULT_OPT_LEVEL, superinstructions=True, cache=None):
+    """Run the whole pipeline quietly, through cache if one is given; returns a CompileResult.
+
+    Like main.py, lexical or semantic errors stop before parsing and
+    parser errors stop before code generation.
+    """
+    if cache is not None:
+        key = cache.key(source_code, opt_level, superinstructions)
+        result = cache.get(key)
+        if result is not None:
+            return result
+
+    lexer = LexicalAnalyzer()
+    lexer.analyze(source_code)
+    semantic_errors = SemanticAnalyzer().analyze(lexer.tokens)
+    entry, functions, report = None, {}, []
+    parser_errors = codegen_errors = ()
+    if not lexer.errors and not semantic_errors:
+        parser = Parser(lexer.tokens)
+        ast = parser.parse()
+        parser_errors = parser.errors
+        if not parser_errors:
+            compiler = Compiler(opt_level, superinstructions)
+            entry = compiler.compile(ast)
+            functions, report = compiler.functions, compiler.report
+            codegen_errors = compiler.errors
+
+    result = CompileResult(entry, functions,
+                           collect_diagnostics(lexer.errors, semantic_errors,
+                                               parser_errors, codegen_errors),
+                           report)
+    if cache is not None:
+        cache.put(key, result)
+    return result
+
+
+class CompileCache:
+    """Disk cache of compiled programs with LRU size limit and an in-process memo.
+
+    `memo_hits`, `disk_hits` and `misses` count the outcome of get().
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES, memo_size=DEFAULT_MEMO_SIZE):
+        if directory is None:
+            directory = os.environ.get(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memo_size = memo_size
+        self._memo = OrderedDict()
+        self.memo_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, source_code, opt_level=DEFAULT_OPT_LEVEL, superinstructions=True):
+        """Cache key of source_code compiled with these options"""
+        digest = hashlib.sha256()
+        digest.update(compiler_fingerprint().encode())
+        digest.update(f"\0-O{opt_level}\0superinstructions={superinstructions}\0".encode())
+        digest.update(source_code.encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        """CompileResult stored under key, or None"""
+        result = self._memo.get(key)
+        if result is not None:
+            self._memo.move_to_end(key)
+            self.memo_hits += 1
+            return result
+
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            result = self._decode(data)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, ValueError, KeyError, struct.error):
+            # A corrupt or foreign entry is a miss; compiling again replaces it
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.disk_hits += 1
+        self._remember(key, result)
+        return result
+
+    def put(self, key, result):
+        """Store a CompileResult under key, then evict down to max_bytes"""
+        self._remember(key, result)
+        data = self._encode(result)
+        os.makedirs(self.directory, exist_ok=True)
+        # Written under a temporary name and renamed, so readers never see half an entry
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temporary, self.path(key))
+        except BaseException:
+            self._remove(temporary)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the directory fits in max_bytes"""
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.directory) as scan:
+                for item in scan:
+                    if item.name.endswith(ENTRY_SUFFIX):
+                        stat = item.stat()
+                        entries.append((stat.st_mtime_ns, stat.st_size, item.path))
+                        total += stat.st_size
+        except FileNotFoundError:
+            return 0
+
+        removed = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        """Forget every entry, on disk and in memory"""
+        self._memo.clear()
+        try:
+            with os.scandir(self.directory) as scan:
+                for item in scan:
+                    if item.name.endswith(ENTRY_SUFFIX):
+                        self._remove(item.path)
+        except FileNotFoundError:
+            pass
+
+    def _remember(self, key, result):
+        self._memo[key] = result
+        self._memo.move_to_end(key)
+        while len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _encode(result):
+        metadata = json.dumps({
+            'diagnostics': result.diagnostics,
+            'report': result.report,
+        }).encode()
+        program = b''
+        if result.entry is not None:
+            program = bytecode.CompactProgram.from_functions(result.functions,
+                                                             result.entry).to_bytes()
+        return _U32.pack(len(metadata)) + metadata + program
+
+    @staticmethod
+    def _decode(data):
+        length, = _U32.unpack_from(data)
+        metadata = json.loads(data[_U32.size:_U32.size + length])
+        program = data[_U32.size + length:]
+        entry, functions = None, {}
+        if program:
+            functions, entry = bytecode.CompactProgram.from_buffer(program).to_code_objects()
+        return CompileResult(entry, functions,
+                             [tuple(diagnostic) for diagnostic in metadata['diagnostics']],
+                             [tuple(item) for item in metadata['report']])
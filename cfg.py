@@ -0,0 +1,291 @@
+"""
+Control-flow graph IR between the AST and bytecode
+
+CFGBuilder is a CodeGenerator that emits each function into basic blocks
+instead of one flat list: straight-line code is generated by the usual
+visitors into the current block, and if, while and return close it. A
+block never holds jumps; how it ends is recorded on the block:
+
+    branch   JUMP_IF_FALSE whose operand is the block taken when the
+             condition is false, or None
+    next     block executed otherwise (fall-through), or None when the
+             block returns or ends the function
+
+Passes work on ControlFlowGraph (blocks with successor and predecessor
+lists, reverse postorder, dominators) and linearize() lowers a graph to
+an instruction list, placing each block's `next` right after it whenever
+possible so that no JUMP is needed. Blocks are created in source order,
+so an untouched graph lowers to exactly what CodeGenerator emits.
+"""
+
+from main import CodeGenerator, Instruction, OpCode, thread_jumps
+
+_RETURN = OpCode.RETURN
+
+
+class BasicBlock:
+    """Straight-line instructions with at most one branch at the end"""
+
+    __slots__ = ('id', 'instructions', 'branch', 'next', 'successors', 'predecessors')
+
+    def __init__(self, block_id):
+        self.id = block_id
+        self.instructions = []
+        self.branch = None
+        self.next = None
+        self.successors = []
+        self.predecessors = []
+
+    @property
+    def target(self):
+        """Block the branch goes to, or None"""
+        return self.branch.operand if self.branch is not None else None
+
+    @property
+    def returns(self):
+        return bool(self.instructions) and self.instructions[-1].opcode is _RETURN
+
+    def __repr__(self):
+        return f"B{self.id}"
+
+
+class ControlFlowGraph:
+    """Basic blocks of one function; blocks[0] is the entry.
+
+    successors and predecessors of every block are filled in by
+    compute_edges(), which passes call again after changing the graph.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.blocks = []
+
+    @property
+    def entry(self):
+        return self.blocks[0] if self.blocks else None
+
+    def new_block(self):
+        block = BasicBlock(len(self.blocks))
+        self.blocks.append(block)
+        return block
+
+    def compute_edges(self):
+        for block in self.blocks:
+            block.successors = []
+            block.predecessors = []
+        for block in self.blocks:
+            for successor in (block.next, block.target):
+                if successor is not None and successor not in block.successors:
+                    block.successors.append(successor)
+                    successor.predecessors.append(block)
+        return self
+
+    def reverse_postorder(self):
+        """Blocks reachable from the entry, each before its successors except along back edges"""
+        if not self.blocks:
+            return []
+        order = []
+        visited = {self.entry}
+        stack = [(self.entry, iter(self.entry.successors))]
+        while stack:
+            block, successors = stack[-1]
+            for successor in successors:
+                if successor not in visited:
+                    visited.add(successor)
+                    stack.append((successor, iter(successor.successors)))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+        order.reverse()
+        return order
+
+    def immediate_dominators(self):
+        """{block: immediate dominator} for the reachable blocks; the entry maps to None.
+
+        Iterative algorithm of Cooper, Harvey and Kennedy over reverse postorder.
+        """
+        order = self.reverse_postorder()
+        if not order:
+            return {}
+        index = {block: position for position, block in enumerate(order)}
+        idom = {order[0]: order[0]}
+
+        def intersect(first, second):
+            while first is not second:
+                while index[first] > index[second]:
+                    first = idom[first]
+                while index[second] > index[first]:
+                    second = idom[second]
+            return first
+
+        changed = True
+        while changed:
+            changed = False
+            for block in order[1:]:
+                processed = [pred for pred in block.predecessors if pred in idom]
+                new_idom = processed[0]
+                for pred in processed[1:]:
+                    new_idom = intersect(pred, new_idom)
+                if idom.get(block) is not new_idom:
+                    idom[block] = new_idom
+                    changed = True
+
+        idom[order[0]] = None
+        return idom
+
+    def dominators(self):
+        """{block: set of the blocks that dominate it, itself included}"""
+        idom = self.immediate_dominators()
+        result = {}
+        for block in idom:
+            dominators = set()
+            current = block
+            while current is not None:
+                dominators.add(current)
+                current = idom[current]
+            result[block] = dominators
+        return result
+
+    def dominates(self, first, second, idom=None):
+        """True if every path from the entry to second goes through first"""
+        if idom is None:
+            idom = self.immediate_dominators()
+        current = second
+        while current is not None:
+            if current is first:
+                return True
+            current = idom.get(current)
+        return False
+
+    def __repr__(self):
+        return f"ControlFlowGraph({self.name}, {len(self.blocks)} blocks)"
+
+
+def linearize(graph):
+    """Lower a graph to an instruction list with index jump targets.
+
+    Blocks are placed in creation order, except that a block's `next` is
+    placed right after it when it has not been placed yet; a JUMP is only
+    emitted when `next` ended up elsewhere.
+    """
+    order = []
+    placed = set()
+    for block in graph.blocks:
+        while block is not None and block not in placed:
+            order.append(block)
+            placed.add(block)
+            block = block.next
+
+    instructions = []
+    positions = {}
+    jumps = []
+    for index, block in enumerate(order):
+        positions[block] = len(instructions)
+        instructions.extend(block.instructions)
+        following = order[index + 1] if index + 1 < len(order) else None
+        if block.branch is not None:
+            branch = Instruction(block.branch.opcode, block.target, block.branch.line)
+            jumps.append(branch)
+            instructions.append(branch)
+        if block.next is not None and block.next is not following:
+            # Attributed to the last line of the block
+            line = instructions[-1].line if instructions else 0
+            jump = Instruction(OpCode.JUMP, block.next, line)
+            jumps.append(jump)
+            instructions.append(jump)
+
+    for jump in jumps:
+        jump.operand = positions[jump.operand]
+    thread_jumps(instructions)
+    return instructions
+
+
+class CFGBuilder(CodeGenerator):
+    """CodeGenerator that builds a ControlFlowGraph per function.
+
+    build() fills `graphs` ({name: ControlFlowGraph}) and `program` (code
+    outside any function) and leaves the CodeObjects empty; linearize()
+    lowers the graphs into them and returns the entry function.
+    generate() does both, so the builder can stand in for CodeGenerator.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.graphs = {}
+        self.program = ControlFlowGraph('<program>')
+        self._graph = self.program
+        self._block = None
+        self._outer = None
+
+    def generate(self, ast):
+        self.build(ast)
+        return self.linearize()
+
+    def build(self, ast):
+        """Generate the graphs of every function of ast; returns `graphs`"""
+        self._reset()
+        self.graphs = {}
+        self.program = ControlFlowGraph('<program>')
+        self._graph = self.program
+        self._enter(self.program.new_block())
+        self.generate_node(ast)
+        self.program.compute_edges()
+        return self.graphs
+
+    def linearize(self):
+        """Lower every graph into its CodeObject; returns the entry like generate()"""
+        for name, graph in self.graphs.items():
+            self.functions[name].instructions[:] = linearize(graph)
+        self.instructions = linearize(self.program)
+        entry = self._entry()
+        self.compute_stacksizes([*self.functions.values(), entry])
+        return entry
+
+    def _enter(self, block):
+        """Make block the one instructions are emitted into"""
+        self._block = block
+        self.instructions = block.instructions
+        return block
+
+    def _begin_code(self, code):
+        self._outer = (self._graph, self._block)
+        self._graph = ControlFlowGraph(code.name)
+        self.graphs[code.name] = self._graph
+        self._enter(self._graph.new_block())
+
+    def _end_code(self, code):
+        self._graph.compute_edges()
+        graph, block = self._outer
+        self._graph = graph
+        self._enter(block)
+
+    def visit_if_statement(self, node):
+        yield node.children[0]
+        condition = self._block
+        condition.branch = Instruction(OpCode.JUMP_IF_FALSE, line=node.line)
+        condition.next = self._enter(self._graph.new_block())
+
+        yield from self._statements(node.children[1:])
+
+        body_end = self._block
+        body_end.next = condition.branch.operand = self._enter(self._graph.new_block())
+
+    def visit_while_statement(self, node):
+        before = self._block
+        before.next = header = self._enter(self._graph.new_block())
+
+        yield node.children[0]
+        condition = self._block
+        condition.branch = Instruction(OpCode.JUMP_IF_FALSE, line=node.line)
+        condition.next = self._enter(self._graph.new_block())
+
+        yield from self._statements(node.children[1:])
+
+        self._block.next = header
+        condition.branch.operand = self._enter(self._graph.new_block())
+
+    def visit_return_statement(self, node):
+        yield from super().visit_return_statement(node)
+        # Anything after a return in the same block is unreachable
+        self._enter(self._graph.new_block())
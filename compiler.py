@@ -0,0 +1,108 @@
+"""
+Compilation pipeline: AST -> optimized bytecode
+
+Code is generated through the control-flow graph of cfg.py: passes over
+basic blocks run between CFGBuilder.build() and linearize(), the passes
+over instruction lists after it.
+
+Optimization levels:
+
+    0   code generation only
+    1   peephole optimization of the generated instructions, then removal
+        of unreachable code and dead stores
+    2   constant folding and propagation on the AST, loop optimizations on
+        the CFG, then level 1, then fusion of frequent sequences into
+        superinstructions and type specialization of arithmetic
+"""
+
+from cfg import CFGBuilder
+from deadcode import DeadCodeEliminator
+from loops import LoopOptimizer
+from optimizer import ConstantFolder
+from peephole import PeepholeOptimizer
+from superinstructions import SuperinstructionFuser
+from typespec import TypeSpecializer
+
+OPT_LEVELS = (0, 1, 2)
+DEFAULT_OPT_LEVEL = 2
+
+
+class Compiler:
+    """Runs the optimization passes enabled by opt_level around CFGBuilder.
+
+    After compile(), `functions` and `errors` are those of the code
+    generator, `report` lists (pass name, instructions removed),
+    `eliminated` maps each function to the instructions dead code
+    elimination removed from it and `specialized` to the arithmetic
+    instructions given a type-specialized opcode.
+    superinstructions=False keeps level 2 to the basic instruction set,
+    loop_optimization=False leaves loops as written and
+    type_specialization=False keeps the generic arithmetic opcodes.
+    """
+
+    def __init__(self, opt_level=DEFAULT_OPT_LEVEL, superinstructions=True,
+                 loop_optimization=True, type_specialization=True):
+        if opt_level not in OPT_LEVELS:
+            raise ValueError(f"Invalid optimization level {opt_level!r}, expected one of {OPT_LEVELS}")
+        self.opt_level = opt_level
+        self.superinstructions = superinstructions
+        self.loop_optimization = loop_optimization
+        self.type_specialization = type_specialization
+        self.codegen = CFGBuilder()
+        self.report = []
+        self.eliminated = {}
+        self.specialized = {}
+
+    @property
+    def functions(self):
+        return self.codegen.functions
+
+    @property
+    def errors(self):
+        return self.codegen.errors
+
+    def compile(self, ast):
+        """Compile ast; returns the entry function's instructions like CodeGenerator.generate()"""
+        self.report = []
+        self.eliminated = {}
+        self.specialized = {}
+
+        if self.opt_level >= 2:
+            folder = ConstantFolder()
+            folder.optimize(ast)
+            self.report.append(('constant_folding', folder.instructions_removed))
+
+        graphs = self.codegen.build(ast)
+        if self.opt_level >= 2 and self.loop_optimization:
+            loops = LoopOptimizer()
+            loops.optimize_graphs(graphs, self.codegen.functions)
+            self.report.append(('loop_optimization', loops.instructions_removed))
+        instructions = self.codegen.linearize()
+
+        if self.opt_level >= 1:
+            peephole = PeepholeOptimizer()
+            peephole.optimize_functions(self.codegen.functions)
+            eliminator = DeadCodeEliminator()
+            eliminator.optimize_functions(self.codegen.functions, instructions)
+            if eliminator.instructions_removed:
+                # Jumps over removed code may now go to the next instruction
+                peephole.optimize_functions(self.codegen.functions)
+            self.report.append(('peephole', peephole.instructions_removed))
+            self.report.append(('dead_code', eliminator.instructions_removed))
+            self.eliminated = eliminator.removed
+
+        # Last: the other passes do not know the fused branches
+        if self.opt_level >= 2 and self.superinstructions:
+            fuser = SuperinstructionFuser()
+            fuser.optimize_functions(self.codegen.functions)
+            self.report.append(('superinstructions', fuser.instructions_removed))
+
+        # After fusion, whose rules match the generic arithmetic opcodes
+        if self.opt_level >= 2 and self.type_specialization:
+            specializer = TypeSpecializer()
+            specializer.optimize_functions(self.codegen.functions)
+            self.specialized = specializer.specialized
+
+        # The passes change how deep the stack gets
+        self.codegen.compute_stacksizes([*self.codegen.functions.values(), instructions])
+        return instructions
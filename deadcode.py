@@ -0,0 +1,247 @@
+"""
+Dead code elimination over the instructions of each function
+
+Each function is split into basic blocks. Blocks that cannot be reached
+from the first instruction are removed: code after a RETURN, the body of
+an `if (0)` once its branch became a JUMP, and so on. A backward liveness
+analysis over the frame slots then finds stores to locals that are never
+read again:
+
+    LOAD_CONST c; STORE_FAST x   -> removed
+    DUP; STORE_FAST x            -> removed
+    STORE_FAST x                 -> POP (the value may come from a call)
+
+The locals of the entry function are the program state VirtualMachine.memory
+shows, so they are live wherever the program can stop: when it returns,
+and before every instruction that can end it early, with a runtime error
+(a call overflowing the call stack, a division, a global or a local that
+may be unassigned) or at a limit checkpoint (a call, a jump back, a
+PRINT). Which locals may be unassigned comes from a forward analysis of
+the slots stored on every path. Name-based variables (STORE_VAR) are
+globals and are never dead.
+"""
+
+from main import Instruction, OpCode, JUMP_OPCODES, FUSED_BRANCH_OPCODES, jump_target
+
+_RETURN = OpCode.RETURN
+_JUMP = OpCode.JUMP
+_STORE_FAST = OpCode.STORE_FAST
+_BRANCH_OPCODES = JUMP_OPCODES | FUSED_BRANCH_OPCODES
+# Instructions at which the program may stop, whatever their operands
+_STOP_OPCODES = frozenset((OpCode.CALL, OpCode.BINARY_DIV, OpCode.LOAD_VAR, OpCode.PRINT))
+
+
+def block_starts(instructions):
+    """Sorted indices of the first instruction of each basic block"""
+    count = len(instructions)
+    starts = {0} if count else set()
+    for index, instr in enumerate(instructions):
+        if instr.opcode in _BRANCH_OPCODES or instr.opcode is _RETURN:
+            if index + 1 < count:
+                starts.add(index + 1)
+            target = jump_target(instr)
+            if target is not None and target < count:
+                starts.add(target)
+    return sorted(starts)
+
+
+def successors(instructions, start, end):
+    """Indices execution may continue at after block [start, end); len(instructions) is the exit"""
+    last = instructions[end - 1]
+    if last.opcode is _RETURN:
+        return ()
+    if last.opcode is _JUMP:
+        return (last.operand,)
+    target = jump_target(last)
+    if target is not None:
+        return (target, end)
+    return (end,)
+
+
+def slot_effects(instr):
+    """(slots read, slots written) by one instruction"""
+    opcode = instr.opcode
+    if opcode is OpCode.LOAD_FAST:
+        return (instr.operand,), ()
+    if opcode is _STORE_FAST:
+        return (), (instr.operand,)
+    if opcode is OpCode.INC_FAST:
+        return (instr.operand[0],), (instr.operand[0],)
+    if opcode is OpCode.LOAD_FAST_LOAD_FAST:
+        return instr.operand, ()
+    if opcode is OpCode.COMPARE_FAST_CONST_JUMP_IF_FALSE:
+        return (instr.operand[0],), ()
+    return (), ()
+
+
+def can_stop(instr, index, assigned):
+    """True if the program may stop before instruction index runs; assigned is a
+    bitset of the slots that surely hold a value there"""
+    if instr.opcode in _STOP_OPCODES:
+        return True
+    target = jump_target(instr)
+    if target is not None and target <= index:
+        return True
+    reads, _ = slot_effects(instr)
+    return any(not assigned >> slot & 1 for slot in reads)
+
+
+def _transfer(instr, live):
+    reads, writes = slot_effects(instr)
+    for slot in writes:
+        live &= ~(1 << slot)
+    for slot in reads:
+        live |= 1 << slot
+    return live
+
+
+class DeadCodeEliminator:
+    """Removes unreachable blocks and dead stores from instruction lists in place.
+
+    `removed` maps each function name to the instructions removed from it;
+    `unreachable` and `dead_stores` count what was eliminated and
+    `instructions_removed` is the total.
+    """
+
+    def __init__(self):
+        self.removed = {}
+        self.unreachable = 0
+        self.dead_stores = 0
+        self.instructions_removed = 0
+
+    def optimize(self, instructions, live_at_exit=0, live_at_stop=0, assigned_at_entry=0):
+        """Optimize one instruction list.
+
+        live_at_exit is a bitset of the slots read after it returns and
+        live_at_stop of those seen wherever the program may stop early (see
+        can_stop()); assigned_at_entry are the slots set before it starts.
+        """
+        count = len(instructions)
+        if not count:
+            return instructions
+        starts = block_starts(instructions)
+        ends = dict(zip(starts, starts[1:] + [count]))
+
+        # Reachability from the first block
+        reachable = set()
+        pending = [0]
+        while pending:
+            start = pending.pop()
+            if start in reachable or start >= count:
+                continue
+            reachable.add(start)
+            pending.extend(successors(instructions, start, ends[start]))
+
+        stops = self._stops(instructions, reachable, ends, assigned_at_entry) if live_at_stop else ()
+
+        # Liveness of slots at the end of every reachable block
+        live_in = dict.fromkeys(reachable, 0)
+        live_in[count] = live_at_exit
+        live_out = {}
+        blocks = sorted(reachable, reverse=True)
+        changed = True
+        while changed:
+            changed = False
+            for start in blocks:
+                end = ends[start]
+                if instructions[end - 1].opcode is _RETURN:
+                    live = live_at_exit
+                else:
+                    live = 0
+                    for successor in successors(instructions, start, end):
+                        live |= live_in[successor]
+                live_out[start] = live
+                for index in range(end - 1, start - 1, -1):
+                    live = _transfer(instructions[index], live)
+                    if index in stops:
+                        live |= live_at_stop
+                if live != live_in[start]:
+                    live_in[start] = live
+                    changed = True
+
+        # Dead stores, walking each block backwards
+        dropped = set()
+        replaced = {}
+        for start in blocks:
+            live = live_out[start]
+            for index in range(ends[start] - 1, start - 1, -1):
+                instr = instructions[index]
+                if instr.opcode is _STORE_FAST and not live >> instr.operand & 1:
+                    self.dead_stores += 1
+                    previous = instructions[index - 1].opcode if index > start else None
+                    if previous is OpCode.LOAD_CONST or previous is OpCode.DUP:
+                        dropped.update((index - 1, index))
+                    else:
+                        replaced[index] = Instruction(OpCode.POP, line=instr.line)
+                live = _transfer(instr, live)
+                if index in stops:
+                    live |= live_at_stop
+
+        result = []
+        new_index = [0] * (count + 1)
+        for start in starts:
+            for index in range(start, ends[start]):
+                new_index[index] = len(result)
+                if start not in reachable:
+                    self.unreachable += 1
+                elif index not in dropped:
+                    result.append(replaced.get(index, instructions[index]))
+        new_index[count] = len(result)
+
+        for instr in result:
+            if instr.opcode in JUMP_OPCODES:
+                instr.operand = new_index[instr.operand]
+            elif instr.opcode in FUSED_BRANCH_OPCODES:
+                instr.operand = instr.operand[:-1] + (new_index[instr.operand[-1]],)
+
+        self.instructions_removed += count - len(result)
+        instructions[:] = result
+        return instructions
+
+    @staticmethod
+    def _stops(instructions, reachable, ends, assigned_at_entry):
+        """Indices of the reachable instructions the program may stop before"""
+        # Slots assigned on every path to each block; unvisited blocks assume all
+        every_slot = -1
+        assigned_in = {start: every_slot for start in reachable}
+        assigned_in[0] = assigned_at_entry
+        blocks = sorted(reachable)
+        changed = True
+        while changed:
+            changed = False
+            for start in blocks:
+                assigned = assigned_in[start]
+                for index in range(start, ends[start]):
+                    _, writes = slot_effects(instructions[index])
+                    for slot in writes:
+                        assigned |= 1 << slot
+                for successor in successors(instructions, start, ends[start]):
+                    if successor in assigned_in:
+                        merged = assigned_in[successor] & assigned
+                        if merged != assigned_in[successor]:
+                            assigned_in[successor] = merged
+                            changed = True
+
+        stops = set()
+        for start in blocks:
+            assigned = assigned_in[start]
+            for index in range(start, ends[start]):
+                instr = instructions[index]
+                if can_stop(instr, index, assigned):
+                    stops.add(index)
+                _, writes = slot_effects(instr)
+                for slot in writes:
+                    assigned |= 1 << slot
+        return stops
+
+    def optimize_functions(self, functions, entry=None):
+        """Optimize every CodeObject of a {name: CodeObject} dict; entry is the program's entry function"""
+        for name, code in functions.items():
+            before = len(code.instructions)
+            if code is entry:
+                every_slot = (1 << len(code.varnames)) - 1
+                self.optimize(code.instructions, every_slot, every_slot, (1 << len(code.params)) - 1)
+            else:
+                self.optimize(code.instructions)
+            self.removed[name] = self.removed.get(name, 0) + before - len(code.instructions)
+        return functions
@@ -3,7 +3,7 @@
 Debug del CodeGenerator para encontrar problemas en la generación TAC
 """
 
-from main import LexicalAnalyzer, Parser, CodeGenerator
+from main import LexicalAnalyzer, Parser, CodeGenerator, ASTVisitor
 
 def debug_codegen():
     """Debug del generador de código con trazas detalladas"""
@@ -62,16 +62,25 @@ int main() {
     
     # Verificar nodos del AST manualmente
     print(f"\nRecorrido manual del AST:")
-    def traverse_ast(node, level=0):
-        indent = "  " * level
+    ASTTracer().visit(ast)
+
+
+class ASTTracer(ASTVisitor):
+    """Recorre el AST mostrando cada nodo; iterativo, sin límite de profundidad"""
+
+    def __init__(self):
+        self.level = 0
+
+    def generic_visit(self, node):
+        indent = "  " * self.level
         print(f"{indent}- Nodo: {node.type} (value: {getattr(node, 'value', None)})")
         print(f"{indent}  Children: {len(node.children)}")
-        
+
         for i, child in enumerate(node.children):
             print(f"{indent}  Child {i}:")
-            traverse_ast(child, level + 2)
-    
-    traverse_ast(ast)
+            self.level += 2
+            yield child
+            self.level -= 2
 
 if __name__ == '__main__':
     debug_codegen()
@@ -3,7 +3,7 @@
 Debug del Parser para encontrar problemas en el AST
 """
 
-from main import LexicalAnalyzer, Parser
+from main import LexicalAnalyzer, Parser, ASTVisitor
 
 def debug_parser():
     """Debug del parser con trazas detalladas"""
@@ -52,20 +52,29 @@ int main() {
     
     # Mostrar estructura del AST
     print(f"\nEstructura detallada del AST:")
-    def print_ast_detailed(node, level=0):
-        indent = "  " * level
+    DetailedASTPrinter().visit(ast)
+
+
+class DetailedASTPrinter(ASTVisitor):
+    """Imprime el AST con posiciones; iterativo, sin límite de profundidad"""
+
+    def __init__(self):
+        self.level = 0
+
+    def generic_visit(self, node):
+        indent = "  " * self.level
         node_info = f"{node.type}"
         if hasattr(node, 'value') and node.value:
             node_info += f": {node.value}"
         if hasattr(node, 'line') and hasattr(node, 'column'):
             node_info += f" (L:{node.line}, C:{node.column})"
         print(f"{indent}- {node_info}")
-        
+
         for i, child in enumerate(node.children):
             print(f"{indent}  Child {i}:")
-            print_ast_detailed(child, level + 2)
-    
-    print_ast_detailed(ast)
+            self.level += 2
+            yield child
+            self.level -= 2
 
 if __name__ == '__main__':
     debug_parser()
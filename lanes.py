@@ -0,0 +1,433 @@
+"""
+Vectorized execution of one program over many inputs (needs NumPy)
+
+LaneVM runs a program once for a whole batch of inputs, one lane per
+input. Every value is either a Python number, the same in all lanes, or
+a NumPy array with one element per lane:
+
+    frame slots      a value per slot, plus the lanes it is assigned in
+                     (True for all of them)
+    globals          the same, by name
+    operand stack    a Python list of values, empty at every jump
+    arithmetic       one NumPy operation for all lanes
+    JUMP_IF_FALSE    splits the running lanes with a mask; each part
+                     goes on at its own target
+
+A function runs for one group of lanes at a time, a mask of the lanes
+at the same instruction, until the group's next jump. The group at the
+lowest index runs next, so lanes that leave a loop early wait at its
+exit for the rest, and groups that reach the same instruction merge
+again. Stores only change the lanes of the running group. A runtime
+error stops just the lanes it happens in, with the interpreter's
+message; CALL runs the callee for the calling group.
+
+Each lane ends as VirtualMachine would end on that input, except that
+values are NumPy int64 or float64: int arithmetic in arrays wraps
+instead of growing, and a slot that is float in some lanes is float64
+in all of them (with the same values). Programs the lanes cannot run
+(PRINT, constants other than numbers, values on the stack across a
+jump), and runs that fail inside NumPy (a Python int too large for an
+array, recursion deeper than Python's), run input by input on
+VirtualMachine instead; `interpreted` is then True.
+"""
+
+import operator
+
+from main import (OpCode, CodeObject, VirtualMachine, VerifyError, TerminationReason,
+                  MAX_CALL_DEPTH, COMPARISON_OPERATORS, SPECIALIZED_ARITHMETIC,
+                  TEMPORARY_PREFIX, jump_target, stack_depths)
+from pybackend import Unsupported, program_functions
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_NUMBERS = (int, float)
+
+_ARITHMETIC = {
+    OpCode.BINARY_ADD: operator.add,
+    OpCode.BINARY_SUB: operator.sub,
+    OpCode.BINARY_MUL: operator.mul,
+}
+_ARITHMETIC.update((opcode, _ARITHMETIC[generic])
+                   for opcode, generic in SPECIALIZED_ARITHMETIC.items() if generic in _ARITHMETIC)
+
+_DIVISION = frozenset((OpCode.BINARY_DIV, OpCode.BINARY_DIV_FLOAT))
+
+_SUPPORTED = frozenset(_ARITHMETIC) | _DIVISION | frozenset((
+    OpCode.LOAD_CONST, OpCode.LOAD_VAR, OpCode.STORE_VAR, OpCode.BINARY_CMP,
+    OpCode.JUMP_IF_FALSE, OpCode.JUMP, OpCode.CALL, OpCode.RETURN, OpCode.POP, OpCode.DUP,
+    OpCode.LOAD_FAST, OpCode.STORE_FAST, OpCode.INC_FAST, OpCode.LOAD_FAST_LOAD_FAST,
+    OpCode.COMPARE_JUMP_IF_FALSE, OpCode.COMPARE_FAST_CONST_JUMP_IF_FALSE,
+))
+
+
+class _LaneError(Exception):
+    """Every lane of the running group stopped"""
+
+
+def check_program(entry):
+    """Raise Unsupported unless LaneVM can run every function reachable from entry"""
+    for code in program_functions(entry):
+        instructions = code.instructions
+        for instr in instructions:
+            opcode = instr.opcode
+            if opcode not in _SUPPORTED:
+                raise Unsupported(f"{opcode.name} in {code.name}")
+            if opcode is OpCode.LOAD_CONST:
+                constant = instr.operand
+            elif opcode is OpCode.COMPARE_FAST_CONST_JUMP_IF_FALSE:
+                constant = instr.operand[2]
+            else:
+                continue
+            if not isinstance(constant, _NUMBERS):
+                raise Unsupported(f"Constant {constant!r} in {code.name}")
+
+        try:
+            depths = stack_depths(instructions)
+        except VerifyError as e:
+            raise Unsupported(str(e))
+        for index, instr in enumerate(instructions):
+            target = jump_target(instr)
+            if target is None:
+                continue
+            joins = (target,) if instr.opcode is OpCode.JUMP else (target, index + 1)
+            if any(join < len(instructions) and depths[join] for join in joins):
+                raise Unsupported(f"Values on the stack across the jump at {index} in {code.name}")
+
+
+def _compare(compare, a, b):
+    """1 or 0, per lane for arrays, like BINARY_CMP"""
+    result = compare(a, b)
+    if isinstance(result, numpy.ndarray):
+        return result.astype(numpy.int64)
+    return 1 if result else 0
+
+
+def _missing(assigned, mask):
+    """Lanes of mask in which a value is not assigned, or None"""
+    if assigned is True:
+        return None
+    missing = mask if assigned is False else mask & ~assigned
+    return missing if missing.any() else None
+
+
+class LaneVM:
+    """Runs one program over many inputs at once; see the module docstring.
+
+    After run(), `stack` holds the return value of each lane (0 in lanes
+    that did not return), `returned` and `ended` are the lanes that
+    returned or ran off the end of the entry code, `errors` maps each
+    runtime error message to the lanes it stopped and `memory` holds the
+    variables of the entry function and the globals (0 in lanes where
+    they were never assigned).
+    """
+
+    def __init__(self, lanes, max_call_depth=MAX_CALL_DEPTH):
+        if numpy is None:
+            raise ImportError("LaneVM needs NumPy")
+        self.lanes = lanes
+        self.max_call_depth = max_call_depth
+        self.code = None
+        self.inputs = {}
+        self._clear()
+
+    def _clear(self):
+        self.stack = []
+        self.memory = {}
+        self.returned = numpy.zeros(self.lanes, dtype=bool)
+        self.ended = numpy.zeros(self.lanes, dtype=bool)
+        self.errors = {}
+        self.interpreted = False
+        self._globals = {}
+
+    def load_instructions(self, instructions, inputs=None):
+        """Load a CodeObject (or instruction list) and the inputs of the lanes.
+
+        inputs maps names to a number, the same in every lane, or to one
+        value per lane; the entry function's parameters take the inputs of
+        their names and the other names are globals.
+        """
+        if not isinstance(instructions, CodeObject):
+            instructions = CodeObject('<program>', instructions=instructions)
+        self.code = instructions
+        self.inputs = {}
+        for name, value in (inputs or {}).items():
+            if not isinstance(value, _NUMBERS):
+                value = numpy.asarray(value)
+                if value.ndim == 0:
+                    value = value.item()
+                elif value.shape != (self.lanes,):
+                    raise ValueError(f"Input '{name}' has shape {value.shape} for {self.lanes} lanes")
+            self.inputs[name] = value
+        self._clear()
+
+    def reason(self, lane):
+        """TerminationReason of one lane after run()"""
+        if self.returned[lane]:
+            return TerminationReason.RETURNED
+        if self.ended[lane]:
+            return TerminationReason.END
+        return TerminationReason.ERROR
+
+    def run(self):
+        self._clear()
+        try:
+            check_program(self.code)
+            with numpy.errstate(all='ignore'):
+                self._run_lanes()
+        except (Unsupported, OverflowError, RecursionError):
+            self._clear()
+            self.interpreted = True
+            self._run_interpreted()
+
+    def _run_lanes(self):
+        code = self.code
+        lanes = numpy.ones(self.lanes, dtype=bool)
+        slots = [0] * len(code.varnames)
+        assigned = [False] * len(code.varnames)
+        for name, value in self.inputs.items():
+            if name in code.params:
+                index = code.params.index(name)
+                slots[index] = value
+                assigned[index] = True
+            else:
+                self._globals[name] = (value, True)
+
+        value, returned = self._run(code, slots, assigned, self._globals, lanes, 1)
+        self.returned = returned
+        self.stack = [self._array(value, returned)]
+        for name, (value, where) in self._globals.items():
+            self.memory[name] = self._array(value, where)
+        for name, value, where in zip(code.varnames, slots, assigned):
+            if where is not False and not name.startswith(TEMPORARY_PREFIX):
+                self.memory[name] = self._array(value, where)
+
+    def _array(self, value, where):
+        """value in the lanes of where, 0 in the others, as an array"""
+        if where is True:
+            return numpy.broadcast_to(numpy.asarray(value), (self.lanes,)).copy()
+        return numpy.where(where, value, 0)
+
+    def _fail(self, message, lanes):
+        previous = self.errors.get(message)
+        self.errors[message] = lanes.copy() if previous is None else previous | lanes
+
+    def _run(self, code, slots, assigned, variables, mask, depth):
+        """Run code for the lanes of mask; (return value, lanes that returned)"""
+        instructions = code.instructions
+        end = len(instructions)
+        result = 0
+        returned = numpy.zeros(self.lanes, dtype=bool)
+        pending = {0: mask}
+        while pending:
+            ip = min(pending)
+            group = _Group(self, code, pending.pop(ip))
+            stack = []
+            try:
+                while True:
+                    if ip in pending:
+                        # Another group waits here: go on together
+                        pending[ip] = pending[ip] | group.mask
+                        break
+                    if ip == end:
+                        self.ended |= group.mask
+                        break
+                    instr = instructions[ip]
+                    opcode = instr.opcode
+                    operand = instr.operand
+                    ip += 1
+
+                    if opcode is OpCode.LOAD_FAST:
+                        group.check(assigned[operand], code.varnames[operand])
+                        stack.append(slots[operand])
+                    elif opcode is OpCode.STORE_FAST:
+                        group.store(slots, assigned, operand, stack.pop())
+                    elif opcode is OpCode.LOAD_CONST:
+                        stack.append(operand)
+                    elif opcode in _ARITHMETIC:
+                        b = stack.pop()
+                        stack[-1] = _ARITHMETIC[opcode](stack[-1], b)
+                    elif opcode is OpCode.BINARY_CMP:
+                        b = stack.pop()
+                        stack[-1] = _compare(COMPARISON_OPERATORS[operand], stack[-1], b)
+                    elif opcode in _DIVISION:
+                        b = stack.pop()
+                        group.fail_where(b == 0, "Division by zero")
+                        stack[-1] = stack[-1] / b
+                    elif opcode is OpCode.JUMP_IF_FALSE:
+                        group.branch(pending, stack.pop(), ip, operand)
+                        break
+                    elif opcode is OpCode.JUMP:
+                        group.schedule(pending, operand, group.mask)
+                        break
+                    elif opcode is OpCode.LOAD_FAST_LOAD_FAST:
+                        first, second = operand
+                        group.check(assigned[first], code.varnames[first])
+                        group.check(assigned[second], code.varnames[second])
+                        stack.append(slots[first])
+                        stack.append(slots[second])
+                    elif opcode is OpCode.INC_FAST:
+                        slot, delta = operand
+                        group.check(assigned[slot], code.varnames[slot])
+                        group.store(slots, assigned, slot, slots[slot] + delta)
+                    elif opcode is OpCode.COMPARE_JUMP_IF_FALSE:
+                        compare, target = operand
+                        b = stack.pop()
+                        condition = _compare(COMPARISON_OPERATORS[compare], stack.pop(), b)
+                        group.branch(pending, condition, ip, target)
+                        break
+                    elif opcode is OpCode.COMPARE_FAST_CONST_JUMP_IF_FALSE:
+                        slot, compare, constant, target = operand
+                        group.check(assigned[slot], code.varnames[slot])
+                        condition = _compare(COMPARISON_OPERATORS[compare], slots[slot], constant)
+                        group.branch(pending, condition, ip, target)
+                        break
+                    elif opcode is OpCode.CALL:
+                        stack.append(group.call(operand, stack, depth))
+                    elif opcode is OpCode.RETURN:
+                        value = stack.pop()
+                        result = value if group.full else numpy.where(group.mask, value, result)
+                        returned |= group.mask
+                        break
+                    elif opcode is OpCode.LOAD_VAR:
+                        stack.append(group.load_var(variables, operand))
+                    elif opcode is OpCode.STORE_VAR:
+                        group.store_var(variables, operand, stack.pop())
+                    elif opcode is OpCode.DUP:
+                        stack.append(stack[-1])
+                    elif opcode is OpCode.POP:
+                        stack.pop()
+            except _LaneError:
+                pass
+        return result, returned
+
+    def _run_interpreted(self):
+        """Run the program input by input on VirtualMachine"""
+        code = self.code
+        values = [0] * self.lanes
+        memory = {}
+        for lane in range(self.lanes):
+            vm = VirtualMachine(self.max_call_depth)
+            vm.load_instructions(code)
+            for name, value in self.inputs.items():
+                value = value if isinstance(value, _NUMBERS) else value[lane].item()
+                if name in code.params:
+                    vm.slots[code.params.index(name)] = value
+                else:
+                    vm.globals[name] = value
+            vm.run()
+            reason = vm.termination.reason
+            if reason is TerminationReason.RETURNED:
+                self.returned[lane] = True
+                values[lane] = vm.stack[-1]
+            elif reason is TerminationReason.END:
+                self.ended[lane] = True
+            else:
+                self._fail(vm.termination.message, numpy.arange(self.lanes) == lane)
+            for name, value in vm.memory.items():
+                memory.setdefault(name, [0] * self.lanes)[lane] = value
+        self.stack = [numpy.array(values)]
+        self.memory = {name: numpy.array(lane_values) for name, lane_values in memory.items()}
+
+
+class _Group:
+    """The lanes running together in one function, from a jump target to the next jump"""
+    __slots__ = ('vm', 'code', 'mask', 'full')
+
+    def __init__(self, vm, code, mask):
+        self.vm = vm
+        self.code = code
+        self.mask = mask
+        self.full = bool(mask.all())
+
+    def fail(self, message, lanes):
+        """Stop lanes of the group with a runtime error"""
+        self.vm._fail(message, lanes)
+        self.mask = self.mask & ~lanes
+        self.full = False
+        if not self.mask.any():
+            raise _LaneError
+
+    def fail_where(self, condition, message):
+        """Stop the lanes of the group where condition holds"""
+        if isinstance(condition, numpy.ndarray):
+            lanes = self.mask & condition
+            if lanes.any():
+                self.fail(message, lanes)
+        elif condition:
+            self.fail(message, self.mask)
+
+    def check(self, assigned, name):
+        missing = _missing(assigned, self.mask)
+        if missing is not None:
+            self.fail(f"Undefined variable '{name}'", missing)
+
+    def store(self, slots, assigned, slot, value):
+        if self.full:
+            slots[slot] = value
+            assigned[slot] = True
+        else:
+            slots[slot] = numpy.where(self.mask, value, slots[slot])
+            if assigned[slot] is not True:
+                assigned[slot] = self.mask | assigned[slot]
+
+    def load_var(self, variables, name):
+        # Like LOAD_VAR: the frame's variables, then the globals
+        value, assigned = variables.get(name, (0, False))
+        globals_ = self.vm._globals
+        if assigned is not True and variables is not globals_ and name in globals_:
+            outer, outer_assigned = globals_[name]
+            if assigned is False:
+                value, assigned = outer, outer_assigned
+            else:
+                value = numpy.where(assigned, value, outer)
+                assigned = assigned | outer_assigned
+        self.check(assigned, name)
+        return value
+
+    def store_var(self, variables, name, value):
+        if self.full:
+            variables[name] = (value, True)
+            return
+        old, assigned = variables.get(name, (0, False))
+        if assigned is not True:
+            assigned = self.mask | assigned
+        variables[name] = (numpy.where(self.mask, value, old), assigned)
+
+    def branch(self, pending, condition, ip, target):
+        """Continue the lanes where condition holds at ip, the others at target"""
+        if isinstance(condition, numpy.ndarray):
+            false = condition == 0
+            self.schedule(pending, ip, self.mask & ~false)
+            self.schedule(pending, target, self.mask & false)
+        else:
+            self.schedule(pending, target if condition == 0 else ip, self.mask)
+
+    @staticmethod
+    def schedule(pending, ip, lanes):
+        if not lanes.any():
+            return
+        pending[ip] = pending[ip] | lanes if ip in pending else lanes
+
+    def call(self, code, stack, depth):
+        """Run code for the group with its arguments from stack; the return value"""
+        vm = self.vm
+        if depth >= vm.max_call_depth:
+            self.fail(f"Stack overflow calling '{code.name}'", self.mask)
+        count = len(code.params)
+        arguments = stack[len(stack) - count:]
+        del stack[len(stack) - count:]
+        locals_count = len(code.varnames) - count
+        value, returned = vm._run(code, arguments + [0] * locals_count,
+                                  [True] * count + [False] * locals_count,
+                                  {}, self.mask, depth + 1)
+        stopped = self.mask & ~returned
+        if stopped.any():
+            # Their error is already recorded
+            self.mask = self.mask & returned
+            self.full = False
+            if not self.mask.any():
+                raise _LaneError
+        return value
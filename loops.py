@@ -0,0 +1,473 @@
+"""
+Loop optimizations on the control-flow graph
+
+Natural loops are found from the back edges of the CFG (an edge whose
+target dominates its source) and optimized innermost first. Each loop gets
+a preheader, a block run once before the loop is entered, and two
+transformations move work into it:
+
+Strength reduction. A basic induction variable i is a local whose only
+store in the loop is `i = i + c` or `i = i - c` (c an int constant). Every
+`i * k` (k an int constant) in the loop becomes a load of a temporary t,
+set to i * k in the preheader and advanced by c * k right after the
+increment of i. Only variables that can only hold ints are reduced, so
+the sums are exact.
+
+Loop-invariant code motion. A subexpression of the loop whose operands
+are constants, locals not stored in the loop and globals (only if the loop
+neither stores them nor calls any function) is computed once in the
+preheader into a temporary. An expression is only hoisted from a block
+that runs on every iteration before the loop can be left; when that block
+is not the loop header, the loop condition is copied in front of the
+preheader (it must be free of calls and stores), so the hoisted code runs
+only if the body runs at least once. An expression that can fail (a
+division, a global or a local that may be unassigned when the loop is
+entered) is only hoisted if nothing that can fail or has an effect (a
+call, store or PRINT) runs before it in the loop, so the program stops
+with the same error, and the same memory, as without the optimization.
+
+Temporaries are extra slots named TEMPORARY_PREFIX + number; VirtualMachine
+does not show them among the program's variables.
+"""
+
+from collections import namedtuple
+
+from main import Instruction, OpCode, TEMPORARY_PREFIX
+
+# header: first block; blocks: set of the loop's blocks; latches: blocks with a back edge
+Loop = namedtuple('Loop', ['header', 'blocks', 'latches'])
+
+_LOAD_CONST = OpCode.LOAD_CONST
+_LOAD_FAST = OpCode.LOAD_FAST
+_STORE_FAST = OpCode.STORE_FAST
+_BINARY_MUL = OpCode.BINARY_MUL
+
+_BINARY_OPCODES = frozenset((OpCode.BINARY_ADD, OpCode.BINARY_SUB, OpCode.BINARY_MUL,
+                             OpCode.BINARY_DIV, OpCode.BINARY_CMP))
+_LOAD_OPCODES = frozenset((OpCode.LOAD_CONST, OpCode.LOAD_FAST, OpCode.LOAD_VAR))
+# Instructions that may be duplicated into the copy of a loop condition
+_PURE_OPCODES = _LOAD_OPCODES | _BINARY_OPCODES
+# Instructions that can stop the program with a runtime error
+_FALLIBLE_OPCODES = frozenset((OpCode.BINARY_DIV, OpCode.LOAD_VAR))
+# Instructions whose effect a hoisted error could be seen to overtake
+_ORDERED_OPCODES = _FALLIBLE_OPCODES | frozenset((OpCode.CALL, OpCode.STORE_FAST,
+                                                  OpCode.STORE_VAR, OpCode.PRINT))
+# Values popped and pushed by the other instructions of generated code
+_STACK_EFFECTS = {
+    OpCode.STORE_FAST: (1, 0),
+    OpCode.STORE_VAR: (1, 0),
+    OpCode.POP: (1, 0),
+    OpCode.PRINT: (1, 0),
+    OpCode.RETURN: (1, 0),
+    OpCode.DUP: (1, 2),
+}
+
+
+def find_loops(graph, idom=None):
+    """Natural loops of graph (edges from compute_edges()), innermost first"""
+    if idom is None:
+        idom = graph.immediate_dominators()
+    loops = {}
+    for block in idom:
+        for successor in block.successors:
+            if graph.dominates(successor, block, idom):
+                body, latches = loops.setdefault(successor, ({successor}, []))
+                latches.append(block)
+                # Everything that reaches the latch without going through the header
+                pending = [block]
+                while pending:
+                    member = pending.pop()
+                    if member not in body:
+                        body.add(member)
+                        pending.extend(member.predecessors)
+    result = [Loop(header, body, latches) for header, (body, latches) in loops.items()]
+    result.sort(key=lambda loop: (len(loop.blocks), loop.header.id))
+    return result
+
+
+def _is_int(value):
+    return type(value) is int
+
+
+class LoopOptimizer:
+    """Strength reduction and invariant code motion over ControlFlowGraphs, in place.
+
+    `hoisted` counts the expressions moved to preheaders, `reduced` the
+    multiplications replaced, `instructions_removed` the instructions taken
+    out of loop bodies and `updates_added` the instructions added to them
+    to advance the strength-reduced temporaries.
+    """
+
+    def __init__(self, hoist=True, strength_reduction=True):
+        self.hoist = hoist
+        self.strength_reduction = strength_reduction
+        self.hoisted = 0
+        self.reduced = 0
+        self.instructions_removed = 0
+        self.updates_added = 0
+
+    def optimize_graphs(self, graphs, functions):
+        """Optimize every graph of {name: ControlFlowGraph}; functions gives their CodeObjects"""
+        for name, graph in graphs.items():
+            self.optimize(graph, functions[name])
+        return graphs
+
+    def optimize(self, graph, code):
+        """Optimize the loops of one function; temporaries are added to code.varnames"""
+        done = set()
+        while True:
+            graph.compute_edges()
+            idom = graph.immediate_dominators()
+            loops = [loop for loop in find_loops(graph, idom) if loop.header not in done]
+            if not loops:
+                break
+            loop = loops[0]
+            done.add(loop.header)
+            self._optimize_loop(graph, code, loop, idom)
+        graph.compute_edges()
+        return graph
+
+    def _optimize_loop(self, graph, code, loop, idom):
+        header = loop.header
+        outside = [pred for pred in header.predecessors if pred not in loop.blocks]
+        if not outside:
+            return
+        blocks = sorted(loop.blocks, key=lambda block: block.id)
+        # Taken before the passes below rewrite the header with temporaries
+        condition = [Instruction(instr.opcode, instr.operand, instr.line)
+                     for instr in header.instructions]
+
+        preheader_code = []
+        if self.strength_reduction:
+            preheader_code += self._reduce(graph, code, loop, blocks)
+
+        guarded = False
+        if self.hoist:
+            hoisted, guarded = self._hoist(graph, code, loop, blocks, idom)
+            preheader_code += hoisted
+
+        if not preheader_code:
+            return
+
+        preheader = graph.new_block()
+        preheader.instructions = preheader_code
+        preheader.next = header
+        entry = preheader
+        if guarded:
+            # Copy of the condition: the preheader only runs if the body will
+            guard = graph.new_block()
+            guard.instructions = condition
+            guard.branch = Instruction(header.branch.opcode, header.target, header.branch.line)
+            guard.next = preheader
+            entry = guard
+
+        for pred in outside:
+            if pred.next is header:
+                pred.next = entry
+            if pred.target is header:
+                pred.branch.operand = entry
+
+    # Strength reduction
+
+    def _reduce(self, graph, code, loop, blocks):
+        """Replace i * k by temporaries; returns their preheader initialization"""
+        stores = {}
+        for block in blocks:
+            for index, instr in enumerate(block.instructions):
+                if instr.opcode is _STORE_FAST:
+                    stores.setdefault(instr.operand, []).append((block, index))
+
+        steps = {}
+        for slot, sites in stores.items():
+            if len(sites) != 1 or slot < len(code.params):
+                continue
+            block, index = sites[0]
+            step = self._increment_step(block.instructions, index)
+            if (step is not None and self._int_only(graph, slot) and
+                    any(instr.opcode is _LOAD_FAST and instr.operand == slot
+                        for instr in loop.header.instructions)):
+                steps[slot] = (block.instructions[index], step)
+        if not steps:
+            return []
+
+        temporaries = {}
+        # Line of the first product each temporary replaces
+        lines = {}
+        for block in blocks:
+            for slot, factor, start in self._products(block.instructions, steps):
+                if (slot, factor) not in temporaries:
+                    temporaries[(slot, factor)] = self._new_temporary(code)
+                    lines[(slot, factor)] = block.instructions[start].line
+        if not temporaries:
+            return []
+
+        updates = {}
+        for (slot, factor), temporary in temporaries.items():
+            increment, step = steps[slot]
+            updates.setdefault(id(increment), []).extend([
+                Instruction(_LOAD_FAST, temporary, increment.line),
+                Instruction(_LOAD_CONST, step * factor, increment.line),
+                Instruction(OpCode.BINARY_ADD, line=increment.line),
+                Instruction(_STORE_FAST, temporary, increment.line),
+            ])
+            self.updates_added += 4
+
+        for block in blocks:
+            matches = {start: (slot, factor)
+                       for slot, factor, start in self._products(block.instructions, steps)}
+            result = []
+            index = 0
+            instructions = block.instructions
+            while index < len(instructions):
+                instr = instructions[index]
+                if index in matches:
+                    result.append(Instruction(_LOAD_FAST, temporaries[matches[index]], instr.line))
+                    self.reduced += 1
+                    self.instructions_removed += 2
+                    index += 3
+                    continue
+                result.append(instr)
+                result.extend(updates.get(id(instr), ()))
+                index += 1
+            block.instructions = result
+
+        initialization = []
+        for (slot, factor), temporary in temporaries.items():
+            line = lines[(slot, factor)]
+            initialization += [Instruction(_LOAD_FAST, slot, line), Instruction(_LOAD_CONST, factor, line),
+                               Instruction(_BINARY_MUL, line=line), Instruction(_STORE_FAST, temporary, line)]
+        return initialization
+
+    @staticmethod
+    def _increment_step(instructions, index):
+        """c if instructions[index - 3:index + 1] is i = i + c (-c for i - c), else None"""
+        if index < 3:
+            return None
+        load, const, operation, store = instructions[index - 3:index + 1]
+        if (load.opcode is not _LOAD_FAST or load.operand != store.operand or
+                const.opcode is not _LOAD_CONST or not _is_int(const.operand)):
+            return None
+        if operation.opcode is OpCode.BINARY_ADD:
+            return const.operand
+        if operation.opcode is OpCode.BINARY_SUB:
+            return -const.operand
+        return None
+
+    def _int_only(self, graph, slot):
+        """True if every store to slot in the function stores an int"""
+        for block in graph.blocks:
+            instructions = block.instructions
+            for index, instr in enumerate(instructions):
+                if instr.opcode is not _STORE_FAST or instr.operand != slot:
+                    continue
+                previous = instructions[index - 1] if index else None
+                if previous is not None and previous.opcode is _LOAD_CONST and _is_int(previous.operand):
+                    continue
+                if self._increment_step(instructions, index) is None:
+                    return False
+        return True
+
+    @staticmethod
+    def _products(instructions, steps):
+        """(slot, factor, start) of every i * k or k * i with i in steps"""
+        for index in range(len(instructions) - 2):
+            first, second, operation = instructions[index:index + 3]
+            if operation.opcode is not _BINARY_MUL:
+                continue
+            if first.opcode is _LOAD_FAST and second.opcode is _LOAD_CONST:
+                load, const = first, second
+            elif first.opcode is _LOAD_CONST and second.opcode is _LOAD_FAST:
+                const, load = first, second
+            else:
+                continue
+            if load.operand in steps and _is_int(const.operand):
+                yield load.operand, const.operand, index
+
+    # Invariant code motion
+
+    def _hoist(self, graph, code, loop, blocks, idom):
+        """Move invariant expressions out of the loop; returns (preheader code, guard needed)"""
+        written = set()
+        globals_written = set()
+        calls = False
+        for block in blocks:
+            for instr in block.instructions:
+                if instr.opcode is _STORE_FAST:
+                    written.add(instr.operand)
+                elif instr.opcode is OpCode.STORE_VAR:
+                    globals_written.add(instr.operand)
+                elif instr.opcode is OpCode.CALL:
+                    calls = True
+
+        def invariant(instr):
+            if instr.opcode is _LOAD_CONST:
+                return True
+            if instr.opcode is _LOAD_FAST:
+                return instr.operand not in written
+            if instr.opcode is OpCode.LOAD_VAR:
+                return not calls and instr.operand not in globals_written
+            return False
+
+        header = loop.header
+        # Blocks after which an iteration can end: latches, returns and branches
+        # out of the loop other than the header's own exit, which the guard covers.
+        # A return that never reaches a latch is not in loop.blocks, so the
+        # branch to it is what marks the exit
+        exits = [block for block in blocks
+                 if block in loop.latches or block.returns or
+                 (block is not header and
+                  any(successor not in loop.blocks for successor in block.successors))]
+        guard_allowed = (header.branch is not None and header.target not in loop.blocks and
+                         all(instr.opcode in _PURE_OPCODES for instr in header.instructions))
+
+        assigned = self._assigned_on_entry(graph, code, loop)
+
+        def fallible(instr):
+            if instr.opcode is _LOAD_FAST:
+                return instr.operand not in assigned
+            return instr.opcode in _FALLIBLE_OPCODES
+
+        hoisted = []
+        temporaries = {}
+        guarded = False
+        for block in blocks:
+            if block is not header:
+                if not guard_allowed or not all(graph.dominates(block, other, idom) for other in exits):
+                    continue
+            ranges = self._invariant_ranges(block, invariant)
+            if not ranges:
+                continue
+            # Whether something that must not be overtaken by an error has run
+            # in this iteration before the instruction at `position`
+            ordered = block is not header and self._ordered_before(loop, block)
+
+            result = []
+            position = 0
+            instructions = block.instructions
+            for start, end in ranges:
+                expression = instructions[start:end]
+                ordered = ordered or any(instr.opcode in _ORDERED_OPCODES or fallible(instr)
+                                         for instr in instructions[position:start])
+                if ordered and any(fallible(instr) for instr in expression):
+                    continue
+                guarded = guarded or block is not header
+                key = tuple((instr.opcode, type(instr.operand), instr.operand)
+                            for instr in expression)
+                temporary = temporaries.get(key)
+                if temporary is None:
+                    temporary = temporaries[key] = self._new_temporary(code)
+                    hoisted += expression
+                    hoisted.append(Instruction(_STORE_FAST, temporary, expression[0].line))
+                result += instructions[position:start]
+                result.append(Instruction(_LOAD_FAST, temporary, expression[0].line))
+                position = end
+                self.hoisted += 1
+                self.instructions_removed += end - start - 1
+            result += instructions[position:]
+            block.instructions = result
+        return hoisted, guarded
+
+    @staticmethod
+    def _ordered_before(loop, block):
+        """True if the loop blocks that can run before block in an iteration have an
+        instruction that can fail or has an effect, or an inner loop (which could
+        keep the program from getting to block); paths that merge count as well"""
+        seen = {loop.header}
+        pending = [loop.header]
+        while pending:
+            current = pending.pop()
+            if any(instr.opcode in _ORDERED_OPCODES for instr in current.instructions):
+                return True
+            for successor in current.successors:
+                if successor not in loop.blocks or successor is block:
+                    continue
+                if successor in seen:
+                    return True
+                seen.add(successor)
+                pending.append(successor)
+        return False
+
+    @staticmethod
+    def _assigned_on_entry(graph, code, loop):
+        """Slots stored on every path from the function's entry into the loop"""
+        every_slot = frozenset(range(len(code.varnames)))
+        order = graph.reverse_postorder()
+        # Slots assigned at the end of each block; unvisited blocks assume all
+        assigned = {}
+        changed = True
+        while changed:
+            changed = False
+            for block in order:
+                if block is graph.entry:
+                    slots = set(range(len(code.params)))
+                else:
+                    slots = set(every_slot)
+                    for pred in block.predecessors:
+                        slots &= assigned.get(pred, every_slot)
+                for instr in block.instructions:
+                    if instr.opcode is _STORE_FAST:
+                        slots.add(instr.operand)
+                if assigned.get(block) != slots:
+                    assigned[block] = slots
+                    changed = True
+        result = set(every_slot)
+        for pred in loop.header.predecessors:
+            if pred not in loop.blocks:
+                result &= assigned.get(pred, every_slot)
+        return result
+
+    @staticmethod
+    def _invariant_ranges(block, invariant):
+        """[start, end) ranges of the block's maximal invariant expressions with an operation"""
+        # One entry per stack value: (first instruction, invariant, contains an operation)
+        stack = []
+        ranges = []
+
+        def consume(count, end):
+            """Pop count values; returns where the code producing them starts"""
+            # The popped values were produced by consecutive instructions
+            for _ in range(count):
+                start, is_invariant, operation = stack.pop()
+                if is_invariant and operation:
+                    ranges.append((start, end))
+                end = start
+            return end
+
+        for index, instr in enumerate(block.instructions):
+            opcode = instr.opcode
+            if opcode in _LOAD_OPCODES:
+                stack.append((index, invariant(instr), False))
+            elif opcode in _BINARY_OPCODES:
+                if len(stack) < 2:
+                    return []
+                right = stack[-1]
+                left = stack[-2]
+                if left[1] and right[1]:
+                    del stack[-2:]
+                    stack.append((left[0], True, True))
+                else:
+                    stack.append((consume(2, index), False, True))
+            else:
+                if opcode is OpCode.CALL:
+                    popped, pushed = len(instr.operand.params), 1
+                elif opcode in _STACK_EFFECTS:
+                    popped, pushed = _STACK_EFFECTS[opcode]
+                else:
+                    return []
+                if len(stack) < popped:
+                    return []
+                start = consume(popped, index)
+                for _ in range(pushed):
+                    stack.append((start, False, False))
+                    start = index
+
+        if block.branch is not None and stack:
+            consume(1, len(block.instructions))
+        ranges.sort()
+        return ranges
+
+    @staticmethod
+    def _new_temporary(code):
+        slot = len(code.varnames)
+        code.varnames.append(f"{TEMPORARY_PREFIX}{slot}")
+        return slot
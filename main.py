@@ -14,12 +14,25 @@ Usage:
     python main.py                    # Run with built-in example
     python tests.py                    # Run test suite
     python main.py <file.c>            # Analyze specific file
+    python main.py <file.c> -O0        # ... without optimizations (-O1, -O2)
+    python main.py <file.c> -o out.cbc # ... and save the compiled bytecode
+    python main.py <file.c> --no-cache # ... without the compilation cache
+    python main.py <file.c> --max-instructions N --max-time S
+                                       # ... stopping the program at those limits
+    python main.py out.cbc             # Run saved bytecode
 """
 
 import re
 import sys
+import operator
 import os
+import time
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+from itertools import repeat
+from operator import itemgetter
+from types import GeneratorType
 
 # AST Node Types
 class NodeType(Enum):
@@ -54,6 +67,98 @@ class ASTNode:
     def __repr__(self):
         return f"ASTNode({self.type}, {self.value}, {len(self.children)} children)"
 
+
+def walk(node):
+    """Iterate over (node, depth) pairs in pre-order without recursion"""
+    stack = [(node, 0)]
+    while stack:
+        node, depth = stack.pop()
+        yield node, depth
+        children = node.children
+        for index in range(len(children) - 1, -1, -1):
+            stack.append((children[index], depth + 1))
+
+
+# AST Visitor framework
+class ASTVisitor:
+    """Explicit-stack AST visitor.
+
+    visit(node) calls visit_<node type>(node), e.g. visit_binary_expression,
+    falling back to generic_visit. A handler that returns a plain value is
+    treated as a leaf. A handler written as a generator visits children by
+    yielding them: the yield evaluates to the child's result, code before the
+    first yield runs in pre-order, code after the last one in post-order, and
+    the generator's return value is the node's result. Handlers are resumed
+    from a stack instead of recursing, so tree depth is not bounded by the
+    interpreter's recursion limit.
+    """
+
+    def visit(self, node):
+        """Visit node and return the result of its handler"""
+        table = self._dispatch_table()
+        generic = self.generic_visit
+
+        handler = table.get(node.type)
+        result = handler(self, node) if handler else generic(node)
+        if type(result) is not GeneratorType:
+            return result
+
+        stack = [result]
+        send = None
+        while stack:
+            try:
+                child = stack[-1].send(send)
+            except StopIteration as stop:
+                stack.pop()
+                send = stop.value
+                continue
+
+            handler = table.get(child.type)
+            result = handler(self, child) if handler else generic(child)
+            if type(result) is GeneratorType:
+                stack.append(result)
+                send = None
+            else:
+                send = result
+
+        return send
+
+    def generic_visit(self, node):
+        """Visit every child; results are discarded"""
+        for child in node.children:
+            yield child
+
+    @classmethod
+    def _dispatch_table(cls):
+        """NodeType -> handler function, built once per visitor class"""
+        table = cls.__dict__.get('_visit_table')
+        if table is None:
+            table = {}
+            for node_type in NodeType:
+                handler = getattr(cls, 'visit_' + node_type.value, None)
+                if handler is not None:
+                    table[node_type] = handler
+            cls._visit_table = table
+        return table
+
+
+class ASTTransformer(ASTVisitor):
+    """ASTVisitor whose results replace the visited nodes.
+
+    generic_visit rebuilds each node's children from the results of visiting
+    them (a None result removes the child) and returns the node itself, so
+    handlers only need to be written for the node types they rewrite.
+    """
+
+    def generic_visit(self, node):
+        new_children = []
+        for child in node.children:
+            new_child = yield child
+            if new_child is not None:
+                new_children.append(new_child)
+        node.children = new_children
+        return node
+
 # Bytecode Instructions
 class OpCode(Enum):
     LOAD_CONST = "LOAD_CONST"
@@ -69,6 +174,23 @@ class OpCode(Enum):
     CALL = "CALL"
     RETURN = "RETURN"
     PRINT = "PRINT"
+    POP = "POP"
+    DUP = "DUP"
+    LOAD_FAST = "LOAD_FAST"
+    STORE_FAST = "STORE_FAST"
+    # Superinstructions (see superinstructions.py)
+    INC_FAST = "INC_FAST"
+    LOAD_FAST_LOAD_FAST = "LOAD_FAST_LOAD_FAST"
+    COMPARE_JUMP_IF_FALSE = "COMPARE_JUMP_IF_FALSE"
+    COMPARE_FAST_CONST_JUMP_IF_FALSE = "COMPARE_FAST_CONST_JUMP_IF_FALSE"
+    # Arithmetic on operands known to be int / float (see typespec.py)
+    BINARY_ADD_INT = "BINARY_ADD_INT"
+    BINARY_SUB_INT = "BINARY_SUB_INT"
+    BINARY_MUL_INT = "BINARY_MUL_INT"
+    BINARY_ADD_FLOAT = "BINARY_ADD_FLOAT"
+    BINARY_SUB_FLOAT = "BINARY_SUB_FLOAT"
+    BINARY_MUL_FLOAT = "BINARY_MUL_FLOAT"
+    BINARY_DIV_FLOAT = "BINARY_DIV_FLOAT"
 
 class Instruction:
     def __init__(self, opcode, operand=None, line=0):
@@ -79,6 +201,228 @@ class Instruction:
     def __repr__(self):
         return f"Instruction({self.opcode}, {self.operand})"
 
+class Label:
+    """Symbolic jump target inside one function's instruction list.
+
+    Jumps emitted before the label is placed are kept in `refs` (the patch
+    list) and receive the label's index when the function is assembled.
+    """
+    __slots__ = ('id', 'position', 'refs')
+
+    def __init__(self, label_id):
+        self.id = label_id
+        self.position = None
+        self.refs = []
+
+    def __repr__(self):
+        return f"L{self.id}"
+
+JUMP_OPCODES = frozenset((OpCode.JUMP, OpCode.JUMP_IF_FALSE))
+
+# Superinstructions whose operand is a tuple ending with a jump target
+FUSED_BRANCH_OPCODES = frozenset((OpCode.COMPARE_JUMP_IF_FALSE,
+                                  OpCode.COMPARE_FAST_CONST_JUMP_IF_FALSE))
+
+# Type-specialized opcode -> the generic opcode it stands for
+SPECIALIZED_ARITHMETIC = {
+    OpCode.BINARY_ADD_INT: OpCode.BINARY_ADD,
+    OpCode.BINARY_SUB_INT: OpCode.BINARY_SUB,
+    OpCode.BINARY_MUL_INT: OpCode.BINARY_MUL,
+    OpCode.BINARY_ADD_FLOAT: OpCode.BINARY_ADD,
+    OpCode.BINARY_SUB_FLOAT: OpCode.BINARY_SUB,
+    OpCode.BINARY_MUL_FLOAT: OpCode.BINARY_MUL,
+    OpCode.BINARY_DIV_FLOAT: OpCode.BINARY_DIV,
+}
+
+def jump_target(instr):
+    """Index instr may jump to, or None if it never jumps"""
+    if instr.opcode in JUMP_OPCODES:
+        return instr.operand
+    if instr.opcode in FUSED_BRANCH_OPCODES:
+        return instr.operand[-1]
+    return None
+
+class CodeObject:
+    """Compiled function: its parameter names, local slots and own instruction list.
+
+    varnames[i] is the local variable kept in frame slot i (LOAD_FAST and
+    STORE_FAST operands); the parameters take the first slots. CALL
+    instructions carry the callee's CodeObject as their operand; jump
+    targets are indices into the code object's own instructions.
+
+    A CodeObject can be used as the sequence of its instructions.
+    """
+    def __init__(self, name, params=None, instructions=None, line=0, varnames=None):
+        self.name = name
+        self.params = params if params is not None else []
+        self.instructions = instructions if instructions is not None else []
+        self.line = line
+        self.varnames = varnames if varnames is not None else list(self.params)
+        # Most values the instructions keep on the stack; None until computed
+        self.stacksize = None
+        self._blank_slots = []
+
+    @property
+    def blank_slots(self):
+        """One UNSET per local slot, used to reset a frame on each call"""
+        if len(self._blank_slots) != len(self.varnames):
+            self._blank_slots = [UNSET] * len(self.varnames)
+        return self._blank_slots
+
+    def compute_stacksize(self):
+        """Verify the instructions (see stack_depths) and set stacksize to their maximum depth"""
+        self.stacksize = max_stack_depth(self.instructions)
+        return self.stacksize
+
+    def __len__(self):
+        return len(self.instructions)
+
+    def __getitem__(self, index):
+        return self.instructions[index]
+
+    def __iter__(self):
+        return iter(self.instructions)
+
+    def __repr__(self):
+        return (f"CodeObject({self.name}, {len(self.params)} params, "
+                f"{len(self.varnames)} locals, {len(self.instructions)} instructions)")
+
+class VerifyError(ValueError):
+    """An instruction list whose use of the stack is not provably safe"""
+
+
+# (values popped, values pushed) of each opcode but CALL, which pops its
+# callee's parameters and pushes the return value. RETURN pops the return
+# value off the function's own stack and hands it to the caller.
+STACK_EFFECTS = {
+    OpCode.LOAD_CONST: (0, 1),
+    OpCode.LOAD_VAR: (0, 1),
+    OpCode.STORE_VAR: (1, 0),
+    OpCode.BINARY_ADD: (2, 1),
+    OpCode.BINARY_SUB: (2, 1),
+    OpCode.BINARY_MUL: (2, 1),
+    OpCode.BINARY_DIV: (2, 1),
+    OpCode.BINARY_CMP: (2, 1),
+    OpCode.JUMP_IF_FALSE: (1, 0),
+    OpCode.JUMP: (0, 0),
+    OpCode.RETURN: (1, 0),
+    OpCode.PRINT: (1, 0),
+    OpCode.POP: (1, 0),
+    OpCode.DUP: (1, 2),
+    OpCode.LOAD_FAST: (0, 1),
+    OpCode.STORE_FAST: (1, 0),
+    OpCode.INC_FAST: (0, 0),
+    OpCode.LOAD_FAST_LOAD_FAST: (0, 2),
+    OpCode.COMPARE_JUMP_IF_FALSE: (2, 0),
+    OpCode.COMPARE_FAST_CONST_JUMP_IF_FALSE: (0, 0),
+    **{opcode: (2, 1) for opcode in SPECIALIZED_ARITHMETIC},
+}
+
+def stack_effect(instr):
+    """(values popped, values pushed) of instr"""
+    if instr.opcode is OpCode.CALL:
+        if not isinstance(instr.operand, CodeObject):
+            raise VerifyError(f"CALL operand {instr.operand!r} is not a CodeObject")
+        return len(instr.operand.params), 1
+    try:
+        return STACK_EFFECTS[instr.opcode]
+    except KeyError:
+        raise VerifyError(f"Unknown opcode {instr.opcode!r}") from None
+
+def stack_depths(instructions):
+    """Stack depth before each instruction, None where it is unreachable.
+
+    This is the bytecode verifier: it proves that no instruction pops more
+    values than its function pushed, that every path into an instruction
+    arrives with the same depth, that RETURN finds exactly the return value
+    on the stack and that jumps stay in the list (a jump to its end runs
+    off it). Raises VerifyError for instructions that break any of these.
+    """
+    end = len(instructions)
+    depths = [None] * end
+    work = [(0, 0)] if end else []
+    while work:
+        index, depth = work.pop()
+        while index < end:
+            known = depths[index]
+            if known is not None:
+                if known != depth:
+                    raise VerifyError(f"Instruction {index} is reached with stack depths "
+                                      f"{known} and {depth}")
+                break
+            depths[index] = depth
+            instr = instructions[index]
+            popped, pushed = stack_effect(instr)
+            if depth < popped:
+                raise VerifyError(f"Instruction {index} ({instr.opcode.name}) pops {popped} "
+                                  f"values from a stack of {depth}")
+            if instr.opcode is OpCode.RETURN:
+                if depth != 1:
+                    raise VerifyError(f"Instruction {index} (RETURN) leaves {depth - 1} "
+                                      f"values besides the return value")
+                break
+            depth += pushed - popped
+            target = jump_target(instr)
+            if target is not None:
+                if type(target) is not int or not 0 <= target <= end:
+                    raise VerifyError(f"Instruction {index} jumps to {target!r}, outside "
+                                      f"0..{end}")
+                if instr.opcode is OpCode.JUMP:
+                    index = target
+                    continue
+                work.append((target, depth))
+            index += 1
+    return depths
+
+def max_stack_depth(instructions):
+    """Most values instructions keep on the stack; raises VerifyError like stack_depths"""
+    deepest = 0
+    for instr, depth in zip(instructions, stack_depths(instructions)):
+        if depth is not None:
+            popped, pushed = stack_effect(instr)
+            deepest = max(deepest, depth - popped + pushed)
+    return deepest
+
+def verifies(instructions):
+    """True if instructions and every function they call, directly or not, pass stack_depths.
+
+    A caller relies on its callees returning exactly one value, so a list
+    is only as safe as the functions it calls.
+    """
+    pending = [instructions]
+    seen = {id(instructions)}
+    while pending:
+        current = pending.pop()
+        try:
+            stack_depths(current)
+        except VerifyError:
+            return False
+        for instr in current:
+            if instr.opcode is OpCode.CALL and id(instr.operand.instructions) not in seen:
+                seen.add(id(instr.operand.instructions))
+                pending.append(instr.operand.instructions)
+    return True
+
+def verify(code):
+    """Check code's instructions and that they fit in its declared stacksize"""
+    needed = max_stack_depth(code.instructions)
+    if code.stacksize is None or needed > code.stacksize:
+        raise VerifyError(f"'{code.name}' needs a stack of {needed} values, "
+                          f"declares {code.stacksize}")
+    return needed
+
+# Prefix of the names of compiler temporaries; no identifier can start with it
+TEMPORARY_PREFIX = '$'
+
+class _Unset:
+    """Value of a local slot that has not been assigned yet"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return '<unset>'
+
+UNSET = _Unset()
+
 class LexicalAnalyzer:
     def __init__(self):
         self.keywords = [
@@ -576,498 +920,2282 @@ class SemanticAnalyzer:
     
     
 
+# Integer token kinds used by the parser's token cursor
+TK_EOF = 0
+TK_KEYWORD = 1
+TK_IDENTIFIER = 2
+TK_INTEGER = 3
+TK_FLOAT = 4
+TK_STRING = 5
+TK_CHAR = 6
+TK_OPERATOR = 7
+TK_DELIMITER = 8
+TK_COMMENT = 9
+TK_OTHER = 10
+
+TOKEN_KINDS = {
+    'KEYWORD': TK_KEYWORD,
+    'IDENTIFIER': TK_IDENTIFIER,
+    'INTEGER': TK_INTEGER,
+    'FLOAT': TK_FLOAT,
+    'STRING': TK_STRING,
+    'CHAR': TK_CHAR,
+    'OPERATOR': TK_OPERATOR,
+    'DELIMITER': TK_DELIMITER,
+    'COMMENT': TK_COMMENT,
+}
+
+# Token values the parser compares against get fixed ids; every other value
+# (identifiers, literals) is interned per cursor after these
+FIXED_VALUES = (
+    'int', 'float', 'char', 'void', 'if', 'else', 'while', 'return',
+    '(', ')', '{', '}', ';', ',', '=',
+    '+', '-', '*', '/', '>', '<', '>=', '<=', '==', '!=',
+)
+VALUE_IDS = {value: index for index, value in enumerate(FIXED_VALUES, 1)}
+
+V_NONE = 0
+V_INT = VALUE_IDS['int']
+V_FLOAT = VALUE_IDS['float']
+V_CHAR = VALUE_IDS['char']
+V_VOID = VALUE_IDS['void']
+V_IF = VALUE_IDS['if']
+V_WHILE = VALUE_IDS['while']
+V_RETURN = VALUE_IDS['return']
+V_LPAREN = VALUE_IDS['(']
+V_RPAREN = VALUE_IDS[')']
+V_LBRACE = VALUE_IDS['{']
+V_RBRACE = VALUE_IDS['}']
+V_SEMICOLON = VALUE_IDS[';']
+V_ASSIGN = VALUE_IDS['=']
+V_COMMA = VALUE_IDS[',']
+
+TYPE_VALUE_IDS = frozenset((V_INT, V_FLOAT, V_CHAR, V_VOID))
+
+# Binding power of the binary operators, loosest first
+BINARY_OPERATOR_LEVELS = (('==', '!='), ('<', '>', '<=', '>='), ('+', '-'), ('*', '/'))
+BINARY_PRECEDENCE = {
+    VALUE_IDS[op]: precedence
+    for precedence, ops in enumerate(BINARY_OPERATOR_LEVELS, 1)
+    for op in ops
+}
+
+# Enum attribute access goes through the metaclass; the parser's hot paths
+# use these module-level aliases instead
+_LITERAL = NodeType.LITERAL
+_IDENTIFIER = NodeType.IDENTIFIER
+_BINARY_EXPRESSION = NodeType.BINARY_EXPRESSION
+_DECLARATION = NodeType.DECLARATION
+_ASSIGNMENT = NodeType.ASSIGNMENT
+_FUNCTION_CALL = NodeType.FUNCTION_CALL
+
+
+class TokenCursor:
+    """Integer-coded view of a token list.
+
+    kinds[i] and values[i] hold the token kind and interned value id of
+    tokens[i]; both arrays end with an EOF sentinel so lookups never need a
+    bounds check.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.value_ids = value_ids = dict(VALUE_IDS)
+
+        # map()/itemgetter keep the per-token work in C; only distinct
+        # values pass through the Python-level interning loop
+        raw_values = list(map(itemgetter('value'), tokens))
+        for value in dict.fromkeys(raw_values):
+            if value not in value_ids:
+                value_ids[value] = len(value_ids) + 1
+
+        self.kinds = list(map(TOKEN_KINDS.get, map(itemgetter('type'), tokens), repeat(TK_OTHER)))
+        self.values = list(map(value_ids.__getitem__, raw_values))
+        self.kinds.append(TK_EOF)
+        self.values.append(V_NONE)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def function_spans(self):
+        """Return (start, end) token ranges of the top-level functions.
+
+        Mirrors the top level of Parser.parse(), which skips anything that is
+        not a type keyword. Each function must have the shape
+        TYPE IDENT ( ... ) { ... } with balanced brackets; if the stream holds
+        anything else (e.g. a global declaration or an unclosed brace) the
+        boundaries cannot be found by bracket matching alone and None is
+        returned.
+        """
+        kinds = self.kinds
+        values = self.values
+        length = len(self.tokens)
+        spans = []
+        i = 0
+        while i < length:
+            if kinds[i] != TK_KEYWORD or values[i] not in TYPE_VALUE_IDS:
+                i += 1
+                continue
+            start = i
+            if i + 2 >= length or kinds[i + 1] != TK_IDENTIFIER or values[i + 2] != V_LPAREN:
+                return None
+            i = self._skip_balanced(i + 2, V_LPAREN, V_RPAREN)
+            if i is None or values[i] != V_LBRACE:
+                return None
+            i = self._skip_balanced(i, V_LBRACE, V_RBRACE)
+            if i is None:
+                return None
+            spans.append((start, i))
+        return spans
+
+    def _skip_balanced(self, index, open_id, close_id):
+        """Index just past the bracket matching the one at index, or None"""
+        values = self.values
+        depth = 0
+        for i in range(index, len(self.tokens)):
+            value = values[i]
+            if value == open_id:
+                depth += 1
+            elif value == close_id:
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+        return None
+
+
+TOKEN_FIELDS = ('type', 'value', 'line', 'column')
+_token_row = itemgetter(*TOKEN_FIELDS)
+
+# Below this many tokens a process pool costs more than it saves
+PARALLEL_MIN_TOKENS = 20000
+
+
+def _parse_token_rows(rows):
+    """Process-pool worker: parse a run of whole functions.
+
+    Tokens travel as (type, value, line, column) tuples, which pickle much
+    smaller than the lexer's dicts.
+    """
+    parser = Parser([dict(zip(TOKEN_FIELDS, row)) for row in rows])
+    program = parser.parse()
+    return program.children, parser.errors
+
+
 # Parser/AST Generator
 class Parser:
     def __init__(self, tokens=None):
+        self.errors = []
         self.tokens = tokens or []
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+    @tokens.setter
+    def tokens(self, tokens):
+        """Re-encode the token list and rewind to its first token"""
+        self._cursor = TokenCursor(tokens)
+        self._tokens = tokens
+        self._kinds = self._cursor.kinds
+        self._values = self._cursor.values
+        self._length = len(tokens)
         self.position = 0
-        self.current_token = None
-        self.errors = []
-        if self.tokens:
-            self.current_token = self.tokens[0]
-    
+
+    @property
+    def current_token(self):
+        if self.position < self._length:
+            return self._tokens[self.position]
+        return None
+
     def advance(self):
         """Move to next token"""
-        self.position += 1
-        if self.position < len(self.tokens):
-            self.current_token = self.tokens[self.position]
-        else:
-            self.current_token = None
-    
+        if self.position < self._length:
+            self.position += 1
+
     def peek(self, offset=1):
         """Look ahead at token without consuming"""
         peek_pos = self.position + offset
-        if peek_pos < len(self.tokens):
-            return self.tokens[peek_pos]
+        if peek_pos < self._length:
+            return self._tokens[peek_pos]
         return None
-    
+
     def expect(self, token_type, value=None):
         """Expect a specific token type and optionally value"""
-        if (self.current_token and 
-            self.current_token['type'] == token_type and
-            (value is None or self.current_token['value'] == value)):
-            token = self.current_token
-            self.advance()
-            return token
-        else:
-            self.errors.append({
-                'message': f"Expected {token_type} {f'({value})' if value else ''}, got {self.current_token['type'] if self.current_token else 'EOF'}",
-                'line': self.current_token['line'] if self.current_token else 0,
-                'column': self.current_token['column'] if self.current_token else 0
-            })
-            return None
-    
+        position = self.position
+        if (self._kinds[position] == TOKEN_KINDS.get(token_type, -1) and
+            (value is None or self._values[position] == self._cursor.value_ids.get(value, -1))):
+            self.position = position + 1
+            return self._tokens[position]
+        return self._expected(token_type, value)
+
+    def _expect_kind(self, kind, token_type):
+        """expect() for a token kind, e.g. any IDENTIFIER"""
+        position = self.position
+        if self._kinds[position] == kind:
+            self.position = position + 1
+            return self._tokens[position]
+        return self._expected(token_type)
+
+    def _expect_value(self, value_id, token_type, value):
+        """expect() for a fixed keyword/delimiter; their ids imply the kind"""
+        position = self.position
+        if self._values[position] == value_id:
+            self.position = position + 1
+            return self._tokens[position]
+        return self._expected(token_type, value)
+
+    def _expected(self, token_type, value=None):
+        """Record an 'Expected ...' error at the current token"""
+        token = self.current_token
+        self.errors.append({
+            'message': f"Expected {token_type} {f'({value})' if value else ''}, got {token['type'] if token else 'EOF'}",
+            'line': token['line'] if token else 0,
+            'column': token['column'] if token else 0
+        })
+        return None
+
     def parse(self):
         """Parse tokens into AST"""
         program = ASTNode(NodeType.PROGRAM)
-        
-        while self.current_token:
-            if self.current_token['type'] == 'KEYWORD' and self.current_token['value'] in ['int', 'float', 'char', 'void']:
+        kinds = self._kinds
+        values = self._values
+
+        while kinds[self.position]:
+            if kinds[self.position] == TK_KEYWORD and values[self.position] in TYPE_VALUE_IDS:
                 func = self.parse_function()
                 if func:
                     program.add_child(func)
             else:
-                self.advance()
-        
+                self.position += 1
+
         return program
-    
+
+    def parse_parallel(self, max_workers=None, executor=None, min_tokens=PARALLEL_MIN_TOKENS):
+        """Parse tokens into AST, one batch of top-level functions per worker.
+
+        Function boundaries come from TokenCursor.function_spans(); the
+        batches are parsed in a process pool (or the given executor) and the
+        PROGRAM node and errors are reassembled in source order. Small inputs
+        and streams the pre-scan cannot split fall back to parse(). Error
+        recovery does not cross function boundaries, so on malformed input
+        the errors can differ from those of a sequential parse.
+        """
+        spans = self._cursor.function_spans()
+        if not spans or len(spans) < 2 or self._length < min_tokens:
+            return self.parse()
+
+        if executor is None:
+            with ProcessPoolExecutor(max_workers) as pool:
+                return self.parse_parallel(max_workers, pool, min_tokens)
+
+        # A few batches per worker keeps the pool busy without paying
+        # per-function task overhead
+        batch_count = min(len(spans), 4 * (max_workers or os.cpu_count() or 1))
+        batch_size = -(-len(spans) // batch_count)
+        tokens = self._tokens
+        batches = []
+        for first in range(0, len(spans), batch_size):
+            group = spans[first:first + batch_size]
+            rows = []
+            for start, end in group:
+                rows.extend(map(_token_row, tokens[start:end]))
+            batches.append(rows)
+
+        program = ASTNode(NodeType.PROGRAM)
+        for functions, errors in executor.map(_parse_token_rows, batches):
+            program.children.extend(functions)
+            self.errors.extend(errors)
+
+        self.position = self._length
+        return program
+
     def parse_function(self):
         """Parse function definition"""
-        return_type = self.current_token
-        self.advance()
-        
-        func_name = self.expect('IDENTIFIER')
+        return_type = self._tokens[self.position]
+        self.position += 1
+
+        func_name = self._expect_kind(TK_IDENTIFIER, 'IDENTIFIER')
         if not func_name:
             return None
-        
-        self.expect('DELIMITER', '(')
-        self.expect('DELIMITER', ')')
-        
-        self.expect('DELIMITER', '{')
-        
-        func_node = ASTNode(NodeType.FUNCTION, func_name['value'], 
+
+        self._expect_value(V_LPAREN, 'DELIMITER', '(')
+        parameters = self._parse_parameters()
+        self._expect_value(V_RPAREN, 'DELIMITER', ')')
+
+        self._expect_value(V_LBRACE, 'DELIMITER', '{')
+
+        func_node = ASTNode(NodeType.FUNCTION, func_name['value'],
                           line=func_name['line'], column=func_name['column'])
-        func_node.add_child(ASTNode(NodeType.LITERAL, return_type['value']))
-        
+        func_node.add_child(ASTNode(_LITERAL, return_type['value']))
+        func_node.children.extend(parameters)
+
         # Parse function body
-        while self.current_token and self.current_token['value'] != '}':
-            stmt = self.parse_statement()
-            if stmt:
-                func_node.add_child(stmt)
-        
-        self.expect('DELIMITER', '}')
+        self._parse_block(func_node.children)
         return func_node
-    
+
+    def _parse_parameters(self):
+        """Parse 'type name, ...' up to (not including) ')' into PARAMETER nodes"""
+        kinds = self._kinds
+        values = self._values
+        parameters = []
+
+        # f(void) declares no parameters
+        if values[self.position] == V_VOID and values[self.position + 1] == V_RPAREN:
+            self.position += 1
+            return parameters
+
+        while kinds[self.position] and values[self.position] != V_RPAREN:
+            if values[self.position] not in TYPE_VALUE_IDS:
+                self._expected('KEYWORD')
+                break
+            param_type = self._tokens[self.position]
+            self.position += 1
+
+            param_name = self._expect_kind(TK_IDENTIFIER, 'IDENTIFIER')
+            if not param_name:
+                break
+            parameters.append(ASTNode(NodeType.PARAMETER, param_type['value'],
+                                      [ASTNode(_IDENTIFIER, param_name['value'])],
+                                      line=param_type['line'], column=param_type['column']))
+
+            if values[self.position] != V_COMMA:
+                break
+            self.position += 1
+
+        return parameters
+
+    def _parse_call(self, name_token):
+        """Parse '( args )' after a function name into a FUNCTION_CALL node"""
+        self._expect_value(V_LPAREN, 'DELIMITER', '(')
+        call_node = ASTNode(_FUNCTION_CALL, name_token['value'],
+                            line=name_token['line'], column=name_token['column'])
+
+        values = self._values
+        if values[self.position] != V_RPAREN:
+            while self._kinds[self.position]:
+                argument = self.parse_expression()
+                if argument is None:
+                    break
+                call_node.children.append(argument)
+                if values[self.position] != V_COMMA:
+                    break
+                self.position += 1
+
+        self._expect_value(V_RPAREN, 'DELIMITER', ')')
+        return call_node
+
+    def _parse_block(self, statements):
+        """Parse statements up to and including the closing brace"""
+        kinds = self._kinds
+        values = self._values
+        keyword_statements = self._keyword_statements
+
+        while kinds[self.position] and values[self.position] != V_RBRACE:
+            # Inlined parse_statement(): dispatch on the leading token
+            kind = kinds[self.position]
+            if kind == TK_KEYWORD:
+                handler = keyword_statements.get(values[self.position])
+                stmt = handler(self) if handler is not None else self.parse_statement()
+            elif kind == TK_IDENTIFIER:
+                stmt = self.parse_assignment_or_call()
+            else:
+                stmt = self.parse_statement()
+            if stmt:
+                statements.append(stmt)
+
+        self._expect_value(V_RBRACE, 'DELIMITER', '}')
+
     def parse_statement(self):
         """Parse statement"""
-        if self.current_token['type'] == 'KEYWORD':
-            if self.current_token['value'] == 'int' or self.current_token['value'] == 'float':
-                return self.parse_declaration()
-            elif self.current_token['value'] == 'if':
-                return self.parse_if_statement()
-            elif self.current_token['value'] == 'while':
-                return self.parse_while_statement()
-            elif self.current_token['value'] == 'return':
-                return self.parse_return_statement()
-        elif self.current_token['type'] == 'IDENTIFIER':
+        kind = self._kinds[self.position]
+        if kind == TK_KEYWORD:
+            handler = self._keyword_statements.get(self._values[self.position])
+            if handler is not None:
+                return handler(self)
+        elif kind == TK_IDENTIFIER:
             return self.parse_assignment_or_call()
-        
+
         self.advance()
         return None
-    
+
     def parse_declaration(self):
         """Parse variable declaration"""
-        var_type = self.current_token
-        self.advance()
-        
-        var_name = self.expect('IDENTIFIER')
+        var_type = self._tokens[self.position]
+        self.position += 1
+
+        var_name = self._expect_kind(TK_IDENTIFIER, 'IDENTIFIER')
         if not var_name:
             return None
-        
-        decl_node = ASTNode(NodeType.DECLARATION, var_type['value'],
+
+        decl_node = ASTNode(_DECLARATION, var_type['value'],
+                          [ASTNode(_IDENTIFIER, var_name['value'])],
                           line=var_type['line'], column=var_type['column'])
-        decl_node.add_child(ASTNode(NodeType.IDENTIFIER, var_name['value']))
-        
+
         # Check for initialization
-        if self.current_token and self.current_token['value'] == '=':
-            self.advance()
+        if self._values[self.position] == V_ASSIGN:
+            self.position += 1
             expr = self.parse_expression()
             if expr:
-                decl_node.add_child(expr)
-        
-        self.expect('DELIMITER', ';')
+                decl_node.children.append(expr)
+
+        self._expect_value(V_SEMICOLON, 'DELIMITER', ';')
         return decl_node
-    
+
     def parse_assignment_or_call(self):
         """Parse assignment or function call"""
-        var_name = self.current_token
-        self.advance()
-        
-        if self.current_token and self.current_token['value'] == '=':
+        var_name = self._tokens[self.position]
+        self.position += 1
+
+        next_value = self._values[self.position]
+        if next_value == V_ASSIGN:
             # Assignment
-            self.advance()
+            self.position += 1
             expr = self.parse_expression()
-            
-            assign_node = ASTNode(NodeType.ASSIGNMENT, var_name['value'],
+
+            assign_node = ASTNode(_ASSIGNMENT, var_name['value'],
+                                 [ASTNode(_IDENTIFIER, var_name['value'])],
                                  line=var_name['line'], column=var_name['column'])
-            assign_node.add_child(ASTNode(NodeType.IDENTIFIER, var_name['value']))
             if expr:
-                assign_node.add_child(expr)
-            
-            self.expect('DELIMITER', ';')
+                assign_node.children.append(expr)
+
+            self._expect_value(V_SEMICOLON, 'DELIMITER', ';')
             return assign_node
-        elif self.current_token and self.current_token['value'] == '(':
+        elif next_value == V_LPAREN:
             # Function call
-            self.advance()
-            self.expect('DELIMITER', ')')
-            
-            call_node = ASTNode(NodeType.FUNCTION_CALL, var_name['value'],
-                               line=var_name['line'], column=var_name['column'])
-            self.expect('DELIMITER', ';')
+            call_node = self._parse_call(var_name)
+            self._expect_value(V_SEMICOLON, 'DELIMITER', ';')
             return call_node
-        
+
         return None
-    
+
+    def _parse_condition(self):
+        """Parse '( expression ) {' after if/while, returning the expression"""
+        self._expect_value(V_LPAREN, 'DELIMITER', '(')
+        condition = self.parse_expression()
+        self._expect_value(V_RPAREN, 'DELIMITER', ')')
+        self._expect_value(V_LBRACE, 'DELIMITER', '{')
+        return condition
+
     def parse_if_statement(self):
         """Parse if statement"""
-        self.expect('KEYWORD', 'if')
-        self.expect('DELIMITER', '(')
-        condition = self.parse_expression()
-        self.expect('DELIMITER', ')')
-        self.expect('DELIMITER', '{')
-        
-        if_node = ASTNode(NodeType.IF_STATEMENT)
+        keyword = self._expect_value(V_IF, 'KEYWORD', 'if')
+        condition = self._parse_condition()
+
+        if_node = ASTNode(NodeType.IF_STATEMENT, line=keyword['line'], column=keyword['column'])
         if condition:
             if_node.add_child(condition)
-        
+
         # Parse if body
-        while self.current_token and self.current_token['value'] != '}':
-            stmt = self.parse_statement()
-            if stmt:
-                if_node.add_child(stmt)
-        
-        self.expect('DELIMITER', '}')
+        self._parse_block(if_node.children)
         return if_node
-    
+
     def parse_while_statement(self):
         """Parse while statement"""
-        self.expect('KEYWORD', 'while')
-        self.expect('DELIMITER', '(')
-        condition = self.parse_expression()
-        self.expect('DELIMITER', ')')
-        self.expect('DELIMITER', '{')
-        
-        while_node = ASTNode(NodeType.WHILE_STATEMENT)
+        keyword = self._expect_value(V_WHILE, 'KEYWORD', 'while')
+        condition = self._parse_condition()
+
+        while_node = ASTNode(NodeType.WHILE_STATEMENT, line=keyword['line'],
+                             column=keyword['column'])
         if condition:
             while_node.add_child(condition)
-        
+
         # Parse while body
-        while self.current_token and self.current_token['value'] != '}':
-            stmt = self.parse_statement()
-            if stmt:
-                while_node.add_child(stmt)
-        
-        self.expect('DELIMITER', '}')
+        self._parse_block(while_node.children)
         return while_node
-    
+
     def parse_return_statement(self):
         """Parse return statement"""
-        self.expect('KEYWORD', 'return')
-        
-        return_node = ASTNode(NodeType.RETURN_STATEMENT)
-        if self.current_token and self.current_token['value'] != ';':
+        keyword = self._expect_value(V_RETURN, 'KEYWORD', 'return')
+
+        return_node = ASTNode(NodeType.RETURN_STATEMENT, line=keyword['line'],
+                              column=keyword['column'])
+        if self._kinds[self.position] and self._values[self.position] != V_SEMICOLON:
             expr = self.parse_expression()
             if expr:
                 return_node.add_child(expr)
-        
-        self.expect('DELIMITER', ';')
+
+        self._expect_value(V_SEMICOLON, 'DELIMITER', ';')
         return return_node
-    
-    def parse_expression(self):
-        """Parse expression (simplified)"""
+
+    def parse_expression(self, min_precedence=1):
+        """Parse expression by precedence climbing over BINARY_PRECEDENCE.
+
+        Operators of equal precedence are folded in the loop, so long chains
+        like a + b + c + ... do not recurse.
+        """
         left = self.parse_term()
-        
-        while (self.current_token and 
-               self.current_token['type'] == 'OPERATOR' and
-               self.current_token['value'] in ['+', '-', '>', '<', '==', '!=']):
-            op = self.current_token
-            self.advance()
-            right = self.parse_term()
-            
-            bin_expr = ASTNode(NodeType.BINARY_EXPRESSION, op['value'],
-                             line=op['line'], column=op['column'])
-            bin_expr.add_child(left)
-            bin_expr.add_child(right)
-            left = bin_expr
-        
-        return left
-    
+        values = self._values
+        tokens = self._tokens
+        precedence_of = BINARY_PRECEDENCE.get
+
+        while True:
+            precedence = precedence_of(values[self.position])
+            if precedence is None or precedence < min_precedence:
+                return left
+            op = tokens[self.position]
+            self.position += 1
+            right = self.parse_expression(precedence + 1)
+
+            left = ASTNode(_BINARY_EXPRESSION, op['value'], [left, right],
+                           line=op['line'], column=op['column'])
+
     def parse_term(self):
         """Parse term (simplified)"""
-        if self.current_token and self.current_token['type'] == 'INTEGER':
-            token = self.current_token
-            self.advance()
-            return ASTNode(NodeType.LITERAL, int(token['value']),
+        position = self.position
+        kind = self._kinds[position]
+        if kind == TK_INTEGER:
+            token = self._tokens[position]
+            self.position = position + 1
+            return ASTNode(_LITERAL, int(token['value']),
                          line=token['line'], column=token['column'])
-        elif self.current_token and self.current_token['type'] == 'FLOAT':
-            token = self.current_token
-            self.advance()
-            return ASTNode(NodeType.LITERAL, float(token['value']),
+        elif kind == TK_FLOAT:
+            token = self._tokens[position]
+            self.position = position + 1
+            return ASTNode(_LITERAL, float(token['value']),
                          line=token['line'], column=token['column'])
-        elif self.current_token and self.current_token['type'] == 'IDENTIFIER':
-            token = self.current_token
-            self.advance()
-            return ASTNode(NodeType.IDENTIFIER, token['value'],
+        elif kind == TK_IDENTIFIER:
+            token = self._tokens[position]
+            self.position = position + 1
+            if self._values[position + 1] == V_LPAREN:
+                return self._parse_call(token)
+            return ASTNode(_IDENTIFIER, token['value'],
                          line=token['line'], column=token['column'])
-        elif self.current_token and self.current_token['value'] == '(':
-            self.advance()
+        elif self._values[position] == V_LPAREN:
+            self.position = position + 1
             expr = self.parse_expression()
-            self.expect('DELIMITER', ')')
+            self._expect_value(V_RPAREN, 'DELIMITER', ')')
             return expr
-        
+
         return None
 
 
-# Virtual Machine/Interpreter
-class VirtualMachine:
-    def __init__(self):
-        self.stack = []
-        self.memory = {}
-        self.instruction_pointer = 0
-        self.instructions = []
-        self.running = False
-    
-    def load_instructions(self, instructions):
-        """Load bytecode instructions"""
-        self.instructions = instructions
-        self.instruction_pointer = 0
-    
-    def run(self):
-        """Execute all instructions"""
-        self.running = True
-        while self.running and self.instruction_pointer < len(self.instructions):
-            self.execute_instruction()
-    
-    def execute_instruction(self):
-        """Execute single instruction"""
-        instr = self.instructions[self.instruction_pointer]
-        
-        # Handle stack operations
-        if self._handle_stack_ops(instr):
-            return
-        
-        # Handle arithmetic operations
-        if self._handle_arithmetic_ops(instr):
-            return
-        
-        # Handle control flow operations
-        if self._handle_control_flow_ops(instr):
-            return
-        
-        # Handle other operations
-        self._handle_other_ops(instr)
-        
-        self.instruction_pointer += 1
-    
-    def _handle_stack_ops(self, instr):
-        """Handle stack-based operations"""
-        if instr.opcode == OpCode.LOAD_CONST:
-            self.stack.append(instr.operand)
-            return True
-        elif instr.opcode == OpCode.LOAD_VAR:
-            var_name = instr.operand
-            if var_name in self.memory:
-                self.stack.append(self.memory[var_name])
-            else:
-                print(f"Runtime Error: Undefined variable '{var_name}'")
-                self.running = False
-            return True
-        elif instr.opcode == OpCode.STORE_VAR:
-            var_name = instr.operand
-            if self.stack:
-                self.memory[var_name] = self.stack.pop()
-            return True
-        return False
-    
-    def _handle_arithmetic_ops(self, instr):
-        """Handle arithmetic operations"""
-        if len(self.stack) < 2:
-            return False
-        
-        if instr.opcode == OpCode.BINARY_ADD:
-            b = self.stack.pop()
-            a = self.stack.pop()
-            self.stack.append(a + b)
-            return True
-        elif instr.opcode == OpCode.BINARY_SUB:
-            b = self.stack.pop()
-            a = self.stack.pop()
-            self.stack.append(a - b)
-            return True
-        elif instr.opcode == OpCode.BINARY_MUL:
-            b = self.stack.pop()
-            a = self.stack.pop()
-            self.stack.append(a * b)
-            return True
-        elif instr.opcode == OpCode.BINARY_DIV:
-            b = self.stack.pop()
-            a = self.stack.pop()
-            if b != 0:
-                self.stack.append(a / b)
-            else:
-                print("Runtime Error: Division by zero")
-                self.running = False
-            return True
-        elif instr.opcode == OpCode.BINARY_CMP:
-            b = self.stack.pop()
-            a = self.stack.pop()
-            self.stack.append(1 if a > b else 0)
-            return True
-        return False
+# Leading keyword -> statement parser
+Parser._keyword_statements = {
+    V_INT: Parser.parse_declaration,
+    V_FLOAT: Parser.parse_declaration,
+    V_IF: Parser.parse_if_statement,
+    V_WHILE: Parser.parse_while_statement,
+    V_RETURN: Parser.parse_return_statement,
+}
+
+
+# Default limit on nested calls before the VM reports a stack overflow
+MAX_CALL_DEPTH = 1000
+# Frames allocated up front; deeper call chains grow the pool on demand
+FRAME_POOL_SIZE = 64
+# With a time limit, the clock is read once per this many instructions run
+CLOCK_CHECK_INTERVAL = 1024
+# Characters of output an OutputSink collects before handing them on
+OUTPUT_BUFFER_SIZE = 8192
+
+
+class TerminationReason(Enum):
+    """Why run() stopped; the value of a limit's reason is its ExecutionLimits field"""
+    RETURNED = "returned"           # the entry function returned
+    END = "end"                     # ran off the end of the instructions
+    ERROR = "error"                 # runtime error
+    INSTRUCTION_LIMIT = "max_instructions"
+    TIME_LIMIT = "max_time"
+    STACK_LIMIT = "max_stack_depth"
+    MEMORY_LIMIT = "max_memory_entries"
+    OUTPUT_LIMIT = "max_output_bytes"
+
+LIMIT_REASONS = frozenset((TerminationReason.INSTRUCTION_LIMIT, TerminationReason.TIME_LIMIT,
+                           TerminationReason.STACK_LIMIT, TerminationReason.MEMORY_LIMIT,
+                           TerminationReason.OUTPUT_LIMIT))
+
+
+class Termination:
+    """How a run ended: its reason, the error or limit message, and where it stopped"""
+    __slots__ = ('reason', 'message', 'function', 'instruction_pointer')
+
+    def __init__(self, reason, message=None, function=None, instruction_pointer=0):
+        self.reason = reason
+        self.message = message
+        self.function = function
+        self.instruction_pointer = instruction_pointer
+
+    @property
+    def limit_exceeded(self):
+        return self.reason in LIMIT_REASONS
+
+    def __repr__(self):
+        return (f"Termination({self.reason.name}, {self.message!r}, "
+                f"{self.function!r}, {self.instruction_pointer})")
+
+
+class ExecutionLimits:
+    """Resource quotas for running untrusted programs; None leaves a resource unlimited.
+
+        max_instructions    instructions run since the program was loaded
+        max_time            seconds spent in run() since it was loaded
+        max_stack_depth     values on the operand stack
+        max_memory_entries  variables: the globals plus the slots of every active call
+        max_output_bytes    bytes PRINT writes (UTF-8, newlines included)
+
+    The VM checks them where a program can keep going: at jumps back to an
+    earlier instruction, at calls and at returns (output at PRINT), so
+    straight-line code runs at full speed. Instructions are counted in
+    forward runs between those checkpoints; an instruction a forward jump
+    skips counts as run, so the count is an upper bound. A program that
+    exceeds a limit stops before the checkpoint that found it, with
+    vm.termination telling which one; nothing is printed.
+    """
+    __slots__ = ('max_instructions', 'max_time', 'max_stack_depth', 'max_memory_entries',
+                 'max_output_bytes')
+
+    def __init__(self, max_instructions=None, max_time=None, max_stack_depth=None,
+                 max_memory_entries=None, max_output_bytes=None):
+        self.max_instructions = max_instructions
+        self.max_time = max_time
+        self.max_stack_depth = max_stack_depth
+        self.max_memory_entries = max_memory_entries
+        self.max_output_bytes = max_output_bytes
+
+    def __repr__(self):
+        limits = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.__slots__
+                           if getattr(self, name) is not None)
+        return f"ExecutionLimits({limits})"
+
+class OutputSink:
+    """Where a VirtualMachine writes PRINT output and runtime error messages.
+
+    write() collects text and hands it to emit() in batches of about
+    buffer_size characters; flush() hands on the rest. The VM flushes its
+    sink before run() and execute_instruction() return. Subclasses
+    implement emit().
+    """
+
+    def __init__(self, buffer_size=OUTPUT_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self._parts = []
+        self._size = 0
+
+    def write(self, text):
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._parts:
+            text = ''.join(self._parts)
+            self._parts = []
+            self._size = 0
+            self.emit(text)
+
+    def emit(self, text):
+        raise NotImplementedError
+
+
+class StdoutSink(OutputSink):
+    """sys.stdout as it is at each flush; the default sink"""
+
+    def emit(self, text):
+        sys.stdout.write(text)
+
+
+class BufferSink(OutputSink):
+    """Keeps the output in memory"""
+
+    def __init__(self, buffer_size=OUTPUT_BUFFER_SIZE):
+        super().__init__(buffer_size)
+        self._chunks = []
+
+    def emit(self, text):
+        self._chunks.append(text)
+
+    def getvalue(self):
+        self.flush()
+        return ''.join(self._chunks)
+
+    def clear(self):
+        self.flush()
+        self._chunks = []
+
+
+class FileSink(OutputSink):
+    """Writes to an open text file"""
+
+    def __init__(self, file, buffer_size=OUTPUT_BUFFER_SIZE):
+        super().__init__(buffer_size)
+        self.file = file
+
+    def emit(self, text):
+        self.file.write(text)
+
+
+class CallbackSink(OutputSink):
+    """Calls callback(text) with each batch"""
+
+    def __init__(self, callback, buffer_size=OUTPUT_BUFFER_SIZE):
+        super().__init__(buffer_size)
+        self.callback = callback
+
+    def emit(self, text):
+        self.callback(text)
+
+
+class NullSink(OutputSink):
+    """Discards the output"""
+
+    def write(self, text):
+        pass
+
+    def emit(self, text):
+        pass
+
+
+class VMRuntimeError(Exception):
+    """A runtime error of the program, raised by run() of a VM with raise_errors.
+
+    `message` is the one the VM would print ("Division by zero", ...),
+    `function` and `line` tell where it happened and `termination` is the
+    VM's Termination.
+    """
+
+    def __init__(self, message, function=None, line=0, termination=None):
+        super().__init__(message)
+        self.message = message
+        self.function = function
+        self.line = line
+        self.termination = termination
+
+
+COMPARISON_OPERATORS = {
+    '>': operator.gt,
+    '<': operator.lt,
+    '>=': operator.ge,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+
+# Handler-table dispatch
+#
+# run() pre-decodes every instruction list it executes into (handler,
+# operand) pairs: the handler comes from HANDLERS, indexed by the opcode's
+# number, and operands are resolved once (comparison operators become
+# functions, jump targets are clamped to the end of the list). A handler
+# is called as handler(vm, operand, ip), with ip already pointing at the
+# next instruction, and returns the ip to continue at or one of the
+# negative codes below. Each decoded list ends with a sentinel handler, so
+# the loop needs no bounds check.
+#
+# Instruction lists that pass the verifier (stack_depths) never pop an
+# empty stack, so their handlers pop without checking. Lists that do not
+# verify, such as hand-written ones, run with CHECKED_HANDLERS, where
+# instructions that would pop a value that is not there do nothing.
+
+OPCODE_INDEX = {opcode: index for index, opcode in enumerate(OpCode)}
+
+# Returned by a handler instead of an ip; vm.instruction_pointer is already set
+_STOP = -1      # leave run()
+_SWITCH = -2    # the current frame changed: continue at vm.instruction_pointer
+
+
+def _stop(vm, ip, reason=TerminationReason.ERROR, message=None):
+    vm.running = False
+    vm.instruction_pointer = ip
+    vm._terminate(reason, message)
+    return _STOP
+
+
+def _runtime_error(vm, message, ip):
+    _stop(vm, ip, TerminationReason.ERROR, message)
+    vm._report_error()
+    return _STOP
+
+
+def _undefined_local(vm, slot, ip):
+    name = vm.frames[-1].code.varnames[slot]
+    return _runtime_error(vm, f"Undefined variable '{name}'", ip)
+
+
+def _op_load_const(vm, value, ip):
+    vm.stack.append(value)
+    return ip
+
+
+def _op_load_var(vm, name, ip):
+    variables = vm.locals
+    if name not in variables:
+        variables = vm._globals
+        if name not in variables:
+            return _runtime_error(vm, f"Undefined variable '{name}'", ip)
+    vm.stack.append(variables[name])
+    return ip
+
+
+def _op_store_var(vm, name, ip):
+    vm.locals[name] = vm.stack.pop()
+    return ip
+
+
+# Quickening
+#
+# The operand of a decoded generic arithmetic instruction is its
+# quickening state, (executions left, operand type), or None once it has
+# seen operands other than two ints or two floats. After QUICKEN_WARMUP
+# executions in a row with the same operand type, the instruction is
+# rewritten in the decoded list (never in the CodeObject) into a quickened
+# handler for that type. Its guard checks the operand types and, on a
+# mismatch, puts the generic handler back with QUICKEN_BACKOFF executions
+# to go before it is quickened again.
+QUICKEN_WARMUP = 8
+QUICKEN_BACKOFF = 64
+
+
+def _observe(vm, generic, state, a, b, ip):
+    """Count one execution of a generic arithmetic instruction towards quickening"""
+    kind = type(a)
+    if kind is not type(b) or (kind is not int and kind is not float):
+        state = None
+    else:
+        remaining, seen = state
+        if seen is not None and seen is not kind:
+            state = (QUICKEN_WARMUP, kind)
+        elif remaining > 1:
+            state = (remaining - 1, kind)
+        else:
+            vm._decode(vm.instructions)[ip - 1] = (_QUICKENED[generic][kind], generic)
+            return
+    vm._decode(vm.instructions)[ip - 1] = (generic, state)
+
+
+def _deoptimize(vm, generic, ip):
+    """A guard failed: restore the generic handler and let it run the instruction"""
+    state = (QUICKEN_BACKOFF, None)
+    vm._decode(vm.instructions)[ip - 1] = (generic, state)
+    return generic(vm, state, ip)
+
+
+def _op_add(vm, state, ip):
+    stack = vm.stack
+    b = stack.pop()
+    a = stack[-1]
+    stack[-1] = a + b
+    if state is not None:
+        _observe(vm, _op_add, state, a, b, ip)
+    return ip
+
+
+def _op_sub(vm, state, ip):
+    stack = vm.stack
+    b = stack.pop()
+    a = stack[-1]
+    stack[-1] = a - b
+    if state is not None:
+        _observe(vm, _op_sub, state, a, b, ip)
+    return ip
+
+
+def _op_mul(vm, state, ip):
+    stack = vm.stack
+    b = stack.pop()
+    a = stack[-1]
+    stack[-1] = a * b
+    if state is not None:
+        _observe(vm, _op_mul, state, a, b, ip)
+    return ip
+
+
+def _op_div(vm, state, ip):
+    stack = vm.stack
+    b = stack.pop()
+    if b == 0:
+        stack.pop()
+        return _runtime_error(vm, "Division by zero", ip)
+    a = stack[-1]
+    stack[-1] = a / b
+    if state is not None:
+        _observe(vm, _op_div, state, a, b, ip)
+    return ip
+
+
+# Quickened forms: the operand is the generic handler to go back to
+
+def _quick_add_int(vm, generic, ip):
+    stack = vm.stack
+    try:
+        a = stack[-2]
+    except IndexError:
+        return _deoptimize(vm, generic, ip)
+    b = stack.pop()
+    if type(a) is int and type(b) is int:
+        stack[-1] = a + b
+        return ip
+    stack.append(b)
+    return _deoptimize(vm, generic, ip)
+
+
+def _quick_sub_int(vm, generic, ip):
+    stack = vm.stack
+    try:
+        a = stack[-2]
+    except IndexError:
+        return _deoptimize(vm, generic, ip)
+    b = stack.pop()
+    if type(a) is int and type(b) is int:
+        stack[-1] = a - b
+        return ip
+    stack.append(b)
+    return _deoptimize(vm, generic, ip)
+
+
+def _quick_mul_int(vm, generic, ip):
+    stack = vm.stack
+    try:
+        a = stack[-2]
+    except IndexError:
+        return _deoptimize(vm, generic, ip)
+    b = stack.pop()
+    if type(a) is int and type(b) is int:
+        stack[-1] = a * b
+        return ip
+    stack.append(b)
+    return _deoptimize(vm, generic, ip)
+
+
+def _quick_div_int(vm, generic, ip):
+    stack = vm.stack
+    try:
+        a = stack[-2]
+    except IndexError:
+        return _deoptimize(vm, generic, ip)
+    b = stack.pop()
+    if type(a) is int and type(b) is int and b:
+        stack[-1] = a / b
+        return ip
+    stack.append(b)
+    return _deoptimize(vm, generic, ip)
+
+
+def _quick_add_float(vm, generic, ip):
+    stack = vm.stack
+    try:
+        a = stack[-2]
+    except IndexError:
+        return _deoptimize(vm, generic, ip)
+    b = stack.pop()
+    if type(a) is float and type(b) is float:
+        stack[-1] = a + b
+        return ip
+    stack.append(b)
+    return _deoptimize(vm, generic, ip)
+
+
+def _quick_sub_float(vm, generic, ip):
+    stack = vm.stack
+    try:
+        a = stack[-2]
+    except IndexError:
+        return _deoptimize(vm, generic, ip)
+    b = stack.pop()
+    if type(a) is float and type(b) is float:
+        stack[-1] = a - b
+        return ip
+    stack.append(b)
+    return _deoptimize(vm, generic, ip)
+
+
+def _quick_mul_float(vm, generic, ip):
+    stack = vm.stack
+    try:
+        a = stack[-2]
+    except IndexError:
+        return _deoptimize(vm, generic, ip)
+    b = stack.pop()
+    if type(a) is float and type(b) is float:
+        stack[-1] = a * b
+        return ip
+    stack.append(b)
+    return _deoptimize(vm, generic, ip)
+
+
+def _quick_div_float(vm, generic, ip):
+    stack = vm.stack
+    try:
+        a = stack[-2]
+    except IndexError:
+        return _deoptimize(vm, generic, ip)
+    b = stack.pop()
+    if type(a) is float and type(b) is float and b:
+        stack[-1] = a / b
+        return ip
+    stack.append(b)
+    return _deoptimize(vm, generic, ip)
+
+
+_QUICKENED = {
+    _op_add: {int: _quick_add_int, float: _quick_add_float},
+    _op_sub: {int: _quick_sub_int, float: _quick_sub_float},
+    _op_mul: {int: _quick_mul_int, float: _quick_mul_float},
+    _op_div: {int: _quick_div_int, float: _quick_div_float},
+}
+
+
+# Statically specialized opcodes: the compiler proved both operands are
+# numbers of the opcode's type and that they are on the stack
+
+def _op_add_numbers(vm, operand, ip):
+    stack = vm.stack
+    b = stack.pop()
+    stack[-1] += b
+    return ip
+
+
+def _op_sub_numbers(vm, operand, ip):
+    stack = vm.stack
+    b = stack.pop()
+    stack[-1] -= b
+    return ip
+
+
+def _op_mul_numbers(vm, operand, ip):
+    stack = vm.stack
+    b = stack.pop()
+    stack[-1] *= b
+    return ip
+
+
+def _op_div_numbers(vm, operand, ip):
+    stack = vm.stack
+    b = stack.pop()
+    if b == 0:
+        stack.pop()
+        return _runtime_error(vm, "Division by zero", ip)
+    stack[-1] /= b
+    return ip
+
+
+def _op_compare(vm, compare, ip):
+    stack = vm.stack
+    b = stack.pop()
+    stack[-1] = 1 if compare(stack[-1], b) else 0
+    return ip
+
+
+def _op_jump_if_false(vm, target, ip):
+    if vm.stack.pop() == 0:
+        return target
+    return ip
+
+
+def _op_jump(vm, target, ip):
+    return target
+
+
+def _op_call(vm, code, ip):
+    vm.instruction_pointer = ip
+    vm._call(code)
+    return _SWITCH if vm.running else _STOP
+
+
+def _op_return(vm, operand, ip):
+    vm.instruction_pointer = ip
+    vm._return()
+    return _SWITCH if vm.running else _STOP
+
+
+def _op_print(vm, operand, ip):
+    vm.output.write(f"{vm.stack.pop()}\n")
+    return ip
+
+
+def _op_pop(vm, operand, ip):
+    vm.stack.pop()
+    return ip
+
+
+def _op_dup(vm, operand, ip):
+    stack = vm.stack
+    stack.append(stack[-1])
+    return ip
+
+
+def _op_load_fast(vm, slot, ip):
+    value = vm.slots[slot]
+    if value is UNSET:
+        return _undefined_local(vm, slot, ip)
+    vm.stack.append(value)
+    return ip
+
+
+def _op_store_fast(vm, slot, ip):
+    vm.slots[slot] = vm.stack.pop()
+    return ip
+
+
+def _op_inc_fast(vm, operand, ip):
+    slot, delta = operand
+    slots = vm.slots
+    value = slots[slot]
+    if value is UNSET:
+        return _undefined_local(vm, slot, ip)
+    slots[slot] = value + delta
+    return ip
+
+
+def _op_load_fast_load_fast(vm, operand, ip):
+    first, second = operand
+    slots = vm.slots
+    if slots[first] is UNSET:
+        return _undefined_local(vm, first, ip)
+    if slots[second] is UNSET:
+        return _undefined_local(vm, second, ip)
+    stack = vm.stack
+    stack.append(slots[first])
+    stack.append(slots[second])
+    return ip
+
+
+def _op_compare_jump_if_false(vm, operand, ip):
+    compare, target = operand
+    stack = vm.stack
+    b = stack.pop()
+    if not compare(stack.pop(), b):
+        return target
+    return ip
+
+
+def _op_compare_fast_const_jump_if_false(vm, operand, ip):
+    slot, compare, constant, target = operand
+    value = vm.slots[slot]
+    if value is UNSET:
+        return _undefined_local(vm, slot, ip)
+    if not compare(value, constant):
+        return target
+    return ip
+
+
+# Checked forms for instruction lists that do not verify. Binary operators
+# leave a stack with fewer than two values untouched.
+
+def _op_store_var_checked(vm, name, ip):
+    stack = vm.stack
+    if stack:
+        vm.locals[name] = stack.pop()
+    return ip
+
+
+def _op_add_checked(vm, state, ip):
+    stack = vm.stack
+    if len(stack) > 1:
+        b = stack.pop()
+        a = stack[-1]
+        stack[-1] = a + b
+        if state is not None:
+            _observe(vm, _op_add_checked, state, a, b, ip)
+    return ip
+
+
+def _op_sub_checked(vm, state, ip):
+    stack = vm.stack
+    if len(stack) > 1:
+        b = stack.pop()
+        a = stack[-1]
+        stack[-1] = a - b
+        if state is not None:
+            _observe(vm, _op_sub_checked, state, a, b, ip)
+    return ip
+
+
+def _op_mul_checked(vm, state, ip):
+    stack = vm.stack
+    if len(stack) > 1:
+        b = stack.pop()
+        a = stack[-1]
+        stack[-1] = a * b
+        if state is not None:
+            _observe(vm, _op_mul_checked, state, a, b, ip)
+    return ip
+
+
+def _op_div_checked(vm, state, ip):
+    stack = vm.stack
+    if len(stack) > 1:
+        b = stack.pop()
+        if b == 0:
+            stack.pop()
+            return _runtime_error(vm, "Division by zero", ip)
+        a = stack[-1]
+        stack[-1] = a / b
+        if state is not None:
+            _observe(vm, _op_div_checked, state, a, b, ip)
+    return ip
+
+
+def _op_compare_checked(vm, compare, ip):
+    stack = vm.stack
+    if len(stack) > 1:
+        b = stack.pop()
+        stack[-1] = 1 if compare(stack[-1], b) else 0
+    return ip
+
+
+def _op_jump_if_false_checked(vm, target, ip):
+    stack = vm.stack
+    if stack and stack.pop() == 0:
+        return target
+    return ip
+
+
+def _op_print_checked(vm, operand, ip):
+    stack = vm.stack
+    if stack:
+        vm.output.write(f"{stack.pop()}\n")
+    return ip
+
+
+def _op_pop_checked(vm, operand, ip):
+    stack = vm.stack
+    if stack:
+        stack.pop()
+    return ip
+
+
+def _op_store_fast_checked(vm, slot, ip):
+    stack = vm.stack
+    if stack:
+        vm.slots[slot] = stack.pop()
+    return ip
+
+
+def _op_end(vm, operand, ip):
+    """Sentinel after the last instruction: the program ran off the end"""
+    vm.instruction_pointer = ip - 1
+    vm._terminate(TerminationReason.END)
+    return _STOP
+
+
+# Checkpoints of a VM with ExecutionLimits. vm._segment is the index where
+# the current forward run of instructions started; a checkpoint charges
+# the run up to it and checks the limits. A limit stops the program where
+# it can resume: at a jump's target, or at the CALL, RETURN or PRINT that
+# has not run yet.
+
+def _op_backward_jump(vm, operand, ip):
+    """A jump to an earlier instruction, typically a loop's; operand is the decoded jump"""
+    handler, operand = operand
+    target = handler(vm, operand, ip)
+    if 0 <= target < ip:
+        reason = vm._checkpoint(ip)
+        vm._segment = target
+        if reason is not None:
+            return _stop(vm, target, reason, vm._limit_message(reason))
+    return target
+
+
+def _op_call_limited(vm, code, ip):
+    # The callee's own values go on top of the stack without its arguments
+    reason = vm._checkpoint(ip, (code.stacksize or 0) - len(code.params),
+                            len(code.varnames))
+    if reason is not None:
+        vm._segment = ip - 1
+        return _stop(vm, ip - 1, reason, vm._limit_message(reason))
+    vm._segment = ip
+    depth = len(vm.frames)
+    result = _op_call(vm, code, ip)
+    if len(vm.frames) > depth:
+        vm._frame_entries += len(code.varnames)
+        vm._segment = 0
+    return result
+
+
+def _op_return_limited(vm, operand, ip):
+    reason = vm._checkpoint(ip)
+    if reason is not None:
+        vm._segment = ip - 1
+        return _stop(vm, ip - 1, reason, vm._limit_message(reason))
+    vm._segment = ip
+    depth = len(vm.frames)
+    code = vm.frames[-1].code
+    result = _op_return(vm, operand, ip)
+    if len(vm.frames) < depth:
+        vm._frame_entries -= len(code.varnames)
+        vm._segment = vm.instruction_pointer
+    return result
+
+
+def _op_print_limited(vm, operand, ip):
+    stack = vm.stack
+    if stack:
+        text = f"{stack[-1]}\n"
+        size = len(text.encode())
+        limit = vm.limits.max_output_bytes
+        if limit is not None and vm.output_bytes + size > limit:
+            reason = TerminationReason.OUTPUT_LIMIT
+            return _stop(vm, ip - 1, reason, vm._limit_message(reason))
+        vm.output_bytes += size
+        stack.pop()
+        vm.output.write(text)
+    return ip
+
+
+_HANDLERS_BY_OPCODE = {
+    OpCode.LOAD_CONST: _op_load_const,
+    OpCode.LOAD_VAR: _op_load_var,
+    OpCode.STORE_VAR: _op_store_var,
+    OpCode.BINARY_ADD: _op_add,
+    OpCode.BINARY_SUB: _op_sub,
+    OpCode.BINARY_MUL: _op_mul,
+    OpCode.BINARY_DIV: _op_div,
+    OpCode.BINARY_CMP: _op_compare,
+    OpCode.JUMP_IF_FALSE: _op_jump_if_false,
+    OpCode.JUMP: _op_jump,
+    OpCode.CALL: _op_call,
+    OpCode.RETURN: _op_return,
+    OpCode.PRINT: _op_print,
+    OpCode.POP: _op_pop,
+    OpCode.DUP: _op_dup,
+    OpCode.LOAD_FAST: _op_load_fast,
+    OpCode.STORE_FAST: _op_store_fast,
+    OpCode.INC_FAST: _op_inc_fast,
+    OpCode.LOAD_FAST_LOAD_FAST: _op_load_fast_load_fast,
+    OpCode.COMPARE_JUMP_IF_FALSE: _op_compare_jump_if_false,
+    OpCode.COMPARE_FAST_CONST_JUMP_IF_FALSE: _op_compare_fast_const_jump_if_false,
+    OpCode.BINARY_ADD_INT: _op_add_numbers,
+    OpCode.BINARY_SUB_INT: _op_sub_numbers,
+    OpCode.BINARY_MUL_INT: _op_mul_numbers,
+    OpCode.BINARY_ADD_FLOAT: _op_add_numbers,
+    OpCode.BINARY_SUB_FLOAT: _op_sub_numbers,
+    OpCode.BINARY_MUL_FLOAT: _op_mul_numbers,
+    OpCode.BINARY_DIV_FLOAT: _op_div_numbers,
+}
+# Handler of each opcode, indexed by OPCODE_INDEX
+HANDLERS = tuple(_HANDLERS_BY_OPCODE[opcode] for opcode in OpCode)
+
+_CHECKED_BY_OPCODE = {
+    OpCode.STORE_VAR: _op_store_var_checked,
+    OpCode.BINARY_ADD: _op_add_checked,
+    OpCode.BINARY_SUB: _op_sub_checked,
+    OpCode.BINARY_MUL: _op_mul_checked,
+    OpCode.BINARY_DIV: _op_div_checked,
+    OpCode.BINARY_CMP: _op_compare_checked,
+    OpCode.JUMP_IF_FALSE: _op_jump_if_false_checked,
+    OpCode.PRINT: _op_print_checked,
+    OpCode.POP: _op_pop_checked,
+    OpCode.STORE_FAST: _op_store_fast_checked,
+}
+# Handlers for instruction lists that fail verification, same indices
+CHECKED_HANDLERS = tuple(_CHECKED_BY_OPCODE.get(opcode, handler)
+                         for opcode, handler in zip(OpCode, HANDLERS))
+
+_QUICKENED.update({
+    _op_add_checked: _QUICKENED[_op_add],
+    _op_sub_checked: _QUICKENED[_op_sub],
+    _op_mul_checked: _QUICKENED[_op_mul],
+    _op_div_checked: _QUICKENED[_op_div],
+})
+
+_BINARY_CMP = OpCode.BINARY_CMP
+_GENERIC_ARITHMETIC = frozenset((OpCode.BINARY_ADD, OpCode.BINARY_SUB,
+                                 OpCode.BINARY_MUL, OpCode.BINARY_DIV))
+_COMPARE_JUMP_IF_FALSE = OpCode.COMPARE_JUMP_IF_FALSE
+_COMPARE_FAST_CONST_JUMP_IF_FALSE = OpCode.COMPARE_FAST_CONST_JUMP_IF_FALSE
+
+
+_LIMITED_HANDLERS = {
+    OpCode.CALL: _op_call_limited,
+    OpCode.RETURN: _op_return_limited,
+    OpCode.PRINT: _op_print_limited,
+}
+
+
+def decode_instructions(instructions, limited=False):
+    """(handler, operand) pairs run() executes for instructions, plus the end sentinel.
+
+    limited=True adds the checkpoints of a VM with ExecutionLimits.
+    """
+    handlers = HANDLERS if verifies(instructions) else CHECKED_HANDLERS
+    end = len(instructions)
+    decoded = []
+    for index, instr in enumerate(instructions):
+        opcode = instr.opcode
+        operand = instr.operand
+        if opcode in JUMP_OPCODES:
+            operand = min(operand, end)
+        elif opcode in _GENERIC_ARITHMETIC:
+            operand = (QUICKEN_WARMUP, None)
+        elif opcode is _BINARY_CMP:
+            operand = COMPARISON_OPERATORS.get(operand, operator.gt)
+        elif opcode is _COMPARE_JUMP_IF_FALSE:
+            op, target = operand
+            operand = (COMPARISON_OPERATORS[op], min(target, end))
+        elif opcode is _COMPARE_FAST_CONST_JUMP_IF_FALSE:
+            slot, op, constant, target = operand
+            operand = (slot, COMPARISON_OPERATORS[op], constant, min(target, end))
+        handler = handlers[OPCODE_INDEX[opcode]]
+        if limited:
+            target = jump_target(instr)
+            if target is not None and target <= index:
+                handler, operand = _op_backward_jump, (handler, operand)
+            elif opcode in _LIMITED_HANDLERS:
+                handler = _LIMITED_HANDLERS[opcode]
+        decoded.append((handler, operand))
+    decoded.append((_op_end, None))
+    return decoded
+
+
+class Frame:
+    """Activation record of a call.
+
+    Frames are recycled through VirtualMachine's pool. Each keeps its slot
+    list (reset from the code object's blank slots on every call) and its
+    locals dict for name-based variables (cleared on return), so a call
+    does not allocate.
+    """
+    __slots__ = ('code', 'instructions', 'slots', 'locals', 'return_ip')
+
+    def __init__(self):
+        self.code = None
+        self.instructions = None
+        self.slots = []
+        self.locals = {}
+        self.return_ip = 0
+
+    def bind_slots(self, code):
+        """Size the slot list for code and mark every slot unassigned"""
+        slots = self.slots
+        blank = code.blank_slots
+        if len(slots) < len(blank):
+            slots.extend(blank[len(slots):])
+        slots[:len(blank)] = blank
+        return slots
+
+
+class VariableView(Mapping):
+    """Read-only name -> value view of a VirtualMachine's variables.
+
+    Combines the globals (name-based variables) with the assigned slots of
+    the base frame, so vm.memory still shows the entry function's variables
+    although they live in slots. Compiler temporaries are left out.
+    """
+
+    def __init__(self, vm):
+        self._vm = vm
+
+    def _variables(self):
+        vm = self._vm
+        base = vm.frames[0] if vm.frames else None
+        return _named_variables(vm._globals, base.code if base is not None else None,
+                                base.slots if base is not None else ())
+
+    def __getitem__(self, name):
+        return self._variables()[name]
+
+    def __iter__(self):
+        return iter(self._variables())
+
+    def __len__(self):
+        return len(self._variables())
+
+    def __repr__(self):
+        return repr(self._variables())
+
+
+def _named_variables(globals_, code, slots):
+    """Globals plus the assigned, non-temporary slots of code, by name"""
+    variables = dict(globals_)
+    if code is not None:
+        for name, value in zip(code.varnames, slots):
+            if value is not UNSET and not name.startswith(TEMPORARY_PREFIX):
+                variables[name] = value
+    return variables
+
+
+class Snapshot:
+    """State of a VirtualMachine at one point, taken by VirtualMachine.snapshot().
+
+    `frames` holds a (code, instructions, slots, locals, return_ip) tuple
+    per active call, base frame first, and the stack and slots are tuples.
+    The globals and locals dicts are shared with the VM the snapshot was
+    taken from and with every VM restored from it, which copy them before
+    writing (copy-on-write), so a snapshot costs the stack and slots only.
+    A snapshot is never changed and can be restored any number of times.
+    """
+    __slots__ = ('instructions', 'instruction_pointer', 'stack', 'globals', 'frames', 'running',
+                 'termination', 'instructions_run', 'time_used', 'output_bytes', 'segment',
+                 'frame_entries')
+
+    def __init__(self, instructions, instruction_pointer, stack, globals_, frames, running,
+                 termination, instructions_run, time_used, output_bytes, segment, frame_entries):
+        self.instructions = instructions
+        self.instruction_pointer = instruction_pointer
+        self.stack = stack
+        self.globals = globals_
+        self.frames = frames
+        self.running = running
+        self.termination = termination
+        self.instructions_run = instructions_run
+        self.time_used = time_used
+        self.output_bytes = output_bytes
+        self.segment = segment
+        self.frame_entries = frame_entries
+
+    @property
+    def memory(self):
+        """Globals plus the entry function's variables, by name, as vm.memory showed them"""
+        if not self.frames:
+            return _named_variables(self.globals, None, ())
+        code, _, slots, _, _ = self.frames[0]
+        return _named_variables(self.globals, code, slots)
+
+    def __repr__(self):
+        return (f"Snapshot(ip={self.instruction_pointer}, depth={len(self.frames)}, "
+                f"stack={list(self.stack)!r})")
+
+
+# Virtual Machine/Interpreter
+class VirtualMachine:
+    """Runs CodeObjects.
+
+    With `limits` (ExecutionLimits) the program is stopped when it goes
+    over one of them. After run(), `termination` says why it stopped and,
+    with limits, `instructions_run`, `time_used` and `output_bytes` how much
+    it used since it was loaded. With a `profiler` (profiler.Profiler), run()
+    goes through the profiler's own dispatch loop instead of _execute().
+
+    PRINT writes to `output`, an OutputSink (StdoutSink by default). A
+    runtime error is written there too as "Runtime Error: ...", or, with
+    `raise_errors`, raised by run() as a VMRuntimeError once the VM has
+    stopped.
+
+    snapshot() records the VM's state (instruction pointer, stack, call
+    frames, memory and usage counters) in a Snapshot; restore() puts a
+    snapshot back and fork() makes a new VM that continues from one, so
+    a long prefix runs once and its state is reused. Memory dicts are
+    shared copy-on-write: a VM copies them the first time it runs, or its
+    globals are accessed, after a snapshot or restore.
+    """
+
+    def __init__(self, max_call_depth=MAX_CALL_DEPTH, limits=None, profiler=None, output=None,
+                 raise_errors=False):
+        self.stack = []
+        self._globals = {}
+        # Whether the globals and locals dicts are shared with a Snapshot
+        self._shared = False
+        self.instruction_pointer = 0
+        self.instructions = []
+        self.running = False
+        self.max_call_depth = max_call_depth
+        self.frames = []
+        self.locals = self._globals
+        self.slots = []
+        self._frame_pool = [Frame() for _ in range(min(FRAME_POOL_SIZE, max_call_depth))]
+        # id(instruction list) -> (list, decoded list)
+        self._decoded = {}
+        self.limits = limits
+        self.profiler = profiler
+        self.output = output if output is not None else StdoutSink()
+        self.raise_errors = raise_errors
+        self._error = None
+        self.termination = None
+        self.instructions_run = 0
+        self.time_used = 0.0
+        self.output_bytes = 0
+        self._segment = 0
+        self._frame_entries = 0
+        self._deadline = None
+        self._next_clock = 0
+
+    @property
+    def globals(self):
+        """Name-based variables of the base frame; copied first if a Snapshot shares them"""
+        if self._shared:
+            self._own()
+        return self._globals
+
+    @globals.setter
+    def globals(self, variables):
+        self._globals = variables
+
+    @property
+    def memory(self):
+        """Globals plus the entry function's variables, by name"""
+        return VariableView(self)
+
+    def snapshot(self):
+        """Snapshot of the current state; see Snapshot"""
+        self._shared = True
+        frames = tuple((frame.code, frame.instructions, tuple(frame.slots), frame.locals,
+                        frame.return_ip) for frame in self.frames)
+        return Snapshot(self.instructions, self.instruction_pointer, tuple(self.stack),
+                        self._globals, frames, self.running, self.termination,
+                        self.instructions_run, self.time_used, self.output_bytes,
+                        self._segment, self._frame_entries)
+
+    def restore(self, snapshot):
+        """Return to the state recorded in snapshot (which stays as it is)"""
+        self._release_frames()
+        self._globals = snapshot.globals
+        self._shared = True
+        for code, instructions, slots, variables, return_ip in snapshot.frames:
+            frame = self._acquire_frame()
+            frame.code = code
+            frame.instructions = instructions
+            frame.slots[:] = slots
+            frame.locals = variables
+            frame.return_ip = return_ip
+            self.frames.append(frame)
+        if self.frames:
+            self.locals = self.frames[-1].locals
+            self.slots = self.frames[-1].slots
+        self.stack = list(snapshot.stack)
+        self.instructions = snapshot.instructions
+        self.instruction_pointer = snapshot.instruction_pointer
+        self._decoded = {}
+        self.running = snapshot.running
+        self.termination = snapshot.termination
+        self.instructions_run = snapshot.instructions_run
+        self.time_used = snapshot.time_used
+        self.output_bytes = snapshot.output_bytes
+        self._segment = snapshot.segment
+        self._frame_entries = snapshot.frame_entries
+
+    def fork(self, snapshot=None, **options):
+        """New VirtualMachine continuing from snapshot (by default, the current state).
+
+        The child has the same max_call_depth, limits, profiler, output and
+        raise_errors unless options (VirtualMachine arguments) say otherwise;
+        the two run independently afterwards.
+        """
+        settings = {'max_call_depth': self.max_call_depth, 'limits': self.limits,
+                    'profiler': self.profiler, 'output': self.output,
+                    'raise_errors': self.raise_errors}
+        settings.update(options)
+        child = VirtualMachine(**settings)
+        child.restore(snapshot if snapshot is not None else self.snapshot())
+        return child
+
+    def _own(self):
+        """Copy the globals and locals dicts a Snapshot shares with this VM"""
+        self._shared = False
+        shared = self._globals
+        self._globals = dict(shared)
+        for frame in self.frames:
+            frame.locals = self._globals if frame.locals is shared else dict(frame.locals)
+        self.locals = self.frames[-1].locals if self.frames else self._globals
     
-    def _handle_control_flow_ops(self, instr):
-        """Handle control flow operations"""
-        if instr.opcode == OpCode.JUMP_IF_FALSE:
-            if self.stack and self.stack.pop() == 0:
-                self.instruction_pointer = instr.operand
-                return True
-        elif instr.opcode == OpCode.JUMP:
-            self.instruction_pointer = instr.operand
-            return True
-        return False
+    def load_instructions(self, instructions):
+        """Load bytecode instructions.
+
+        instructions is either a list of Instructions or a CodeObject (as
+        returned by CodeGenerator.generate()), whose slots the base frame gets.
+        """
+        code = instructions if isinstance(instructions, CodeObject) else None
+        if code is not None:
+            instructions = code.instructions
+        self.instructions = instructions
+        self.instruction_pointer = 0
+        self._decoded = {}
+        self._release_frames()
+        self.termination = None
+        self.instructions_run = 0
+        self.time_used = 0.0
+        self.output_bytes = 0
+        self._segment = 0
+        self._frame_entries = len(code.varnames) if code is not None else 0
+
+        # The loaded code runs in the base frame, whose locals are the globals
+        base = self._acquire_frame()
+        base.code = code
+        base.instructions = instructions
+        base.locals = self.globals
+        self.slots = base.bind_slots(code) if code is not None else base.slots
+        self.frames.append(base)
+        self.locals = self.globals
     
-    def _handle_other_ops(self, instr):
-        """Handle other operations"""
-        if instr.opcode == OpCode.PRINT:
-            if self.stack:
-                value = self.stack.pop()
-                print(value)
-        elif instr.opcode == OpCode.RETURN:
+    def run(self):
+        """Execute instructions until the program returns, fails or runs off the end.
+
+        Each instruction list is decoded once per run (see HANDLERS); the
+        current ip is kept in a local and only written back to
+        instruction_pointer on calls, returns and when the run stops.
+        Sets `termination`; with `limits`, the program may also stop at a
+        checkpoint and be resumed by another run() with larger limits.
+        """
+        try:
+            self._run()
+        finally:
+            self.output.flush()
+        self._raise_error()
+
+    def _run(self):
+        if not self.frames:
+            self.load_instructions(self.instructions)
+        if self._shared:
+            self._own()
+        self.running = True
+        self.termination = None
+        self._decoded = {}
+        ip = self.instruction_pointer
+        if ip >= len(self.instructions):
+            self._terminate(TerminationReason.END)
+            return
+        execute = self._execute if self.profiler is None else self._execute_profiled
+        if self.limits is None:
+            execute(ip)
+            return
+
+        # The decoded checkpoints enforce the limits
+        started = time.perf_counter()
+        max_time = self.limits.max_time
+        self._deadline = started + max_time - self.time_used if max_time is not None else None
+        self._next_clock = self.instructions_run
+        self._segment = ip
+        try:
+            execute(ip)
+        finally:
+            # The forward run the program stopped in
+            self.instructions_run += max(0, self.instruction_pointer - self._segment)
+            self._segment = self.instruction_pointer
+            self.time_used += time.perf_counter() - started
+            self._deadline = None
+
+    def _execute(self, ip):
+        code = self._decode(self.instructions)
+        while True:
+            while ip >= 0:
+                handler, operand = code[ip]
+                ip = handler(self, operand, ip + 1)
+            if ip == _STOP:
+                return
+            code = self._decode(self.instructions)
+            ip = self.instruction_pointer
+
+    def _execute_profiled(self, ip):
+        self.profiler.execute(self, ip)
+
+    def _checkpoint(self, ip, stack_growth=0, new_entries=0):
+        """Charge the instructions run up to ip; the TerminationReason of a limit exceeded or None"""
+        limits = self.limits
+        self.instructions_run += ip - self._segment
+        if limits.max_instructions is not None and self.instructions_run > limits.max_instructions:
+            return TerminationReason.INSTRUCTION_LIMIT
+        if self._deadline is not None and self.instructions_run >= self._next_clock:
+            self._next_clock = self.instructions_run + CLOCK_CHECK_INTERVAL
+            if time.perf_counter() > self._deadline:
+                return TerminationReason.TIME_LIMIT
+        if (limits.max_stack_depth is not None
+                and len(self.stack) + stack_growth > limits.max_stack_depth):
+            return TerminationReason.STACK_LIMIT
+        if (limits.max_memory_entries is not None
+                and len(self._globals) + self._frame_entries + new_entries
+                > limits.max_memory_entries):
+            return TerminationReason.MEMORY_LIMIT
+        return None
+
+    def _limit_message(self, reason):
+        return f"{reason.value} of {getattr(self.limits, reason.value)} exceeded"
+
+    def _report_error(self):
+        """Write the runtime error in termination to the output, or keep it for _raise_error()"""
+        termination = self.termination
+        if not self.raise_errors:
+            self.output.write(f"Runtime Error: {termination.message}\n")
+            return
+        ip = termination.instruction_pointer
+        line = self.instructions[ip - 1].line if 0 < ip <= len(self.instructions) else 0
+        self._error = VMRuntimeError(termination.message, termination.function, line, termination)
+
+    def _raise_error(self):
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _terminate(self, reason, message=None):
+        """Record in self.termination why execution stopped"""
+        code = self.frames[-1].code if self.frames else None
+        self.termination = Termination(reason, message, code.name if code is not None else None,
+                                       self.instruction_pointer)
+
+    def execute_instruction(self):
+        """Execute the instruction at instruction_pointer (one step of run())"""
+        if self._shared:
+            self._own()
+        ip = self.instruction_pointer
+        handler, operand = self._decode(self.instructions)[ip]
+        try:
+            ip = handler(self, operand, ip + 1)
+        finally:
+            self.output.flush()
+        if ip >= 0:
+            self.instruction_pointer = ip
+        self._raise_error()
+
+    def _decode(self, instructions):
+        """Decoded form of instructions, cached until the next run() or load"""
+        entry = self._decoded.get(id(instructions))
+        if entry is None or entry[0] is not instructions:
+            entry = self._decoded[id(instructions)] = (
+                instructions, decode_instructions(instructions, self.limits is not None))
+        return entry[1]
+
+    def _call(self, code):
+        """Push a frame for code, binding its parameters from the stack"""
+        if len(self.frames) >= self.max_call_depth:
+            self.running = False
+            self._terminate(TerminationReason.ERROR, f"Stack overflow calling '{code.name}'")
+            self._report_error()
+            return
+
+        frame = self._acquire_frame()
+        frame.code = code
+        frame.instructions = code.instructions
+        frame.return_ip = self.instruction_pointer
+
+        # Arguments were pushed in parameter order into the first slots
+        slots = frame.bind_slots(code)
+        count = len(code.params)
+        if count:
+            stack = self.stack
+            slots[:count] = stack[-count:]
+            del stack[-count:]
+
+        self.frames.append(frame)
+        self.locals = frame.locals
+        self.slots = slots
+        self.instructions = code.instructions
+        self.instruction_pointer = 0
+
+    def _return(self):
+        """Pop the current frame, leaving the return value on the stack.
+
+        Returning from the base frame ends the program.
+        """
+        if len(self.frames) <= 1:
             self.running = False
+            self._terminate(TerminationReason.RETURNED)
+            return
+
+        frame = self.frames.pop()
+        caller = self.frames[-1]
+        self.locals = caller.locals
+        self.slots = caller.slots
+        self.instructions = caller.instructions
+        self.instruction_pointer = frame.return_ip
+
+        frame.locals.clear()
+        frame.code = frame.instructions = None
+        self._frame_pool.append(frame)
+
+    def _acquire_frame(self):
+        if self._frame_pool:
+            return self._frame_pool.pop()
+        return Frame()
+
+    def _release_frames(self):
+        """Return every active frame to the pool"""
+        while self.frames:
+            frame = self.frames.pop()
+            if frame.locals is self._globals or self._shared:
+                frame.locals = {}
+            else:
+                frame.locals.clear()
+            frame.code = frame.instructions = None
+            self._frame_pool.append(frame)
+        self.locals = self._globals
+        self.slots = []
     
     def print_state(self):
         """Debug: Print VM state"""
         print(f"IP: {self.instruction_pointer}")
         print(f"Stack: {self.stack}")
         print(f"Memory: {self.memory}")
+        if self.termination is not None and self.termination.limit_exceeded:
+            print(f"Stopped: {self.termination.message}")
+        if len(self.frames) > 1:
+            frame = self.frames[-1]
+            local_vars = {name: value for name, value in zip(frame.code.varnames, frame.slots)
+                          if value is not UNSET and not name.startswith(TEMPORARY_PREFIX)}
+            local_vars.update(frame.locals)
+            print(f"Call depth: {len(self.frames) - 1} ({frame.code.name})")
+            print(f"Locals: {local_vars}")
 
 
 # Code Generator
-class CodeGenerator:
+class CodeGenerator(ASTVisitor):
+    BINARY_OPCODES = {
+        '+': OpCode.BINARY_ADD,
+        '-': OpCode.BINARY_SUB,
+        '*': OpCode.BINARY_MUL,
+        '/': OpCode.BINARY_DIV,
+    }
+
     def __init__(self):
         self.instructions = []
         self.label_counter = 0
+        self.functions = {}
+        self.errors = []
+        self._declared = {}
+        self._labels = []
+        self._slots = None
     
     def generate(self, ast):
-        """Generate bytecode from AST"""
-        self.instructions = []
+        """Generate bytecode from AST.
+
+        Each function is compiled into its own CodeObject (self.functions, by
+        name). The entry function -- main, or the first function if there is
+        no main -- is returned for load_instructions(); it can be indexed and
+        iterated like its instruction list.
+        """
+        self._reset()
         self.generate_node(ast)
-        return self.instructions
+        if self._labels:
+            # Control flow generated outside any function
+            self.assemble(self.instructions)
+        entry = self._entry()
+        self.compute_stacksizes([*self.functions.values(), entry])
+        return entry
+
+    @staticmethod
+    def compute_stacksizes(codes):
+        """Set the stacksize of each CodeObject in codes.
+
+        One whose instructions do not verify (only possible after errors)
+        keeps stacksize None and runs with the checked handlers.
+        """
+        for code in codes:
+            try:
+                code.compute_stacksize()
+            except VerifyError:
+                code.stacksize = None
+
+    def _reset(self):
+        self.instructions = []
+        self.label_counter = 0
+        self.functions = {}
+        self.errors = []
+        self._declared = {}
+        self._labels = []
+        self._slots = None
+
+    def _entry(self):
+        """The entry CodeObject once every function has its instructions"""
+        entry = self.functions.get('main') or next(iter(self.functions.values()), None)
+        if entry is None:
+            # Code outside any function only uses name-based variables
+            return CodeObject('<program>', instructions=self.instructions)
+        self.instructions = entry.instructions
+        return entry
     
     def generate_node(self, node):
         """Generate bytecode for AST node"""
-        if node.type == NodeType.PROGRAM:
-            for child in node.children:
-                self.generate_node(child)
-        elif node.type == NodeType.FUNCTION:
-            # Generate function body (skip return type for now)
-            for child in node.children[1:]:  # Skip return type
-                self.generate_node(child)
-        elif node.type == NodeType.DECLARATION:
-            if len(node.children) > 1:  # Has initialization
-                # Generate expression first
-                self.generate_node(node.children[1])  
-                # Store result in variable
-                self.instructions.append(Instruction(OpCode.STORE_VAR, node.children[0].value))
-        elif node.type == NodeType.ASSIGNMENT:
-            # Generate expression
-            self.generate_node(node.children[1])  
+        self.visit(node)
+
+    def error(self, message, node):
+        self.errors.append({
+            'message': message,
+            'line': node.line,
+            'column': node.column
+        })
+
+    def generic_visit(self, node):
+        """Nodes without a visit_ method generate no code"""
+        return None
+
+    def visit_program(self, node):
+        # Declare every function first so calls may refer to later definitions
+        for child in node.children:
+            if child.type == NodeType.FUNCTION:
+                self._declare_function(child)
+        for child in node.children:
+            yield child
+
+    def _declare_function(self, node):
+        """Create the CodeObject for a FUNCTION node, or None if it is a redefinition"""
+        if node.value in self.functions:
+            self.error(f"Function '{node.value}' already defined", node)
+            return None
+        params = [child.children[0].value for child in node.children
+                  if child.type == NodeType.PARAMETER]
+        code = CodeObject(node.value, params, line=node.line)
+        self.functions[node.value] = code
+        self._declared[id(node)] = code
+        return code
+
+    def visit_function(self, node):
+        if id(node) in self._declared:
+            code = self._declared.pop(id(node))
+        elif node.value in self.functions:
+            return  # redefinition, already reported
+        else:
+            code = self._declare_function(node)
+
+        self._begin_code(code)
+        # Skip return type and parameters
+        body = [child for child in node.children[1:] if child.type != NodeType.PARAMETER]
+        self._slots = self._allocate_slots(code.params, body)
+        code.varnames = list(self._slots)
+        yield from self._statements(body)
+        self._slots = None
+
+        # Falling off the end of a function returns 0
+        if not body or body[-1].type != NodeType.RETURN_STATEMENT:
+            self.instructions.append(Instruction(OpCode.LOAD_CONST, 0, node.line))
+            self.instructions.append(Instruction(OpCode.RETURN, line=node.line))
+
+        self._end_code(code)
+
+    def _begin_code(self, code):
+        """Direct the instructions emitted from now on to code"""
+        self.instructions = code.instructions
+
+    def _end_code(self, code):
+        """Called once the whole body of code has been emitted"""
+        self.assemble(code.instructions)
+
+    @staticmethod
+    def _allocate_slots(params, body):
+        """name -> slot for every parameter and variable assigned in body.
+
+        Any other name a function reads is a global and stays name-based.
+        """
+        slots = {name: index for index, name in enumerate(params)}
+        for statement in body:
+            for node, _ in walk(statement):
+                if node.type in (NodeType.DECLARATION, NodeType.ASSIGNMENT) and node.children:
+                    slots.setdefault(node.children[0].value, len(slots))
+        return slots
+
+    def _store(self, name, line=0):
+        slot = self._slots.get(name) if self._slots is not None else None
+        if slot is None:
+            self.instructions.append(Instruction(OpCode.STORE_VAR, name, line))
+        else:
+            self.instructions.append(Instruction(OpCode.STORE_FAST, slot, line))
+
+    def _statements(self, statements):
+        """Yield statements in order, discarding the value of call statements"""
+        for statement in statements:
+            yield statement
+            if statement.type == NodeType.FUNCTION_CALL:
+                self.instructions.append(Instruction(OpCode.POP, line=statement.line))
+
+    def visit_function_call(self, node):
+        code = self.functions.get(node.value)
+        if code is None:
+            self.error(f"Undefined function '{node.value}'", node)
+        elif len(node.children) != len(code.params):
+            self.error(f"Function '{node.value}' expects {len(code.params)} "
+                       f"arguments, got {len(node.children)}", node)
+            code = None
+        if code is None:
+            # Keep the stack balanced for the enclosing expression
+            self.instructions.append(Instruction(OpCode.LOAD_CONST, 0, node.line))
+            return
+
+        # Arguments are pushed left to right
+        for argument in node.children:
+            yield argument
+        self.instructions.append(Instruction(OpCode.CALL, code, node.line))
+
+    def visit_declaration(self, node):
+        if len(node.children) > 1:  # Has initialization
+            # Generate expression first
+            yield node.children[1]
             # Store result in variable
-            self.instructions.append(Instruction(OpCode.STORE_VAR, node.children[0].value))
-        elif node.type == NodeType.BINARY_EXPRESSION:
-            # Generate left operand
-            self.generate_node(node.children[0])
-            # Generate right operand  
-            self.generate_node(node.children[1])
-            
-            # Apply operation
-            if node.value == '+':
-                self.instructions.append(Instruction(OpCode.BINARY_ADD))
-            elif node.value == '-':
-                self.instructions.append(Instruction(OpCode.BINARY_SUB))
-            elif node.value == '*':
-                self.instructions.append(Instruction(OpCode.BINARY_MUL))
-            elif node.value == '/':
-                self.instructions.append(Instruction(OpCode.BINARY_DIV))
-            elif node.value in ['>', '<', '>=', '<=', '==', '!=']:
-                self.instructions.append(Instruction(OpCode.BINARY_CMP, node.value))
-        elif node.type == NodeType.LITERAL:
-            # Load constant onto stack
-            self.instructions.append(Instruction(OpCode.LOAD_CONST, node.value))
-        elif node.type == NodeType.IDENTIFIER:
-            # Load variable onto stack
-            self.instructions.append(Instruction(OpCode.LOAD_VAR, node.value))
-        elif node.type == NodeType.IF_STATEMENT:
-            # Generate condition
-            self.generate_node(node.children[0])
-            
-            # Jump if false
-            false_label = self.new_label()
-            self.instructions.append(Instruction(OpCode.JUMP_IF_FALSE, false_label))
-            
-            # Generate if body
-            for child in node.children[1:]:
-                self.generate_node(child)
-            
-            # Set label for after if
-            self.set_label(false_label)
-        elif node.type == NodeType.WHILE_STATEMENT:
-            start_label = self.new_label()
-            self.set_label(start_label)
-            
-            # Generate condition
-            self.generate_node(node.children[0])
-            
-            # Jump if false (exit loop)
-            end_label = self.new_label()
-            self.instructions.append(Instruction(OpCode.JUMP_IF_FALSE, end_label))
-            
-            # Generate while body
-            for child in node.children[1:]:
-                self.generate_node(child)
-            
-            # Jump back to start
-            self.instructions.append(Instruction(OpCode.JUMP, start_label))
-            
-            # Set end label
-            self.set_label(end_label)
-        elif node.type == NodeType.RETURN_STATEMENT:
-            if node.children:
-                # Generate return expression
-                self.generate_node(node.children[0])
-            else:
-                # Return 0 by default
-                self.instructions.append(Instruction(OpCode.LOAD_CONST, 0))
-            self.instructions.append(Instruction(OpCode.RETURN))
+            self._store(node.children[0].value, node.line)
+
+    def visit_assignment(self, node):
+        # Generate expression
+        yield node.children[1]
+        # Store result in variable
+        self._store(node.children[0].value, node.line)
+
+    def visit_binary_expression(self, node):
+        # Generate left and right operands
+        yield node.children[0]
+        yield node.children[1]
+
+        # Apply operation
+        opcode = self.BINARY_OPCODES.get(node.value)
+        if opcode is not None:
+            self.instructions.append(Instruction(opcode, line=node.line))
+        elif node.value in ['>', '<', '>=', '<=', '==', '!=']:
+            self.instructions.append(Instruction(OpCode.BINARY_CMP, node.value, node.line))
+
+    def visit_literal(self, node):
+        # Load constant onto stack
+        self.instructions.append(Instruction(OpCode.LOAD_CONST, node.value, node.line))
+
+    def visit_identifier(self, node):
+        # Load variable onto stack: locals by slot, globals by name
+        slot = self._slots.get(node.value) if self._slots is not None else None
+        if slot is None:
+            self.instructions.append(Instruction(OpCode.LOAD_VAR, node.value, node.line))
+        else:
+            self.instructions.append(Instruction(OpCode.LOAD_FAST, slot, node.line))
+
+    def visit_if_statement(self, node):
+        # Generate condition
+        yield node.children[0]
+
+        # Jump if false
+        false_label = self.new_label()
+        self.emit_jump(OpCode.JUMP_IF_FALSE, false_label, node.line)
+
+        # Generate if body
+        yield from self._statements(node.children[1:])
+
+        # Set label for after if
+        self.set_label(false_label)
+
+    def visit_while_statement(self, node):
+        start_label = self.new_label()
+        self.set_label(start_label)
+
+        # Generate condition
+        yield node.children[0]
+
+        # Jump if false (exit loop)
+        end_label = self.new_label()
+        self.emit_jump(OpCode.JUMP_IF_FALSE, end_label, node.line)
+
+        # Generate while body
+        yield from self._statements(node.children[1:])
+
+        # Jump back to start
+        self.emit_jump(OpCode.JUMP, start_label, node.line)
+
+        # Set end label
+        self.set_label(end_label)
+
+    def visit_return_statement(self, node):
+        if node.children:
+            # Generate return expression
+            yield node.children[0]
+        else:
+            # Return 0 by default
+            self.instructions.append(Instruction(OpCode.LOAD_CONST, 0, node.line))
+        self.instructions.append(Instruction(OpCode.RETURN, line=node.line))
     
     def new_label(self):
         """Create new label"""
-        label = len(self.instructions)
+        self.label_counter += 1
+        label = Label(self.label_counter)
+        self._labels.append(label)
         return label
     
     def set_label(self, label):
         """Set label at current position"""
-        pass  # Labels are just instruction indices in this simple implementation
+        label.position = len(self.instructions)
+
+    def emit_jump(self, opcode, label, line=0):
+        """Append a jump to label, recording it in the label's patch list"""
+        instruction = Instruction(opcode, label, line)
+        label.refs.append(instruction)
+        self.instructions.append(instruction)
+        return instruction
+
+    def assemble(self, instructions):
+        """Resolve the pending labels to indices, then thread jumps.
+
+        Every label created since the last assemble() belongs to
+        `instructions`; they are resolved in one pass once the whole
+        function has been emitted, so forward jumps need no special case.
+        """
+        for label in self._labels:
+            if label.position is None:
+                raise ValueError(f"Label {label!r} was never placed")
+            for instruction in label.refs:
+                instruction.operand = label.position
+        self._labels = []
+        thread_jumps(instructions)
+        return instructions
+
+
+def thread_jumps(instructions):
+    """Retarget jumps that land on an unconditional JUMP to its final target.
+
+    A chain of JUMPs is followed to its end (stopping at cycles), so every
+    taken branch costs a single dispatch. Returns the number of jumps
+    retargeted.
+    """
+    retargeted = 0
+    count = len(instructions)
+    for instruction in instructions:
+        if instruction.opcode not in JUMP_OPCODES:
+            continue
+        target = instruction.operand
+        seen = set()
+        while (target < count and target not in seen and
+               instructions[target].opcode == OpCode.JUMP):
+            seen.add(target)
+            target = instructions[target].operand
+        if target != instruction.operand:
+            instruction.operand = target
+            retargeted += 1
+    return retargeted
 
 
 if __name__ == '__main__':
     import sys
     import os
+
+    # The optional passes import this module as 'main'
+    sys.modules.setdefault('main', sys.modules[__name__])
+    from compiler import Compiler, DEFAULT_OPT_LEVEL, OPT_LEVELS
+    from cache import CompileCache, CompileResult, collect_diagnostics
+    import bytecode
+
+    # -O0, -O1, -O2 select the optimization level; -o FILE.cbc saves the bytecode;
+    # --no-cache compiles without the compilation cache; --max-instructions N
+    # and --max-time SECONDS limit the execution; --profile prints a profile
+    # of the execution
+    opt_level = DEFAULT_OPT_LEVEL
+    output_path = None
+    use_cache = True
+    limits = None
+    profiler = None
+    args = []
+    argv = iter(sys.argv[1:])
+    for arg in argv:
+        if arg.startswith('-O') and arg[2:].isdigit() and int(arg[2:]) in OPT_LEVELS:
+            opt_level = int(arg[2:])
+        elif arg == '-o':
+            output_path = next(argv, None)
+        elif arg == '--no-cache':
+            use_cache = False
+        elif arg == '--profile':
+            from profiler import Profiler
+            profiler = Profiler()
+        elif arg in ('--max-instructions', '--max-time'):
+            value = next(argv, None)
+            try:
+                value = int(value) if arg == '--max-instructions' else float(value)
+            except (TypeError, ValueError):
+                print(f"Error: {arg} needs a number")
+                sys.exit(1)
+            limits = limits or ExecutionLimits()
+            setattr(limits, arg[2:].replace('-', '_'), value)
+        else:
+            args.append(arg)
+
+    if args and args[0].endswith('.cbc'):
+        # Compiled bytecode: run it directly, without lexer, parser or code generator
+        try:
+            entry = bytecode.load(args[0])
+        except (OSError, bytecode.BytecodeFormatError) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"\nRunning bytecode: {args[0]} ({len(entry)} instructions)")
+        vm = VirtualMachine(limits=limits, profiler=profiler)
+        vm.load_instructions(entry)
+        vm.run()
+        print("\nEstado final de la VM:")
+        vm.print_state()
+        if profiler is not None:
+            print("\n" + profiler.report())
+        sys.exit(0)
     
     # Check for command line arguments
-    if len(sys.argv) > 1:
+    if args:
         # Analyze file from command line
-        filename = sys.argv[1]
+        filename = args[0]
         if os.path.exists(filename):
             with open(filename, 'r') as f:
                 source_code = f.read()
@@ -1105,12 +3233,35 @@ int contador_global = 0;
 float valor_global = 0.0f;
 '''
     
+    # An unchanged program compiled before goes straight to the VM
+    cache = CompileCache() if use_cache else None
+    if cache is not None:
+        cache_key = cache.key(source_code, opt_level)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print(f"\nBytecode en caché ({cache_key[:12]}, -O{opt_level})")
+            for stage, line, column, message in cached.diagnostics:
+                print(f"Línea {line}, Columna {column}: {message}")
+            if cached.entry is None:
+                sys.exit(1)
+            if output_path and not cached.diagnostics:
+                size = bytecode.save(output_path, cached.functions, cached.entry)
+                print(f"Bytecode guardado en {output_path} ({size} bytes)")
+            vm = VirtualMachine(limits=limits, profiler=profiler)
+            vm.load_instructions(cached.entry)
+            vm.run()
+            print("\nEstado final de la VM:")
+            vm.print_state()
+            if profiler is not None:
+                print("\n" + profiler.report())
+            sys.exit(0)
+
     # Initialize analyzers
     lexer = LexicalAnalyzer()
     semantic = SemanticAnalyzer()
     parser = Parser([])
     codegen = CodeGenerator()
-    vm = VirtualMachine()
+    vm = VirtualMachine(limits=limits, profiler=profiler)
     
     # Análisis léxico
     print("=" * 60)
@@ -1205,13 +3356,41 @@ float valor_global = 0.0f;
         print("=" * 60)
         
         if not parser.errors:
-            instructions = codegen.generate(ast)
-            print("Generacion de codigo completada")
-            print(f"Total de instrucciones: {len(instructions)}")
+            compiler = Compiler(opt_level)
+            codegen = compiler.codegen
+            instructions = compiler.compile(ast)
+            print(f"Generacion de codigo completada (-O{opt_level})")
+            for pass_name, removed in compiler.report:
+                print(f"  {pass_name}: {removed} instrucciones eliminadas")
+                if pass_name == 'dead_code':
+                    for function_name, count in compiler.eliminated.items():
+                        print(f"    {function_name}: {count}")
+            if compiler.specialized:
+                print(f"  type_specialization: {sum(compiler.specialized.values())} "
+                      f"instrucciones especializadas")
+            total = sum(len(code.instructions) for code in codegen.functions.values())
+            print(f"Total de instrucciones: {total or len(instructions)}")
             
+            for error in codegen.errors:
+                print(f"Línea {error['line']}, Columna {error['column']}: {error['message']}")
+
+            if cache is not None:
+                try:
+                    cache.put(cache_key, CompileResult(
+                        instructions, codegen.functions,
+                        collect_diagnostics(codegen_errors=codegen.errors), compiler.report))
+                except OSError as e:
+                    print(f"Aviso: no se pudo guardar en la caché: {e}")
+            
+            if output_path and not codegen.errors:
+                size = bytecode.save(output_path, codegen.functions, instructions)
+                print(f"Bytecode guardado en {output_path} ({size} bytes)")
+
             print("\nBytecode generado:")
-            for i, instr in enumerate(instructions):
-                print(f"  {i:3d}: {instr}")
+            for code in codegen.functions.values():
+                print(f"  {code.name}({', '.join(code.params)}):  slots {code.varnames}, pila {code.stacksize}")
+                for i, instr in enumerate(code.instructions):
+                    print(f"  {i:3d}: {instr}")
             
             # VIRTUAL MACHINE - Execute
             print("\n" + "=" * 60)
@@ -1223,4 +3402,6 @@ float valor_global = 0.0f;
             vm.run()
             
             print("\nEstado final de la VM:")
-            vm.print_state()
\ No newline at end of file
+            vm.print_state()
+            if profiler is not None:
+                print("\n" + profiler.report())
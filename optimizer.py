@@ -0,0 +1,190 @@
+"""
+AST optimizations run between Parser.parse() and CodeGenerator.generate()
+
+ConstantFolder folds constant subexpressions and propagates the constant
+values of variables through the straight-line code of each function:
+
+    int x = 5;          int x = 5;
+    int y = x + 1;  ->  int y = 6;
+    y = y * (2 + 3);    y = 30;
+
+Folding uses the same operators as the VirtualMachine, so an optimized
+program computes exactly what the unoptimized one would (int / int is a
+float, comparisons produce 1 or 0). Divisions by a constant zero are left
+in place so they still fail at run time.
+
+Propagation keeps every store, so vm.memory is the same when the program
+stops, whether it returns or fails. A store it leaves unread is only
+removed by deadcode.DeadCodeEliminator where no early stop of the entry
+function could show it.
+"""
+
+import operator
+
+from main import ASTNode, ASTTransformer, NodeType, COMPARISON_OPERATORS, walk
+
+ARITHMETIC_OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+}
+
+_LITERAL = NodeType.LITERAL
+_MISSING = object()
+
+
+def is_constant(node):
+    """True for a numeric LITERAL node"""
+    return (node is not None and node.type == _LITERAL and
+            type(node.value) in (int, float))
+
+
+def fold_binary(op, left, right):
+    """Value of `left op right` as the VM computes it, or None if it must not be folded"""
+    function = ARITHMETIC_OPERATORS.get(op)
+    if function is not None:
+        if op == '/' and right == 0:
+            return None  # keep the runtime division-by-zero error
+        return function(left, right)
+    compare = COMPARISON_OPERATORS.get(op)
+    if compare is not None:
+        return 1 if compare(left, right) else 0
+    return None
+
+
+def assigned_names(statements):
+    """Names declared or assigned anywhere in the given statements"""
+    names = set()
+    for statement in statements:
+        for node, _ in walk(statement):
+            if node.type in (NodeType.DECLARATION, NodeType.ASSIGNMENT) and node.children:
+                names.add(node.children[0].value)
+    return names
+
+
+class ConstantFolder(ASTTransformer):
+    """Constant folding and propagation.
+
+    `constants` maps variable names to their known value at the current point
+    of the function being visited. Control flow is handled conservatively:
+    variables assigned inside a loop are unknown in the whole loop and after
+    it, and after an if only the values both paths agree on are kept.
+
+    After optimize(), `folded` counts the folded operations and
+    `instructions_removed` the bytecode instructions they save (each folded
+    operation replaces two LOAD_CONST and a BINARY_* with one LOAD_CONST).
+    """
+
+    def __init__(self):
+        self.constants = {}
+        self.folded = 0
+        self.propagated = 0
+        self.instructions_removed = 0
+
+    def optimize(self, ast):
+        """Optimize ast in place and return it"""
+        self.constants = {}
+        self.folded = 0
+        self.propagated = 0
+        self.instructions_removed = 0
+        return self.visit(ast)
+
+    def visit_function(self, node):
+        outer = self.constants
+        self.constants = {}
+        try:
+            return (yield from self.generic_visit(node))
+        finally:
+            self.constants = outer
+
+    def visit_parameter(self, node):
+        return node
+
+    def visit_declaration(self, node):
+        name = node.children[0].value
+        if len(node.children) > 1:
+            value = yield node.children[1]
+            node.children[1] = value
+            self._bind(name, value)
+        else:
+            self.constants.pop(name, None)
+        return node
+
+    def visit_assignment(self, node):
+        name = node.children[0].value
+        if len(node.children) > 1:
+            value = yield node.children[1]
+            node.children[1] = value
+            self._bind(name, value)
+        else:
+            self.constants.pop(name, None)
+        return node
+
+    def visit_if_statement(self, node):
+        condition = yield node.children[0]
+        before = dict(self.constants)
+        body = yield from self._statements(node.children[1:])
+        node.children = [condition] + body
+
+        if is_constant(condition):
+            if condition.value == 0:
+                self.constants = before  # the body never runs
+        else:
+            after = self.constants
+            self.constants = {name: value for name, value in before.items()
+                              if _same(after.get(name, _MISSING), value)}
+        return node
+
+    def visit_while_statement(self, node):
+        # A variable assigned in the loop may differ on every iteration,
+        # including when the condition is evaluated
+        for name in assigned_names(node.children[1:]):
+            self.constants.pop(name, None)
+        entry = dict(self.constants)
+
+        condition = yield node.children[0]
+        body = yield from self._statements(node.children[1:])
+        node.children = [condition] + body
+
+        self.constants = entry
+        return node
+
+    def visit_identifier(self, node):
+        value = self.constants.get(node.value, _MISSING)
+        if value is _MISSING:
+            return node
+        self.propagated += 1
+        return ASTNode(_LITERAL, value, line=node.line, column=node.column)
+
+    def visit_binary_expression(self, node):
+        left = yield node.children[0]
+        right = yield node.children[1]
+        node.children = [left, right]
+
+        if is_constant(left) and is_constant(right):
+            value = fold_binary(node.value, left.value, right.value)
+            if value is not None:
+                self.folded += 1
+                self.instructions_removed += 2
+                return ASTNode(_LITERAL, value, line=node.line, column=node.column)
+        return node
+
+    def _statements(self, statements):
+        results = []
+        for statement in statements:
+            result = yield statement
+            if result is not None:
+                results.append(result)
+        return results
+
+    def _bind(self, name, value):
+        if is_constant(value):
+            self.constants[name] = value.value
+        else:
+            self.constants.pop(name, None)
+
+
+def _same(a, b):
+    """Equal values of the same type (1 and 1.0 are different constants)"""
+    return type(a) is type(b) and a == b
@@ -0,0 +1,144 @@
+"""
+Peephole optimizer over generated Instruction lists
+
+A window slides over each function's instructions; at every position the
+rules of the rule table whose opcode pattern matches are tried in order and
+the first one that applies replaces the window. Passes repeat until nothing
+changes. Jump operands are instruction indices, so every pass rebuilds an
+old index -> new index map and retargets all jumps through it.
+
+A rule never rewrites a window that a jump enters in the middle: only the
+first instruction of a window may be a jump target.
+"""
+
+from collections import Counter, namedtuple
+
+from main import Instruction, OpCode, JUMP_OPCODES, thread_jumps
+
+# pattern: tuple of opcodes matched against consecutive instructions
+# rewrite(window, index) -> replacement list, or None if the rule does not apply
+PeepholeRule = namedtuple('PeepholeRule', ['name', 'pattern', 'rewrite'])
+
+
+def _store_load(window, index):
+    """STORE x; LOAD x -> DUP; STORE x (by name or by slot)"""
+    store, load = window
+    if store.operand != load.operand:
+        return None
+    return [Instruction(OpCode.DUP, line=store.line), store]
+
+
+def _constant_branch(window, index):
+    """LOAD_CONST c; JUMP_IF_FALSE L -> JUMP L if c is 0, nothing otherwise"""
+    const, branch = window
+    if type(const.operand) not in (int, float):
+        return None
+    if const.operand == 0:
+        return [Instruction(OpCode.JUMP, branch.operand, branch.line)]
+    return []
+
+
+def _jump_to_next(window, index):
+    """JUMP to the following instruction"""
+    if window[0].operand != index + 1:
+        return None
+    return []
+
+
+def _branch_to_next(window, index):
+    """JUMP_IF_FALSE to the following instruction only discards the condition"""
+    branch = window[0]
+    if branch.operand != index + 1:
+        return None
+    return [Instruction(OpCode.POP, line=branch.line)]
+
+
+PEEPHOLE_RULES = (
+    PeepholeRule('store_load', (OpCode.STORE_VAR, OpCode.LOAD_VAR), _store_load),
+    PeepholeRule('store_load', (OpCode.STORE_FAST, OpCode.LOAD_FAST), _store_load),
+    PeepholeRule('constant_branch', (OpCode.LOAD_CONST, OpCode.JUMP_IF_FALSE), _constant_branch),
+    PeepholeRule('jump_to_next', (OpCode.JUMP,), _jump_to_next),
+    PeepholeRule('branch_to_next', (OpCode.JUMP_IF_FALSE,), _branch_to_next),
+)
+
+
+class PeepholeOptimizer:
+    """Applies a table of peephole rules to instruction lists in place.
+
+    `applied` counts rewrites per rule name and `instructions_removed` the
+    net number of instructions removed, over every list optimized since the
+    optimizer was created.
+    """
+
+    def __init__(self, rules=PEEPHOLE_RULES):
+        self.rules = tuple(rules)
+        self.applied = Counter()
+        self.instructions_removed = 0
+
+        # First opcode -> rules starting with it
+        self._by_opcode = {}
+        for rule in self.rules:
+            self._by_opcode.setdefault(rule.pattern[0], []).append(rule)
+
+    def optimize(self, instructions):
+        """Optimize one instruction list in place and return it"""
+        original = len(instructions)
+        thread_jumps(instructions)
+        while self._pass(instructions):
+            thread_jumps(instructions)
+        self.instructions_removed += original - len(instructions)
+        return instructions
+
+    def optimize_functions(self, functions):
+        """Optimize every CodeObject of a {name: CodeObject} dict"""
+        for code in functions.values():
+            self.optimize(code.instructions)
+        return functions
+
+    def _pass(self, instructions):
+        """One sweep of the window; returns True if any rule applied"""
+        count = len(instructions)
+        targets = {instr.operand for instr in instructions if instr.opcode in JUMP_OPCODES}
+        by_opcode = self._by_opcode
+
+        result = []
+        new_index = [0] * (count + 1)
+        changed = False
+        index = 0
+        while index < count:
+            replacement = None
+            for rule in by_opcode.get(instructions[index].opcode, ()):
+                size = len(rule.pattern)
+                end = index + size
+                if end > count:
+                    continue
+                if any(instructions[index + k].opcode != rule.pattern[k] for k in range(1, size)):
+                    continue
+                if any(position in targets for position in range(index + 1, end)):
+                    continue
+                replacement = rule.rewrite(instructions[index:end], index)
+                if replacement is not None:
+                    self.applied[rule.name] += 1
+                    break
+
+            if replacement is None:
+                new_index[index] = len(result)
+                result.append(instructions[index])
+                index += 1
+                continue
+
+            changed = True
+            for position in range(index, end):
+                new_index[position] = len(result)
+            result.extend(replacement)
+            index = end
+
+        if not changed:
+            return False
+
+        new_index[count] = len(result)
+        for instr in result:
+            if instr.opcode in JUMP_OPCODES:
+                instr.operand = new_index[instr.operand]
+        instructions[:] = result
+        return True
@@ -0,0 +1,212 @@
+"""
+Per-opcode VM profiler
+
+A Profiler passed as VirtualMachine(profiler=...) makes run() dispatch
+through Profiler.execute(), a copy of the VM's dispatch loop that also
+records, for every instruction list it runs:
+
+    counts        executions of each instruction index
+    sampled_time  time spent in the handler of about one in
+                  `sample_interval` executions (perf_counter around the
+                  call), per index
+    back_edges    jumps to an earlier index (the loop headers), per target
+
+Timing only a sample keeps the clock calls from dominating what is
+measured; the gap between samples is random (1 to 2 * sample_interval - 1)
+so that loops whose length divides the interval are not always sampled at
+the same instruction. The time of an opcode is estimated as its mean
+sampled time times its executions. Without a profiler the VM runs its own
+loop, which checks nothing of this per instruction. execute_instruction()
+(single steps) is not profiled.
+
+The counts are mapped back to the source through Instruction.line:
+report() shows the opcodes, source lines and loops the program spent
+its instructions in. A profiler accumulates over runs until reset().
+"""
+
+import random
+import time
+from collections import namedtuple
+
+from main import _STOP
+
+SAMPLE_INTERVAL = 16
+DEFAULT_TOP = 10
+
+HotLoop = namedtuple('HotLoop', ['function', 'target', 'line', 'iterations'])
+
+
+class FunctionProfile:
+    """What the profiler saw of one instruction list"""
+    __slots__ = ('name', 'instructions', 'counts', 'sampled', 'sampled_time', 'back_edges')
+
+    def __init__(self, name, instructions):
+        self.name = name
+        self.instructions = instructions
+        # One more entry for the end-of-list sentinel
+        size = len(instructions) + 1
+        self.counts = [0] * size
+        self.sampled = [0] * size
+        self.sampled_time = [0.0] * size
+        self.back_edges = {}
+
+    def executed(self):
+        """(index, Instruction, executions) of every instruction that ran"""
+        return [(index, instr, self.counts[index])
+                for index, instr in enumerate(self.instructions) if self.counts[index]]
+
+
+class Profiler:
+    """Counts and samples what a VirtualMachine executes; see the module docstring"""
+
+    def __init__(self, sample_interval=SAMPLE_INTERVAL, seed=None):
+        if sample_interval < 1:
+            raise ValueError("sample_interval must be at least 1")
+        self.sample_interval = sample_interval
+        self._random = random.Random(seed)
+        # id(instruction list) -> FunctionProfile (which keeps the list alive)
+        self.functions = {}
+        self._countdown = self._next_sample()
+
+    def reset(self):
+        self.functions = {}
+        self._countdown = self._next_sample()
+
+    def _next_sample(self):
+        """Executions until the next timed one"""
+        return self._random.randint(1, 2 * self.sample_interval - 1)
+
+    def profile_of(self, vm):
+        """FunctionProfile of the instruction list vm is running"""
+        instructions = vm.instructions
+        profile = self.functions.get(id(instructions))
+        if profile is None:
+            code = vm.frames[-1].code if vm.frames else None
+            name = code.name if code is not None else '<program>'
+            profile = self.functions[id(instructions)] = FunctionProfile(name, instructions)
+        return profile
+
+    def execute(self, vm, ip):
+        """VirtualMachine._execute() with counting, timing and back-edge detection"""
+        clock = time.perf_counter
+        next_sample = self._next_sample
+        countdown = self._countdown
+        try:
+            while True:
+                profile = self.profile_of(vm)
+                counts = profile.counts
+                sampled = profile.sampled
+                sampled_time = profile.sampled_time
+                back_edges = profile.back_edges
+                code = vm._decode(vm.instructions)
+                while ip >= 0:
+                    handler, operand = code[ip]
+                    counts[ip] += 1
+                    countdown -= 1
+                    if countdown:
+                        next_ip = handler(vm, operand, ip + 1)
+                    else:
+                        countdown = next_sample()
+                        started = clock()
+                        next_ip = handler(vm, operand, ip + 1)
+                        sampled_time[ip] += clock() - started
+                        sampled[ip] += 1
+                    if 0 <= next_ip <= ip:
+                        back_edges[next_ip] = back_edges.get(next_ip, 0) + 1
+                    ip = next_ip
+                if ip == _STOP:
+                    return
+                ip = vm.instruction_pointer
+        finally:
+            self._countdown = countdown
+
+    @property
+    def total(self):
+        """Instructions executed"""
+        return sum(count for profile in self.functions.values()
+                   for _, _, count in profile.executed())
+
+    def opcode_counts(self):
+        """{OpCode: executions}"""
+        counts = {}
+        for profile in self.functions.values():
+            for _, instr, count in profile.executed():
+                counts[instr.opcode] = counts.get(instr.opcode, 0) + count
+        return counts
+
+    def opcode_times(self):
+        """{OpCode: estimated seconds}; opcodes never sampled are left out"""
+        sampled = {}
+        for profile in self.functions.values():
+            for index, instr, _ in profile.executed():
+                if profile.sampled[index]:
+                    calls, seconds = sampled.get(instr.opcode, (0, 0.0))
+                    sampled[instr.opcode] = (calls + profile.sampled[index],
+                                             seconds + profile.sampled_time[index])
+        counts = self.opcode_counts()
+        return {opcode: seconds / calls * counts[opcode]
+                for opcode, (calls, seconds) in sampled.items()}
+
+    def line_counts(self):
+        """{(function, source line): executions}"""
+        counts = {}
+        for profile in self.functions.values():
+            for _, instr, count in profile.executed():
+                key = (profile.name, instr.line)
+                counts[key] = counts.get(key, 0) + count
+        return counts
+
+    def hot_loops(self, top=None):
+        """HotLoops by iterations, most first; the line is that of the jump target"""
+        loops = []
+        for profile in self.functions.values():
+            for target, iterations in profile.back_edges.items():
+                line = profile.instructions[target].line if target < len(profile.instructions) else 0
+                loops.append(HotLoop(profile.name, target, line, iterations))
+        loops.sort(key=lambda loop: -loop.iterations)
+        return loops if top is None else loops[:top]
+
+    def report(self, top=DEFAULT_TOP):
+        """Text report of the opcodes, source lines and loops that ran most"""
+        total = self.total
+        lines = [f"Perfil de ejecución: {total} instrucciones "
+                 f"(cronometrada 1 de cada {self.sample_interval})"]
+        if not total:
+            return lines[0]
+
+        def share(count):
+            return f"{100.0 * count / total:5.1f}%"
+
+        times = self.opcode_times()
+        lines += ["", "Opcodes:",
+                  f"  {'opcode':<34} {'ejecuciones':>11} {'%':>6} {'tiempo est.':>12} {'ns/instr':>9}"]
+        by_count = sorted(self.opcode_counts().items(), key=lambda item: -item[1])
+        for opcode, count in by_count:
+            seconds = times.get(opcode)
+            if seconds is None:
+                timing = f"{'-':>12} {'-':>9}"
+            else:
+                timing = f"{seconds * 1e3:9.3f} ms {seconds / count * 1e9:9.0f}"
+            lines.append(f"  {opcode.name:<34} {count:>11} {share(count)} {timing}")
+
+        # A line's time: each instruction's executions at its opcode's mean
+        mean = {opcode: times[opcode] / count for opcode, count in by_count if opcode in times}
+        line_times = {}
+        for profile in self.functions.values():
+            for _, instr, count in profile.executed():
+                key = (profile.name, instr.line)
+                line_times[key] = line_times.get(key, 0.0) + count * mean.get(instr.opcode, 0.0)
+        lines += ["", "Líneas más ejecutadas:",
+                  f"  {'función':<20} {'línea':>6} {'ejecuciones':>11} {'%':>6} {'tiempo est.':>12}"]
+        hot_lines = sorted(self.line_counts().items(), key=lambda item: -item[1])[:top]
+        for (function, line), count in hot_lines:
+            lines.append(f"  {function:<20} {line:>6} {count:>11} {share(count)} "
+                         f"{line_times[function, line] * 1e3:9.3f} ms")
+
+        loops = self.hot_loops(top)
+        if loops:
+            lines += ["", "Bucles calientes (saltos hacia atrás):",
+                      f"  {'función':<20} {'línea':>6} {'destino':>8} {'iteraciones':>12}"]
+            for loop in loops:
+                lines.append(f"  {loop.function:<20} {loop.line:>6} {loop.target:>8} {loop.iterations:>12}")
+        return "\n".join(lines)
@@ -0,0 +1,428 @@
+"""
+Bytecode-to-Python compilation backend
+
+PythonBackend runs a program loaded in a VirtualMachine by translating
+its bytecode into Python source, one Python function per CodeObject, and
+calling that instead of dispatching instruction by instruction:
+
+    frame slots      Python locals s0, s1, ... (an unassigned slot is an
+                     unbound local)
+    operand stack    expressions built up during translation; values go
+                     to temporaries t0, t1, ... only when they have to
+    basic blocks     `if b == <index>:` arms of a `while True` loop, in
+                     instruction order, so falling into the next block
+                     needs nothing and a backward jump `continue`s
+    CALL             a Python call, with the call depth as first argument
+
+Translated code does not report runtime errors. Where the interpreter
+would stop (undefined variable, division by zero, stack overflow) the
+Python code raises instead; the backend then restores the globals and
+runs the program on the interpreter from the start, so the error message
+and the final VM state are the interpreter's own. Programs the
+translator does not handle run on the interpreter directly: opcodes
+without a translation (PRINT, whose output could not be taken back, or
+any opcode added later) and stacks that are not empty between blocks.
+So do VMs with ExecutionLimits, which only the interpreter enforces.
+
+The compiled Python code is kept in an LRU cache keyed by the SHA-256 of
+the program's bytecode.
+"""
+
+import hashlib
+import math
+from collections import OrderedDict, namedtuple
+
+from main import OpCode, UNSET, COMPARISON_OPERATORS, SPECIALIZED_ARITHMETIC, TerminationReason
+from deadcode import block_starts, successors
+
+DEFAULT_CACHE_SIZE = 64
+
+_CALL = OpCode.CALL
+
+_ARITHMETIC = {
+    OpCode.BINARY_ADD: '+',
+    OpCode.BINARY_SUB: '-',
+    OpCode.BINARY_MUL: '*',
+    OpCode.BINARY_DIV: '/',
+}
+_ARITHMETIC.update((opcode, _ARITHMETIC[generic])
+                   for opcode, generic in SPECIALIZED_ARITHMETIC.items())
+
+# text: Python expression; slots: frame slots it reads; compare: (a, op, b)
+# for a BINARY_CMP result; evaluated: a constant or temporary, so
+# dropping it cannot skip an error
+_Value = namedtuple('_Value', ['text', 'slots', 'compare', 'evaluated'])
+
+# Python code of one program: `make` builds its entry function from
+# (globals, max call depth, constants, exception to raise)
+CompiledProgram = namedtuple('CompiledProgram', ['key', 'code', 'make', 'constants'])
+
+
+class Unsupported(Exception):
+    """The program cannot be translated; it runs on the interpreter"""
+
+
+class _Deoptimize(Exception):
+    """Raised by translated code where the interpreter would stop"""
+
+
+def program_functions(entry):
+    """CodeObjects reachable from entry through CALL, entry first"""
+    functions = [entry]
+    seen = {id(entry)}
+    for code in functions:
+        for instr in code.instructions:
+            if instr.opcode is _CALL and id(instr.operand) not in seen:
+                seen.add(id(instr.operand))
+                functions.append(instr.operand)
+    return functions
+
+
+def bytecode_hash(functions):
+    """SHA-256 of the instructions of functions, calls referring to their position"""
+    index = {id(code): position for position, code in enumerate(functions)}
+    digest = hashlib.sha256()
+    for code in functions:
+        digest.update(f"{code.name}\0{len(code.params)}\0{len(code.varnames)}\n".encode())
+        for instr in code.instructions:
+            operand = instr.operand
+            if instr.opcode is _CALL:
+                operand = index[id(operand)]
+            digest.update(f"{instr.opcode.value} {operand!r}\n".encode())
+    return digest.hexdigest()
+
+
+class _FunctionTranslator:
+    """Python source of one CodeObject, as the entry function or as a callee"""
+
+    def __init__(self, code, names, constants, entry):
+        self.code = code
+        self.names = names
+        self.constants = constants
+        self.entry = entry
+        self.lines = []
+        self.indent = 2
+        self.stack = []
+        self.temporaries = 0
+        self.uses_locals = not entry and any(instr.opcode is OpCode.STORE_VAR
+                                             for instr in code.instructions)
+
+    def translate(self, name):
+        code = self.code
+        instructions = code.instructions
+        if self.entry:
+            self.lines.append(f"    def {name}():")
+            self.emit("depth = 1")
+        else:
+            params = ''.join(f", s{slot}" for slot in range(len(code.params)))
+            self.lines.append(f"    def {name}(depth{params}):")
+            self.emit("if depth > MAX:")
+            self.emit("    raise Deoptimize")
+        if self.uses_locals:
+            self.emit("L = {}")
+
+        starts = block_starts(instructions)
+        if not starts:
+            self.exit()
+            return self.lines
+        ends = starts[1:] + [len(instructions)]
+        reachable = self._reachable(starts, ends)
+        blocks = [(start, end) for start, end in zip(starts, ends) if start in reachable]
+
+        if len(blocks) == 1 and not any(target <= blocks[0][0]
+                                        for target in successors(instructions, *blocks[0])):
+            self.block(*blocks[0])
+            return self.lines
+
+        self.emit("b = 0")
+        self.emit("while True:")
+        self.indent += 1
+        for start, end in blocks:
+            self.emit(f"if b == {start}:")
+            self.indent += 1
+            self.block(start, end)
+            self.indent -= 1
+        return self.lines
+
+    def _reachable(self, starts, ends):
+        instructions = self.code.instructions
+        block_end = dict(zip(starts, ends))
+        reachable = {0}
+        work = [0]
+        while work:
+            start = work.pop()
+            for target in successors(instructions, start, block_end[start]):
+                if target in block_end and target not in reachable:
+                    reachable.add(target)
+                    work.append(target)
+        return reachable
+
+    def emit(self, line):
+        self.lines.append('    ' * self.indent + line)
+
+    def exit(self):
+        """Falling off the end: the program stops, unless this is a callee"""
+        if self.entry:
+            self.emit(f"return (), {len(self.code.instructions)}, False, locals()")
+        else:
+            self.emit("raise Deoptimize")
+
+    def goto(self, start, target):
+        if target >= len(self.code.instructions):
+            self.exit()
+        else:
+            self.emit(f"b = {target}")
+            if target <= start:
+                self.emit("continue")
+
+    def branch(self, start, end, condition, target):
+        """Go to target if condition (a Python expression) holds, else to end"""
+        if self.stack:
+            raise Unsupported("values on the stack across a jump")
+        count = len(self.code.instructions)
+        if start < target < count and start < end < count:
+            self.emit(f"b = {target} if {condition} else {end}")
+            return
+        self.emit(f"if {condition}:")
+        self.indent += 1
+        self.goto(start, target)
+        self.indent -= 1
+        self.emit("else:")
+        self.indent += 1
+        self.goto(start, end)
+        self.indent -= 1
+
+    def push(self, text, slots=frozenset(), compare=None, evaluated=False):
+        self.stack.append(_Value(text, slots, compare, evaluated))
+
+    def pop(self):
+        if not self.stack:
+            raise Unsupported("stack underflow")
+        return self.stack.pop()
+
+    def temporary(self, text):
+        name = f"t{self.temporaries}"
+        self.temporaries += 1
+        self.emit(f"{name} = {text}")
+        return _Value(name, frozenset(), None, True)
+
+    def before_store(self, slot):
+        """Pending values that read slot are computed before it changes"""
+        for index, value in enumerate(self.stack):
+            if slot in value.slots:
+                self.stack[index] = self.temporary(value.text)
+
+    def literal(self, value):
+        if type(value) is int or (type(value) is float and math.isfinite(value)):
+            return f"({value!r})" if value < 0 else repr(value)
+        if type(value) is str:
+            return repr(value)
+        self.constants.append(value)
+        return f"K[{len(self.constants) - 1}]"
+
+    def load_var(self, name):
+        if self.entry:
+            return f"G[{name!r}]"
+        if self.uses_locals:
+            return f"(L[{name!r}] if {name!r} in L else G[{name!r}])"
+        return f"G[{name!r}]"
+
+    def block(self, start, end):
+        instructions = self.code.instructions
+        for index in range(start, end):
+            instr = instructions[index]
+            opcode = instr.opcode
+            operand = instr.operand
+            if opcode is OpCode.LOAD_CONST:
+                self.push(self.literal(operand), evaluated=True)
+            elif opcode is OpCode.LOAD_FAST:
+                self.push(f"s{operand}", frozenset((operand,)))
+            elif opcode is OpCode.STORE_FAST:
+                value = self.pop()
+                self.before_store(operand)
+                self.emit(f"s{operand} = {value.text}")
+            elif opcode is OpCode.LOAD_VAR:
+                self.stack.append(self.temporary(self.load_var(operand)))
+            elif opcode is OpCode.STORE_VAR:
+                value = self.pop()
+                self.emit(f"{'G' if self.entry else 'L'}[{operand!r}] = {value.text}")
+            elif opcode in _ARITHMETIC:
+                b = self.pop()
+                a = self.pop()
+                self.push(f"({a.text} {_ARITHMETIC[opcode]} {b.text})", a.slots | b.slots)
+            elif opcode is OpCode.BINARY_CMP:
+                b = self.pop()
+                a = self.pop()
+                op = operand if operand in COMPARISON_OPERATORS else '>'
+                self.push(f"(1 if {a.text} {op} {b.text} else 0)", a.slots | b.slots,
+                          (a.text, op, b.text))
+            elif opcode is OpCode.POP:
+                value = self.pop()
+                if not value.evaluated:
+                    self.emit(value.text)
+            elif opcode is OpCode.DUP:
+                value = self.pop()
+                if not value.evaluated:
+                    value = self.temporary(value.text)
+                self.stack += [value, value]
+            elif opcode is OpCode.INC_FAST:
+                slot, delta = operand
+                self.before_store(slot)
+                self.emit(f"s{slot} = s{slot} + {self.literal(delta)}")
+            elif opcode is OpCode.LOAD_FAST_LOAD_FAST:
+                for slot in operand:
+                    self.push(f"s{slot}", frozenset((slot,)))
+            elif opcode is _CALL:
+                count = len(operand.params)
+                if len(self.stack) < count:
+                    raise Unsupported("stack underflow")
+                arguments = self.stack[len(self.stack) - count:]
+                del self.stack[len(self.stack) - count:]
+                call = ''.join(f", {argument.text}" for argument in arguments)
+                self.stack.append(self.temporary(f"{self.names[id(operand)]}(depth + 1{call})"))
+            elif opcode is OpCode.RETURN:
+                values = [value.text for value in self.stack]
+                if self.entry:
+                    self.emit(f"return ({''.join(text + ', ' for text in values)}), "
+                              f"{index + 1}, True, locals()")
+                elif len(values) == 1:
+                    self.emit(f"return {values[0]}")
+                else:
+                    raise Unsupported("callee returns with more than one value on the stack")
+                self.stack = []
+                return
+            elif opcode is OpCode.JUMP:
+                if self.stack:
+                    raise Unsupported("values on the stack across a jump")
+                self.goto(start, operand)
+                return
+            elif opcode is OpCode.JUMP_IF_FALSE:
+                value = self.pop()
+                if value.compare is not None:
+                    condition = "not ({} {} {})".format(*value.compare)
+                else:
+                    condition = f"{value.text} == 0"
+                self.branch(start, end, condition, operand)
+                return
+            elif opcode is OpCode.COMPARE_JUMP_IF_FALSE:
+                op, target = operand
+                if op not in COMPARISON_OPERATORS:
+                    raise Unsupported(f"unknown comparison {op!r}")
+                b = self.pop()
+                a = self.pop()
+                self.branch(start, end, f"not ({a.text} {op} {b.text})", target)
+                return
+            elif opcode is OpCode.COMPARE_FAST_CONST_JUMP_IF_FALSE:
+                slot, op, constant, target = operand
+                if op not in COMPARISON_OPERATORS:
+                    raise Unsupported(f"unknown comparison {op!r}")
+                self.branch(start, end, f"not (s{slot} {op} {self.literal(constant)})", target)
+                return
+            else:
+                raise Unsupported(f"no translation for {opcode.name}")
+
+        # The block falls through into the next one
+        if self.stack:
+            raise Unsupported("values on the stack across blocks")
+        self.goto(start, end)
+
+
+def translate(entry):
+    """(Python source defining _make, constants) of the program starting at entry.
+
+    Raises Unsupported when the program has to run on the interpreter.
+    """
+    functions = program_functions(entry)
+    names = {id(code): f"f{position}" for position, code in enumerate(functions)}
+    constants = []
+    lines = ["def _make(G, MAX, K, Deoptimize):"]
+    called = {id(instr.operand) for code in functions for instr in code.instructions
+              if instr.opcode is _CALL}
+    for code in functions:
+        if id(code) in called:
+            lines += _FunctionTranslator(code, names, constants, False).translate(names[id(code)])
+    lines += _FunctionTranslator(entry, names, constants, True).translate('entry')
+    lines.append("    return entry")
+    return '\n'.join(lines) + '\n', constants
+
+
+class PythonBackend:
+    """Runs VirtualMachine programs as translated Python; see the module docstring.
+
+    run() counts its outcome in `compiled` (ran as Python), `deoptimized`
+    (Python stopped, the interpreter ran it again) and `interpreted`
+    (not translated); `cache_hits` counts programs found in the cache.
+    """
+
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self.compiled = 0
+        self.deoptimized = 0
+        self.interpreted = 0
+        self.cache_hits = 0
+
+    def compile(self, entry):
+        """CompiledProgram for the program starting at entry, or None if it is not supported"""
+        key = bytecode_hash(program_functions(entry))
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return self._cache[key]
+
+        try:
+            source, constants = translate(entry)
+            code = compile(source, f"<minilang {entry.name}>", 'exec')
+        except (Unsupported, SyntaxError, RecursionError):
+            # Also remembered, so the program is not translated again
+            program = None
+        else:
+            namespace = {}
+            exec(code, namespace)
+            program = CompiledProgram(key, code, namespace['_make'], constants)
+
+        self._cache[key] = program
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return program
+
+    def run(self, vm):
+        """Same effect as vm.run() on a program just loaded with load_instructions()"""
+        # Only the interpreter has the checkpoints that enforce limits
+        entry = self._loaded_entry(vm) if vm.limits is None else None
+        program = self.compile(entry) if entry is not None else None
+        if program is None:
+            self.interpreted += 1
+            vm.run()
+            return
+
+        saved_globals = dict(vm.globals)
+        function = program.make(vm.globals, vm.max_call_depth, program.constants, _Deoptimize)
+        vm.running = True
+        try:
+            values, ip, returned, variables = function()
+        except Exception:
+            self.deoptimized += 1
+            vm.globals.clear()
+            vm.globals.update(saved_globals)
+            vm.run()
+            return
+
+        self.compiled += 1
+        vm.stack.extend(values)
+        vm.instruction_pointer = ip
+        vm.running = not returned
+        vm._terminate(TerminationReason.RETURNED if returned else TerminationReason.END)
+        slots = vm.slots
+        for slot in range(len(entry.varnames)):
+            slots[slot] = variables.get(f"s{slot}", UNSET)
+
+    @staticmethod
+    def _loaded_entry(vm):
+        """Entry CodeObject if vm is about to start it, otherwise None"""
+        if len(vm.frames) != 1 or vm.instruction_pointer != 0:
+            return None
+        code = vm.frames[0].code
+        if code is None or any(value is not UNSET for value in vm.slots[:len(code.varnames)]):
+            return None
+        return code
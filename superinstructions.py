@@ -0,0 +1,208 @@
+"""
+Superinstructions: fused opcodes for the most frequent instruction sequences
+
+The fused sequences were chosen from the dynamic opcode sequences executed
+by real programs (bench_vm.py, the gcd program of testutils.py and
+examples/valid_program.c, about 73k instructions at -O2), as reported by
+profile_sequences():
+
+    LOAD_FAST LOAD_CONST BINARY_CMP JUMP_IF_FALSE   loop conditions
+        -> COMPARE_FAST_CONST_JUMP_IF_FALSE (slot, op, constant, target)
+    LOAD_FAST LOAD_CONST BINARY_ADD/SUB STORE_FAST  i = i + c
+        -> INC_FAST (slot, delta)
+    BINARY_CMP JUMP_IF_FALSE
+        -> COMPARE_JUMP_IF_FALSE (op, target)
+    LOAD_FAST LOAD_FAST
+        -> LOAD_FAST_LOAD_FAST (first slot, second slot)
+
+Run the module on C files to see the sequences of other programs:
+
+    python superinstructions.py examples/valid_program.c
+
+Fusion runs after every other pass: the fused branches keep their jump
+target inside a tuple operand, which jump threading and the peephole
+optimizer do not rewrite.
+"""
+
+import sys
+from collections import Counter, deque, namedtuple
+
+from main import (Instruction, OpCode, COMPARISON_OPERATORS, JUMP_OPCODES,
+                  FUSED_BRANCH_OPCODES, VirtualMachine)
+
+# pattern: tuple of opcodes; fuse(window) -> fused Instruction or None.
+# The jump target of a fused branch is the old index, remapped afterwards.
+SuperinstructionRule = namedtuple('SuperinstructionRule', ['name', 'pattern', 'fuse'])
+
+
+def _is_number(value):
+    return type(value) in (int, float)
+
+
+def _compare_fast_const_jump(window):
+    load, const, compare, branch = window
+    if not _is_number(const.operand) or compare.operand not in COMPARISON_OPERATORS:
+        return None
+    return Instruction(OpCode.COMPARE_FAST_CONST_JUMP_IF_FALSE,
+                       (load.operand, compare.operand, const.operand, branch.operand),
+                       load.line)
+
+
+def _inc_fast(window):
+    load, const, operation, store = window
+    if load.operand != store.operand or not _is_number(const.operand):
+        return None
+    # x - c == x + (-c) for ints and IEEE floats
+    delta = const.operand if operation.opcode == OpCode.BINARY_ADD else -const.operand
+    return Instruction(OpCode.INC_FAST, (load.operand, delta), load.line)
+
+
+def _compare_jump(window):
+    compare, branch = window
+    if compare.operand not in COMPARISON_OPERATORS:
+        return None
+    return Instruction(OpCode.COMPARE_JUMP_IF_FALSE, (compare.operand, branch.operand),
+                       compare.line)
+
+
+def _load_fast_load_fast(window):
+    first, second = window
+    return Instruction(OpCode.LOAD_FAST_LOAD_FAST, (first.operand, second.operand), first.line)
+
+
+SUPERINSTRUCTION_RULES = (
+    SuperinstructionRule('compare_fast_const_jump',
+                         (OpCode.LOAD_FAST, OpCode.LOAD_CONST, OpCode.BINARY_CMP,
+                          OpCode.JUMP_IF_FALSE),
+                         _compare_fast_const_jump),
+    SuperinstructionRule('inc_fast',
+                         (OpCode.LOAD_FAST, OpCode.LOAD_CONST, OpCode.BINARY_ADD,
+                          OpCode.STORE_FAST),
+                         _inc_fast),
+    SuperinstructionRule('inc_fast',
+                         (OpCode.LOAD_FAST, OpCode.LOAD_CONST, OpCode.BINARY_SUB,
+                          OpCode.STORE_FAST),
+                         _inc_fast),
+    SuperinstructionRule('compare_jump', (OpCode.BINARY_CMP, OpCode.JUMP_IF_FALSE),
+                         _compare_jump),
+    SuperinstructionRule('load_fast_load_fast', (OpCode.LOAD_FAST, OpCode.LOAD_FAST),
+                         _load_fast_load_fast),
+)
+
+
+class SuperinstructionFuser:
+    """Replaces rule matches with superinstructions, in place.
+
+    Rules are tried in table order at each position (longer sequences
+    first); a sequence a jump enters in the middle is not fused. `applied`
+    counts fusions per rule name and `instructions_removed` the instructions
+    saved.
+    """
+
+    def __init__(self, rules=SUPERINSTRUCTION_RULES):
+        self.rules = tuple(rules)
+        self.applied = Counter()
+        self.instructions_removed = 0
+
+        self._by_opcode = {}
+        for rule in self.rules:
+            self._by_opcode.setdefault(rule.pattern[0], []).append(rule)
+
+    def optimize(self, instructions):
+        """Fuse one instruction list in place and return it"""
+        count = len(instructions)
+        targets = {instr.operand for instr in instructions if instr.opcode in JUMP_OPCODES}
+        targets.update(instr.operand[-1] for instr in instructions
+                       if instr.opcode in FUSED_BRANCH_OPCODES)
+
+        result = []
+        new_index = [0] * (count + 1)
+        index = 0
+        while index < count:
+            fused = None
+            for rule in self._by_opcode.get(instructions[index].opcode, ()):
+                end = index + len(rule.pattern)
+                if end > count:
+                    continue
+                window = instructions[index:end]
+                if any(instr.opcode != opcode for instr, opcode in zip(window, rule.pattern)):
+                    continue
+                if any(position in targets for position in range(index + 1, end)):
+                    continue
+                fused = rule.fuse(window)
+                if fused is not None:
+                    self.applied[rule.name] += 1
+                    break
+
+            new_index[index] = len(result)
+            if fused is None:
+                result.append(instructions[index])
+                index += 1
+            else:
+                result.append(fused)
+                index = end
+        new_index[count] = len(result)
+
+        for instr in result:
+            if instr.opcode in JUMP_OPCODES:
+                instr.operand = new_index[instr.operand]
+            elif instr.opcode in FUSED_BRANCH_OPCODES:
+                instr.operand = instr.operand[:-1] + (new_index[instr.operand[-1]],)
+
+        self.instructions_removed += count - len(result)
+        instructions[:] = result
+        return instructions
+
+    def optimize_functions(self, functions):
+        """Fuse every CodeObject of a {name: CodeObject} dict"""
+        for code in functions.values():
+            self.optimize(code.instructions)
+        return functions
+
+
+def profile_sequences(code, max_length=4, max_steps=None):
+    """Run code and count the executed opcode sequences of 2..max_length opcodes"""
+    vm = VirtualMachine()
+    vm.load_instructions(code)
+    vm.running = True
+
+    counts = Counter()
+    window = deque(maxlen=max_length)
+    steps = 0
+    while vm.running and vm.instruction_pointer < len(vm.instructions):
+        if max_steps is not None and steps >= max_steps:
+            break
+        window.append(vm.instructions[vm.instruction_pointer].opcode.name)
+        recent = tuple(window)
+        for length in range(2, len(recent) + 1):
+            counts[recent[-length:]] += 1
+        vm.execute_instruction()
+        steps += 1
+    return counts
+
+
+if __name__ == '__main__':
+    from main import LexicalAnalyzer, Parser
+    from compiler import Compiler
+
+    totals = Counter()
+    for path in sys.argv[1:]:
+        with open(path) as f:
+            lexer = LexicalAnalyzer()
+            lexer.analyze(f.read())
+        parser = Parser(lexer.tokens)
+        ast = parser.parse()
+        # Sequences are measured on the unfused -O2 instruction set
+        compiler = Compiler(2, superinstructions=False)
+        entry = compiler.compile(ast)
+        if parser.errors or compiler.errors:
+            print(f"{path}: skipped (errors)")
+            continue
+        totals.update(profile_sequences(entry))
+
+    for length in range(2, 5):
+        print(f"\nSequences of {length} opcodes:")
+        ranked = [(sequence, count) for sequence, count in totals.most_common()
+                  if len(sequence) == length]
+        for sequence, count in ranked[:8]:
+            print(f"  {count:8d}  {' '.join(sequence)}")
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Test del ejecutor por lotes en procesos (batch.py)
+"""
+
+import pickle
+
+from main import (VirtualMachine, Instruction, OpCode, CodeObject, BufferSink, ExecutionLimits,
+                  TerminationReason)
+from bytecode import BytecodeFormatError, CompactProgram
+from batch import BatchExecutor, Job, encode_program, program_key
+from testutils import compile_source
+
+PROGRAM = '''
+int fib(int n) {
+    if (n < 2) {
+        return n;
+    }
+    return fib(n - 1) + fib(n - 2);
+}
+
+int main(int n, int d) {
+    int total = fib(n);
+    return total / d + bonus;
+}
+'''
+
+LOOP = '''
+int main(int n) {
+    int i = 0;
+    while (i < n) {
+        i = i + 1;
+    }
+    return i;
+}
+'''
+
+
+def run_here(entry, inputs, limits=None):
+    """Lo mismo en este proceso: (VM, salida)"""
+    sink = BufferSink()
+    vm = VirtualMachine(limits=limits, output=sink)
+    vm.load_instructions(entry)
+    for name, value in inputs.items():
+        if name in entry.params:
+            vm.slots[entry.params.index(name)] = value
+        else:
+            vm.globals[name] = value
+    vm.run()
+    return vm, sink.getvalue()
+
+
+def assert_same(result, vm, output):
+    assert result.reason is vm.termination.reason
+    assert result.message == vm.termination.message
+    assert result.output == output
+    assert result.memory == dict(vm.memory)
+    assert result.instructions_run == vm.instructions_run
+    if result.reason is TerminationReason.RETURNED:
+        assert result.value == vm.stack[-1]
+    else:
+        assert result.value is None
+
+
+def test_same_as_interpreter():
+    """Cada trabajo termina como en una VirtualMachine local, en orden de entrada con run_all"""
+    entry = compile_source(PROGRAM)
+    jobs = [(entry, {'n': n % 15, 'd': n % 4, 'bonus': n}) for n in range(60)]
+    with BatchExecutor(max_workers=2, chunk_size=5) as executor:
+        results = executor.run_all(jobs)
+        assert [result.job for result in results] == list(range(60))
+        for result, (_, inputs) in zip(results, jobs):
+            assert_same(result, *run_here(entry, inputs))
+        reasons = {result.reason for result in results}
+        assert reasons == {TerminationReason.RETURNED, TerminationReason.ERROR}
+        assert results[5].value == 5 + 5
+
+        # El mismo pool sirve otro lote; se admiten bytes y Job
+        data = encode_program(entry)
+        results = executor.run_all([Job(data, {'n': 10, 'd': 1, 'bonus': 0})] * 3)
+        assert [result.value for result in results] == [55] * 3
+    print("✅ Mismo resultado que el intérprete: OK")
+
+
+def test_budgets():
+    """Límites del ejecutor por defecto o propios de cada trabajo"""
+    entry = compile_source(LOOP)
+    jobs = [(entry, {'n': 10 ** 9}), (entry, {'n': 100}),
+            Job(entry, {'n': 10 ** 9}, ExecutionLimits(max_time=0.05)),
+            Job(entry, {'n': 5000}, ExecutionLimits(max_instructions=10 ** 6))]
+    with BatchExecutor(max_workers=2, limits=ExecutionLimits(max_instructions=20000),
+                       chunk_size=1) as executor:
+        results = executor.run_all(jobs)
+    assert [result.reason for result in results] == [
+        TerminationReason.INSTRUCTION_LIMIT, TerminationReason.RETURNED,
+        TerminationReason.TIME_LIMIT, TerminationReason.RETURNED]
+    assert results[0].instructions_run < 21000 and results[0].memory['i'] > 1000
+    assert results[2].time_used >= 0.05
+    assert results[3].value == 5000
+    print("✅ Presupuesto por trabajo: OK")
+
+
+def test_streaming():
+    """run() entrega los resultados según terminan: los cortos no esperan al largo"""
+    entry = compile_source(LOOP)
+    jobs = [(entry, {'n': 3 * 10 ** 6})] + [(entry, {'n': n}) for n in range(30)]
+    with BatchExecutor(max_workers=2, chunk_size=1, max_pending=4) as executor:
+        order = [result.job for result in executor.run(jobs)]
+    assert sorted(order) == list(range(31))
+    assert order.index(0) > 10
+    print("✅ Resultados en orden de terminación: OK")
+
+
+def test_compact_shipping():
+    """Se envían bytes compactos; los precargados solo por clave"""
+    entry = compile_source(PROGRAM)
+    data = encode_program(entry)
+    assert len(data) < len(pickle.dumps(entry.instructions)) / 2
+    with BatchExecutor(max_workers=2, preload=[entry]) as executor:
+        task = executor._task(0, (entry, {'n': 3}))
+        assert task[1] == program_key(data) and task[2] is None
+        task = executor._task(0, (compile_source(LOOP), {}))
+        assert isinstance(task[2], bytes)
+        results = executor.run_all([(entry, {'n': 12, 'd': 2, 'bonus': 1})])
+        assert results[0].value == 73
+
+        # La salida de PRINT vuelve en el resultado
+        printing = CodeObject('<program>', instructions=[
+            Instruction(OpCode.LOAD_VAR, 'v'), Instruction(OpCode.PRINT),
+            Instruction(OpCode.LOAD_CONST, 'fin'), Instruction(OpCode.PRINT)])
+        results = executor.run_all([(printing, {'v': v}) for v in range(3)])
+        assert [result.output for result in results] == [f"{v}\nfin\n" for v in range(3)]
+        assert all(result.reason is TerminationReason.END for result in results)
+
+        # Bytes dañados: error en el resultado, el pool sigue funcionando
+        results = executor.run_all([(data[:-3], {}), (data, {'n': 1, 'd': 1, 'bonus': 1})])
+        assert results[0].reason is TerminationReason.ERROR and results[0].message
+        assert results[1].value == 2
+
+    try:
+        BatchExecutor(max_workers=1, preload=[b'CBC\0'])
+        assert False, "BytecodeFormatError esperado"
+    except BytecodeFormatError:
+        pass
+    print("✅ Bytecode compacto y precarga: OK")
+
+
+def test_failing_jobs():
+    """Un trabajo que hace fallar a la VM con una excepción de Python no detiene el lote"""
+    entry = compile_source(PROGRAM)
+    # Bytecode dañado que se decodifica: el 1 de fib(n - 1) pasa a ser '1'
+    program = CompactProgram.from_buffer(encode_program(entry))
+    program.constants[program.constants.index(1)] = '1'
+    broken = program.to_bytes()
+    inputs = {'n': 6, 'd': 1, 'bonus': 0}
+    jobs = [(entry, inputs), (broken, inputs), (entry, inputs), (b'junk', {}), (entry, inputs)]
+    # Un solo proceso y un solo bloque: los trabajos buenos usan la VM que falló
+    with BatchExecutor(max_workers=1, chunk_size=len(jobs)) as executor:
+        results = executor.run_all(jobs * 2)
+    assert [result.job for result in results] == list(range(2 * len(jobs)))
+    vm, output = run_here(entry, inputs)
+    for result in results:
+        kind = result.job % len(jobs)
+        if kind == 1:
+            assert result.reason is TerminationReason.ERROR
+            assert result.message.startswith('TypeError: '), result.message
+        elif kind == 3:
+            assert result.reason is TerminationReason.ERROR
+            assert result.message == 'Truncated bytecode file', result.message
+        else:
+            assert_same(result, vm, output)
+    print("✅ Trabajos que fallan: OK")
+
+
+if __name__ == '__main__':
+    test_same_as_interpreter()
+    test_budgets()
+    test_streaming()
+    test_compact_shipping()
+    test_failing_jobs()
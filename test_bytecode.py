@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Test de la codificación compacta y del formato .cbc (bytecode.py)
+"""
+
+import os
+import struct
+import tempfile
+
+from main import CodeObject, Instruction, OpCode
+from bytecode import (CompactProgram, BytecodeFormatError, FORMAT_VERSION, MAGIC,
+                      OPCODE_NUMBERS, save, load, load_program)
+from testutils import GCD_PROGRAM, compile_program, execute
+
+
+def describe(instr):
+    """Instrucción comparable; los CALL se comparan por nombre de función"""
+    operand = instr.operand.name if instr.opcode == OpCode.CALL else instr.operand
+    return instr.opcode, operand, instr.line
+
+
+def test_round_trip():
+    """Codificar y decodificar conserva cada función y su ejecución"""
+    for level in (0, 2):
+        entry, compiler = compile_program(GCD_PROGRAM, level)
+        data = CompactProgram.from_functions(compiler.functions).to_bytes()
+        assert data.startswith(MAGIC)
+
+        functions, loaded = CompactProgram.from_buffer(data).to_code_objects()
+        assert list(functions) == list(compiler.functions)
+        assert loaded is functions['main']
+        for name, code in compiler.functions.items():
+            assert functions[name].params == code.params
+            assert functions[name].varnames == code.varnames
+            assert functions[name].stacksize == code.stacksize > 0
+            assert [describe(i) for i in functions[name]] == [describe(i) for i in code]
+
+        # Los CALL apuntan a los CodeObjects reconstruidos
+        calls = [i.operand for i in loaded if i.opcode == OpCode.CALL]
+        assert calls and all(callee is functions['gcd'] for callee in calls)
+
+        original, restored = execute(entry), execute(loaded)
+        assert restored.stack == original.stack == [1200]
+        assert restored.memory == original.memory
+    print("✅ Ida y vuelta del bytecode: OK")
+
+
+def test_constant_pool_and_tables():
+    """Pool de constantes y tabla de nombres sin duplicados, tabla de líneas"""
+    code = CodeObject('main', instructions=[
+        Instruction(OpCode.LOAD_CONST, 1, line=1),
+        Instruction(OpCode.LOAD_CONST, 1.0, line=1),
+        Instruction(OpCode.BINARY_ADD, line=1),
+        Instruction(OpCode.STORE_VAR, 'a', line=2),
+        Instruction(OpCode.LOAD_CONST, 1, line=3),
+        Instruction(OpCode.LOAD_CONST, 2 ** 70, line=3),
+        Instruction(OpCode.BINARY_ADD, line=3),
+        Instruction(OpCode.STORE_VAR, 'a', line=3),
+        Instruction(OpCode.LOAD_CONST, -0.0, line=4),
+        Instruction(OpCode.LOAD_CONST, 'texto', line=4),
+        Instruction(OpCode.LOAD_VAR, 'a', line=5),
+        Instruction(OpCode.RETURN, line=5),
+    ])
+    program = CompactProgram.from_functions({'main': code})
+    assert program.constants == [1, 1.0, 2 ** 70, -0.0, 'texto']
+    assert [type(value) for value in program.constants[:2]] == [int, float]
+    assert program.names == ['a', 'main']
+
+    function = program.functions[0]
+    assert function.ops.typecode == 'H' and function.args.itemsize == 4
+    assert list(function.args[:5]) == [0, 1, 0, 0, 0]
+    assert function.lines == [(0, 1), (3, 2), (4, 3), (8, 4), (10, 5)]
+
+    _, loaded = CompactProgram.from_buffer(program.to_bytes()).to_code_objects()
+    assert [describe(i) for i in loaded] == [describe(i) for i in code]
+    assert str(loaded[8].operand) == '-0.0'
+    assert execute(loaded).memory == {'a': 1 + 2 ** 70}
+    print("✅ Pool de constantes y tablas: OK")
+
+
+def test_file_format():
+    """Archivos .cbc: guardar, cargar con mmap y rechazar archivos inválidos"""
+    entry, compiler = compile_program(GCD_PROGRAM, 2)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'program.cbc')
+        size = save(path, compiler.functions, entry)
+        assert size == os.path.getsize(path)
+        assert execute(load(path)).stack == [1200]
+        functions, _ = load_program(path)
+        assert set(functions) == {'gcd', 'main'}
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        bad_version = data[:4] + struct.pack('<H', FORMAT_VERSION + 1) + data[6:]
+        for broken, message in ((b'XXXX' + data[4:], 'magic'),
+                                (bad_version, 'version'),
+                                (data[:len(data) // 2], 'Truncated'),
+                                (b'', 'empty')):
+            with open(path, 'wb') as f:
+                f.write(broken)
+            try:
+                load(path)
+            except BytecodeFormatError as e:
+                assert message in str(e), str(e)
+            else:
+                raise AssertionError(f"archivo inválido aceptado ({message})")
+
+    # Una función que necesita más pila de la que declara se rechaza
+    program = CompactProgram.from_functions(compiler.functions)
+    program.functions[0].stacksize -= 1
+    try:
+        CompactProgram.from_buffer(program.to_bytes()).to_code_objects()
+    except BytecodeFormatError as e:
+        assert 'needs a stack' in str(e), str(e)
+    else:
+        raise AssertionError("pila insuficiente aceptada")
+    print("✅ Formato de archivo .cbc: OK")
+
+
+def test_indices_out_of_range():
+    """Índices fuera de las tablas y saltos fuera de la función: BytecodeFormatError"""
+    entry, compiler = compile_program(GCD_PROGRAM, 2)
+    data = CompactProgram.from_functions(compiler.functions, entry).to_bytes()
+
+    def position(program, opcode):
+        for function in program.functions:
+            for index, number in enumerate(function.ops):
+                if number == OPCODE_NUMBERS[opcode]:
+                    return function, index
+        raise AssertionError(opcode)
+
+    def break_name(program):
+        program.functions[0].name = len(program.names)
+
+    def break_param(program):
+        program.functions[0].params = [len(program.names) + 5]
+
+    def break_constant(program):
+        function, index = position(program, OpCode.LOAD_CONST)
+        function.args[index] = len(program.constants)
+
+    def break_call(program):
+        function, index = position(program, OpCode.CALL)
+        function.args[index] = len(program.functions)
+
+    def break_jump(program):
+        # Sin tamaño de pila no se verifica la pila, pero sí los saltos
+        function, index = position(program, OpCode.JUMP)
+        function.stacksize = None
+        function.args[index] = len(function.ops) + 1
+
+    def break_slot(program):
+        function, index = position(program, OpCode.STORE_FAST)
+        function.args[index] = len(function.varnames)
+
+    def replace_operand(opcode, operand):
+        """Breaker that gives the first opcode instruction a new pool constant"""
+        def breaker(program):
+            function, index = position(program, opcode)
+            program.constants.append(operand)
+            function.args[index] = len(program.constants) - 1
+        breaker.__name__ = f"{opcode.name} {operand!r}"
+        return breaker
+
+    breakers = [
+        (break_name, 'Name index'), (break_param, 'Name index'),
+        (break_constant, 'Constant index'), (break_call, 'Function index'),
+        (break_jump, 'jumps to'), (break_slot, 'Slot 2 out of range'),
+        # Operandos de superinstrucciones: ranura, aridad, número y comparación
+        (replace_operand(OpCode.LOAD_FAST_LOAD_FAST, (0, 99)), 'bad slot 99'),
+        (replace_operand(OpCode.INC_FAST, (1,)), 'Malformed INC_FAST'),
+        (replace_operand(OpCode.INC_FAST, (1, 'x')), "bad number 'x'"),
+        (replace_operand(OpCode.COMPARE_JUMP_IF_FALSE, ('=\x1f', 3)), 'bad comparison'),
+        (replace_operand(OpCode.COMPARE_JUMP_IF_FALSE, ('<', '3')), 'bad target'),
+        (replace_operand(OpCode.COMPARE_FAST_CONST_JUMP_IF_FALSE, 5), 'Malformed'),
+    ]
+    for breaker, message in breakers:
+        program = CompactProgram.from_buffer(data)
+        breaker(program)
+        try:
+            CompactProgram.from_buffer(program.to_bytes()).to_code_objects()
+        except BytecodeFormatError as e:
+            assert message in str(e), str(e)
+        else:
+            raise AssertionError(f"programa inválido aceptado ({breaker.__name__})")
+
+    # Un entero grande que no son dígitos
+    program = CompactProgram.from_buffer(data)
+    program.constants.append(2 ** 70)
+    corrupt = program.to_bytes().replace(str(2 ** 70).encode(), b'x' * len(str(2 ** 70)))
+    try:
+        CompactProgram.from_buffer(corrupt)
+        raise AssertionError("entero inválido aceptado")
+    except BytecodeFormatError as e:
+        assert 'Malformed integer constant' in str(e), str(e)
+
+    # Los saltos correctos sin tamaño de pila se siguen aceptando
+    program = CompactProgram.from_buffer(data)
+    for function in program.functions:
+        function.stacksize = None
+    _, loaded = CompactProgram.from_buffer(program.to_bytes()).to_code_objects()
+    assert execute(loaded).stack == [1200]
+    print("✅ Índices fuera de rango: OK")
+
+
+if __name__ == '__main__':
+    test_round_trip()
+    test_constant_pool_and_tables()
+    test_file_format()
+    test_indices_out_of_range()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Test de la caché de compilación (cache.py)
+"""
+
+import os
+import struct
+import tempfile
+import time
+
+from bytecode import CompactProgram
+from cache import CompileCache, compile_source, ENTRY_SUFFIX
+from testutils import execute
+
+PROGRAM = '''
+int square(int n) {
+    return n * n;
+}
+
+int main() {
+    int i = 0;
+    int total = 0;
+    while (i < 5) {
+        total = total + square(i);
+        i = i + 1;
+    }
+    return total;
+}
+'''
+
+
+def entry_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(ENTRY_SUFFIX))
+
+
+def test_keys():
+    """La clave depende del código fuente y de las opciones"""
+    cache = CompileCache(tempfile.mkdtemp())
+    key = cache.key(PROGRAM, 2)
+    assert key == cache.key(PROGRAM, 2)
+    assert len({key, cache.key(PROGRAM, 1), cache.key(PROGRAM, 2, False),
+                cache.key(PROGRAM + ' ', 2)}) == 4
+    print("✅ Claves de la caché: OK")
+
+
+def test_disk_and_memo():
+    """Una compilación guardada se recupera de memoria y de disco"""
+    with tempfile.TemporaryDirectory() as directory:
+        cache = CompileCache(directory)
+        compiled = compile_source(PROGRAM, cache=cache)
+        assert cache.misses == 1 and len(entry_files(directory)) == 1
+
+        assert compile_source(PROGRAM, cache=cache) is compiled
+        assert cache.memo_hits == 1
+
+        # Otro proceso: solo el disco
+        other = CompileCache(directory)
+        loaded = compile_source(PROGRAM, cache=other)
+        assert other.disk_hits == 1 and other.misses == 0
+        assert loaded.report == compiled.report and loaded.diagnostics == []
+        assert sorted(loaded.functions) == sorted(compiled.functions)
+        vm = execute(loaded.entry)
+        assert vm.stack == execute(compiled.entry).stack == [30]
+    print("✅ Memoria y disco: OK")
+
+
+def test_diagnostics():
+    """Los errores de compilación también se guardan"""
+    with tempfile.TemporaryDirectory() as directory:
+        source_code = 'int main() { int x = 1; int x = 2; return x; }'
+        compiled = compile_source(source_code, cache=CompileCache(directory))
+        assert compiled.entry is None
+        assert [stage for stage, *_ in compiled.diagnostics] == ['semantic']
+        loaded = compile_source(source_code, cache=CompileCache(directory))
+        assert loaded.entry is None and loaded.diagnostics == compiled.diagnostics
+    print("✅ Diagnósticos en caché: OK")
+
+
+def test_lru_eviction():
+    """El directorio no pasa de max_bytes; se expulsa lo usado hace más tiempo"""
+    with tempfile.TemporaryDirectory() as directory:
+        cache = CompileCache(directory)
+        sources = [PROGRAM.replace('i < 5', f'i < {limit}') for limit in range(3)]
+        keys = [cache.key(source_code) for source_code in sources]
+        compile_source(sources[0], cache=cache)
+        size = os.path.getsize(cache.path(keys[0]))
+        cache.max_bytes = size * 2
+
+        compile_source(sources[1], cache=cache)
+        # Usar la primera la hace la más reciente
+        past = time.time() - 60
+        os.utime(cache.path(keys[1]), (past, past))
+        CompileCache(directory, max_bytes=size * 2).get(keys[0])
+        compile_source(sources[2], cache=cache)
+
+        assert entry_files(directory) == sorted(key + ENTRY_SUFFIX for key in (keys[0], keys[2]))
+        assert cache.evict() == 0
+    print("✅ Expulsión LRU: OK")
+
+
+def test_corrupt_entry():
+    """Una entrada dañada cuenta como fallo y se vuelve a compilar"""
+    with tempfile.TemporaryDirectory() as directory:
+        cache = CompileCache(directory)
+        key = cache.key(PROGRAM)
+        compile_source(PROGRAM, cache=cache)
+        with open(cache.path(key), 'r+b') as f:
+            f.truncate(30)
+
+        other = CompileCache(directory)
+        assert other.get(key) is None and other.misses == 1
+        assert not os.path.exists(cache.path(key))
+        assert execute(compile_source(PROGRAM, cache=other).entry).stack == [30]
+        other.clear()
+        assert entry_files(directory) == []
+
+        # Un índice de nombre fuera de la tabla también es un fallo, no una excepción
+        compile_source(PROGRAM, cache=CompileCache(directory))
+        with open(cache.path(key), 'rb') as f:
+            data = f.read()
+        length, = struct.unpack_from('<I', data)
+        split = 4 + length
+        program = CompactProgram.from_buffer(data[split:])
+        program.functions[0].name = len(program.names)
+        with open(cache.path(key), 'wb') as f:
+            f.write(data[:split] + program.to_bytes())
+        other = CompileCache(directory)
+        assert other.get(key) is None and other.misses == 1
+        assert not os.path.exists(cache.path(key))
+    print("✅ Entradas dañadas: OK")
+
+
+if __name__ == '__main__':
+    test_keys()
+    test_disk_and_memo()
+    test_diagnostics()
+    test_lru_eviction()
+    test_corrupt_entry()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Test del grafo de flujo de control (cfg.py)
+"""
+
+from main import CodeGenerator, Instruction, OpCode
+from cfg import CFGBuilder, ControlFlowGraph, linearize
+from testutils import parse, execute
+
+PROGRAM = '''
+int gcd(int a, int b) {
+    while (a != b) {
+        if (a > b) {
+            a = a - b;
+        }
+        if (b > a) {
+            b = b - a;
+        }
+    }
+    return a;
+}
+
+int sign(int x) {
+    if (x < 0) {
+        return 0 - 1;
+    }
+    if (x > 0) {
+        return 1;
+    }
+    return 0;
+}
+
+int main() {
+    int total = 0;
+    int i = 1;
+    while (i <= 8) {
+        total = total + gcd(i * 6, 48) + sign(i - 4);
+        i = i + 1;
+    }
+    return total;
+}
+'''
+
+
+def test_blocks_and_edges():
+    """Bloques básicos, sucesores y predecesores de un bucle con dos if"""
+    builder = CFGBuilder()
+    graphs = builder.build(parse(PROGRAM))
+    assert set(graphs) == {'gcd', 'sign', 'main'}
+    # Las funciones quedan vacías hasta linearize()
+    assert builder.functions['gcd'].instructions == []
+
+    gcd = graphs['gcd']
+    entry, header, body, join1, then2, join2, exit_block = (
+        gcd.blocks[0], gcd.blocks[1], gcd.blocks[2], gcd.blocks[4], gcd.blocks[5],
+        gcd.blocks[6], gcd.blocks[7])
+    assert entry.successors == [header]
+    assert header.target is exit_block and header.next is body
+    assert header.successors == [body, exit_block]
+    assert set(header.predecessors) == {entry, join2}
+    assert join2.next is header
+    assert exit_block.returns and exit_block.successors == []
+    # Ningún bloque contiene saltos
+    for graph in graphs.values():
+        for block in graph.blocks:
+            assert all(instr.opcode not in (OpCode.JUMP, OpCode.JUMP_IF_FALSE)
+                       for instr in block.instructions)
+    print("✅ Bloques y aristas: OK")
+
+
+def test_dominators():
+    """Dominadores y orden postorden inverso"""
+    graphs = CFGBuilder().build(parse(PROGRAM))
+    gcd = graphs['gcd']
+    blocks = gcd.blocks
+    idom = gcd.immediate_dominators()
+    assert idom[blocks[0]] is None
+    assert idom[blocks[1]] is blocks[0]
+    # El join de un if lo domina la condición, no el cuerpo
+    assert idom[blocks[4]] is blocks[2]
+    assert idom[blocks[7]] is blocks[1]
+    assert gcd.dominates(blocks[1], blocks[6]) and not gcd.dominates(blocks[3], blocks[4])
+    dominators = gcd.dominators()
+    assert dominators[blocks[6]] == {blocks[0], blocks[1], blocks[2], blocks[4], blocks[6]}
+
+    order = gcd.reverse_postorder()
+    # El bloque vacío tras el return final no es alcanzable
+    assert order[0] is blocks[0] and set(order) == set(blocks[:8]) == set(idom)
+    position = {block: index for index, block in enumerate(order)}
+    for block in order:
+        for successor in block.successors:
+            # Solo las aristas hacia atrás van a un bloque anterior
+            if position[successor] <= position[block]:
+                assert gcd.dominates(successor, block)
+
+    # Lo que sigue a un return es inalcanzable: sin dominador
+    sign = graphs['sign']
+    unreachable = [block for block in sign.blocks if block not in sign.immediate_dominators()]
+    assert unreachable and all(not block.instructions for block in unreachable)
+    print("✅ Dominadores: OK")
+
+
+def test_same_bytecode_as_codegen():
+    """Sin pasadas, el grafo se baja a lo mismo que CodeGenerator"""
+    builder = CFGBuilder()
+    entry = builder.generate(parse(PROGRAM))
+    codegen = CodeGenerator()
+    expected = codegen.generate(parse(PROGRAM))
+    for name, code in codegen.functions.items():
+        assert repr(builder.functions[name].instructions) == repr(code.instructions), name
+    vm = execute(entry)
+    assert vm.stack == execute(expected).stack
+    assert vm.memory == {'total': 121, 'i': 9}
+    print("✅ Mismo bytecode que CodeGenerator: OK")
+
+
+def test_linearizer_fall_through():
+    """Un bloque se coloca tras su predecesor para evitar el JUMP"""
+    graph = ControlFlowGraph('f')
+    entry, late, early = graph.new_block(), graph.new_block(), graph.new_block()
+    entry.instructions = [Instruction(OpCode.LOAD_CONST, 1)]
+    entry.branch = Instruction(OpCode.JUMP_IF_FALSE, late)
+    entry.next = early
+    early.instructions = [Instruction(OpCode.LOAD_CONST, 10), Instruction(OpCode.RETURN)]
+    late.instructions = [Instruction(OpCode.LOAD_CONST, 20), Instruction(OpCode.RETURN)]
+    graph.compute_edges()
+    assert late.predecessors == [entry]
+
+    instructions = linearize(graph)
+    # early va justo después de entry aunque se creó el último
+    assert [instr.opcode for instr in instructions] == [
+        OpCode.LOAD_CONST, OpCode.JUMP_IF_FALSE, OpCode.LOAD_CONST, OpCode.RETURN,
+        OpCode.LOAD_CONST, OpCode.RETURN]
+    assert instructions[1].operand == 4
+    assert execute(instructions).stack == [10]
+
+    # Un sucesor ya colocado necesita un JUMP
+    late.instructions = [Instruction(OpCode.LOAD_CONST, 20)]
+    late.next = early
+    early.instructions = [Instruction(OpCode.RETURN)]
+    instructions = linearize(graph)
+    assert instructions[-1].opcode == OpCode.JUMP and instructions[-1].operand == 2
+    entry.instructions[0].operand = 0
+    assert execute(instructions).stack == [20]
+    print("✅ Linealización con caída: OK")
+
+
+if __name__ == '__main__':
+    test_blocks_and_edges()
+    test_dominators()
+    test_same_bytecode_as_codegen()
+    test_linearizer_fall_through()
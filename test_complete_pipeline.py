@@ -3,7 +3,7 @@
 Test completo del pipeline de compilación con código válido
 """
 
-from main import LexicalAnalyzer, Parser, SemanticAnalyzer, CodeGenerator, VirtualMachine
+from main import LexicalAnalyzer, Parser, SemanticAnalyzer, CodeGenerator, VirtualMachine, walk
 
 def test_complete_pipeline():
     """Prueba completa del pipeline con código sin errores"""
@@ -111,11 +111,8 @@ int main() {
             print(f"  {i:2d}: {instr.opcode:<15}")
 
 def count_nodes(node):
-    """Cuenta recursivamente los nodos del AST"""
-    count = 1
-    for child in node.children:
-        count += count_nodes(child)
-    return count
+    """Cuenta los nodos del AST (recorrido iterativo)"""
+    return sum(1 for _ in walk(node))
 
 def test_simple_math():
     """Prueba simple de operaciones matemáticas"""
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Test de la eliminación de código muerto (deadcode.py)
+"""
+
+from main import Instruction, OpCode, CodeObject
+from deadcode import DeadCodeEliminator, block_starts
+from testutils import compile_program, compile_source, execute
+
+PROGRAM = '''
+int helper(int a) {
+    int unused = a * 2;
+    int b = 5;
+    b = 7;
+    if (0) {
+        a = 9;
+    }
+    return a + b;
+    a = 3;
+}
+
+int loop(int n) {
+    int acc = 0;
+    int last = 0;
+    while (n > 0) {
+        last = n;
+        acc = acc + n;
+        n = n - 1;
+    }
+    return acc;
+}
+
+int main() {
+    int x = helper(2);
+    int y = 1;
+    y = loop(4);
+    return x + y;
+}
+'''
+
+
+def opcodes(instructions):
+    return [instr.opcode for instr in instructions]
+
+
+def test_same_result():
+    """El programa calcula lo mismo con y sin eliminación"""
+    plain = compile_source(PROGRAM, 0)
+    optimized, compiler = compile_program(PROGRAM, 1)
+    expected = execute(plain)
+    vm = execute(optimized)
+    assert vm.stack == expected.stack == [19]
+    # Los locales de main son el estado final del programa y se conservan
+    assert vm.memory == expected.memory == {'x': 9, 'y': 10}
+    assert dict(compiler.report)['dead_code'] == sum(compiler.eliminated.values())
+    print(f"✅ Mismo resultado: {compiler.eliminated}")
+
+
+def test_unreachable_and_dead_stores():
+    """Código tras RETURN, cuerpo de if (0) y almacenamientos sin lectura"""
+    _, compiler = compile_program(PROGRAM, 1)
+    helper = compiler.functions['helper'].instructions
+    # a = 9 y a = 3 no son alcanzables; b = 5 se sobrescribe; unused no se lee
+    assert OpCode.JUMP not in opcodes(helper)
+    assert [instr.operand for instr in helper if instr.opcode == OpCode.LOAD_CONST] == [2, 7]
+    assert opcodes(helper[:4]) == [OpCode.LOAD_FAST, OpCode.LOAD_CONST, OpCode.BINARY_MUL, OpCode.POP]
+    assert compiler.eliminated['helper'] == 8
+
+    # last se asigna dentro del bucle pero nunca se lee
+    loop = compiler.functions['loop']
+    stores = [instr.operand for instr in loop.instructions if instr.opcode == OpCode.STORE_FAST]
+    assert loop.varnames.index('last') not in stores
+    assert loop.varnames.index('acc') in stores
+    # y = 1 en main se sobrescribe antes de leerse, pero se conserva: la
+    # llamada a loop puede detener el programa y memory mostraría y
+    assert compiler.eliminated['main'] == 0
+    print("✅ Código inalcanzable y almacenamientos muertos: OK")
+
+
+def test_liveness_across_back_edge():
+    """Un valor leído en la siguiente vuelta del bucle sigue vivo"""
+    instructions = [
+        Instruction(OpCode.LOAD_CONST, 0),      # 0
+        Instruction(OpCode.STORE_FAST, 0),      # 1  previous = 0
+        Instruction(OpCode.LOAD_CONST, 3),      # 2
+        Instruction(OpCode.STORE_FAST, 1),      # 3  n = 3
+        Instruction(OpCode.LOAD_FAST, 1),       # 4  inicio del bucle
+        Instruction(OpCode.JUMP_IF_FALSE, 14),  # 5
+        Instruction(OpCode.LOAD_FAST, 0),       # 6  lee previous de la vuelta anterior
+        Instruction(OpCode.LOAD_FAST, 1),       # 7
+        Instruction(OpCode.BINARY_ADD),         # 8
+        Instruction(OpCode.STORE_FAST, 0),      # 9  previous = previous + n
+        Instruction(OpCode.LOAD_FAST, 1),       # 10
+        Instruction(OpCode.LOAD_CONST, 1),      # 11
+        Instruction(OpCode.BINARY_SUB),         # 12
+        Instruction(OpCode.JUMP, 16),           # 13 salta sobre código muerto
+        Instruction(OpCode.LOAD_FAST, 0),       # 14 salida del bucle
+        Instruction(OpCode.RETURN),             # 15
+        Instruction(OpCode.STORE_FAST, 1),      # 16 n = n - 1
+        Instruction(OpCode.JUMP, 4),            # 17
+        Instruction(OpCode.LOAD_CONST, 99),     # 18 inalcanzable
+        Instruction(OpCode.STORE_FAST, 0),      # 19
+    ]
+    assert block_starts(instructions) == [0, 4, 6, 14, 16, 18]
+    eliminator = DeadCodeEliminator()
+    eliminator.optimize(instructions)
+    assert eliminator.unreachable == 2 and eliminator.dead_stores == 0
+    assert len(instructions) == 18
+    assert instructions[5].operand == 14 and instructions[13].operand == 16
+    assert instructions[17].opcode == OpCode.JUMP and instructions[17].operand == 4
+
+    vm = execute(CodeObject('main', instructions=instructions, varnames=['previous', 'n']))
+    assert vm.stack == [6]
+    print("✅ Vida de variables a través del bucle: OK")
+
+
+def test_entry_locals_at_stops():
+    """Los locales de la función de entrada siguen vivos donde el programa puede pararse"""
+    source_code = '''
+int f(int a, int b) {
+    return a / b;
+}
+
+int main() {
+    int v0 = 5;
+    int v1 = 1;
+    v0 = f(v1, 0);
+    return v0;
+}
+'''
+    memories = [dict(execute(compile_source(source_code, opt_level)).memory)
+                for opt_level in (0, 1, 2)]
+    assert memories == [{'v0': 5, 'v1': 1}] * 3
+
+    def eliminate(instructions, params=0):
+        every_slot = (1 << 3) - 1
+        eliminator = DeadCodeEliminator()
+        eliminator.optimize(instructions, every_slot, every_slot, (1 << params) - 1)
+        return eliminator.dead_stores
+
+    # Entre dos asignaciones sin nada que pueda pararlo, la primera sí muere
+    instructions = [
+        Instruction(OpCode.LOAD_CONST, 1), Instruction(OpCode.STORE_FAST, 0),
+        Instruction(OpCode.LOAD_CONST, 2), Instruction(OpCode.LOAD_CONST, 3),
+        Instruction(OpCode.BINARY_ADD), Instruction(OpCode.STORE_FAST, 0),
+        Instruction(OpCode.LOAD_FAST, 0), Instruction(OpCode.RETURN),
+    ]
+    assert eliminate(instructions) == 1 and len(instructions) == 6
+    # Una división, una global, un local quizá sin valor o un salto atrás la mantienen
+    for middle, params in (([Instruction(OpCode.LOAD_CONST, 2), Instruction(OpCode.LOAD_CONST, 0),
+                             Instruction(OpCode.BINARY_DIV)], 0),
+                           ([Instruction(OpCode.LOAD_VAR, 'g')], 0),
+                           ([Instruction(OpCode.LOAD_FAST, 1)], 0)):
+        instructions = ([Instruction(OpCode.LOAD_CONST, 1), Instruction(OpCode.STORE_FAST, 0)] +
+                        middle + [Instruction(OpCode.STORE_FAST, 0),
+                                  Instruction(OpCode.LOAD_FAST, 0), Instruction(OpCode.RETURN)])
+        assert eliminate(instructions, params) == 0, middle
+    # Un parámetro siempre tiene valor
+    instructions = [Instruction(OpCode.LOAD_CONST, 1), Instruction(OpCode.STORE_FAST, 0),
+                    Instruction(OpCode.LOAD_FAST, 1), Instruction(OpCode.STORE_FAST, 0),
+                    Instruction(OpCode.LOAD_FAST, 0), Instruction(OpCode.RETURN)]
+    assert eliminate(instructions, params=2) == 1
+    instructions = [Instruction(OpCode.LOAD_CONST, 1), Instruction(OpCode.STORE_FAST, 0),  # 0, 1
+                    Instruction(OpCode.LOAD_CONST, 0), Instruction(OpCode.JUMP_IF_FALSE, 0),  # 2, 3
+                    Instruction(OpCode.LOAD_CONST, 2), Instruction(OpCode.STORE_FAST, 0),  # 4, 5
+                    Instruction(OpCode.LOAD_FAST, 0), Instruction(OpCode.RETURN)]
+    assert eliminate(instructions) == 0
+    print("✅ Locales de la entrada vivos en las paradas: OK")
+
+
+def test_level_zero_keeps_everything():
+    """-O0 no elimina nada"""
+    _, compiler = compile_program(PROGRAM, 0)
+    assert compiler.eliminated == {}
+    helper = compiler.functions['helper'].instructions
+    assert [instr.operand for instr in helper if instr.opcode == OpCode.LOAD_CONST][-2:] == [3, 0]
+    print("✅ -O0 sin eliminación: OK")
+
+
+if __name__ == '__main__':
+    test_same_result()
+    test_unreachable_and_dead_stores()
+    test_liveness_across_back_edge()
+    test_entry_locals_at_stops()
+    test_level_zero_keeps_everything()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Test de la ejecución vectorizada por carriles (lanes.py); sin NumPy se omite
+"""
+
+import contextlib
+import io
+import random
+import re
+import unittest
+
+from main import VirtualMachine, Instruction, OpCode, CodeObject, TerminationReason
+from testutils import compile_program, compile_source, random_program
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PROGRAM = '''
+int fib(int n) {
+    if (n < 2) {
+        return n;
+    }
+    return fib(n - 1) + fib(n - 2);
+}
+
+int score(int x, int y) {
+    int total = 0;
+    int i = 0;
+    int last;
+    while (i < x) {
+        if (i > y) {
+            total = total + fib(i) / (y - 3);
+            last = i;
+        }
+        if (i < y + 1) {
+            total = total - i * 1.5;
+        }
+        i = i + 1;
+    }
+    return total + last * offset;
+}
+
+int main() {
+    return score(3, 4);
+}
+'''
+
+
+def requires_numpy():
+    if numpy is None:
+        raise unittest.SkipTest("NumPy no está instalado")
+
+
+def run_lanes(code, inputs, lanes):
+    from lanes import LaneVM
+    vm = LaneVM(lanes)
+    vm.load_instructions(code, inputs)
+    vm.run()
+    return vm
+
+
+def run_each(code, inputs, lanes):
+    """Lo mismo con una VirtualMachine por carril: (VMs, salida)"""
+    vms = []
+    output = io.StringIO()
+    # Las entradas son escalares de NumPy: como en los carriles, los int desbordan
+    with contextlib.redirect_stdout(output), numpy.errstate(over='ignore'):
+        for lane in range(lanes):
+            vm = VirtualMachine()
+            vm.load_instructions(code)
+            for name, values in inputs.items():
+                value = values if isinstance(values, (int, float)) else values[lane]
+                if name in code.params:
+                    vm.slots[code.params.index(name)] = value
+                else:
+                    vm.globals[name] = value
+            vm.run()
+            vms.append(vm)
+    return vms, output.getvalue()
+
+
+def assert_same(lane_vm, vms):
+    for lane, vm in enumerate(vms):
+        assert lane_vm.reason(lane) is vm.termination.reason, lane
+        if vm.termination.reason is TerminationReason.RETURNED:
+            assert lane_vm.stack[0][lane] == vm.stack[-1], lane
+        if vm.termination.reason is TerminationReason.ERROR:
+            assert lane_vm.errors[vm.termination.message][lane], lane
+        for name, value in vm.memory.items():
+            assert lane_vm.memory[name][lane] == value, (lane, name)
+    assert sum(int(lanes.sum()) for lanes in lane_vm.errors.values()) == sum(
+        vm.termination.reason is TerminationReason.ERROR for vm in vms)
+
+
+def test_same_as_interpreter():
+    """Cada carril termina como una VirtualMachine con su entrada"""
+    requires_numpy()
+    for opt_level in (0, 2):
+        functions = compile_program(PROGRAM, opt_level)[1].functions
+        lanes = 300
+        inputs = {'x': numpy.arange(lanes) % 12, 'y': numpy.arange(lanes) % 7, 'offset': 2}
+        vm = run_lanes(functions['score'], inputs, lanes)
+        assert not vm.interpreted
+        vms, _ = run_each(functions['score'], inputs, lanes)
+        assert_same(vm, vms)
+        # y == 3 divide por cero si el bucle pasa de y; sin pasar, last no tiene valor
+        assert set(vm.errors) == {"Division by zero", "Undefined variable 'last'"}
+        assert vm.errors["Division by zero"].sum() > 0 and vm.returned.sum() > 0
+    print("✅ Mismo resultado que el intérprete: OK")
+
+
+def test_random_programs():
+    """Programas aleatorios con a, b y c como entradas por carril"""
+    requires_numpy()
+    rng = random.Random(47)
+    for _ in range(40):
+        source_code = random_program(rng)
+        source_code = re.sub(r'    int [abc] = \d+;\n', '', source_code)
+        source_code = source_code.replace('int main() {', 'int main(int a, int b, int c) {')
+        lanes = 40
+        inputs = {'a': numpy.arange(lanes) % 7 - 3, 'b': numpy.arange(lanes) // 5,
+                  'c': rng.choice((2, 0.5))}
+        for opt_level in (0, 2):
+            entry = compile_source(source_code, opt_level)
+            vm = run_lanes(entry, inputs, lanes)
+            assert not vm.interpreted
+            assert_same(vm, run_each(entry, inputs, lanes)[0])
+    print("✅ Programas aleatorios: OK")
+
+
+def test_recursion_limit():
+    """El desbordamiento de pila solo detiene los carriles que llegan a él"""
+    requires_numpy()
+    functions = compile_program('int down(int n) { if (n > 0) { return down(n - 1); } return 7; } '
+                                   'int main() { return down(3); }')[1].functions
+    from lanes import LaneVM
+    vm = LaneVM(4, max_call_depth=20)
+    vm.load_instructions(functions['down'], {'n': [0, 5, 25, 40]})
+    vm.run()
+    assert vm.returned.tolist() == [True, True, False, False]
+    assert vm.errors["Stack overflow calling 'down'"].tolist() == [False, False, True, True]
+    assert vm.stack[0].tolist()[:2] == [7, 7]
+    print("✅ Límite de llamadas por carril: OK")
+
+
+def test_unsupported_falls_back():
+    """PRINT se ejecuta carril a carril en el intérprete; las entradas se validan"""
+    requires_numpy()
+    from lanes import LaneVM, check_program
+    from pybackend import Unsupported
+    printing = [Instruction(OpCode.LOAD_VAR, 'v'), Instruction(OpCode.PRINT)]
+    try:
+        check_program(CodeObject('<program>', instructions=printing))
+        assert False, "Unsupported esperado"
+    except Unsupported:
+        pass
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        vm = run_lanes(printing, {'v': [1, 2, 3]}, 3)
+    assert vm.interpreted and output.getvalue() == "1\n2\n3\n"
+    assert vm.ended.all() and vm.reason(0) is TerminationReason.END
+    assert vm.memory['v'].tolist() == [1, 2, 3]
+
+    # Lista de instrucciones sin RETURN: los carriles llegan al final
+    vm = run_lanes([Instruction(OpCode.LOAD_VAR, 'v'), Instruction(OpCode.LOAD_CONST, 2),
+                    Instruction(OpCode.BINARY_MUL), Instruction(OpCode.STORE_VAR, 'w')],
+                   {'v': [1, 2, 3]}, 3)
+    assert not vm.interpreted and vm.ended.all() and vm.memory['w'].tolist() == [2, 4, 6]
+
+    try:
+        LaneVM(3).load_instructions(printing, {'v': [1, 2]})
+        assert False, "ValueError esperado"
+    except ValueError:
+        pass
+    print("✅ Vuelta al intérprete: OK")
+
+
+if __name__ == '__main__':
+    try:
+        test_same_as_interpreter()
+        test_random_programs()
+        test_recursion_limit()
+        test_unsupported_falls_back()
+    except unittest.SkipTest as e:
+        print(f"⚠️  Omitido: {e}")
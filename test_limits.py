@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Test de los límites de ejecución (ExecutionLimits) y de vm.termination
+"""
+
+import random
+
+from main import (VirtualMachine, Instruction, OpCode, CodeObject, ExecutionLimits,
+                  TerminationReason)
+from pybackend import PythonBackend
+from testutils import compile_source, execute_with_output, random_program
+
+FOREVER = '''
+int main() {
+    int i = 0;
+    int total = 0;
+    while (i < 1) {
+        total = total + 2;
+    }
+    return total;
+}
+'''
+
+RECURSIVE = '''
+int down(int n) {
+    int a = n;
+    int b = a * 2;
+    return b + down(n + 1);
+}
+
+int main() {
+    return down(0);
+}
+'''
+
+
+def test_termination_reasons():
+    """Sin límites, termination dice cómo terminó el programa"""
+    vm, _ = execute_with_output(compile_source('int main() { int x = 4; return x * 2; }'))
+    assert vm.termination.reason is TerminationReason.RETURNED
+    assert not vm.termination.limit_exceeded and vm.termination.function == 'main'
+
+    code = compile_source('int main() { int z = 0; int y = 5 / z; return y; }', 0)
+    vm, output = execute_with_output(code)
+    assert vm.termination.reason is TerminationReason.ERROR
+    assert vm.termination.message == "Division by zero"
+    assert output == "Runtime Error: Division by zero\n"
+
+    vm, _ = execute_with_output([Instruction(OpCode.LOAD_CONST, 1),
+                                 Instruction(OpCode.STORE_VAR, 'x')])
+    assert vm.termination.reason is TerminationReason.END and vm.running
+
+    vm, output = execute_with_output(compile_source(RECURSIVE, 0))
+    assert vm.termination.reason is TerminationReason.ERROR
+    assert output == "Runtime Error: Stack overflow calling 'down'\n"
+    print("✅ Motivo de terminación: OK")
+
+
+def test_instruction_limit():
+    """Un bucle infinito se detiene en el límite de instrucciones y puede seguir"""
+    for opt_level in (0, 2):
+        code = compile_source(FOREVER, opt_level)
+        limits = ExecutionLimits(max_instructions=10000)
+        vm, output = execute_with_output(code, limits=limits)
+        assert output == ""
+        assert vm.termination.reason is TerminationReason.INSTRUCTION_LIMIT
+        assert vm.termination.message == "max_instructions of 10000 exceeded"
+        assert not vm.running and 10000 < vm.instructions_run <= 10000 + len(code)
+        total = vm.memory['total']
+        assert total > 1000
+
+        # Con un límite mayor continúa donde se detuvo
+        limits.max_instructions = 20000
+        vm.run()
+        assert vm.termination.reason is TerminationReason.INSTRUCTION_LIMIT
+        assert vm.memory['total'] > 1.9 * total
+    print("✅ Límite de instrucciones: OK")
+
+
+def count_steps(code):
+    """Instrucciones que ejecuta code, paso a paso"""
+    vm = VirtualMachine(limits=ExecutionLimits())
+    vm.load_instructions(code)
+    vm.running = True
+    steps = 0
+    while vm.running and vm.instruction_pointer < len(vm.instructions):
+        vm.execute_instruction()
+        steps += 1
+    return steps
+
+
+def test_instruction_count():
+    """instructions_run nunca cuenta menos de lo ejecutado y no cambia el resultado"""
+    rng = random.Random(45)
+    for _ in range(40):
+        code = compile_source(random_program(rng), rng.choice((0, 2)))
+        plain, _ = execute_with_output(code)
+        limited, _ = execute_with_output(code, limits=ExecutionLimits(max_instructions=10 ** 9))
+        assert dict(limited.memory) == dict(plain.memory) and limited.stack == plain.stack
+        assert limited.termination.reason is plain.termination.reason
+        # Lo que un salto hacia delante se salta cuenta como ejecutado
+        assert count_steps(code) <= limited.instructions_run
+
+    # El único salto hacia delante tomado es la salida del bucle
+    code = compile_source('''
+int twice(int v) {
+    return v * 2;
+}
+
+int main() {
+    int i = 0;
+    int total = 0;
+    while (i < 50) {
+        total = total + twice(i);
+        i = i + 1;
+    }
+    return total;
+}
+''', 0)
+    vm, _ = execute_with_output(code, limits=ExecutionLimits())
+    body = 10
+    assert vm.stack == [2450] and vm.instructions_run == count_steps(code) + body
+    print("✅ Cuenta de instrucciones: OK")
+
+
+def test_time_limit():
+    """El reloj se consulta en los puntos de control"""
+    vm, _ = execute_with_output(compile_source(FOREVER, 0), limits=ExecutionLimits(max_time=0.05))
+    assert vm.termination.reason is TerminationReason.TIME_LIMIT
+    assert 0.05 <= vm.time_used < 1.0
+    print("✅ Límite de tiempo: OK")
+
+
+def test_stack_and_memory_limits():
+    """Recursión sin fin: la pila y los slots de cada llamada tienen límite"""
+    code = compile_source(RECURSIVE, 0)
+    vm, output = execute_with_output(code, limits=ExecutionLimits(max_stack_depth=50))
+    assert output == ""
+    assert vm.termination.reason is TerminationReason.STACK_LIMIT
+    assert vm.termination.function == 'down' and len(vm.stack) <= 50
+    depth = len(vm.frames)
+
+    vm, _ = execute_with_output(code, limits=ExecutionLimits(max_memory_entries=100))
+    assert vm.termination.reason is TerminationReason.MEMORY_LIMIT
+    # down tiene 3 slots y main ninguno
+    assert vm.termination.message == "max_memory_entries of 100 exceeded"
+    assert len(vm.frames) == 1 + 100 // 3
+    assert depth > 10
+    print("✅ Límites de pila y memoria: OK")
+
+
+def test_output_limit():
+    """PRINT no escribe más bytes de los permitidos"""
+    code = CodeObject('<program>', instructions=[
+        Instruction(OpCode.LOAD_CONST, 'hola'), Instruction(OpCode.PRINT), Instruction(OpCode.JUMP, 0),
+    ])
+    vm, output = execute_with_output(code, limits=ExecutionLimits(max_output_bytes=22))
+    assert output == "hola\n" * 4
+    assert vm.termination.reason is TerminationReason.OUTPUT_LIMIT
+    # El valor sigue en la pila y PRINT no se ejecutó
+    assert vm.stack == ['hola'] and vm.instruction_pointer == 1 and vm.output_bytes == 20
+    print("✅ Límite de salida: OK")
+
+
+def test_no_checkpoints_without_limits():
+    """Sin límites no hay puntos de control; pybackend deja los límites al intérprete"""
+    code = compile_source(FOREVER.replace('i < 1', 'total < 100'))
+    plain, _ = execute_with_output(code)
+    handlers = {handler.__name__ for handler, _ in plain._decode(code.instructions)}
+    assert '_op_backward_jump' not in handlers
+
+    limited, _ = execute_with_output(code, limits=ExecutionLimits(max_instructions=10 ** 6))
+    handlers = {handler.__name__ for handler, _ in limited._decode(code.instructions)}
+    assert '_op_backward_jump' in handlers
+    assert limited.memory['total'] == plain.memory['total'] == 100
+
+    backend = PythonBackend()
+    vm = VirtualMachine(limits=ExecutionLimits(max_instructions=5000))
+    vm.load_instructions(compile_source(FOREVER))
+    backend.run(vm)
+    assert backend.interpreted == 1 and backend.compiled == 0
+    assert vm.termination.reason is TerminationReason.INSTRUCTION_LIMIT
+    print("✅ Sin límites no hay sobrecoste: OK")
+
+
+if __name__ == '__main__':
+    test_termination_reasons()
+    test_instruction_limit()
+    test_instruction_count()
+    test_time_limit()
+    test_stack_and_memory_limits()
+    test_output_limit()
+    test_no_checkpoints_without_limits()
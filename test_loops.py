@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Test de las optimizaciones de bucles (loops.py): código invariante y
+reducción de fuerza
+"""
+
+import random
+
+from main import OpCode
+from cfg import CFGBuilder
+from loops import LoopOptimizer, find_loops
+from testutils import parse, compile_program, compile_source, execute, outcome, random_program
+
+PROGRAM = '''
+int main() {
+    int n = 12;
+    int scale = 3;
+    int total = 0;
+    int i = 0;
+    while (i < n) {
+        int j = 0;
+        while (j < n) {
+            total = total + j * 4 + scale * n + i * 2;
+            j = j + 1;
+        }
+        i = i + 1;
+    }
+    return total;
+}
+'''
+
+
+def optimize_graphs(source_code):
+    """Grafos de main antes de linealizar, tras LoopOptimizer (sin plegado de constantes)"""
+    builder = CFGBuilder()
+    graphs = builder.build(parse(source_code))
+    optimizer = LoopOptimizer()
+    optimizer.optimize_graphs(graphs, builder.functions)
+    return graphs['main'], builder, optimizer
+
+
+def test_nested_loops():
+    """Bucles anidados: mismo resultado y menos trabajo por iteración"""
+    entry, compiler = compile_program(PROGRAM)
+    plain = compile_source(PROGRAM, loop_optimization=False)
+    vm = execute(entry)
+    assert outcome(vm) == outcome(execute(plain))
+    assert vm.stack == [12 * 12 * 36 + 12 * (4 * 66) + 12 * (2 * 66)]
+    # Los temporales no aparecen entre las variables del programa
+    assert set(vm.memory) == {'n', 'scale', 'total', 'i', 'j'}
+    assert dict(compiler.report)['loop_optimization'] > 0
+    print("✅ Bucles anidados: OK")
+
+
+def test_hoisting_and_reduction():
+    """scale * n sale de los dos bucles; j * 4 e i * 2 se reducen a sumas"""
+    graph, builder, optimizer = optimize_graphs(PROGRAM)
+    assert optimizer.hoisted >= 2 and optimizer.reduced == 2
+
+    loops = find_loops(graph.compute_edges())
+    inner, outer = loops
+    assert inner.blocks < outer.blocks
+    for block in inner.blocks:
+        for index, instr in enumerate(block.instructions[:-2]):
+            window = block.instructions[index:index + 3]
+            # Ninguna multiplicación queda en el bucle interior
+            assert window[2].opcode != OpCode.BINARY_MUL, window
+
+    # El bucle interior tiene guarda: la condición se evalúa antes del preheader
+    header = inner.header
+    guards = [block for block in graph.blocks
+              if block.branch is not None and block not in inner.blocks
+              and block.target is header.target]
+    assert len(guards) == 1
+    assert builder.functions['main'].varnames[5:] == [
+        f'${slot}' for slot in range(5, len(builder.functions['main'].varnames))]
+    print("✅ Código invariante y reducción de fuerza: OK")
+
+
+def test_no_speculation():
+    """Lo que se saca de un bucle que no se ejecuta no produce errores"""
+    source_code = '''
+int main() {
+    int zero = 0;
+    int i = 0;
+    int x = 1;
+    while (i < 0) {
+        x = 10 / zero + x;
+        i = i + 1;
+    }
+    if (zero == 0) {
+        i = 5;
+    }
+    while (i < 7) {
+        if (i > 5) {
+            x = x + 100 / zero;
+        }
+        i = i + 1;
+    }
+    return x;
+}
+'''
+    vm = execute(compile_source(source_code))
+    # El segundo bucle divide por cero dentro de un if: error en la segunda vuelta
+    assert not vm.running
+    assert outcome(vm) == outcome(execute(compile_source(source_code, loop_optimization=False)))
+    assert vm.memory['i'] == 6
+    print("✅ Sin evaluación especulativa: OK")
+
+
+def test_error_order():
+    """Un error que se saca del bucle no adelanta a las llamadas y asignaciones anteriores"""
+    sources = [
+        # Desbordamiento de pila en g antes de la división por cero
+        'int g(int a) { return g(a); } '
+        'int main() { int i4 = 2; int i6 = 0; '
+        'while (i6 < 3) { int zz = g(1); int v10 = i4 / 0; i6 = i6 + 1; } }',
+        # La global no existe: el error llega después de incrementar i
+        'int main() { int t = 0; int i = 0; '
+        'while (i < 3) { i = i + 1; t = t + missing * 2; } return t; }',
+        # u no tiene valor al entrar en el bucle
+        'int main() { int u; int t = 0; int i = 0; '
+        'while (i < 3) { i = i + 1; t = t + u * 2; } return t; }',
+        # El return sale del bucle antes de llegar a la global que no existe
+        'int main() { int k0 = 0; int r = 0; '
+        'while (k0 < 4) { if (k0 < 10) { return 7; } r = q + 1; k0 = k0 + 1; } return 0; }',
+        # ...o a la división por cero
+        'int main() { int p = 2; int k0 = 0; int r = 0; '
+        'while (k0 < 4) { if (k0 < 10) { return 7; } r = (p + 1) / (p - 2); k0 = k0 + 1; } '
+        'return 0; }',
+    ]
+    for source_code in sources:
+        outcomes = []
+        for opt_level in (0, 2):
+            vm = execute(compile_source(source_code, opt_level))
+            outcomes.append((vm.termination.reason, vm.termination.message, dict(vm.memory)))
+        assert outcomes[0] == outcomes[1], (source_code, outcomes)
+    # Sin nada antes en el bucle, la división sí se saca
+    _, _, optimizer = optimize_graphs(
+        'int main() { int d = 4; int t = 0; int i = 0; '
+        'while (i < 3) { t = t + 100 / d; i = i + 1; } return t; }')
+    assert optimizer.hoisted == 1
+    print("✅ Orden de los errores: OK")
+
+
+def test_not_reduced():
+    """Variables que pueden no ser enteras o con varios incrementos no se reducen"""
+    sources = [
+        # i empieza siendo real
+        'int main() { float i = 0.5; int t = 0; while (i < 9) { t = t + i * 3; i = i + 1; } return t; }',
+        # dos incrementos en el bucle
+        'int main() { int i = 0; int t = 0; while (i < 9) { t = t + i * 3; i = i + 1; i = i + 2; } return t; }',
+        # parámetro: su tipo no se conoce
+        'int f(int i) { int t = 0; while (i < 9) { t = t + i * 3; i = i + 1; } return t; } '
+        'int main() { return f(1); }',
+    ]
+    for source_code in sources:
+        _, _, optimizer = optimize_graphs(source_code)
+        assert optimizer.reduced == 0, source_code
+        assert outcome(execute(compile_source(source_code))) == \
+            outcome(execute(compile_source(source_code, loop_optimization=False)))
+    print("✅ Casos sin reducción: OK")
+
+
+def test_random_programs():
+    """Programas aleatorios (semilla fija) con y sin optimización de bucles"""
+    rng = random.Random(19)
+    changed = 0
+    for _ in range(80):
+        source_code = random_program(rng)
+        entry, compiler = compile_program(source_code)
+        plain = compile_source(source_code, loop_optimization=False)
+        changed += dict(compiler.report)['loop_optimization'] > 0
+        assert outcome(execute(entry)) == outcome(execute(plain)), source_code
+    assert changed > 20
+    print(f"✅ Programas aleatorios: OK ({changed} con bucles optimizados)")
+
+
+if __name__ == '__main__':
+    test_nested_loops()
+    test_hoisting_and_reduction()
+    test_no_speculation()
+    test_error_order()
+    test_not_reduced()
+    test_random_programs()
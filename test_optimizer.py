@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Test del plegado y propagación de constantes (optimizer.py)
+"""
+
+from main import CodeGenerator, VirtualMachine, NodeType, OpCode, NullSink, TerminationReason
+from compiler import Compiler
+from optimizer import ConstantFolder
+from testutils import parse, execute
+
+
+def run(source_code, optimize):
+    """Compila y ejecuta; devuelve (memoria, pila, instrucciones, folder)"""
+    ast = parse(source_code)
+    folder = ConstantFolder()
+    if optimize:
+        folder.optimize(ast)
+    codegen = CodeGenerator()
+    instructions = codegen.generate(ast)
+    assert not codegen.errors, codegen.errors
+    vm = execute(instructions)
+    total = sum(len(code.instructions) for code in codegen.functions.values())
+    return vm.memory, vm.stack, total, folder
+
+
+def assert_same_result(source_code):
+    """El programa optimizado calcula lo mismo y el informe cuadra con el bytecode"""
+    memory, stack, before, _ = run(source_code, optimize=False)
+    opt_memory, opt_stack, after, folder = run(source_code, optimize=True)
+    assert opt_memory == memory, (opt_memory, memory)
+    assert opt_stack == stack, (opt_stack, stack)
+    assert [type(v) for v in opt_memory.values()] == [type(v) for v in memory.values()]
+    assert before - after == folder.instructions_removed
+    return opt_memory, folder
+
+
+def test_constant_folding():
+    """Subexpresiones constantes, semántica int/float y división por cero"""
+    ast = parse('int main() { int a = 2 + 3 * 4; return a; }')
+    ConstantFolder().optimize(ast)
+    declaration = ast.children[0].children[1]
+    assert declaration.children[1].type == NodeType.LITERAL
+    assert declaration.children[1].value == 14
+
+    memory, folder = assert_same_result('''
+int main() {
+    int a = 2 + 3 * 4;
+    float b = 7 / 2;
+    float c = 1.5 * 2;
+    int d = (10 > 3) + (2 == 2.0);
+    return a;
+}
+''')
+    assert memory == {'a': 14, 'b': 3.5, 'c': 3.0, 'd': 2}
+    assert folder.folded == 7
+    assert folder.instructions_removed == 14
+
+    # La división por cero constante se deja para la ejecución
+    ast = parse('int main() { int z = 4 / (2 - 2); return z; }')
+    folder = ConstantFolder()
+    folder.optimize(ast)
+    division = ast.children[0].children[1].children[1]
+    assert division.type == NodeType.BINARY_EXPRESSION
+    assert division.children[1].value == 0
+    assert folder.folded == 1
+    print("✅ Plegado de constantes: OK")
+
+
+def test_constant_propagation():
+    """Propagación en código lineal, conservadora en if y while"""
+    memory, folder = assert_same_result('''
+int main() {
+    int x = 5;
+    int y = x + 1;
+    y = y * (2 + 3);
+    return y - x;
+}
+''')
+    assert memory == {'x': 5, 'y': 30}
+    assert folder.propagated == 4
+
+    ast = parse('''
+int main() {
+    int x = 5;
+    int y = x + 1;
+    y = y * 2;
+    return y - x;
+}
+''')
+    codegen = CodeGenerator()
+    ConstantFolder().optimize(ast)
+    instructions = codegen.generate(ast)
+    assert [instr.opcode for instr in instructions] == [
+        OpCode.LOAD_CONST, OpCode.STORE_FAST,
+        OpCode.LOAD_CONST, OpCode.STORE_FAST,
+        OpCode.LOAD_CONST, OpCode.STORE_FAST,
+        OpCode.LOAD_CONST, OpCode.RETURN,
+    ]
+    assert instructions[-2].operand == 7
+
+    # Las variables del bucle no se propagan ni dentro ni después del bucle
+    memory, _ = assert_same_result('''
+int main() {
+    int i = 0;
+    int step = 2;
+    int total = 0;
+    while (i < 10) {
+        total = total + step;
+        i = i + step;
+    }
+    int after = i + total;
+    int fixed = step * 3;
+    return after;
+}
+''')
+    assert memory['after'] == 20 and memory['fixed'] == 6
+
+    # Tras un if solo sobreviven los valores en los que coinciden ambos caminos
+    memory, _ = assert_same_result('''
+int pick(int n) {
+    int a = 1;
+    int b = 2;
+    if (n > 0) {
+        a = 10;
+        b = 2;
+    }
+    if (0) {
+        b = 99;
+    }
+    return a * 100 + b;
+}
+
+int main() {
+    int p = pick(1);
+    int q = pick(0);
+    return p + q;
+}
+''')
+    assert memory == {'p': 1002, 'q': 102}
+    print("✅ Propagación de constantes: OK")
+
+
+def test_functions_are_independent():
+    """Las constantes de una función no se propagan a otra"""
+    memory, _ = assert_same_result('''
+int f(int x) {
+    int k = x + 1;
+    return k;
+}
+
+int main() {
+    int x = 100;
+    int k = 3;
+    int r = f(k) + x;
+    return r;
+}
+''')
+    assert memory == {'x': 100, 'k': 3, 'r': 104}
+    print("✅ Funciones independientes: OK")
+
+
+def test_memory_after_error():
+    """Un almacenamiento propagado sigue en memory si el programa falla después"""
+    source_code = '''
+int f(int a, int b) {
+    return a / b;
+}
+
+int main() {
+    int v0 = 5;
+    int v1 = v0 - 4;
+    int v2 = v1 * 3;
+    v0 = f(v1, v2 - 3);
+    return v0 + v2;
+}
+'''
+    results = []
+    for opt_level, passes in ((0, {}), (2, {}),
+                              (2, {'loop_optimization': False, 'superinstructions': False,
+                                   'type_specialization': False})):
+        compiler = Compiler(opt_level, **passes)
+        entry = compiler.compile(parse(source_code))
+        vm = VirtualMachine(output=NullSink())
+        vm.load_instructions(entry)
+        vm.run()
+        assert vm.termination.reason is TerminationReason.ERROR
+        results.append((vm.termination.message, dict(vm.memory)))
+    # v0 = 5 y los demás se propagan como constantes, pero se siguen guardando
+    assert results == [("Division by zero", {'v0': 5, 'v1': 1, 'v2': 3})] * 3
+    print("✅ Memoria tras un error: OK")
+
+
+if __name__ == '__main__':
+    test_constant_folding()
+    test_constant_propagation()
+    test_functions_are_independent()
+    test_memory_after_error()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Test de la salida de la VM (OutputSink) y de los errores como excepciones (VMRuntimeError)
+"""
+
+import contextlib
+import io
+
+from main import (VirtualMachine, Instruction, OpCode, CodeObject, ExecutionLimits,
+                  TerminationReason, OutputSink, BufferSink, FileSink, CallbackSink, NullSink,
+                  VMRuntimeError)
+from testutils import compile_source, execute
+
+DIVIDE = '''
+int ratio(int a, int b) {
+    return a / b;
+}
+
+int main() {
+    int x = 4;
+    int y = ratio(x, 2);
+    y = y + ratio(x, 0);
+    return y;
+}
+'''
+
+
+def printing(count, last='fin'):
+    """Programa que imprime 0..count-1 y luego last"""
+    return CodeObject('<program>', instructions=[
+        Instruction(OpCode.LOAD_CONST, 0), Instruction(OpCode.STORE_VAR, 'i'),
+        Instruction(OpCode.LOAD_VAR, 'i'), Instruction(OpCode.PRINT),
+        Instruction(OpCode.LOAD_VAR, 'i'), Instruction(OpCode.LOAD_CONST, 1),
+        Instruction(OpCode.BINARY_ADD), Instruction(OpCode.STORE_VAR, 'i'),
+        Instruction(OpCode.LOAD_VAR, 'i'), Instruction(OpCode.LOAD_CONST, count),
+        Instruction(OpCode.BINARY_CMP, '<'), Instruction(OpCode.JUMP_IF_FALSE, 13),
+        Instruction(OpCode.JUMP, 2),
+        Instruction(OpCode.LOAD_CONST, last), Instruction(OpCode.PRINT),
+    ])
+
+
+def expected_output(count, last='fin'):
+    return ''.join(f"{i}\n" for i in range(count)) + f"{last}\n"
+
+
+def test_default_stdout():
+    """Por defecto la salida va a sys.stdout, el del momento del flush"""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        execute(printing(3))
+        execute(compile_source(DIVIDE, 0))
+    assert output.getvalue() == expected_output(3) + "Runtime Error: Division by zero\n"
+    print("✅ Salida estándar por defecto: OK")
+
+
+def test_sinks():
+    """Memoria, fichero, callback por lotes y descarte"""
+    sink = BufferSink()
+    vm = execute(printing(100), output=sink)
+    assert sink.getvalue() == expected_output(100)
+    # La salida de varias ejecuciones se acumula hasta clear()
+    vm.load_instructions(printing(2, 'otra'))
+    vm.run()
+    assert sink.getvalue() == expected_output(100) + expected_output(2, 'otra')
+    sink.clear()
+    assert sink.getvalue() == ""
+
+    file = io.StringIO()
+    execute(printing(50), output=FileSink(file))
+    assert file.getvalue() == expected_output(50)
+
+    batches = []
+    execute(printing(1000), output=CallbackSink(batches.append, buffer_size=100))
+    assert ''.join(batches) == expected_output(1000)
+    # Lotes de unos 100 caracteres, no uno por PRINT
+    assert 30 < len(batches) < 100 and all(len(batch) < 110 for batch in batches)
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        vm = execute(printing(10), output=NullSink())
+    assert output.getvalue() == "" and vm.memory['i'] == 10
+
+    try:
+        OutputSink().emit("x")
+        assert False, "NotImplementedError esperado"
+    except NotImplementedError:
+        pass
+    print("✅ Destinos de salida: OK")
+
+
+def test_error_after_output():
+    """El mensaje de error va al mismo destino, detrás de lo ya impreso"""
+    code = CodeObject('<program>', instructions=[
+        Instruction(OpCode.LOAD_CONST, 'antes'), Instruction(OpCode.PRINT),
+        Instruction(OpCode.LOAD_VAR, 'nada'), Instruction(OpCode.PRINT),
+    ])
+    sink = BufferSink()
+    vm = execute(code, output=sink)
+    assert sink.getvalue() == "antes\nRuntime Error: Undefined variable 'nada'\n"
+    assert vm.termination.reason is TerminationReason.ERROR
+
+    # Paso a paso también se vacía el buffer
+    steps = []
+    vm = VirtualMachine(output=CallbackSink(steps.append))
+    vm.load_instructions(code)
+    vm.running = True
+    vm.execute_instruction()
+    vm.execute_instruction()
+    assert steps == ["antes\n"]
+    print("✅ Error detrás de la salida: OK")
+
+
+def test_raise_errors():
+    """Con raise_errors, run() lanza VMRuntimeError con dónde ocurrió"""
+    for opt_level in (0, 2):
+        sink = BufferSink()
+        vm = VirtualMachine(output=sink, raise_errors=True)
+        vm.load_instructions(compile_source(DIVIDE, opt_level))
+        try:
+            vm.run()
+            assert False, "VMRuntimeError esperado"
+        except VMRuntimeError as error:
+            assert str(error) == error.message == "Division by zero"
+            assert error.function == 'ratio' and error.line == 3
+            assert error.termination is vm.termination
+            assert error.termination.reason is TerminationReason.ERROR
+        assert sink.getvalue() == "" and not vm.running
+
+    # Desbordamiento de pila: la línea es la de la llamada
+    vm = VirtualMachine(max_call_depth=20, raise_errors=True)
+    vm.load_instructions(compile_source('int f(int n) {\n    return f(n + 1);\n}\n'
+                                        'int main() {\n    return f(0);\n}\n', 0))
+    try:
+        vm.run()
+        assert False, "VMRuntimeError esperado"
+    except VMRuntimeError as error:
+        assert error.message == "Stack overflow calling 'f'"
+        assert error.function == 'f' and error.line == 2
+
+    # Los límites no son errores: no se lanza nada
+    vm = execute(printing(10 ** 6), raise_errors=True, output=NullSink(),
+             limits=ExecutionLimits(max_instructions=1000))
+    assert vm.termination.reason is TerminationReason.INSTRUCTION_LIMIT
+    print("✅ Errores como excepciones: OK")
+
+
+def test_output_limit():
+    """max_output_bytes cuenta lo que se escribe en el destino"""
+    sink = BufferSink()
+    vm = execute(printing(1000), output=sink, limits=ExecutionLimits(max_output_bytes=25))
+    assert vm.termination.reason is TerminationReason.OUTPUT_LIMIT
+    assert len(sink.getvalue().encode()) == vm.output_bytes <= 25
+    # 0..9 son 20 bytes y "10\n" 3 más; "11\n" ya no cabe
+    assert sink.getvalue() == ''.join(f"{i}\n" for i in range(11))
+    print("✅ Límite de salida con destino: OK")
+
+
+if __name__ == '__main__':
+    test_default_stdout()
+    test_sinks()
+    test_error_after_output()
+    test_raise_errors()
+    test_output_limit()
@@ -3,7 +3,7 @@
 Test independiente del Parser (Generador AST)
 """
 
-from main import LexicalAnalyzer, Parser
+from main import LexicalAnalyzer, Parser, TokenCursor, NodeType, walk, TK_KEYWORD, TK_IDENTIFIER, TK_EOF, V_INT
 
 def test_parser():
     """Prueba del parser con código válido"""
@@ -49,37 +49,130 @@ int main() {
         print(f"  Nodo raíz: {ast.type}")
         print(f"  Total de hijos: {len(ast.children)}")
         
-        # Función recursiva para mostrar el árbol
-        def print_ast(node, level=0):
-            indent = "  " * level
-            if hasattr(node, 'value') and node.value:
-                print(f"{indent}- {node.type}: {node.value}")
-            else:
-                print(f"{indent}- {node.type}")
-            
-            for child in node.children:
-                print_ast(child, level + 1)
+        # Recorrido iterativo para mostrar el árbol
+        def print_ast(root):
+            for node, level in walk(root):
+                indent = "  " * level
+                if hasattr(node, 'value') and node.value:
+                    print(f"{indent}- {node.type}: {node.value}")
+                else:
+                    print(f"{indent}- {node.type}")
         
         print("\nÁrbol completo:")
         print_ast(ast)
         
         # Estadísticas del AST
-        def count_nodes(node):
-            count = 1
-            for child in node.children:
-                count += count_nodes(child)
-            return count
-        
-        total_nodes = count_nodes(ast)
+        total_nodes = sum(1 for _ in walk(ast))
         print("\nEstadísticas del AST:")
         print(f"  - Total de nodos: {total_nodes}")
         print(f"  - Profundidad máxima: {max_depth(ast)}")
 
 def max_depth(node):
     """Calcula la profundidad máxima del AST"""
-    if not node.children:
-        return 1
-    return 1 + max(max_depth(child) for child in node.children)
+    return 1 + max(depth for _, depth in walk(node))
+
+def test_token_cursor():
+    """Prueba del cursor de tokens codificado con enteros"""
+    lexer = LexicalAnalyzer()
+    lexer.analyze('int main() { int x = 1; x = x + 1; return x; }')
+
+    cursor = TokenCursor(lexer.tokens)
+    assert len(cursor) == len(lexer.tokens)
+    assert cursor.kinds[0] == TK_KEYWORD and cursor.values[0] == V_INT
+    assert cursor.kinds[1] == TK_IDENTIFIER
+    # Valores iguales comparten el mismo id internado
+    x_ids = {cursor.values[i] for i, t in enumerate(lexer.tokens) if t['value'] == 'x'}
+    assert len(x_ids) == 1
+    # Centinela EOF al final
+    assert cursor.kinds[-1] == TK_EOF
+
+    # Asignar tokens después de construir el parser reinicia el cursor
+    parser = Parser([])
+    parser.tokens = lexer.tokens
+    ast = parser.parse()
+    assert not parser.errors
+    assert len(ast.children) == 1
+    assert [child.type.name for child in ast.children[0].children[1:]] == [
+        'DECLARATION', 'ASSIGNMENT', 'RETURN_STATEMENT']
+    print("✅ Cursor de tokens: OK")
+
+def test_parse_parallel():
+    """Parsing paralelo por funciones: mismo AST y errores que el secuencial"""
+    functions = []
+    for i in range(40):
+        functions.append(f"""
+int f{i}() {{
+    int a = {i};
+    while (a > 0) {{
+        if (a > 2) {{ a = a - 2; }}
+        a = a - 1;
+    }}
+    int = 5;
+    return a;
+}}
+""")
+    lexer = LexicalAnalyzer()
+    lexer.analyze("// cabecera\n" + "".join(functions))
+
+    cursor = TokenCursor(lexer.tokens)
+    spans = cursor.function_spans()
+    assert len(spans) == 40
+    assert all(lexer.tokens[start]['value'] == 'int' and lexer.tokens[end - 1]['value'] == '}'
+               for start, end in spans)
+
+    sequential = Parser(lexer.tokens)
+    expected = sequential.parse()
+    parallel = Parser(lexer.tokens)
+    result = parallel.parse_parallel(max_workers=2, min_tokens=0)
+
+    def shape(root):
+        return [(node.type, node.value, node.line, depth) for node, depth in walk(root)]
+
+    assert result.type == NodeType.PROGRAM
+    assert shape(result) == shape(expected)
+    assert parallel.errors == sequential.errors and len(parallel.errors) == 40
+    assert parallel.position == len(lexer.tokens)
+
+    # Una declaración global impide separar por llaves: se usa parse()
+    lexer.analyze("int g = 0;\n" + functions[0])
+    assert TokenCursor(lexer.tokens).function_spans() is None
+    fallback = Parser(lexer.tokens)
+    assert shape(fallback.parse_parallel(min_tokens=0)) == shape(Parser(lexer.tokens).parse())
+    print("✅ Parsing paralelo: OK")
+
+def test_functions_and_calls():
+    """Parámetros, llamadas con argumentos y precedencia de operadores"""
+    lexer = LexicalAnalyzer()
+    lexer.analyze('''
+int add(int a, float b) { return a + b * 2; }
+int main(void) { int r = add(1, add(2, 3)) <= 4; add(r, 0); return r; }
+''')
+    parser = Parser(lexer.tokens)
+    ast = parser.parse()
+    assert not parser.errors, parser.errors
+
+    add, main = ast.children
+    params = [child for child in add.children if child.type == NodeType.PARAMETER]
+    assert [(p.value, p.children[0].value) for p in params] == [('int', 'a'), ('float', 'b')]
+    assert not any(child.type == NodeType.PARAMETER for child in main.children)
+
+    # a + (b * 2)
+    expr = add.children[-1].children[0]
+    assert expr.value == '+' and expr.children[1].value == '*'
+
+    # (add(1, add(2, 3))) <= 4
+    compare = main.children[1].children[1]
+    assert compare.value == '<='
+    call = compare.children[0]
+    assert call.type == NodeType.FUNCTION_CALL and call.value == 'add'
+    assert [arg.type for arg in call.children] == [NodeType.LITERAL, NodeType.FUNCTION_CALL]
+
+    statement_call = main.children[2]
+    assert statement_call.type == NodeType.FUNCTION_CALL and len(statement_call.children) == 2
+    print("✅ Funciones y llamadas: OK")
 
 if __name__ == '__main__':
     test_parser()
+    test_functions_and_calls()
+    test_token_cursor()
+    test_parse_parallel()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Test del optimizador peephole (peephole.py) y de los niveles de optimización
+"""
+
+from main import Instruction, OpCode
+from compiler import Compiler, OPT_LEVELS
+from peephole import PeepholeOptimizer, PEEPHOLE_RULES
+from testutils import GCD_PROGRAM, compile_program, compile_source, execute
+
+
+def opcodes(instructions):
+    return [instr.opcode for instr in instructions]
+
+
+def test_levels_compute_the_same():
+    """Todos los niveles de optimización dan el mismo resultado"""
+    results = []
+    sizes = []
+    for level in OPT_LEVELS:
+        instructions, compiler = compile_program(GCD_PROGRAM, level)
+        vm = execute(instructions)
+        results.append((vm.memory, vm.stack))
+        sizes.append(sum(len(code.instructions) for code in compiler.functions.values()))
+        assert [name for name, _ in compiler.report] == (
+            [] if level == 0 else ['peephole', 'dead_code'] if level == 1 else
+            ['constant_folding', 'loop_optimization', 'peephole', 'dead_code',
+             'superinstructions'])
+
+    assert results[0][1] == [1200]
+    assert all(result == results[0] for result in results)
+    assert sizes[0] > sizes[1] > sizes[2]
+    print(f"✅ Niveles -O0/-O1/-O2: {sizes} instrucciones, mismo resultado")
+
+
+def test_rules():
+    """Cada regla de la tabla sobre código generado"""
+    instructions, compiler = compile_program(GCD_PROGRAM, 1)
+    main_code = compiler.functions['main'].instructions
+
+    # STORE_FAST x; LOAD_FAST x -> DUP; STORE_FAST x
+    _, unoptimized = compile_program('int main() { int x = 1; int y = x + 1; return y; }', 0)
+    plain = unoptimized.functions['main'].instructions
+    assert opcodes(plain[1:3]) == [OpCode.STORE_FAST, OpCode.LOAD_FAST]
+    store_load = compile_source('int main() { int x = 1; int y = x + 1; return y; }', 1)
+    assert opcodes(store_load[:4]) == [OpCode.LOAD_CONST, OpCode.DUP, OpCode.STORE_FAST, OpCode.LOAD_CONST]
+    assert execute(store_load).memory == {'x': 1, 'y': 2}
+
+    # Ninguna condición constante queda en el código
+    for index, instr in enumerate(main_code[:-1]):
+        assert not (instr.opcode == OpCode.LOAD_CONST and
+                    main_code[index + 1].opcode == OpCode.JUMP_IF_FALSE)
+    # Ningún salto apunta a la instrucción siguiente ni a otro JUMP
+    for code in compiler.functions.values():
+        for index, instr in enumerate(code.instructions):
+            if instr.opcode in (OpCode.JUMP, OpCode.JUMP_IF_FALSE):
+                assert instr.operand != index + 1
+                assert 0 <= instr.operand <= len(code.instructions)
+                if instr.operand < len(code.instructions):
+                    assert code.instructions[instr.operand].opcode != OpCode.JUMP
+    print("✅ Reglas peephole: OK")
+
+
+def test_jump_remapping():
+    """Los destinos de salto se reajustan al eliminar instrucciones"""
+    instructions = [
+        Instruction(OpCode.LOAD_CONST, 0),       # 0
+        Instruction(OpCode.STORE_VAR, 'i'),      # 1
+        Instruction(OpCode.JUMP, 3),             # 2  salto a la siguiente
+        Instruction(OpCode.LOAD_VAR, 'i'),       # 3  inicio del bucle
+        Instruction(OpCode.LOAD_CONST, 3),       # 4
+        Instruction(OpCode.BINARY_CMP, '<'),     # 5
+        Instruction(OpCode.JUMP_IF_FALSE, 13),   # 6
+        Instruction(OpCode.LOAD_CONST, 1),       # 7
+        Instruction(OpCode.JUMP_IF_FALSE, 13),   # 8  condición constante verdadera
+        Instruction(OpCode.LOAD_VAR, 'i'),       # 9
+        Instruction(OpCode.LOAD_CONST, 1),       # 10
+        Instruction(OpCode.BINARY_ADD),          # 11
+        Instruction(OpCode.STORE_VAR, 'i'),      # 12
+        Instruction(OpCode.JUMP, 3),             # 13 vuelta atrás (también destino)
+    ]
+    # El bucle termina saltando más allá del final
+    instructions[6].operand = 14
+    expected = execute(list(instructions)).memory
+
+    optimizer = PeepholeOptimizer()
+    optimizer.optimize(instructions)
+    assert optimizer.applied == {'jump_to_next': 1, 'constant_branch': 1}
+    assert optimizer.instructions_removed == 3
+    assert opcodes(instructions).count(OpCode.JUMP) == 1
+    assert instructions[-1].opcode == OpCode.JUMP and instructions[-1].operand == 2
+    assert instructions[5].operand == len(instructions)
+    assert execute(instructions).memory == expected == {'i': 3}
+    print("✅ Reajuste de saltos: OK")
+
+
+def test_window_with_jump_target():
+    """Una ventana en la que entra un salto no se reescribe"""
+    instructions = [
+        Instruction(OpCode.LOAD_CONST, 5),
+        Instruction(OpCode.STORE_VAR, 'x'),
+        Instruction(OpCode.LOAD_VAR, 'x'),   # destino del salto de abajo
+        Instruction(OpCode.LOAD_CONST, 0),
+        Instruction(OpCode.JUMP_IF_FALSE, 6),
+        Instruction(OpCode.JUMP, 2),
+        Instruction(OpCode.RETURN),
+    ]
+    optimizer = PeepholeOptimizer()
+    optimizer.optimize(instructions)
+    assert 'store_load' not in optimizer.applied
+    assert opcodes(instructions[1:3]) == [OpCode.STORE_VAR, OpCode.LOAD_VAR]
+    print("✅ Ventanas con destino de salto: OK")
+
+
+def test_configurable_rules():
+    """La tabla de reglas es configurable y los niveles se validan"""
+    only_store_load = [rule for rule in PEEPHOLE_RULES if rule.name == 'store_load']
+    instructions = compile_source('''
+int main() {
+    int x = 1;
+    int y = x + 1;
+    if (0) {
+        y = 0;
+    }
+    return y;
+}
+''', 0)
+    optimizer = PeepholeOptimizer(only_store_load)
+    optimizer.optimize(instructions.instructions)
+    assert set(optimizer.applied) == {'store_load'}
+    assert optimizer.instructions_removed == 0
+
+    try:
+        Compiler(3)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("nivel de optimización inválido aceptado")
+    print("✅ Reglas configurables: OK")
+
+
+if __name__ == '__main__':
+    test_levels_compute_the_same()
+    test_rules()
+    test_jump_remapping()
+    test_window_with_jump_target()
+    test_configurable_rules()
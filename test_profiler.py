@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Test del perfilador de la VM (profiler.py) y de las líneas de origen del bytecode
+"""
+
+import random
+
+from main import VirtualMachine, OpCode, ExecutionLimits, TerminationReason
+from profiler import Profiler
+from testutils import compile_source, execute, random_program
+
+PROGRAM = '''
+int square(int n) {
+    return n * n;
+}
+
+int main() {
+    int i = 0;
+    int total = 0;
+    while (i < 20) {
+        int j = 0;
+        while (j < 10) {
+            total = total + square(j);
+            j = j + 1;
+        }
+        i = i + 1;
+    }
+    return total;
+}
+'''
+
+
+def count_steps(code):
+    """{opcode: ejecuciones}, paso a paso"""
+    vm = VirtualMachine()
+    vm.load_instructions(code)
+    vm.running = True
+    counts = {}
+    while vm.running and vm.instruction_pointer < len(vm.instructions):
+        opcode = vm.instructions[vm.instruction_pointer].opcode
+        counts[opcode] = counts.get(opcode, 0) + 1
+        vm.execute_instruction()
+    return counts
+
+
+def test_source_lines():
+    """Todas las instrucciones generadas tienen la línea de su sentencia"""
+    rng = random.Random(46)
+    for _ in range(30):
+        source_code = random_program(rng)
+        for opt_level in (0, 2):
+            code = compile_source(source_code, opt_level)
+            for function in [code] + [instr.operand for instr in code if instr.opcode is OpCode.CALL]:
+                assert all(instr.line > 0 for instr in function), (opt_level, source_code)
+
+    code = compile_source(PROGRAM, 0)
+    lines = {instr.line for instr in code}
+    assert lines == {7, 8, 9, 10, 11, 12, 13, 15, 17}
+    print("✅ Líneas de origen: OK")
+
+
+def test_counts():
+    """Cuenta exactamente lo que ejecuta la VM, sin cambiar el resultado"""
+    for opt_level in (0, 2):
+        code = compile_source(PROGRAM, opt_level)
+        profiler = Profiler()
+        vm = execute(code, profiler=profiler)
+        plain = execute(code)
+        assert vm.stack == plain.stack == [20 * 285]
+        assert vm.termination.reason is TerminationReason.RETURNED
+        expected = count_steps(code)
+        assert profiler.opcode_counts() == expected
+        assert profiler.total == sum(expected.values())
+
+        # Por línea: la suma de la línea 12 es la más ejecutada de main
+        lines = profiler.line_counts()
+        assert sum(lines.values()) == profiler.total
+        # LOAD_FAST, LOAD_FAST, BINARY_MUL, RETURN (fusionadas a -O2) por llamada
+        assert lines['square', 3] == (4 if opt_level == 0 else 3) * 200
+        main_lines = {line: count for (function, line), count in lines.items() if function == 'main'}
+        assert max(main_lines, key=main_lines.get) == 12
+
+    # Varias ejecuciones se acumulan hasta reset()
+    total = profiler.total
+    execute(code, profiler=profiler)
+    assert profiler.total == 2 * total
+    profiler.reset()
+    assert profiler.total == 0 and profiler.report().startswith("Perfil de ejecución: 0")
+    print("✅ Cuentas por opcode y por línea: OK")
+
+
+def test_hot_loops():
+    """Los destinos de los saltos hacia atrás son los bucles, con sus iteraciones"""
+    for opt_level in (0, 2):
+        profiler = Profiler()
+        execute(compile_source(PROGRAM, opt_level), profiler=profiler)
+        loops = profiler.hot_loops()
+        assert [(loop.function, loop.iterations) for loop in loops] == [('main', 200), ('main', 20)]
+        # La línea del destino es la del bucle (o la primera de su cuerpo si
+        # el bucle se rotó)
+        assert loops[0].line in (11, 12) and loops[1].line in (9, 10)
+        assert profiler.hot_loops(1) == loops[:1]
+    print("✅ Bucles calientes: OK")
+
+
+def test_sampling_and_report():
+    """Con sample_interval=1 se cronometra todo; el informe tiene las tres secciones"""
+    code = compile_source(PROGRAM)
+    profiler = Profiler(sample_interval=1)
+    execute(code, profiler=profiler)
+    for profile in profiler.functions.values():
+        assert profile.sampled == profile.counts
+        assert all(seconds >= 0 for seconds in profile.sampled_time)
+    times = profiler.opcode_times()
+    assert set(times) == set(profiler.opcode_counts())
+
+    profiler = Profiler(seed=46)
+    execute(code, profiler=profiler)
+    sampled = sum(sum(profile.sampled) for profile in profiler.functions.values())
+    assert profiler.total / 32 < sampled < profiler.total / 8
+    report = profiler.report(top=3)
+    print(report)
+    for heading in ("Opcodes:", "Líneas más ejecutadas:", "Bucles calientes"):
+        assert heading in report
+    assert "OpCode." not in report and "CALL" in report
+
+    try:
+        Profiler(sample_interval=0)
+        assert False, "ValueError esperado"
+    except ValueError:
+        pass
+    print("✅ Muestreo e informe: OK")
+
+
+def test_with_limits():
+    """El perfilador respeta los límites de ejecución y se puede reanudar"""
+    code = compile_source(PROGRAM.replace('i < 20', 'i < 1000000'), 0)
+    profiler = Profiler()
+    limits = ExecutionLimits(max_instructions=5000)
+    vm = execute(code, profiler=profiler, limits=limits)
+    assert vm.termination.reason is TerminationReason.INSTRUCTION_LIMIT
+    # Los límites cobran también lo que se salta un salto hacia delante
+    first = profiler.total
+    assert 4000 < first <= vm.instructions_run
+    limits.max_instructions = 10000
+    vm.run()
+    assert vm.termination.reason is TerminationReason.INSTRUCTION_LIMIT
+    assert 1.8 * first < profiler.total <= vm.instructions_run
+    print("✅ Con límites de ejecución: OK")
+
+
+if __name__ == '__main__':
+    test_source_lines()
+    test_counts()
+    test_hot_loops()
+    test_sampling_and_report()
+    test_with_limits()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Test del backend que traduce el bytecode a Python (pybackend.py)
+"""
+
+import contextlib
+import io
+import random
+
+from main import VirtualMachine, Instruction, OpCode, CodeObject
+from pybackend import PythonBackend, Unsupported, translate, bytecode_hash, program_functions
+from testutils import compile_source, random_program
+
+PROGRAM = '''
+int fib(int n) {
+    if (n < 2) {
+        return n;
+    }
+    return fib(n - 1) + fib(n - 2);
+}
+
+int main() {
+    int i = 0;
+    int total = 0;
+    while (i < 15) {
+        total = total + fib(i) * 3 / 2;
+        i = i + 1;
+    }
+    return total;
+}
+'''
+
+
+def execute(code, backend=None, max_call_depth=1000):
+    """VM tras ejecutar code (con el backend si se da) y lo que imprimió"""
+    vm = VirtualMachine(max_call_depth)
+    vm.load_instructions(code)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        if backend is not None:
+            backend.run(vm)
+        else:
+            vm.run()
+    return vm, output.getvalue()
+
+
+def outcome(code, backend=None, max_call_depth=1000):
+    vm, output = execute(code, backend, max_call_depth)
+    return dict(vm.memory), vm.stack, vm.running, vm.instruction_pointer, output
+
+
+def test_same_result():
+    """Mismo estado final que el intérprete en todos los niveles de optimización"""
+    backend = PythonBackend()
+    for opt_level in (0, 1, 2):
+        code = compile_source(PROGRAM, opt_level)
+        assert outcome(code, backend) == outcome(code)
+    vm, _ = execute(code, backend)
+    assert vm.stack == [1479.0] and not vm.running
+    assert backend.compiled == 4 and backend.deoptimized == backend.interpreted == 0
+    print("✅ Mismo resultado que el intérprete: OK")
+
+
+def test_runtime_errors_deoptimize():
+    """Los errores de ejecución se repiten en el intérprete, con su mensaje y estado"""
+    sources = [
+        'int main() { int z = 0; int y = 5; y = y / z; return y; }',
+        'int main() { int x; int y = x + 1; return y; }',
+        'int f(int n) { return f(n + 1); } int main() { int a = 1; return f(0); }',
+        'int f() { return missing; } int main() { int a = 2; return f(); }',
+    ]
+    backend = PythonBackend()
+    for source_code in sources:
+        code = compile_source(source_code, 0)
+        expected = outcome(code, max_call_depth=50)
+        assert expected[-1].startswith("Runtime Error")
+        assert outcome(code, backend, max_call_depth=50) == expected
+    assert backend.deoptimized == len(sources) and backend.compiled == 0
+
+    # Los globales escritos antes del error se restauran
+    program = CodeObject('<program>', instructions=[
+        Instruction(OpCode.LOAD_CONST, 1), Instruction(OpCode.STORE_VAR, 'g'),
+        Instruction(OpCode.LOAD_VAR, 'g'), Instruction(OpCode.LOAD_CONST, 0),
+        Instruction(OpCode.BINARY_DIV), Instruction(OpCode.STORE_VAR, 'h'),
+    ])
+    assert outcome(program, backend) == outcome(program)
+    print("✅ Errores en tiempo de ejecución: OK")
+
+
+def test_unsupported_falls_back():
+    """PRINT o una pila con valores entre bloques se ejecutan en el intérprete"""
+    printing = CodeObject('<program>', instructions=[
+        Instruction(OpCode.LOAD_CONST, 7), Instruction(OpCode.PRINT),
+        Instruction(OpCode.LOAD_CONST, 1), Instruction(OpCode.RETURN),
+    ])
+    across = CodeObject('<program>', instructions=[
+        Instruction(OpCode.LOAD_CONST, 4), Instruction(OpCode.LOAD_CONST, 0),
+        Instruction(OpCode.JUMP_IF_FALSE, 4), Instruction(OpCode.LOAD_CONST, 5),
+        Instruction(OpCode.RETURN),
+    ])
+    backend = PythonBackend()
+    for code in (printing, across):
+        try:
+            translate(code)
+            assert False, "Unsupported esperado"
+        except Unsupported:
+            pass
+        assert outcome(code, backend) == outcome(code)
+    assert execute(printing, backend)[1] == "7\n"
+    assert backend.interpreted == 3 and backend.compiled == 0
+    print("✅ Vuelta al intérprete: OK")
+
+
+def test_cache():
+    """El código Python se cachea por el hash del bytecode"""
+    backend = PythonBackend(cache_size=2)
+    first = compile_source(PROGRAM)
+    second = compile_source(PROGRAM)
+    assert first is not second
+    key = bytecode_hash(program_functions(first))
+    assert key == bytecode_hash(program_functions(second))
+    assert key != bytecode_hash(program_functions(compile_source(PROGRAM, 0)))
+
+    program = backend.compile(first)
+    assert program.key == key and backend.compile(second) is program
+    assert backend.cache_hits == 1
+    backend.compile(compile_source('int main() { return 1; }'))
+    backend.compile(compile_source('int main() { return 2; }'))
+    # El primero salió de la caché
+    assert backend.compile(first) is not program and backend.cache_hits == 1
+    print("✅ Caché por hash del bytecode: OK")
+
+
+def test_random_programs():
+    """Programas aleatorios con bucles, llamadas y reales"""
+    rng = random.Random(42)
+    backend = PythonBackend()
+    for _ in range(60):
+        source_code = random_program(rng)
+        for opt_level in (0, 2):
+            code = compile_source(source_code, opt_level)
+            assert outcome(code, backend) == outcome(code), source_code
+    assert backend.compiled > 100
+    print(f"✅ Programas aleatorios: OK ({backend.compiled} compilados)")
+
+
+if __name__ == '__main__':
+    test_same_result()
+    test_runtime_errors_deoptimize()
+    test_unsupported_falls_back()
+    test_cache()
+    test_random_programs()
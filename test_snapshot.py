@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Test de snapshot(), restore() y fork() de la VM (Snapshot, memoria copy-on-write)
+"""
+
+from main import (VirtualMachine, Instruction, OpCode, CodeObject, BufferSink, ExecutionLimits,
+                  TerminationReason, Snapshot)
+from testutils import compile_source
+
+PROGRAM = '''
+int step(int v) {
+    int k = 0;
+    while (k < 50) {
+        v = v + k;
+        k = k + 1;
+    }
+    return v;
+}
+
+int main() {
+    int total = 0;
+    int i = 0;
+    while (i < 200) {
+        total = total + step(i);
+        i = i + 1;
+    }
+    return total * factor;
+}
+'''
+
+
+def finish(vm):
+    vm.limits = None
+    vm.run()
+    return vm
+
+
+def expected(factor):
+    return sum(i + 1225 for i in range(200)) * factor
+
+
+def test_restore_mid_call():
+    """Una instantánea dentro de una llamada se reanuda igual, tantas veces como se quiera"""
+    for opt_level in (0, 2):
+        vm = VirtualMachine(limits=ExecutionLimits(max_instructions=30000))
+        vm.load_instructions(compile_source(PROGRAM, opt_level))
+        vm.globals['factor'] = 3
+        vm.run()
+        assert vm.termination.reason is TerminationReason.INSTRUCTION_LIMIT
+        snapshot = vm.snapshot()
+        assert isinstance(snapshot, Snapshot) and len(snapshot.frames) == 2
+        assert snapshot.frames[-1][0].name == 'step'
+        memory = snapshot.memory
+        assert memory == dict(vm.memory) and 0 < memory['i'] < 200
+        ip, stack = vm.instruction_pointer, list(vm.stack)
+
+        assert finish(vm).stack == [expected(3)]
+        # La instantánea no cambia al seguir ejecutando
+        assert snapshot.memory == memory and list(snapshot.stack) == stack
+        for _ in range(2):
+            vm.restore(snapshot)
+            assert vm.instruction_pointer == ip and vm.stack == stack
+            assert len(vm.frames) == 2 and vm.frames[-1].code.name == 'step'
+            assert vm.memory == memory and vm.instructions_run == snapshot.instructions_run
+            assert finish(vm).stack == [expected(3)]
+            assert vm.termination.reason is TerminationReason.RETURNED
+    print("✅ Restaurar dentro de una llamada: OK")
+
+
+def test_fork_fan_out():
+    """Se ejecuta el prefijo una vez y cada hijo sigue con su propia entrada"""
+    vm = VirtualMachine(limits=ExecutionLimits(max_instructions=60000))
+    vm.load_instructions(compile_source(PROGRAM))
+    vm.globals['factor'] = 1
+    vm.run()
+    prefix = vm.instructions_run
+    snapshot = vm.snapshot()
+
+    children = [vm.fork(snapshot, limits=ExecutionLimits(max_instructions=10 ** 7))
+                for _ in range(5)]
+    for factor, child in enumerate(children):
+        # El hijo comparte la memoria hasta que escribe en ella
+        assert child._globals is snapshot.globals
+        child.globals['factor'] = factor
+        assert child._globals is not snapshot.globals
+    for factor, child in enumerate(children):
+        child.run()
+        assert child.stack == [expected(factor)]
+        assert child.instructions_run > prefix
+    # Ni el padre ni la instantánea ven lo que hicieron los hijos
+    assert vm.globals['factor'] == 1 and snapshot.globals['factor'] == 1
+    assert finish(vm).stack == [expected(1)]
+
+    # Sin instantánea, fork() parte del estado actual (con "hola" en la pila);
+    # la configuración, incluido el destino de salida, se hereda
+    sink = BufferSink()
+    parent = VirtualMachine(max_call_depth=7, output=sink)
+    parent.load_instructions([Instruction(OpCode.LOAD_CONST, 'hola'), Instruction(OpCode.PRINT),
+                              Instruction(OpCode.LOAD_VAR, 'v'), Instruction(OpCode.PRINT)])
+    parent.globals['v'] = 1
+    parent.running = True
+    parent.execute_instruction()
+    child = parent.fork()
+    assert child.max_call_depth == 7 and child.output is sink
+    child.globals['v'] = 2
+    child.run()
+    parent.run()
+    assert sink.getvalue() == "hola\n2\nhola\n1\n"
+    print("✅ Fork de un prefijo común: OK")
+
+
+def test_copy_on_write_locals():
+    """Los diccionarios de variables por nombre de cada llamada también se copian al escribir"""
+    callee = CodeObject('f', instructions=[
+        Instruction(OpCode.LOAD_VAR, 'x'), Instruction(OpCode.LOAD_CONST, 1),
+        Instruction(OpCode.BINARY_ADD), Instruction(OpCode.STORE_VAR, 'x'),
+        Instruction(OpCode.LOAD_VAR, 'x'), Instruction(OpCode.RETURN),
+    ])
+    entry = CodeObject('<program>', instructions=[
+        Instruction(OpCode.CALL, callee), Instruction(OpCode.STORE_VAR, 'r'),
+    ])
+    vm = VirtualMachine()
+    vm.load_instructions(entry)
+    vm.running = True
+    vm.execute_instruction()
+    vm.frames[-1].locals['x'] = 10
+    vm.globals['x'] = 100
+    first = vm.snapshot()
+    vm.execute_instruction()
+    vm.execute_instruction()
+    second = vm.snapshot()
+    assert first.frames[-1][3] == {'x': 10} and first.globals == {'x': 100}
+    vm.run()
+    assert vm.memory == {'x': 100, 'r': 11}
+
+    # Dos instantáneas sin escrituras entre ellas comparten los diccionarios
+    third = vm.snapshot()
+    fourth = vm.snapshot()
+    assert third.globals is fourth.globals
+
+    for snapshot in (first, second, first):
+        vm.restore(snapshot)
+        vm.run()
+        assert vm.memory == {'x': 100, 'r': 11} and vm.stack == []
+    assert first.frames[-1][3] == {'x': 10} and second.globals == {'x': 100}
+
+    # Una instantánea de una VM sin cargar no tiene marcos
+    empty = VirtualMachine().snapshot()
+    assert empty.frames == () and empty.memory == {}
+    print("✅ Copy-on-write de las variables: OK")
+
+
+if __name__ == '__main__':
+    test_restore_mid_call()
+    test_fork_fan_out()
+    test_copy_on_write_locals()
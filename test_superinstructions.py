@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Test de las superinstrucciones (superinstructions.py): el código fusionado
+calcula lo mismo que el código sin fusionar
+"""
+
+import os
+import random
+import tempfile
+
+from main import Instruction, OpCode
+from superinstructions import SuperinstructionFuser, profile_sequences
+from testutils import compile_program, compile_source, execute, outcome
+import bytecode
+
+FUSED_OPCODES = {OpCode.INC_FAST, OpCode.LOAD_FAST_LOAD_FAST,
+                 OpCode.COMPARE_JUMP_IF_FALSE, OpCode.COMPARE_FAST_CONST_JUMP_IF_FALSE}
+
+PROGRAM = '''
+int scale(int n, int factor) {
+    int acc = 0;
+    while (n > 0) {
+        acc = acc + factor;
+        n = n - 1;
+    }
+    return acc;
+}
+
+int main() {
+    int i = 0;
+    int total = 0;
+    float x = 0.5;
+    while (i < 30) {
+        if (i > total) {
+            total = total + scale(i, 3);
+        }
+        x = x + 0.25;
+        i = i + 2;
+    }
+    return total;
+}
+'''
+
+
+def fused_opcodes(compiler):
+    return {instr.opcode for code in compiler.functions.values()
+            for instr in code.instructions if instr.opcode in FUSED_OPCODES}
+
+
+def random_program(rng):
+    """Función con bucles acotados, constantes enteras y reales y comparaciones"""
+    operators = ['+', '-', '*']
+    comparisons = ['<', '>', '<=', '>=', '==', '!=']
+    names = ['a', 'b', 'c']
+
+    def operand():
+        choice = rng.random()
+        if choice < 0.5:
+            return rng.choice(names)
+        if choice < 0.8:
+            return str(rng.randint(0, 9))
+        return f"{rng.randint(0, 9)}.5"
+
+    def statement():
+        target = rng.choice(names)
+        if rng.random() < 0.5:
+            return f"{target} = {target} {rng.choice('+-')} {operand()};"
+        return f"{target} = {operand()} {rng.choice(operators)} {operand()};"
+
+    body = []
+    for _ in range(rng.randint(2, 4)):
+        inner = ' '.join(statement() for _ in range(rng.randint(1, 3)))
+        if rng.random() < 0.5:
+            body.append(f"if ({operand()} {rng.choice(comparisons)} {operand()}) {{ {inner} }}")
+        else:
+            # Bucle acotado: el contador solo lo modifica su incremento
+            bound = rng.randint(1, 8)
+            step = rng.randint(1, 3)
+            if rng.random() < 0.5:
+                body.append(f"k = 0; while (k < {bound}) {{ {inner} k = k + {step}; }}")
+            else:
+                body.append(f"k = {bound}; while (k >= 0) {{ {inner} k = k - {step}; }}")
+
+    return f'''
+int work(int a, int b) {{
+    int c = a - b;
+    int k = 0;
+    {' '.join(body)}
+    return a + b * c;
+}}
+
+int main() {{
+    int first = work({rng.randint(0, 5)}, {rng.randint(0, 5)});
+    int second = work(first, {rng.randint(0, 5)});
+    return second - first;
+}}
+'''
+
+
+def test_fused_equals_unfused():
+    """Mismo resultado con y sin superinstrucciones en -O2"""
+    fused, compiler = compile_program(PROGRAM)
+    plain = compile_source(PROGRAM, superinstructions=False)
+    assert fused_opcodes(compiler) == FUSED_OPCODES
+    assert dict(compiler.report)['superinstructions'] > 0
+    vm = execute(fused)
+    assert outcome(vm) == outcome(execute(plain))
+    assert vm.stack == [30] and vm.memory['x'] == 4.25
+    print("✅ Código fusionado equivalente: OK")
+
+
+def test_random_programs():
+    """Programas aleatorios (semilla fija) fusionados y sin fusionar"""
+    rng = random.Random(36)
+    applied = 0
+    for _ in range(60):
+        source_code = random_program(rng)
+        fused, compiler = compile_program(source_code)
+        plain = compile_source(source_code, superinstructions=False)
+        applied += dict(compiler.report)['superinstructions']
+        assert outcome(execute(fused)) == outcome(execute(plain)), source_code
+    assert applied > 0
+    print("✅ Programas aleatorios: OK")
+
+
+def test_undefined_local():
+    """Las superinstrucciones también detectan locales sin asignar"""
+    sources = [
+        'int main() { int x; x = x + 1; int y = 2; return y; }',          # INC_FAST
+        'int main() { int x; int z = x * x; return z; }',                  # LOAD_FAST_LOAD_FAST
+        'int main() { int x; while (x < 3) { x = 3; } return x; }',       # COMPARE_FAST_CONST
+    ]
+    for source_code in sources:
+        fused, compiler = compile_program(source_code)
+        assert fused_opcodes(compiler), source_code
+        vm = execute(fused)
+        assert not vm.running
+        assert outcome(vm) == outcome(execute(compile_source(source_code, superinstructions=False)))
+    print("✅ Local sin asignar: OK")
+
+
+def test_fusion_rules():
+    """Resta como incremento negativo y ventanas con destino de salto"""
+    instructions = [
+        Instruction(OpCode.LOAD_FAST, 0),
+        Instruction(OpCode.LOAD_CONST, 1.5),
+        Instruction(OpCode.BINARY_SUB),
+        Instruction(OpCode.STORE_FAST, 0),
+        Instruction(OpCode.LOAD_FAST, 0),
+        Instruction(OpCode.LOAD_CONST, 1),
+        Instruction(OpCode.BINARY_ADD),        # destino del salto de abajo
+        Instruction(OpCode.STORE_FAST, 1),
+        Instruction(OpCode.LOAD_FAST, 1),
+        Instruction(OpCode.LOAD_CONST, 10),
+        Instruction(OpCode.BINARY_CMP, '<'),
+        Instruction(OpCode.JUMP_IF_FALSE, 13),
+        Instruction(OpCode.JUMP, 6),
+        Instruction(OpCode.RETURN),
+    ]
+    fuser = SuperinstructionFuser()
+    fuser.optimize(instructions)
+    assert fuser.applied == {'inc_fast': 1, 'compare_fast_const_jump': 1}
+    assert fuser.instructions_removed == 6
+    assert instructions[0].opcode == OpCode.INC_FAST and instructions[0].operand == (0, -1.5)
+    assert [instr.opcode for instr in instructions[1:4]] == [
+        OpCode.LOAD_FAST, OpCode.LOAD_CONST, OpCode.BINARY_ADD]
+    assert instructions[5].operand == (1, '<', 10, 7)
+    assert instructions[6].opcode == OpCode.JUMP and instructions[6].operand == 3
+    print("✅ Reglas de fusión: OK")
+
+
+def test_bytecode_round_trip():
+    """El formato .cbc guarda los operandos de las superinstrucciones"""
+    entry, compiler = compile_program(PROGRAM)
+    expected = outcome(execute(entry))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'program.cbc')
+        bytecode.save(path, compiler.functions, entry)
+        loaded = bytecode.load(path)
+    assert [repr(instr) for instr in loaded] == [repr(instr) for instr in entry]
+    assert outcome(execute(loaded)) == expected
+    print("✅ Superinstrucciones en .cbc: OK")
+
+
+def test_profile_sequences():
+    """El perfil cuenta las secuencias ejecutadas"""
+    plain = compile_source(PROGRAM, superinstructions=False)
+    counts = profile_sequences(plain)
+    assert counts[('LOAD_FAST', 'LOAD_CONST', 'BINARY_CMP', 'JUMP_IF_FALSE')] > 0
+    assert max(counts, key=counts.get) in {('LOAD_FAST', 'LOAD_CONST'),
+                                           ('LOAD_FAST', 'LOAD_FAST')}
+    print("✅ Perfil de secuencias: OK")
+
+
+if __name__ == '__main__':
+    test_fused_equals_unfused()
+    test_random_programs()
+    test_undefined_local()
+    test_fusion_rules()
+    test_bytecode_round_trip()
+    test_profile_sequences()
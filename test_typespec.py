@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Test de la especialización por tipos (typespec.py) y del quickening de la VM
+"""
+
+import random
+
+from main import OpCode, SPECIALIZED_ARITHMETIC, QUICKEN_WARMUP, QUICKEN_BACKOFF
+from testutils import compile_program, compile_source, execute, outcome, random_program
+
+PROGRAM = '''
+int half(int n) {
+    return n / 2;
+}
+
+int main() {
+    int i = 0;
+    int total = 0;
+    float scale = 0.5;
+    int mixed = 1;
+    while (i < 10) {
+        total = total + i * 3;
+        scale = scale * 2.0 + i;
+        if (i > 5) {
+            mixed = 1.5;
+        }
+        mixed = mixed + 1;
+        total = total - half(i);
+        i = i + 1;
+    }
+    return total;
+}
+'''
+
+
+def test_specialized_opcodes():
+    """Solo se especializa la aritmética con tipos conocidos"""
+    code, compiler = compile_program(PROGRAM)
+    opcodes = [instr.opcode for instr in code]
+    # i * 3 (antes del bucle tras la reducción de fuerza): int; scale * 2.0 + i: float
+    assert opcodes.count(OpCode.BINARY_MUL_INT) == 1
+    assert opcodes.count(OpCode.BINARY_MUL_FLOAT) == 1
+    assert opcodes.count(OpCode.BINARY_ADD_FLOAT) == 1
+    # total recibe el resultado de half(), que no se conoce
+    assert OpCode.BINARY_ADD in opcodes and OpCode.BINARY_SUB in opcodes
+    # En half, n es un parámetro: sin especializar
+    assert [instr.opcode for instr in compiler.functions['half']
+            if instr.opcode in SPECIALIZED_ARITHMETIC] == []
+    assert compiler.specialized == {'main': 3}
+
+    vm = execute(code)
+    assert outcome(vm) == outcome(execute(compile_source(PROGRAM, type_specialization=False)))
+    assert vm.memory['scale'] == 1525.0 and type(vm.memory['scale']) is float
+    print("✅ Opcodes especializados: OK")
+
+
+def test_division():
+    """La división sigue siendo real y la división por cero sigue siendo un error"""
+    code = compile_source('int main() { int a = 7; int b = 2; int c = a / b; return c; }', 1)
+    from typespec import TypeSpecializer
+    specializer = TypeSpecializer()
+    assert specializer.optimize(code.instructions, 0, len(code.varnames)) == 1
+    assert OpCode.BINARY_DIV_FLOAT in [instr.opcode for instr in code]
+    assert execute(code).stack == [3.5]
+
+    code = compile_source('int main() { int a = 7; int b = 0; int c = a / b; return c; }', 1)
+    assert specializer.optimize(code.instructions, 0, len(code.varnames)) == 1
+    vm = execute(code)
+    assert not vm.running and 'c' not in vm.memory
+    # Una segunda pasada no cambia nada
+    assert specializer.optimize(code.instructions, 0, len(code.varnames)) == 0
+    print("✅ División especializada: OK")
+
+
+def test_quickening():
+    """La VM reescribe la aritmética genérica en su lista decodificada, con guarda"""
+    source_code = '''
+int add(int a, int b) {
+    return a + b;
+}
+
+int main() {
+    int i = 0;
+    int total = 0;
+    while (i < 20) {
+        total = add(total, i);
+        i = i + 1;
+    }
+    float x = 0.5;
+    i = 0;
+    while (i < 80) {
+        x = add(x, 0.25);
+        i = i + 1;
+    }
+    return RESULT;
+}
+'''
+    code, compiler = compile_program(source_code.replace('RESULT', 'add(x, total)'), 0)
+    add = compiler.functions['add']
+    index = [instr.opcode for instr in add].index(OpCode.BINARY_ADD)
+    vm = execute(code)
+    assert vm.stack == [190 + 0.5 + 80 * 0.25]
+
+    # 20 sumas de enteros, 80 de reales (la guarda falla y se vuelve a
+    # especializar tras QUICKEN_BACKOFF) y una mezcla: queda genérica
+    handler, operand = vm._decode(add.instructions)[index]
+    assert handler.__name__ == '_op_add' and operand is None
+    # El CodeObject no cambia
+    assert add.instructions[index].opcode is OpCode.BINARY_ADD
+    # En main, i = i + 1 se queda especializado
+    handlers = {handler.__name__ for handler, _ in vm._decode(code.instructions)}
+    assert '_quick_add_int' in handlers
+
+    # Sin la última suma mezclada, add termina especializada para reales
+    code, compiler = compile_program(source_code.replace('RESULT', 'x'), 0)
+    add = compiler.functions['add']
+    vm = execute(code)
+    assert vm.stack == [20.5]
+    handler, operand = vm._decode(add.instructions)[index]
+    assert handler.__name__ == '_quick_add_float' and operand.__name__ == '_op_add'
+
+    # Tras la desespecialización, add no vuelve a especializarse hasta
+    # QUICKEN_BACKOFF ejecuciones más (contando la que falló la guarda)
+    floats = source_code.replace('i < 80', 'i < COUNT').replace('RESULT', 'x')
+    for count, quickened in ((1, False), (QUICKEN_BACKOFF - 1, False), (QUICKEN_BACKOFF, True)):
+        code, compiler = compile_program(floats.replace('COUNT', str(count)), 0)
+        add = compiler.functions['add']
+        vm = execute(code)
+        handler, operand = vm._decode(add.instructions)[index]
+        if quickened:
+            assert handler.__name__ == '_quick_add_float'
+        else:
+            assert handler.__name__ == '_op_add'
+            assert operand == (QUICKEN_BACKOFF - count, float)
+
+    # Menos ejecuciones que QUICKEN_WARMUP no especializan
+    vm = execute(compile_source('int main() { int x = 1; x = x + 1; return x; }', 0))
+    assert QUICKEN_WARMUP > 1
+    assert not any(handler.__name__.startswith('_quick')
+                   for handler, _ in vm._decode(vm.instructions))
+    print("✅ Quickening con guarda: OK")
+
+
+def test_random_programs():
+    """Programas aleatorios con enteros y reales: mismo resultado con y sin especializar"""
+    rng = random.Random(43)
+    specialized = 0
+    for _ in range(80):
+        source_code = random_program(rng)
+        code, compiler = compile_program(source_code)
+        plain = compile_source(source_code, type_specialization=False)
+        specialized += sum(compiler.specialized.values())
+        result = execute(code)
+        assert outcome(result) == outcome(execute(plain)), source_code
+        # El intérprete sin quickening (-O0) da lo mismo
+        assert outcome(result) == outcome(execute(compile_source(source_code, 0)))
+    assert specialized > 80
+    print(f"✅ Programas aleatorios: OK ({specialized} instrucciones especializadas)")
+
+
+if __name__ == '__main__':
+    test_specialized_opcodes()
+    test_division()
+    test_quickening()
+    test_random_programs()
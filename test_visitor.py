@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Test del framework de visitantes del AST (recorrido iterativo)
+"""
+
+import sys
+
+from main import ASTNode, NodeType, ASTVisitor, ASTTransformer, CodeGenerator, OpCode, walk
+
+DEPTH = 100_000
+
+
+def build_chain(depth, right_deep=False):
+    """Construye 1 + 1 + ... + 1 con `depth` operadores anidados"""
+    node = ASTNode(NodeType.LITERAL, 1)
+    for _ in range(depth):
+        leaf = ASTNode(NodeType.LITERAL, 1)
+        children = [leaf, node] if right_deep else [node, leaf]
+        node = ASTNode(NodeType.BINARY_EXPRESSION, '+', children)
+    return node
+
+
+class Evaluator(ASTVisitor):
+    """Evalúa sumas; usa el resultado de cada yield"""
+
+    def visit_literal(self, node):
+        return node.value
+
+    def visit_binary_expression(self, node):
+        left = yield node.children[0]
+        right = yield node.children[1]
+        return left + right
+
+
+class OrderRecorder(ASTVisitor):
+    """Registra el orden pre y post de cada nodo"""
+
+    def __init__(self):
+        self.events = []
+
+    def generic_visit(self, node):
+        self.events.append(('pre', node.value))
+        for child in node.children:
+            yield child
+        self.events.append(('post', node.value))
+
+
+class DoubleLiterals(ASTTransformer):
+    def visit_literal(self, node):
+        return ASTNode(NodeType.LITERAL, node.value * 2)
+
+
+def test_deep_chains():
+    """Cadenas de 100k niveles sin tocar el límite de recursión"""
+    assert DEPTH > sys.getrecursionlimit()
+
+    for right_deep in (False, True):
+        chain = build_chain(DEPTH, right_deep)
+
+        assert sum(1 for _ in walk(chain)) == 2 * DEPTH + 1
+        assert max(depth for _, depth in walk(chain)) == DEPTH
+        assert Evaluator().visit(chain) == DEPTH + 1
+
+        DoubleLiterals().visit(chain)
+        assert Evaluator().visit(chain) == 2 * (DEPTH + 1)
+
+    print(f"✅ Cadenas de {DEPTH} niveles: OK")
+
+
+def test_codegen_deep_expression():
+    """El generador de código recorre expresiones profundas"""
+    program = ASTNode(NodeType.PROGRAM, children=[
+        ASTNode(NodeType.FUNCTION, 'main', [
+            ASTNode(NodeType.LITERAL, 'int'),
+            ASTNode(NodeType.ASSIGNMENT, 'x', [
+                ASTNode(NodeType.IDENTIFIER, 'x'),
+                build_chain(DEPTH),
+            ]),
+        ])
+    ])
+
+    instructions = CodeGenerator().generate(program)
+
+    # Carga de 1 + DEPTH constantes, DEPTH sumas, STORE y el return implícito
+    assert len(instructions) == 2 * DEPTH + 4
+    assert instructions[0].opcode == OpCode.LOAD_CONST
+    assert instructions[-4].opcode == OpCode.BINARY_ADD
+    assert instructions[-3].opcode == OpCode.STORE_FAST
+    assert instructions[-1].opcode == OpCode.RETURN
+    print(f"✅ Generación de código para {len(instructions)} instrucciones: OK")
+
+
+def test_hook_order():
+    """Los hooks pre-orden y post-orden se ejecutan en el orden esperado"""
+    tree = ASTNode(NodeType.PROGRAM, 'a', [
+        ASTNode(NodeType.FUNCTION, 'b', [ASTNode(NodeType.LITERAL, 'c')]),
+        ASTNode(NodeType.FUNCTION, 'd'),
+    ])
+    recorder = OrderRecorder()
+    recorder.visit(tree)
+
+    assert recorder.events == [
+        ('pre', 'a'), ('pre', 'b'), ('pre', 'c'), ('post', 'c'),
+        ('post', 'b'), ('pre', 'd'), ('post', 'd'), ('post', 'a'),
+    ]
+    assert [node.value for node, _ in walk(tree)] == ['a', 'b', 'c', 'd']
+    print("✅ Orden de hooks: OK")
+
+
+def test_dispatch_table_per_class():
+    """Cada clase de visitante tiene su propia tabla de despacho"""
+    class ChildEvaluator(Evaluator):
+        def visit_literal(self, node):
+            return 10
+
+    tree = build_chain(2)
+    assert Evaluator().visit(tree) == 3
+    assert ChildEvaluator().visit(tree) == 30
+    assert Evaluator._dispatch_table() is not ChildEvaluator._dispatch_table()
+    assert ChildEvaluator._dispatch_table()[NodeType.LITERAL] is ChildEvaluator.visit_literal
+    print("✅ Tabla de despacho por clase: OK")
+
+
+if __name__ == '__main__':
+    test_deep_chains()
+    test_codegen_deep_expression()
+    test_hook_order()
+    test_dispatch_table_per_class()
@@ -3,7 +3,9 @@
 Test independiente de la Máquina Virtual
 """
 
-from main import LexicalAnalyzer, Parser, CodeGenerator, VirtualMachine, Instruction, OpCode
+from main import (LexicalAnalyzer, Parser, CodeGenerator, VirtualMachine, Instruction, OpCode,
+                  FRAME_POOL_SIZE, UNSET, thread_jumps, HANDLERS, OPCODE_INDEX, CodeObject,
+                  CHECKED_HANDLERS, VerifyError, stack_depths, max_stack_depth, verify)
 
 def test_virtual_machine():
     """Prueba de la máquina virtual con código completo"""
@@ -122,6 +124,366 @@ def test_vm_manual():
     print(f"\nResultado: {vm.memory.get('result', 'No encontrado')}")
     print(f"Memoria completa: {vm.memory}")
 
+def compile_source(source_code):
+    """Lexer -> Parser -> CodeGenerator; devuelve (instrucciones, generador)"""
+    lexer = LexicalAnalyzer()
+    lexer.analyze(source_code)
+    parser = Parser(lexer.tokens)
+    ast = parser.parse()
+    assert not parser.errors, parser.errors
+    codegen = CodeGenerator()
+    instructions = codegen.generate(ast)
+    return instructions, codegen
+
+def test_function_calls():
+    """Llamadas con argumentos, valores de retorno y reutilización de frames"""
+    source_code = '''
+int add(int a, int b) {
+    return a + b;
+}
+
+int twice(int x) {
+    return add(x, x);
+}
+
+void log_value(int v) {
+    int ignored = v;
+}
+
+int main() {
+    int r = add(2, 3) * twice(4);
+    log_value(r);
+    int s = add(1, add(2, add(3, 4)));
+    return r - s;
+}
+'''
+    instructions, codegen = compile_source(source_code)
+    assert not codegen.errors
+    assert set(codegen.functions) == {'add', 'twice', 'log_value', 'main'}
+    assert codegen.functions['add'].params == ['a', 'b']
+    assert instructions is codegen.functions['main']
+    assert any(instr.opcode == OpCode.CALL for instr in instructions)
+
+    vm = VirtualMachine()
+    pooled = {id(frame) for frame in vm._frame_pool}
+    vm.load_instructions(instructions)
+    vm.run()
+
+    assert vm.memory == {'r': 40, 's': 10}
+    assert vm.stack == [30]
+    # Los parámetros y locales de las funciones no llegan a la memoria global
+    assert 'a' not in vm.memory and 'ignored' not in vm.memory
+    # Todos los frames vuelven al pool y no se creó ninguno nuevo
+    assert len(vm.frames) == 1
+    assert len(vm._frame_pool) == FRAME_POOL_SIZE - 1
+    assert {id(frame) for frame in vm._frame_pool} <= pooled
+    print("✅ Llamadas a funciones: OK")
+
+def test_call_errors():
+    """Errores de generación y desbordamiento de la pila de llamadas"""
+    lexer = LexicalAnalyzer()
+    lexer.analyze('''
+int one(int a) { return a; }
+int main() { int x = one(1, 2); int y = missing(); return 0; }
+''')
+    codegen = CodeGenerator()
+    codegen.generate(Parser(lexer.tokens).parse())
+    messages = [error['message'] for error in codegen.errors]
+    assert messages == ["Function 'one' expects 1 arguments, got 2",
+                        "Undefined function 'missing'"]
+
+    instructions, _ = compile_source('''
+int forever(int n) { return forever(n + 1); }
+int main() { return forever(0); }
+''')
+    vm = VirtualMachine(max_call_depth=50)
+    vm.load_instructions(instructions)
+    vm.run()
+    assert not vm.running
+    assert len(vm.frames) == 50
+    print("✅ Errores de llamadas: OK")
+
+def test_control_flow():
+    """if/while con saltos resueltos: bucles, recursión y condiciones falsas"""
+    instructions, codegen = compile_source('''
+int fact(int n) {
+    if (n <= 1) {
+        return 1;
+    }
+    return n * fact(n - 1);
+}
+
+int main() {
+    int i = 0;
+    int evens = 0;
+    while (i < 10) {
+        if (i == 2) {
+            evens = evens + 1;
+        }
+        if (i == 6) {
+            evens = evens + 1;
+        }
+        i = i + 1;
+    }
+    int skipped = 1;
+    if (i < 0) {
+        skipped = 0;
+    }
+    return fact(5);
+}
+''')
+    assert not codegen.errors
+    for code in codegen.functions.values():
+        for instr in code.instructions:
+            if instr.opcode in (OpCode.JUMP, OpCode.JUMP_IF_FALSE):
+                assert isinstance(instr.operand, int)
+                assert 0 <= instr.operand <= len(code.instructions)
+
+    vm = VirtualMachine()
+    vm.load_instructions(instructions)
+    vm.run()
+    assert vm.memory == {'i': 10, 'evens': 2, 'skipped': 1}
+    assert vm.stack == [120]
+    print("✅ Control de flujo: OK")
+
+def test_jump_threading():
+    """Los saltos que caen en un JUMP van directamente a su destino final"""
+    instructions, _ = compile_source('''
+int main() {
+    int i = 0;
+    int j = 0;
+    while (i < 3) {
+        j = 0;
+        while (j < 3) {
+            j = j + 1;
+        }
+        i = i + 1;
+        if (i > 100) {
+            i = 0;
+        }
+    }
+    return i + j;
+}
+''')
+    # Ningún salto apunta a un JUMP incondicional
+    for instr in instructions:
+        if instr.opcode in (OpCode.JUMP, OpCode.JUMP_IF_FALSE):
+            target = instr.operand
+            assert target >= len(instructions) or instructions[target].opcode != OpCode.JUMP
+
+    vm = VirtualMachine()
+    vm.load_instructions(instructions)
+    vm.run()
+    assert vm.stack == [6]
+
+    # Cadenas y ciclos de saltos construidos a mano
+    chain = [
+        Instruction(OpCode.JUMP, 1),
+        Instruction(OpCode.JUMP, 2),
+        Instruction(OpCode.JUMP_IF_FALSE, 3),
+        Instruction(OpCode.JUMP, 4),
+        Instruction(OpCode.JUMP, 3),
+    ]
+    assert thread_jumps(chain) == 1
+    assert [instr.operand for instr in chain] == [2, 2, 3, 4, 3]
+    print("✅ Jump threading: OK")
+
+def test_slot_locals():
+    """Variables locales en slots del frame; solo los globales van por nombre"""
+    code, codegen = compile_source('''
+int scale(int a, int b) {
+    int product = a * b;
+    product = product + offset;
+    return product;
+}
+
+int main() {
+    int x = 3;
+    int y = scale(x, 4);
+    int unset;
+    return y;
+}
+''')
+    scale = codegen.functions['scale']
+    assert scale.varnames == ['a', 'b', 'product']
+    assert code.varnames == ['x', 'y', 'unset']
+
+    # 'offset' no es local de scale: se lee por nombre de los globales
+    loads = [instr for instr in scale if instr.opcode in (OpCode.LOAD_VAR, OpCode.LOAD_FAST)]
+    assert [(instr.opcode, instr.operand) for instr in loads] == [
+        (OpCode.LOAD_FAST, 0), (OpCode.LOAD_FAST, 1),
+        (OpCode.LOAD_FAST, 2), (OpCode.LOAD_VAR, 'offset'),
+        (OpCode.LOAD_FAST, 2),
+    ]
+    assert not any(instr.opcode in (OpCode.LOAD_VAR, OpCode.STORE_VAR) for instr in code)
+
+    vm = VirtualMachine()
+    vm.load_instructions(code)
+    vm.globals['offset'] = 100
+    vm.run()
+    assert vm.stack == [112]
+    # vm.memory muestra los globales y los slots asignados de main
+    assert vm.memory == {'offset': 100, 'x': 3, 'y': 112}
+    assert vm.frames[0].slots[:3] == [3, 112, UNSET]
+
+    # Los slots de un frame reutilizado vuelven a estar sin asignar
+    frame = vm._frame_pool[-1]
+    assert frame.slots[:3] == [3, 4, 112]
+    assert frame.bind_slots(scale) == [UNSET] * 3
+    print("✅ Variables locales en slots: OK")
+
+def test_undefined_local():
+    """Leer un local sin asignar es un error de ejecución"""
+    code, _ = compile_source('''
+int main() {
+    int x;
+    int y = x + 1;
+    return y;
+}
+''')
+    vm = VirtualMachine()
+    vm.load_instructions(code)
+    vm.run()
+    assert not vm.running
+    assert 'y' not in vm.memory
+    print("✅ Local sin asignar: OK")
+
+def test_handler_dispatch():
+    """run() con la tabla de handlers equivale a ejecutar paso a paso"""
+    assert len(HANDLERS) == len(OPCODE_INDEX) == len(OpCode)
+
+    from compiler import Compiler
+    lexer = LexicalAnalyzer()
+    lexer.analyze('''
+int fib(int n) {
+    if (n < 2) {
+        return n;
+    }
+    return fib(n - 1) + fib(n - 2);
+}
+
+int main() {
+    int i = 0;
+    int total = 0;
+    while (i < 12) {
+        total = total + fib(i) * 2 / 4;
+        i = i + 1;
+    }
+    return total;
+}
+''')
+    ast = Parser(lexer.tokens).parse()
+    for opt_level in (0, 2):
+        # En -O2 hay superinstrucciones
+        code = Compiler(opt_level).compile(ast)
+        vm = VirtualMachine()
+        vm.load_instructions(code)
+        vm.run()
+        stepped = VirtualMachine()
+        stepped.load_instructions(code)
+        stepped.running = True
+        while stepped.running and stepped.instruction_pointer < len(stepped.instructions):
+            stepped.execute_instruction()
+        assert vm.stack == stepped.stack == [116.0]
+        assert dict(vm.memory) == dict(stepped.memory)
+        assert vm.instruction_pointer == stepped.instruction_pointer
+        assert not vm.running and not stepped.running
+
+    # Casos límite: operandos que faltan, salto más allá del final, división por cero
+    vm = VirtualMachine()
+    vm.load_instructions([Instruction(OpCode.LOAD_CONST, 7), Instruction(OpCode.BINARY_ADD),
+                          Instruction(OpCode.POP), Instruction(OpCode.POP),
+                          Instruction(OpCode.JUMP_IF_FALSE, 0), Instruction(OpCode.JUMP, 99)])
+    vm.run()
+    assert vm.stack == [] and vm.running and vm.instruction_pointer == 6
+    vm.load_instructions([Instruction(OpCode.LOAD_CONST, 1), Instruction(OpCode.LOAD_CONST, 0),
+                          Instruction(OpCode.BINARY_DIV), Instruction(OpCode.LOAD_CONST, 5)])
+    vm.run()
+    assert vm.stack == [] and not vm.running and vm.instruction_pointer == 3
+    print("✅ Despacho por tabla de handlers: OK")
+
+def test_stack_verifier():
+    """Profundidad máxima de la pila y verificador del bytecode"""
+    code, codegen = compile_source('''
+int fib(int n) {
+    if (n < 2) {
+        return n;
+    }
+    return fib(n - 1) + fib(n - 2);
+}
+
+int main() {
+    int x = fib(10) * 2;
+    fib(3);
+    return x;
+}
+''')
+    fib = codegen.functions['fib']
+    # n, 1 sobre el resultado de fib(n - 1)
+    assert fib.stacksize == 3 and code.stacksize == 2
+    assert verify(fib) == max_stack_depth(fib.instructions) == 3
+    assert stack_depths(fib.instructions)[:3] == [0, 1, 2]
+
+    # El código compilado usa los handlers sin comprobaciones
+    vm = VirtualMachine()
+    vm.load_instructions(code)
+    vm.run()
+    assert vm.stack == [110]
+    assert vm._decode(fib.instructions)[0][0] is HANDLERS[OPCODE_INDEX[OpCode.LOAD_FAST]]
+    assert vm._decode(code.instructions)[-2][0] is not CHECKED_HANDLERS[OPCODE_INDEX[OpCode.POP]]
+
+    # Una pila declarada menor de la necesaria no se acepta
+    fib.stacksize = 2
+    try:
+        verify(fib)
+    except VerifyError as e:
+        assert 'needs a stack of 3' in str(e)
+    else:
+        raise AssertionError("pila insuficiente aceptada")
+
+    invalid = [
+        ([Instruction(OpCode.LOAD_CONST, 1), Instruction(OpCode.BINARY_ADD)], 'pops 2'),
+        ([Instruction(OpCode.LOAD_CONST, 0), Instruction(OpCode.JUMP_IF_FALSE, 3),
+          Instruction(OpCode.LOAD_CONST, 1), Instruction(OpCode.LOAD_CONST, 2),
+          Instruction(OpCode.POP)], 'stack depths'),
+        ([Instruction(OpCode.LOAD_CONST, 1), Instruction(OpCode.DUP),
+          Instruction(OpCode.RETURN)], 'besides the return value'),
+        ([Instruction(OpCode.JUMP, 5)], 'outside'),
+        ([Instruction(OpCode.CALL, 'fib')], 'not a CodeObject'),
+    ]
+    for instructions, message in invalid:
+        try:
+            stack_depths(instructions)
+        except VerifyError as e:
+            assert message in str(e), str(e)
+        else:
+            raise AssertionError(f"verificado: {instructions}")
+
+    # Código inalcanzable y saltos al final
+    depths = stack_depths([Instruction(OpCode.JUMP, 2), Instruction(OpCode.POP),
+                           Instruction(OpCode.LOAD_CONST, 1), Instruction(OpCode.JUMP_IF_FALSE, 4)])
+    assert depths == [0, None, 0, 1]
+
+    # Quien llama a una función sin verificar tampoco usa los handlers sin comprobaciones
+    broken = CodeObject('broken', instructions=[Instruction(OpCode.RETURN)])
+    caller = CodeObject('main', instructions=[Instruction(OpCode.CALL, broken),
+                                              Instruction(OpCode.STORE_VAR, 'r')])
+    stack_depths(caller.instructions)
+    vm = VirtualMachine()
+    vm.load_instructions(caller)
+    vm.run()
+    assert vm._decode(caller.instructions)[1][0] is CHECKED_HANDLERS[OPCODE_INDEX[OpCode.STORE_VAR]]
+    assert vm.stack == [] and 'r' not in vm.memory
+    print("✅ Verificador de la pila: OK")
+
 if __name__ == '__main__':
     test_virtual_machine()
     test_vm_manual()
+    test_function_calls()
+    test_call_errors()
+    test_control_flow()
+    test_jump_threading()
+    test_slot_locals()
+    test_undefined_local()
+    test_handler_dispatch()
+    test_stack_verifier()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Utilidades comunes de los tests: compilar código fuente, ejecutarlo en la
+VirtualMachine, el programa gcd de ejemplo y el generador de programas
+aleatorios con bucles
+"""
+
+import contextlib
+import io
+
+from main import LexicalAnalyzer, Parser, VirtualMachine
+from compiler import Compiler
+
+
+# Programa con bucles, ifs constantes y llamadas de los tests del peephole y
+# del bytecode compacto
+GCD_PROGRAM = '''
+int gcd(int a, int b) {
+    while (a != b) {
+        if (a > b) {
+            a = a - b;
+        }
+        if (b > a) {
+            b = b - a;
+        }
+    }
+    return a;
+}
+
+int main() {
+    int limit = 4;
+    int total = 0;
+    int i = 1;
+    while (i <= limit * 2) {
+        total = total + gcd(i * 6, 48);
+        i = i + 1;
+    }
+    if (0) {
+        total = 0 - 1;
+    }
+    while (0) {
+        total = total + 1;
+    }
+    if (1) {
+        total = total * 10;
+    }
+    return total;
+}
+'''
+
+
+def parse(source_code):
+    """AST de source_code; falla si el parser da errores"""
+    lexer = LexicalAnalyzer()
+    lexer.analyze(source_code)
+    parser = Parser(lexer.tokens)
+    ast = parser.parse()
+    assert not parser.errors, parser.errors
+    return ast
+
+
+def compile_program(source_code, opt_level=2, **options):
+    """(CodeObject de entrada, Compiler); las opciones van a Compiler"""
+    compiler = Compiler(opt_level, **options)
+    entry = compiler.compile(parse(source_code))
+    assert not compiler.errors, compiler.errors
+    return entry, compiler
+
+
+def compile_source(source_code, opt_level=2, **options):
+    """Solo el CodeObject de entrada de compile_program()"""
+    return compile_program(source_code, opt_level, **options)[0]
+
+
+def execute(code, **options):
+    """VM tras ejecutar code; las opciones van a VirtualMachine"""
+    vm = VirtualMachine(**options)
+    vm.load_instructions(code)
+    vm.run()
+    return vm
+
+
+def execute_with_output(code, **options):
+    """(VM, lo que imprimió) tras ejecutar code"""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        vm = execute(code, **options)
+    return vm, output.getvalue()
+
+
+def outcome(vm):
+    return dict(vm.memory), vm.stack, vm.running
+
+
+def random_program(rng):
+    """Bucles anidados acotados con expresiones invariantes, productos, llamadas,
+    divisiones que pueden fallar y returns dentro de un if"""
+    names = ['a', 'b', 'c']
+    # d no se asigna en los bucles: las divisiones por d - k son invariantes
+    operands = names + ['d']
+
+    def operand():
+        choice = rng.random()
+        if choice < 0.35:
+            return rng.choice(operands)
+        if choice < 0.55:
+            return rng.choice(['i', 'j'])
+        if choice < 0.9:
+            return str(rng.randint(1, 9))
+        return f"{rng.randint(0, 9)}.5"
+
+    def expression(depth=2):
+        if depth == 0 or rng.random() < 0.3:
+            return operand()
+        return f"{expression(depth - 1)} {rng.choice('+-*')} {expression(depth - 1)}"
+
+    def statements(count):
+        result = []
+        for _ in range(count):
+            target = rng.choice(names)
+            value = expression()
+            if rng.random() < 0.2:
+                value = f"bump({value})"
+            elif rng.random() < 0.2:
+                value = f"{rng.randint(1, 99)} / (d - {rng.randint(0, 5)})"
+            if rng.random() < 0.2:
+                result.append(f"if ({expression(1)} > {rng.randint(0, 20)}) {{ return {value}; }}")
+            elif rng.random() < 0.3:
+                result.append(f"if ({expression(1)} > {rng.randint(0, 20)}) {{ {target} = {value}; }}")
+            else:
+                result.append(f"{target} = {value};")
+        return ' '.join(result)
+
+    return f'''
+int bump(int v) {{
+    return v * 2 + 1;
+}}
+
+int main() {{
+    int a = {rng.randint(0, 5)};
+    int b = {rng.randint(0, 5)};
+    int c = {rng.randint(0, 5)};
+    int d = {rng.randint(0, 5)};
+    int i = 0;
+    int j = 0;
+    while (i < {rng.randint(0, 4)}) {{
+        {statements(rng.randint(0, 2))}
+        j = {rng.randint(0, 2)};
+        while (j < {rng.randint(2, 5)}) {{
+            {statements(rng.randint(1, 3))}
+            j = j + {rng.randint(1, 2)};
+        }}
+        i = i + 1;
+    }}
+    return a + b * c;
+}}
+'''
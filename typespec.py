@@ -0,0 +1,216 @@
+"""
+Type specialization of arithmetic
+
+TypeSpecializer infers the type of every stack value and frame slot of a
+function by forward dataflow over its basic blocks. A type is one of:
+
+    int     int constants, int arithmetic, comparison results
+    float   float constants, arithmetic with a float operand, division
+    None    anything else: parameters, globals, call results, strings
+
+A slot with no store on some path into a block takes its type from the
+other paths (reading it there is a runtime error anyway). Where both
+operands of an arithmetic instruction are known numbers it is replaced
+by a type-specialized opcode:
+
+    BINARY_ADD/SUB/MUL   int and int       -> BINARY_ADD_INT ...
+                         a float involved  -> BINARY_ADD_FLOAT ...
+    BINARY_DIV           two numbers       -> BINARY_DIV_FLOAT
+
+They compute the same as the generic opcodes (`/` is still true division,
+so it always gives a float) but the VM runs them without the checks it
+needs for arbitrary operands. Arithmetic the compiler cannot type is
+specialized at run time instead, by quickening in the VM (see main.py).
+
+The pass runs after superinstruction fusion, which matches the generic
+opcodes. A function whose stack cannot be followed (underflow, different
+depths where paths meet) is left as it is.
+"""
+
+from main import Instruction, OpCode, SPECIALIZED_ARITHMETIC
+from deadcode import block_starts, successors
+
+_UNASSIGNED = object()
+
+_NUMBERS = (int, float)
+
+_SPECIALIZED = {
+    (OpCode.BINARY_ADD, int): OpCode.BINARY_ADD_INT,
+    (OpCode.BINARY_SUB, int): OpCode.BINARY_SUB_INT,
+    (OpCode.BINARY_MUL, int): OpCode.BINARY_MUL_INT,
+    (OpCode.BINARY_ADD, float): OpCode.BINARY_ADD_FLOAT,
+    (OpCode.BINARY_SUB, float): OpCode.BINARY_SUB_FLOAT,
+    (OpCode.BINARY_MUL, float): OpCode.BINARY_MUL_FLOAT,
+    (OpCode.BINARY_DIV, float): OpCode.BINARY_DIV_FLOAT,
+}
+
+# (values popped, values pushed) of the opcodes whose results are untyped
+_UNTYPED_EFFECTS = {
+    OpCode.LOAD_VAR: (0, 1),
+    OpCode.STORE_VAR: (1, 0),
+    OpCode.POP: (1, 0),
+    OpCode.PRINT: (1, 0),
+    OpCode.JUMP_IF_FALSE: (1, 0),
+    OpCode.JUMP: (0, 0),
+    OpCode.RETURN: (0, 0),
+    OpCode.COMPARE_JUMP_IF_FALSE: (2, 0),
+    OpCode.COMPARE_FAST_CONST_JUMP_IF_FALSE: (0, 0),
+}
+
+
+class _Untracked(Exception):
+    """The function's stack cannot be followed"""
+
+
+def value_type(value):
+    """int or float for constants of exactly that type, otherwise None"""
+    kind = type(value)
+    return kind if kind in _NUMBERS else None
+
+
+def arithmetic_type(opcode, a, b):
+    """Type of the result of a generic arithmetic opcode on operands of types a and b"""
+    if a not in _NUMBERS or b not in _NUMBERS:
+        return None
+    if opcode is OpCode.BINARY_DIV or a is float or b is float:
+        return float
+    return int
+
+
+def _join(first, second):
+    if first is _UNASSIGNED:
+        return second
+    if second is _UNASSIGNED or first is second:
+        return first
+    return None
+
+
+class TypeSpecializer:
+    """Replaces generic arithmetic with type-specialized opcodes, in place.
+
+    `specialized` maps each function to the instructions it specialized
+    and `instructions_specialized` is their total.
+    """
+
+    def __init__(self):
+        self.specialized = {}
+        self.instructions_specialized = 0
+
+    def optimize_functions(self, functions):
+        for name, code in functions.items():
+            count = self.optimize(code.instructions, len(code.params), len(code.varnames))
+            if count:
+                self.specialized[name] = count
+
+    def optimize(self, instructions, params=0, slot_count=0):
+        """Specialize one instruction list; returns how many instructions changed"""
+        try:
+            types = self.infer(instructions, params, slot_count)
+        except _Untracked:
+            return 0
+
+        count = 0
+        for index, instr in enumerate(instructions):
+            operands = types.get(index)
+            if operands is None:
+                continue
+            kind = arithmetic_type(instr.opcode, *operands)
+            specialized = _SPECIALIZED.get((instr.opcode, kind))
+            if specialized is not None:
+                instructions[index] = Instruction(specialized, line=instr.line)
+                count += 1
+        self.instructions_specialized += count
+        return count
+
+    def infer(self, instructions, params=0, slot_count=0):
+        """{index of a generic arithmetic instruction: (type of a, type of b)}"""
+        starts = block_starts(instructions)
+        if not starts:
+            return {}
+        ends = dict(zip(starts, starts[1:] + [len(instructions)]))
+        slots = [None] * params + [_UNASSIGNED] * (slot_count - params)
+        states = {0: (tuple(slots), ())}
+        operands = {}
+        work = [0]
+        while work:
+            start = work.pop()
+            slots, stack = states[start]
+            slots, stack = list(slots), list(stack)
+            for index in range(start, ends[start]):
+                self._transfer(instructions[index], index, slots, stack, operands)
+            for target in successors(instructions, start, ends[start]):
+                if target not in ends:
+                    continue
+                state = self._merge(states.get(target), slots, stack)
+                if state != states.get(target):
+                    states[target] = state
+                    work.append(target)
+        return {index: pair for index, pair in operands.items() if pair is not None}
+
+    @staticmethod
+    def _merge(previous, slots, stack):
+        if previous is None:
+            return tuple(slots), tuple(stack)
+        old_slots, old_stack = previous
+        if len(old_stack) != len(stack):
+            raise _Untracked
+        return (tuple(_join(a, b) for a, b in zip(old_slots, slots)),
+                tuple(_join(a, b) for a, b in zip(old_stack, stack)))
+
+    @staticmethod
+    def _transfer(instr, index, slots, stack, operands):
+        opcode = instr.opcode
+        operand = instr.operand
+
+        def pop():
+            if not stack:
+                raise _Untracked
+            kind = stack.pop()
+            return None if kind is _UNASSIGNED else kind
+
+        if opcode in SPECIALIZED_ARITHMETIC:
+            # Already specialized: the generic opcode's result type
+            b = pop()
+            stack.append(arithmetic_type(SPECIALIZED_ARITHMETIC[opcode], pop(), b))
+        elif (opcode, float) in _SPECIALIZED:
+            b = pop()
+            a = pop()
+            pair = (a, b)
+            # Types may only widen while the fixed point is computed
+            if operands.get(index, pair) != pair:
+                pair = (_join(operands[index][0], a), _join(operands[index][1], b))
+            operands[index] = pair
+            stack.append(arithmetic_type(opcode, *pair))
+        elif opcode is OpCode.LOAD_CONST:
+            stack.append(value_type(operand))
+        elif opcode is OpCode.LOAD_FAST:
+            stack.append(slots[operand])
+        elif opcode is OpCode.STORE_FAST:
+            slots[operand] = pop()
+        elif opcode is OpCode.LOAD_FAST_LOAD_FAST:
+            stack.extend(slots[slot] for slot in operand)
+        elif opcode is OpCode.INC_FAST:
+            slot, delta = operand
+            current = slots[slot]
+            slots[slot] = arithmetic_type(OpCode.BINARY_ADD,
+                                          None if current is _UNASSIGNED else current,
+                                          value_type(delta))
+        elif opcode is OpCode.BINARY_CMP:
+            pop()
+            pop()
+            stack.append(int)
+        elif opcode is OpCode.DUP:
+            kind = pop()
+            stack += [kind, kind]
+        elif opcode is OpCode.CALL:
+            for _ in operand.params:
+                pop()
+            stack.append(None)
+        elif opcode in _UNTYPED_EFFECTS:
+            popped, pushed = _UNTYPED_EFFECTS[opcode]
+            for _ in range(popped):
+                pop()
+            stack.extend([None] * pushed)
+        else:
+            # Specialized or unknown opcode: nothing to rely on
+            raise _Untracked